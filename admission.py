@@ -0,0 +1,189 @@
+import math
+import os
+import sqlite3
+import threading
+import time
+import uuid
+from contextlib import closing
+
+from metriques import OCTETS_EN_COURS, REFUS_ADMISSION, TRAITEMENTS_EN_COURS
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS reservations (
+    id TEXT PRIMARY KEY,
+    pid INTEGER NOT NULL,
+    octets INTEGER NOT NULL,
+    expire_le REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS idx_reservations_pid ON reservations (pid);
+"""
+
+
+def _processus_vivant(pid):
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True
+    return True
+
+
+class CapaciteEpuisee(Exception):
+    """Demande refusée à l'admission: code HTTP, délai conseillé avant nouvel essai, message"""
+
+    def __init__(self, code, retry_after, message, motif):
+        super().__init__(message)
+        self.code = code
+        self.retry_after = retry_after
+        self.message = message
+        self.motif = motif
+
+
+class ControleAdmission:
+    """Limite, pour tous les processus du serveur, les traitements simultanés et les octets reçus en cours de traitement.
+
+    Une demande réserve à l'admission la taille annoncée de son corps (ou la
+    taille maximale d'une requête si elle n'est pas annoncée) et une place de
+    traitement; tout est rendu à la fin de la requête. Plutôt que d'attendre,
+    une demande qui ne rentre pas est refusée immédiatement avec un délai
+    conseillé, estimé d'après la durée moyenne des traitements récents.
+
+    Les réservations sont des lignes d'une table SQLite partagée par les
+    workers, vérifiées et ajoutées dans une même transaction BEGIN IMMEDIATE:
+    les limites valent pour le serveur entier, quel que soit le nombre de
+    workers. Celles d'un worker arrêté brutalement sont retirées par
+    `processus_termine` (hook child_exit), au plus tard à leur expiration.
+    """
+
+    def __init__(self, chemin_base, max_traitements, budget_octets, taille_max_requete, retry_after_min=1,
+                 duree_max_reservation=900):
+        self.chemin_base = chemin_base
+        self.max_traitements = max_traitements
+        self.budget_octets = budget_octets
+        self.taille_max_requete = taille_max_requete
+        self.retry_after_min = retry_after_min
+        # Au-delà, une réservation est considérée abandonnée (requête bien plus longue que le timeout gunicorn)
+        self.duree_max_reservation = duree_max_reservation
+
+        self._verrou = threading.Lock()
+        self._duree_moyenne = None
+        self.refus = {'taille': 0, 'octets': 0, 'traitements': 0}
+
+        os.makedirs(os.path.dirname(os.path.abspath(chemin_base)), exist_ok=True)
+        with closing(self._connexion()) as conn:
+            conn.executescript(SCHEMA)
+            # Réservations laissées par des processus disparus (redémarrage du serveur)
+            pids = [ligne[0] for ligne in conn.execute("SELECT DISTINCT pid FROM reservations")]
+            conn.executemany("DELETE FROM reservations WHERE pid = ?",
+                             [(pid,) for pid in pids if not _processus_vivant(pid)])
+
+    def _connexion(self):
+        conn = sqlite3.connect(self.chemin_base, timeout=30, isolation_level=None)
+        conn.execute('PRAGMA journal_mode=WAL')
+        # Compteurs de réservations: rien à conserver après une coupure de courant
+        conn.execute('PRAGMA synchronous=OFF')
+        return conn
+
+    def retry_after(self):
+        """Délai conseillé (secondes entières) avant de représenter une demande refusée"""
+
+        with self._verrou:
+            duree = self._duree_moyenne
+        return max(self.retry_after_min, math.ceil(duree or 0))
+
+    def _refuser(self, motif, code, message, retry_after):
+        with self._verrou:
+            self.refus[motif] += 1
+        REFUS_ADMISSION.labels(motif).inc()
+        raise CapaciteEpuisee(code, retry_after, message, motif)
+
+    def _reserver(self, octets):
+        """Ajoute la réservation si elle rentre, retourne (identifiant, None) ou (None, motif du refus)"""
+
+        maintenant = time.time()
+        with closing(self._connexion()) as conn:
+            conn.execute('BEGIN IMMEDIATE')
+            try:
+                conn.execute("DELETE FROM reservations WHERE expire_le < ?", (maintenant,))
+                traitements, octets_en_cours = conn.execute(
+                    "SELECT COUNT(*), COALESCE(SUM(octets), 0) FROM reservations"
+                ).fetchone()
+
+                # Une demande seule passe toujours (dans la limite de taille): le budget borne la somme
+                if octets_en_cours + octets > self.budget_octets and octets_en_cours > 0:
+                    resultat = None, 'octets'
+                elif traitements >= self.max_traitements:
+                    resultat = None, 'traitements'
+                else:
+                    reservation_id = uuid.uuid4().hex
+                    conn.execute(
+                        "INSERT INTO reservations (id, pid, octets, expire_le) VALUES (?, ?, ?, ?)",
+                        (reservation_id, os.getpid(), octets, maintenant + self.duree_max_reservation)
+                    )
+                    resultat = reservation_id, None
+                conn.execute('COMMIT')
+            except Exception:
+                try:
+                    conn.execute('ROLLBACK')
+                except sqlite3.Error:
+                    pass
+                raise
+        return resultat
+
+    def admettre(self, taille_annoncee):
+        """Réserve une place et les octets de la demande, retourne la réservation à passer à `liberer`.
+
+        Lève CapaciteEpuisee: 413 si la requête dépasse la taille maximale,
+        429 si le budget d'octets en cours est épuisé, 503 si tous les
+        traitements sont occupés.
+        """
+
+        if taille_annoncee is not None and taille_annoncee > self.taille_max_requete:
+            self._refuser('taille', 413, f"Requête trop volumineuse (maximum {self.taille_max_requete // (1024 * 1024)} Mo).", None)
+
+        octets = self.taille_max_requete if taille_annoncee is None else taille_annoncee
+
+        reservation_id, motif = self._reserver(octets)
+        if motif == 'octets':
+            self._refuser('octets', 429, "Trop de documents en cours de réception, veuillez réessayer dans quelques instants.",
+                          self.retry_after())
+        if motif == 'traitements':
+            self._refuser('traitements', 503, "Service saturé, veuillez réessayer dans quelques instants.",
+                          self.retry_after())
+
+        TRAITEMENTS_EN_COURS.inc()
+        OCTETS_EN_COURS.inc(octets)
+        return {'id': reservation_id, 'octets': octets, 'debut': time.monotonic()}
+
+    def liberer(self, reservation):
+        duree = time.monotonic() - reservation['debut']
+        with closing(self._connexion()) as conn:
+            conn.execute("DELETE FROM reservations WHERE id = ?", (reservation['id'],))
+        with self._verrou:
+            # Moyenne glissante: le délai conseillé suit la charge actuelle du relais
+            self._duree_moyenne = duree if self._duree_moyenne is None else 0.8 * self._duree_moyenne + 0.2 * duree
+        TRAITEMENTS_EN_COURS.dec()
+        OCTETS_EN_COURS.dec(reservation['octets'])
+
+    def processus_termine(self, pid):
+        """Rend les réservations d'un worker sorti sans les libérer (tué au timeout, plantage)"""
+
+        with closing(self._connexion()) as conn:
+            conn.execute("DELETE FROM reservations WHERE pid = ?", (pid,))
+
+    def etat(self):
+        with closing(self._connexion()) as conn:
+            traitements, octets = conn.execute(
+                "SELECT COUNT(*), COALESCE(SUM(octets), 0) FROM reservations WHERE expire_le >= ?", (time.time(),)
+            ).fetchone()
+        with self._verrou:
+            return {
+                'traitements_en_cours': traitements,
+                'traitements_max': self.max_traitements,
+                'octets_en_cours': octets,
+                'budget_octets': self.budget_octets,
+                'taille_max_requete': self.taille_max_requete,
+                'duree_moyenne_secondes': round(self._duree_moyenne, 2) if self._duree_moyenne is not None else None,
+                'refus': dict(self.refus)
+            }
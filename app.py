@@ -1,58 +1,462 @@
-from flask import Flask, request, send_from_directory, jsonify
+from flask import Flask, Request, request, send_from_directory, jsonify
 from flask_cors import CORS
-import smtplib
+from jinja2 import Environment, FileSystemLoader, StrictUndefined
+from werkzeug.datastructures import FileStorage
+from werkzeug.exceptions import HTTPException, RequestEntityTooLarge
+from werkzeug.formparser import FormDataParser, MultiPartParser
+import sqlite3
 import os
 from datetime import datetime
 import json
 import base64
+import signal
+import sys
 import zipfile
 import io
 import time
-from email.mime.multipart import MIMEMultipart
-from email.mime.text import MIMEText
-from email.mime.base import MIMEBase
-from email import encoders
+import shutil
+import tempfile
+import uuid
+import hashlib
+import mimetypes
+import multiprocessing
+import threading
+import functools
+import hmac
+import logging
+from collections import Counter
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
 
-app = Flask(__name__)
-CORS(app)
+from admission import CapaciteEpuisee, ControleAdmission
+from archive_zip import METHODE_STOCKEE, construire_archive_zip
+from cache_contenu import IndexDepots, StockContenu, lier_ou_copier
+from configuration_envois import ConfigurationRechargeable
+from file_attente import FileAttenteEnvois, formater_horodatage
+from historique_envois import HistoriqueEnvois, decoder_curseur, horodatage_jour, normaliser_client
+from journal import CORRELATION_ID, PARTIE, SECTEUR, configurer_journal, contexte_journal, nouvelle_requete, soumettre
+from limiteur_debit import LimiteurParDestinataire
+from manifeste_lot import FluxBorne, ManifesteInvalide, lire_manifeste, valider_lot, verifier_archive
+from metriques import (
+    ECHECS_SMTP, ENVOIS, OCTETS_ENVOYES, PARTIES_PAR_DEMANDE,
+    exposer_metriques, mesurer, observer_duree
+)
+from mime_streaming import MessageStreaming, encodages_partages, envoyer_message_streaming
+from optimisation_documents import optimisation_disponible, optimiser_document
+from pool_smtp import PoolSMTP, delai_nouvel_essai, erreur_transitoire
+from registre_documents import REGISTRE_DOCUMENTS, TAILLE_SIGNATURE, PieceRefusee, verifier_signature
+from televersement import ErreurTeleversement, FichierTeleverse, ZoneTeleversements
 
-# Configuration Email pour ZeenDoc - Multi-secteurs
-EMAIL_DESTINATAIRE = os.environ.get('EMAIL_DESTINATAIRE', 'gestionprivee@optia-conseil.fr')
+class FichierSpoole:
+    """Fichier du spool qui calcule sa taille et son SHA-256 au fil de l'écriture"""
+    
+    def __init__(self, fichier):
+        self._fichier = fichier
+        self.name = fichier.name
+        self.taille = 0
+        self.hachage = hashlib.sha256()
+        self._type_document = None
+        self._nom_fichier = None
+        self._taille_max = None
+        self._debut = None
+    
+    def limiter(self, type_document, nom_fichier):
+        """Refuse la pièce (PieceRefusee) si son début n'est pas du format annoncé ou dès qu'elle dépasse la taille maximale de son type.
+        
+        Les TAILLE_SIGNATURE premiers octets restent en mémoire jusqu'à la
+        vérification de leur signature: une pièce refusée n'écrit rien sur disque.
+        """
+        
+        self._type_document = type_document
+        self._nom_fichier = nom_fichier
+        self._taille_max = type_document.taille_max
+        self._debut = bytearray()
+    
+    def write(self, donnees):
+        self.taille += len(donnees)
+        if self._taille_max is not None and self.taille > self._taille_max:
+            self._type_document.verifier(self._nom_fichier, self.taille)
+        self.hachage.update(donnees)
+        if self._debut is None:
+            return self._fichier.write(donnees)
+        
+        self._debut += donnees
+        if len(self._debut) >= TAILLE_SIGNATURE:
+            self.terminer_verification()
+        return len(donnees)
+    
+    def terminer_verification(self):
+        """Vérifie et écrit le début encore en mémoire (pièce plus courte que TAILLE_SIGNATURE, ou vide)"""
+        
+        if self._debut is not None:
+            debut, self._debut = bytes(self._debut), None
+            self._type_document.verifier_contenu(self._nom_fichier, debut)
+            self._fichier.write(debut)
+    
+    def seek(self, *args):
+        # Fin de la pièce: werkzeug revient au début du fichier avant de le transmettre
+        self.terminer_verification()
+        return self._fichier.seek(*args)
+    
+    def __iter__(self):
+        return iter(self._fichier)
+    
+    def __getattr__(self, nom):
+        return getattr(self._fichier, nom)
 
-# Adresses ZeenDoc par secteur
-ZEENDOC_EMAIL_LEHAVRE = os.environ.get('ZEENDOC_EMAIL_LEHAVRE', 'depot_docusign.optia_finance@zeenmail.com')
-ZEENDOC_EMAIL_ROUEN = os.environ.get('ZEENDOC_EMAIL_ROUEN', 'depot_docusign.optia_finance@zeenmail.com')
-ZEENDOC_EMAIL_PARIS = os.environ.get('ZEENDOC_EMAIL_PARIS', 'depot_docusign.agenc_paris.optia_finance@zeenmail.com')
+class ParseurMultipartVerifie(MultiPartParser):
+    """Vérifie chaque pièce d'après le registre des documents dès ses en-têtes, avant d'en écrire un octet"""
+    
+    def start_file_streaming(self, event, total_content_length):
+        # Extension d'après les en-têtes de la partie, signature et taille au fil de l'écriture
+        type_document = REGISTRE_DOCUMENTS.verifier_piece(event.name, event.filename)
+        conteneur = super().start_file_streaming(event, total_content_length)
+        if type_document is not None and isinstance(conteneur, FichierSpoole):
+            conteneur.limiter(type_document, event.filename)
+        return conteneur
 
-# Mapping secteur -> adresse ZeenDoc
-ZEENDOC_EMAILS = {
-    'Le Havre': ZEENDOC_EMAIL_LEHAVRE,
-    'Rouen': ZEENDOC_EMAIL_ROUEN,
-    'Paris': ZEENDOC_EMAIL_PARIS
+class ParseurFormulaire(FormDataParser):
+    """Analyse des formulaires de werkzeug, avec ParseurMultipartVerifie pour les corps multipart"""
+    
+    def _parse_multipart(self, stream, mimetype, content_length, options):
+        parser = ParseurMultipartVerifie(
+            stream_factory=self.stream_factory,
+            max_form_memory_size=self.max_form_memory_size,
+            max_form_parts=self.max_form_parts,
+            cls=self.cls,
+        )
+        frontiere = options.get('boundary', '').encode('ascii')
+        if not frontiere:
+            raise ValueError("Frontière multipart manquante")
+        
+        form, files = parser.parse(stream, frontiere, content_length)
+        return stream, form, files
+
+class RequeteSpoolee(Request):
+    """Requête Flask dont les fichiers uploadés sont écrits directement sur disque"""
+    
+    form_data_parser_class = ParseurFormulaire
+    
+    def _get_file_stream(self, total_content_length, content_type, filename=None, content_length=None):
+        # Un fichier nommé dans le spool au lieu d'un SpooledTemporaryFile:
+        # le chemin est ensuite transmis tel quel à toute la chaîne d'envoi
+        fichier = tempfile.NamedTemporaryFile(dir=DOSSIER_SPOOL, prefix='upload_', delete=False)
+        self.fichiers_spool = getattr(self, 'fichiers_spool', []) + [fichier.name]
+        return FichierSpoole(fichier)
+
+app = Flask(__name__)
+app.request_class = RequeteSpoolee
+# Toutes les routes ouvertes aux autres origines, sauf l'historique (réservé à l'administration)
+CORS(app, resources={r'^/(?!historique(/|$))': {}})
+
+# Journal JSON écrit par un thread dédié (niveaux: NIVEAU_JOURNAL, NIVEAUX_JOURNAL)
+configurer_journal()
+journal = logging.getLogger('formulaire')
+# Messages par fichier, au niveau DEBUG pour la plupart
+journal_fichiers = logging.getLogger('formulaire.fichiers')
+
+# Routage et limites d'envoi par secteur: fichier JSON CONFIGURATION_ENVOIS (configuration_envois.json
+# à côté de l'application par défaut), relu à chaud quand il change ou sur SIGHUP.
+# Les variables d'environnement ci-dessous en sont les valeurs par défaut, et la configuration sans fichier.
+DELAI_ENTRE_ENVOIS = float(os.environ.get('DELAI_ENTRE_ENVOIS', '30'))
+CONFIGURATION_ENVOIS_DEFAUT = {
+    'destinataire': os.environ.get('EMAIL_DESTINATAIRE', 'gestionprivee@optia-conseil.fr'),
+    'limite_email_mo': int(os.environ.get('LIMITE_EMAIL_MB', '20')),
+    'max_emails_par_demande': int(os.environ.get('MAX_EMAILS_PAR_DEMANDE', '5')),
+    # Débit ZeenDoc par adresse de dépôt (par défaut: un envoi toutes les DELAI_ENTRE_ENVOIS secondes après une rafale)
+    'debit_zeendoc_par_minute': float(os.environ.get(
+        'DEBIT_ZEENDOC_PAR_MINUTE', 60 / DELAI_ENTRE_ENVOIS if DELAI_ENTRE_ENVOIS > 0 else 0
+    )),
+    # Adresse des secteurs non reconnus
+    'secteur_par_defaut': 'Rouen',
+    'secteurs': {
+        'Le Havre': {'adresse_zeendoc': os.environ.get('ZEENDOC_EMAIL_LEHAVRE', 'depot_docusign.optia_finance@zeenmail.com')},
+        'Rouen': {'adresse_zeendoc': os.environ.get('ZEENDOC_EMAIL_ROUEN', 'depot_docusign.optia_finance@zeenmail.com')},
+        'Paris': {'adresse_zeendoc': os.environ.get('ZEENDOC_EMAIL_PARIS', 'depot_docusign.agenc_paris.optia_finance@zeenmail.com')}
+    }
 }
+CHEMIN_CONFIGURATION_ENVOIS = os.environ.get(
+    'CONFIGURATION_ENVOIS', os.path.join(os.path.dirname(os.path.abspath(__file__)), 'configuration_envois.json')
+)
+DELAI_VERIFICATION_CONFIGURATION = float(os.environ.get('DELAI_VERIFICATION_CONFIGURATION', '5'))
 
 # Configuration SMTP (maintenant obligatoire)
 SMTP_SERVER = os.environ.get('SMTP_SERVER', '')
 SMTP_PORT = int(os.environ.get('SMTP_PORT', '587'))
 SMTP_USERNAME = os.environ.get('SMTP_USERNAME', '')
 SMTP_PASSWORD = os.environ.get('SMTP_PASSWORD', '')
+SMTP_STARTTLS = os.environ.get('SMTP_STARTTLS', '1') == '1'
+# Variante ASGI: identifiants refusés sur une connexion sans STARTTLS, sauf relais local explicitement autorisé
+SMTP_AUTH_SANS_TLS = os.environ.get('SMTP_AUTH_SANS_TLS', '0') == '1'
+SMTP_CONFIGURE = all([SMTP_SERVER, SMTP_USERNAME, SMTP_PASSWORD])
+SMTP_TIMEOUT = int(os.environ.get('SMTP_TIMEOUT', '60'))
+SMTP_MAX_MESSAGES_PAR_CONNEXION = int(os.environ.get('SMTP_MAX_MESSAGES_PAR_CONNEXION', '50'))
+# Variante ASGI: connexions SMTP simultanées par processus (les envois au-delà attendent leur tour)
+SMTP_MAX_CONNEXIONS = int(os.environ.get('SMTP_MAX_CONNEXIONS', '20'))
+
+# Nouvel essai des envois en erreur temporaire (4xx, coupure, délai dépassé), attente exponentielle
+SMTP_TENTATIVES = int(os.environ.get('SMTP_TENTATIVES', '4'))
+SMTP_DELAI_NOUVEL_ESSAI = float(os.environ.get('SMTP_DELAI_NOUVEL_ESSAI', '2'))
+SMTP_DELAI_MAX_NOUVEL_ESSAI = float(os.environ.get('SMTP_DELAI_MAX_NOUVEL_ESSAI', '60'))
+
+# Envois par lot (/envoyer-lot)
+TYPES_DEMANDE = REGISTRE_DOCUMENTS.types_demande
+THREADS_LOT = int(os.environ.get('THREADS_LOT', '4'))
+# Archive ZIP d'un lot: taille une fois décompressée, nombre de fichiers et taux de compression maximaux
+TAILLE_MAX_LOT_MO = int(os.environ.get('TAILLE_MAX_LOT_MO', '500'))
+MAX_FICHIERS_LOT = int(os.environ.get('MAX_FICHIERS_LOT', '1000'))
+RATIO_COMPRESSION_MAX_LOT = int(os.environ.get('RATIO_COMPRESSION_MAX_LOT', '100'))
+# Secteurs dont l'adresse ZeenDoc accepte un dépôt groupé de plusieurs dossiers (ex: "Paris,Rouen")
+FUSION_ZEENDOC_SECTEURS = {s.strip() for s in os.environ.get('FUSION_ZEENDOC_SECTEURS', '').split(',') if s.strip()}
+
+# Contrôle d'admission, pour tout le serveur (tous workers confondus): taille d'une requête
+# (lots compris), octets reçus en cours de traitement et traitements simultanés, au-delà: 413/429/503
+TAILLE_MAX_REQUETE_MO = int(os.environ.get('TAILLE_MAX_REQUETE_MO', '100'))
+BUDGET_RECEPTION_MO = int(os.environ.get('BUDGET_RECEPTION_MO', '400'))
+MAX_TRAITEMENTS_SIMULTANES = int(os.environ.get('MAX_TRAITEMENTS_SIMULTANES', '8'))
+app.config['MAX_CONTENT_LENGTH'] = TAILLE_MAX_REQUETE_MO * 1024 * 1024
+
+MODE_DECOUPAGE_ZEENDOC = os.environ.get('MODE_DECOUPAGE_ZEENDOC', 'best_fit')  # best_fit, first_fit ou sequentiel
+RAFALE_ZEENDOC = int(os.environ.get('RAFALE_ZEENDOC', '3'))
+THREADS_ENVOI_ZEENDOC = int(os.environ.get('THREADS_ENVOI_ZEENDOC', '3'))
+
+# Configuration de la file d'envois en arrière-plan
+ENVOI_ASYNCHRONE = os.environ.get('ENVOI_ASYNCHRONE', '1') == '1'
+DOSSIER_DONNEES = os.environ.get('DOSSIER_DONNEES', os.path.join(os.path.dirname(os.path.abspath(__file__)), 'donnees'))
+NB_WORKERS_ENVOI = int(os.environ.get('NB_WORKERS_ENVOI', '2'))
+# Demandes terminées ou en échec (et fichiers gardés pour reprise) supprimées de la file au-delà
+CONSERVATION_DEMANDES_JOURS = float(os.environ.get('CONSERVATION_DEMANDES_JOURS', '30'))
+# Arrêt d'un processus (SIGTERM): secondes laissées aux envois en cours pour se terminer
+DELAI_ARRET = float(os.environ.get('DELAI_ARRET', '90'))
+DOSSIER_SPOOL = os.path.join(DOSSIER_DONNEES, 'spool')
+TAILLE_BLOC_FICHIER = 1024 * 1024
+
+# Archive ZIP de l'email principal
+THREADS_COMPRESSION_ZIP = int(os.environ.get('THREADS_COMPRESSION_ZIP', str(os.cpu_count() or 1)))
+NIVEAU_COMPRESSION_ZIP = int(os.environ.get('NIVEAU_COMPRESSION_ZIP', '6'))
+
+# Optimisation des images et PDF avant envoi (Pillow / pikepdf optionnels)
+OPTIMISATION_DOCUMENTS = os.environ.get('OPTIMISATION_DOCUMENTS', '1') == '1'
+DPI_CIBLE_IMAGES = int(os.environ.get('DPI_CIBLE_IMAGES', '200'))
+QUALITE_JPEG = int(os.environ.get('QUALITE_JPEG', '80'))
+SEUIL_OPTIMISATION_IMAGE_KO = int(os.environ.get('SEUIL_OPTIMISATION_IMAGE_KO', '1024'))
+# Processus d'optimisation de chaque worker: avec gunicorn (2 workers par cœur), quelques-uns
+# par worker suffisent à occuper les cœurs, sans multiplier les interpréteurs Pillow/pikepdf
+PROCESSUS_OPTIMISATION = int(os.environ.get('PROCESSUS_OPTIMISATION', str(min(2, os.cpu_count() or 1))))
 
-# Configuration pour la gestion des fichiers lourds
-LIMITE_EMAIL_MB = int(os.environ.get('LIMITE_EMAIL_MB', '20'))
-DELAI_ENTRE_ENVOIS = int(os.environ.get('DELAI_ENTRE_ENVOIS', '30'))
-MAX_EMAILS_PAR_DEMANDE = int(os.environ.get('MAX_EMAILS_PAR_DEMANDE', '5'))
+# Modèles des corps d'email (templates/email), compilés une seule fois au démarrage
+MODELES_EMAIL = Environment(
+    loader=FileSystemLoader(os.path.join(os.path.dirname(os.path.abspath(__file__)), 'templates', 'email')),
+    trim_blocks=True,
+    lstrip_blocks=True,
+    keep_trailing_newline=True,
+    undefined=StrictUndefined,
+    auto_reload=False
+)
+MODELE_CORPS_PRINCIPAL = MODELES_EMAIL.get_template('principal.txt')
+MODELE_CORPS_ZEENDOC = MODELES_EMAIL.get_template('zeendoc.txt')
+MODELE_CORPS_ZEENDOC_PARTIE = MODELES_EMAIL.get_template('zeendoc_partie.txt')
+
+# Pièces encodées en base64 gardées en mémoire le temps d'une demande (au-delà: fichiers temporaires du spool)
+MEMOIRE_CACHE_MIME_MO = int(os.environ.get('MEMOIRE_CACHE_MIME_MO', '32'))
+
+# Estimation du surcoût MIME: en-têtes d'une pièce jointe, en-têtes + corps texte d'un email
+ENTETE_PIECE_MIME = 256
+ENTETE_EMAIL_MIME = 16 * 1024
+
+# Téléversement par morceaux (/televersements): taille d'un morceau, durée de vie d'un téléversement non utilisé
+TAILLE_MORCEAU_TELEVERSEMENT_MO = int(os.environ.get('TAILLE_MORCEAU_TELEVERSEMENT_MO', '5'))
+DUREE_VIE_TELEVERSEMENTS_HEURES = float(os.environ.get('DUREE_VIE_TELEVERSEMENTS_HEURES', '24'))
+
+os.makedirs(DOSSIER_SPOOL, exist_ok=True)
+
+# Déduplication: stock local adressé par SHA-256 et dépôts ZeenDoc récents (0 = désactivé)
+TAILLE_MAX_STOCK_MO = int(os.environ.get('TAILLE_MAX_STOCK_MO', '2048'))
+FENETRE_DEDUPLICATION_HEURES = float(os.environ.get('FENETRE_DEDUPLICATION_HEURES', '24'))
+
+STOCK_CONTENU = StockContenu(
+    os.path.join(DOSSIER_DONNEES, 'contenus'),
+    os.path.join(DOSSIER_DONNEES, 'contenus.db'),
+    TAILLE_MAX_STOCK_MO * 1024 * 1024
+)
+INDEX_DEPOTS = IndexDepots(os.path.join(DOSSIER_DONNEES, 'contenus.db'))
+
+CONFIGURATION_ENVOIS = ConfigurationRechargeable(
+    CHEMIN_CONFIGURATION_ENVOIS, CONFIGURATION_ENVOIS_DEFAUT, DELAI_VERIFICATION_CONFIGURATION
+)
+# Serveur de développement et ASGI: SIGHUP relit la configuration (gunicorn: cf. post_worker_init)
+if hasattr(signal, 'SIGHUP') and threading.current_thread() is threading.main_thread():
+    signal.signal(signal.SIGHUP, CONFIGURATION_ENVOIS.demander_rechargement)
+
+# Historique des demandes envoyées (consultation: /historique)
+HISTORIQUE_ENVOIS = HistoriqueEnvois(os.path.join(DOSSIER_DONNEES, 'historique_envois.db'))
+LIMITE_PAGE_HISTORIQUE = 500
+# Jeton d'administration exigé par /historique (en-tête Authorization: Bearer <jeton>), consultation
+# impossible s'il n'est pas défini: l'historique contient noms des clients, fichiers et adresses
+HISTORIQUE_JETON = os.environ.get('HISTORIQUE_JETON', '')
+
+# Optimisations lancées à la finalisation d'un téléversement (ce processus): id -> future
+# Lues et modifiées par les threads de requêtes et les rappels du pool: toujours sous le verrou
+_OPTIMISATIONS_TELEVERSEMENTS = {}
+_VERROU_OPTIMISATIONS_TELEVERSEMENTS = threading.Lock()
+
+def oublier_optimisation_televersement(televersement_id):
+    """Téléversement supprimé (utilisé ou expiré): son optimisation n'est plus attendue"""
+    
+    with _VERROU_OPTIMISATIONS_TELEVERSEMENTS:
+        future = _OPTIMISATIONS_TELEVERSEMENTS.pop(televersement_id, None)
+    if future is not None:
+        future.cancel()
+
+ZONE_TELEVERSEMENTS = ZoneTeleversements(
+    os.path.join(DOSSIER_DONNEES, 'televersements'),
+    os.path.join(DOSSIER_DONNEES, 'televersements.db'),
+    STOCK_CONTENU,
+    TAILLE_MAX_REQUETE_MO * 1024 * 1024,
+    DUREE_VIE_TELEVERSEMENTS_HEURES * 3600,
+    a_la_suppression=oublier_optimisation_televersement
+)
+
+# Contrôle d'admission partagé par tous les workers (réservations dans une base SQLite commune)
+ADMISSION = ControleAdmission(
+    os.path.join(DOSSIER_DONNEES, 'admission.db'),
+    MAX_TRAITEMENTS_SIMULTANES,
+    BUDGET_RECEPTION_MO * 1024 * 1024,
+    TAILLE_MAX_REQUETE_MO * 1024 * 1024
+)
+
+# Un seau à jetons par adresse ZeenDoc (Le Havre, Rouen, Paris...), partagé par tous les workers
+# Le débit est donné à chaque envoi (réglages du secteur), celui-ci ne sert que par défaut
+LIMITEUR_ZEENDOC = LimiteurParDestinataire(
+    os.path.join(DOSSIER_DONNEES, 'debit_zeendoc.db'),
+    CONFIGURATION_ENVOIS.actuelle().generaux.debit_zeendoc_par_minute, capacite=RAFALE_ZEENDOC
+)
+
+# Connexions SMTP partagées par tous les envois du processus
+POOL_SMTP = PoolSMTP(
+    max_messages_par_connexion=SMTP_MAX_MESSAGES_PAR_CONNEXION,
+    timeout=SMTP_TIMEOUT
+)
+# Pools dont /pret rapporte le dernier échange SMTP (la variante ASGI y ajoute le sien)
+POOLS_SMTP = [POOL_SMTP]
+
+# Pool de processus pour l'optimisation, créé à la première utilisation
+# (et recréé après un fork, un pool ne se partage pas entre processus)
+_POOL_OPTIMISATION = {'pid': None, 'executor': None}
+_VERROU_POOL_OPTIMISATION = threading.Lock()
+
+def obtenir_pool_optimisation():
+    with _VERROU_POOL_OPTIMISATION:
+        if _POOL_OPTIMISATION['pid'] != os.getpid():
+            # 'spawn': les processus n'héritent ni des threads ni des sockets SMTP du serveur
+            _POOL_OPTIMISATION['executor'] = ProcessPoolExecutor(
+                max_workers=PROCESSUS_OPTIMISATION,
+                mp_context=multiprocessing.get_context('spawn')
+            )
+            _POOL_OPTIMISATION['pid'] = os.getpid()
+        return _POOL_OPTIMISATION['executor']
+
+def reglages_secteur(secteur):
+    """Réglages d'envoi du secteur dans la configuration en cours (secteur par défaut s'il est inconnu)"""
+    
+    return CONFIGURATION_ENVOIS.actuelle().reglages(secteur)
 
 def obtenir_adresse_zeendoc(secteur_demandeur):
-    """Retourne l'adresse ZeenDoc appropriée selon le secteur"""
+    """Retourne l'adresse ZeenDoc appropriée selon le secteur (configuration en cours)"""
     
-    adresse = ZEENDOC_EMAILS.get(secteur_demandeur)
-    if not adresse:
-        print(f"⚠️  Secteur '{secteur_demandeur}' non reconnu, utilisation adresse par défaut")
-        return ZEENDOC_EMAIL_ROUEN  # Adresse par défaut
+    configuration = CONFIGURATION_ENVOIS.actuelle()
+    adresse = configuration.reglages(secteur_demandeur).adresse_zeendoc
+    if not configuration.connait(secteur_demandeur):
+        journal.warning("Secteur '%s' non reconnu, utilisation adresse par défaut (%s)",
+                        secteur_demandeur, configuration.secteur_par_defaut)
+        return adresse
     
-    print(f"📧 Secteur '{secteur_demandeur}' → {adresse}")
+    journal.debug("Secteur '%s' → %s", secteur_demandeur, adresse)
     return adresse
 
+def contenu_refus(refus):
+    """Retourne (réponse JSON, code HTTP, en-têtes) d'une demande refusée à l'admission"""
+    
+    contenu = {"status": "error", "message": refus.message}
+    entetes = {}
+    if refus.retry_after is not None:
+        contenu["retry_after"] = refus.retry_after
+        entetes["Retry-After"] = str(refus.retry_after)
+    return contenu, refus.code, entetes
+
+def avec_admission(route):
+    """Admet la demande avant la lecture de son corps, ou la refuse tout de suite (413/429/503 + Retry-After)"""
+    
+    @functools.wraps(route)
+    def route_admise(*args, **kwargs):
+        try:
+            reservation = ADMISSION.admettre(request.content_length)
+        except CapaciteEpuisee as refus:
+            journal.warning("Demande refusée (%s): %s", refus.motif, refus.message, extra={'motif': refus.motif})
+            contenu, code, entetes = contenu_refus(refus)
+            return jsonify(contenu), code, entetes
+        
+        try:
+            return route(*args, **kwargs)
+        finally:
+            ADMISSION.liberer(reservation)
+    
+    return route_admise
+
+def avec_jeton_historique(route):
+    """Réserve la route aux porteurs du jeton HISTORIQUE_JETON (403 s'il n'est pas configuré, 401 sinon)"""
+    
+    @functools.wraps(route)
+    def route_protegee(*args, **kwargs):
+        if not HISTORIQUE_JETON:
+            return jsonify({"status": "error", "message": "Consultation de l'historique désactivée (HISTORIQUE_JETON non configuré)."}), 403
+        
+        schema, _, jeton = request.headers.get('Authorization', '').partition(' ')
+        if schema.lower() != 'bearer' or not hmac.compare_digest(jeton.strip().encode('utf-8'), HISTORIQUE_JETON.encode('utf-8')):
+            journal.warning("Accès à l'historique refusé (jeton absent ou invalide)")
+            return jsonify({"status": "error", "message": "Jeton d'accès à l'historique absent ou invalide."}), 401, {'WWW-Authenticate': 'Bearer'}
+        return route(*args, **kwargs)
+    
+    return route_protegee
+
+@app.errorhandler(RequestEntityTooLarge)
+def requete_trop_volumineuse(erreur):
+    # Corps plus long que MAX_CONTENT_LENGTH sans taille annoncée (envoi par morceaux)
+    return jsonify({
+        "status": "error",
+        "message": f"Requête trop volumineuse (maximum {TAILLE_MAX_REQUETE_MO} Mo)."
+    }), 413
+
+@app.errorhandler(PieceRefusee)
+def piece_refusee(erreur):
+    # Refusée dès ses en-têtes (format) ou pendant sa réception (taille), rien n'a été conservé
+    journal.info("Pièce refusée (%s): %s", erreur.doc_id, erreur.message)
+    return jsonify({"status": "error", "message": erreur.message, "doc_id": erreur.doc_id}), erreur.code
+
+@app.before_request
+def contexte_requete():
+    # Identifiant de corrélation fourni par le client ou le proxy, sinon généré
+    request.correlation_id = nouvelle_requete(request.headers.get('X-Correlation-Id'))
+
+@app.after_request
+def entete_correlation(reponse):
+    reponse.headers['X-Correlation-Id'] = getattr(request, 'correlation_id', '')
+    return reponse
+
+@app.before_request
+def demarrer_file_envois():
+    # Démarrage paresseux: un seul jeu de threads par processus, après un éventuel fork
+    if ENVOI_ASYNCHRONE:
+        FILE_ENVOIS.demarrer()
+
+@app.teardown_request
+def nettoyer_spool(exception=None):
+    # Les fichiers pris en charge ont été déplacés hors du spool, on supprime le reste
+    for chemin in getattr(request, 'fichiers_spool', []):
+        try:
+            os.remove(chemin)
+        except FileNotFoundError:
+            pass
+
 # Servir les fichiers statiques (HTML, CSS)
 @app.route('/')
 def index():
@@ -62,135 +466,1067 @@ def index():
 def css():
     return send_from_directory('.', 'styles.css')
 
+@app.route('/documents')
+def registre_documents():
+    """Types de pièces par demande et règles de chaque pièce (libellé, formats, taille maximale)"""
+    
+    reponse = app.response_class(REGISTRE_DOCUMENTS.contenu_json, mimetype='application/json')
+    reponse.set_etag(REGISTRE_DOCUMENTS.etag)
+    # Revalidation à chaque chargement du formulaire: 304 sans corps tant que le registre est inchangé
+    reponse.cache_control.no_cache = True
+    return reponse.make_conditional(request)
+
+@app.route('/secteurs')
+def secteurs_demandeur():
+    """Secteurs proposés par le formulaire (configuration des envois en cours)"""
+    
+    configuration = CONFIGURATION_ENVOIS.actuelle()
+    reponse = app.response_class(configuration.contenu_json, mimetype='application/json')
+    reponse.set_etag(configuration.etag)
+    reponse.cache_control.no_cache = True
+    return reponse.make_conditional(request)
+
 @app.route('/envoyer-demande', methods=['POST'])
+@avec_admission
 def envoyer_demande():
     try:
         # Vérification de la configuration SMTP
-        if not all([SMTP_SERVER, SMTP_USERNAME, SMTP_PASSWORD]):
-            return jsonify({
-                "status": "error", 
-                "message": "Configuration SMTP incomplète. Veuillez configurer SMTP_SERVER, SMTP_USERNAME et SMTP_PASSWORD."
-            }), 500
+        erreur = verifier_configuration_smtp()
+        if erreur:
+            return jsonify(erreur[0]), erreur[1]
         
-        # Récupérer les données du formulaire
-        data = request.form.to_dict()
-        files = request.files
+        # Récupérer les données du formulaire (lecture et écriture des uploads dans le spool)
+        with mesurer('lecture_formulaire'):
+            data = request.form.to_dict()
+            files = request.files
         
         # Récupérer le secteur pour déterminer l'adresse ZeenDoc
-        secteur_demandeur = data.get('secteurDemandeur', '')
-        if not secteur_demandeur:
-            return jsonify({
-                "status": "error", 
-                "message": "Le secteur du demandeur est obligatoire pour déterminer l'adresse de dépôt ZeenDoc."
-            }), 400
+        erreur = verifier_secteur(data)
+        if erreur:
+            return jsonify(erreur[0]), erreur[1]
         
+        secteur_demandeur = data['secteurDemandeur']
+        SECTEUR.set(secteur_demandeur)
         adresse_zeendoc = obtenir_adresse_zeendoc(secteur_demandeur)
         
-        # Construire le sujet
-        type_demande = data.get('type', 'Demande')
+        # Pièces déjà téléversées par morceaux (/televersements), référencées par leur identifiant
+        try:
+            pieces = list(files.items(multi=True)) + pieces_televersees(data)
+        except ErreurTeleversement as e:
+            return reponse_erreur_televersement(e)
+        
         nom = data.get('nom', '')
         prenom = data.get('prenom', '')
-        date_demande = data.get('dateDemande', datetime.now().strftime('%d/%m/%Y'))
-        
-        sujet_principal = f"Demande {type_demande.title()} - {nom} {prenom} - {date_demande}"
-        sujet_zeendoc = f"[ZEENDOC-{secteur_demandeur.upper()}] Documents - {nom} {prenom} - {type_demande.title()}"
-        
-        # Construire le corps du mail principal
-        corps_principal = generer_corps_email(data, adresse_zeendoc)
+        type_demande = data.get('type', 'Demande')
         
-        # Préparer les fichiers pour ZeenDoc
+        # Préparer les fichiers pour ZeenDoc (déplacés du spool vers le dossier de la demande)
+        dossier_fichiers = os.path.join(DOSSIER_DONNEES, 'fichiers', uuid.uuid4().hex)
         fichiers_pieces = []
-        if files and any(file.filename for file in files.values() if file):
-            fichiers_pieces = preparer_fichiers_zeendoc(files, nom, prenom, type_demande)
+        if any(file.filename for _, file in pieces if file):
+            with mesurer('preparation_fichiers'):
+                fichiers_pieces = preparer_fichiers_zeendoc(pieces, nom, prenom, type_demande, dossier_fichiers)
         
-        # Envoi automatique des deux emails
-        envoi_auto_reussi = False
-        resultats_detailles = {}
+        # Mode file d'attente: réponse immédiate, envois en arrière-plan
+        if ENVOI_ASYNCHRONE:
+            return jsonify(mettre_demande_en_file(
+                data, fichiers_pieces, dossier_fichiers, secteur_demandeur, adresse_zeendoc
+            )), 202
         
+        # Envoi automatique des deux emails
+        debut = time.monotonic()
         try:
-            print(f"📧 Début des envois automatiques pour secteur: {secteur_demandeur}")
-            print(f"📧 Adresse ZeenDoc: {adresse_zeendoc}")
-            
-            # 1. Email PRINCIPAL avec ZIP si nécessaire
-            print("📧 Envoi email principal...")
-            envoi_principal = envoyer_email_principal_auto(
-                sujet_principal, 
-                corps_principal, 
+            envoi_auto_reussi, resultats_detailles = executer_envois(
+                data,
                 fichiers_pieces,
-                data
+                secteur_demandeur,
+                adresse_zeendoc
             )
             
-            # 2. Emails ZEENDOC multiples avec fichiers originaux
-            print(f"📁 Envoi vers ZeenDoc ({secteur_demandeur})...")
-            resultats_zeendoc = []
-            if fichiers_pieces:
-                corps_zeendoc = generer_corps_zeendoc(data, fichiers_pieces, adresse_zeendoc)
-                resultats_zeendoc = envoyer_emails_zeendoc_multiples(
-                    sujet_zeendoc, 
-                    corps_zeendoc, 
-                    fichiers_pieces,
-                    adresse_zeendoc  # Nouvelle adresse selon secteur
-                )
-            
-            # Vérification globale
-            zeendoc_reussi = all(r.get('succes', False) for r in resultats_zeendoc) if resultats_zeendoc else True
-            envoi_auto_reussi = envoi_principal and zeendoc_reussi
-            
-            resultats_detailles = {
-                'email_principal': envoi_principal,
-                'zeendoc_parties': resultats_zeendoc,
-                'zeendoc_reussi': zeendoc_reussi,
-                'total_emails_zeendoc': len(resultats_zeendoc),
-                'secteur': secteur_demandeur,
-                'adresse_zeendoc': adresse_zeendoc
-            }
-            
-            print(f"✅ Envois terminés - Principal: {envoi_principal}, ZeenDoc ({secteur_demandeur}): {zeendoc_reussi}")
-            
         except Exception as e:
-            print(f"❌ Erreur envoi automatique: {str(e)}")
+            journal.exception("Erreur envoi automatique: %s", e)
             return jsonify({
                 "status": "error", 
                 "message": f"Erreur lors de l'envoi automatique: {str(e)}"
             }), 500
+        finally:
+            shutil.rmtree(dossier_fichiers, ignore_errors=True)
+        
+        reponse = construire_reponse_envoi(
+            fichiers_pieces, envoi_auto_reussi, resultats_detailles, secteur_demandeur, adresse_zeendoc
+        )
+        historiser_envoi(data, fichiers_pieces, reponse, time.monotonic() - debut)
+        return jsonify(reponse)
+        
+    except HTTPException:
+        # 413 et pièces refusées par le registre: réponses des gestionnaires d'erreur
+        raise
+    except Exception as e:
+        journal.exception("Erreur générale: %s", e)
+        return jsonify({"status": "error", "message": f"Erreur lors du traitement: {str(e)}"}), 500
+
+def verifier_configuration_smtp():
+    """Retourne (réponse JSON, code HTTP) si la configuration SMTP est incomplète, sinon None"""
+    
+    if not SMTP_CONFIGURE:
+        return {
+            "status": "error", 
+            "message": "Configuration SMTP incomplète. Veuillez configurer SMTP_SERVER, SMTP_USERNAME et SMTP_PASSWORD."
+        }, 500
+    return None
+
+def verifier_secteur(data):
+    """Retourne (réponse JSON, code HTTP) si le secteur du demandeur est absent, sinon None"""
+    
+    if not data.get('secteurDemandeur', ''):
+        return {
+            "status": "error", 
+            "message": "Le secteur du demandeur est obligatoire pour déterminer l'adresse de dépôt ZeenDoc."
+        }, 400
+    return None
+
+def mettre_demande_en_file(data, fichiers_pieces, dossier_fichiers, secteur_demandeur, adresse_zeendoc):
+    """Enregistre la demande dans la file d'envois et retourne la réponse 202"""
+    
+    demande_id = FILE_ENVOIS.ajouter({
+        'data': data,
+        'fichiers': fichiers_pieces,
+        'dossier_fichiers': dossier_fichiers,
+        'secteur': secteur_demandeur,
+        'adresse_zeendoc': adresse_zeendoc,
+        'correlation_id': CORRELATION_ID.get()
+    })
+    journal.info("Demande %s mise en file (%d fichier(s), secteur %s)", demande_id, len(fichiers_pieces), secteur_demandeur,
+                 extra={'demande_id': demande_id})
+    
+    return {
+        "status": "success",
+        "message": "Demande enregistrée, envoi automatique en cours...",
+        "demande_id": demande_id,
+        "statut_url": f"/demandes/{demande_id}/statut",
+        "fichiers_count": len(fichiers_pieces),
+        "fichiers_info": [f["nom"] for f in fichiers_pieces],
+        "secteur": secteur_demandeur,
+        "adresse_zeendoc": adresse_zeendoc
+    }
+
+@app.route('/capacite')
+def capacite():
+    """Utilisation courante du contrôle d'admission (tous les workers) et de la file d'envois"""
+    
+    return jsonify({
+        "status": "success",
+        **ADMISSION.etat(),
+        "retry_after": ADMISSION.retry_after(),
+        "file_envois": FILE_ENVOIS.compter_actives()
+    })
+
+@app.route('/sante')
+def sante():
+    """Sonde de vivacité: le processus répond (aucune vérification externe)"""
+    
+    return jsonify({"status": "success", "pid": os.getpid()})
+
+@app.route('/pret')
+def pret():
+    """Sonde de disponibilité: configuration SMTP, file d'envois lisible, processus pas en cours d'arrêt.
+    
+    N'ouvre aucune connexion SMTP: l'état du serveur est celui du dernier
+    échange des envois de ce processus (informatif, il ne rend pas le
+    processus indisponible, les envois en erreur temporaire sont réessayés).
+    """
+    
+    etats = [pool.etat() for pool in POOLS_SMTP]
+    dernier_succes = max((e['dernier_succes'] for e in etats if e['dernier_succes']), default=None)
+    derniere_erreur = max((e for e in etats if e['derniere_erreur']), key=lambda e: e['derniere_erreur'], default=None)
+    
+    contenu = {
+        "smtp": {
+            "configure": SMTP_CONFIGURE,
+            "serveur": f"{SMTP_SERVER}:{SMTP_PORT}" if SMTP_SERVER else None,
+            "dernier_succes": formater_horodatage(dernier_succes) if dernier_succes else None,
+            "derniere_erreur": formater_horodatage(derniere_erreur['derniere_erreur']) if derniere_erreur else None,
+            "erreur": derniere_erreur['erreur'] if derniere_erreur else None
+        },
+        "arret_en_cours": FILE_ENVOIS.en_arret
+    }
+    problemes = []
+    if not SMTP_CONFIGURE:
+        problemes.append("configuration SMTP incomplète")
+    if FILE_ENVOIS.en_arret:
+        problemes.append("arrêt en cours")
+    try:
+        contenu["file_envois"] = FILE_ENVOIS.compter_actives()
+    except sqlite3.Error as e:
+        problemes.append(f"file d'envois illisible: {e}")
+    
+    if problemes:
+        return jsonify({"status": "error", "message": ", ".join(problemes), **contenu}), 503, {'Cache-Control': 'no-store'}
+    return jsonify({"status": "success", **contenu}), 200, {'Cache-Control': 'no-store'}
+
+@app.route('/historique')
+@avec_jeton_historique
+def historique():
+    """Demandes envoyées, de la plus récente à la plus ancienne, par pages (curseur `suivant` → `apres`).
+    
+    Filtres: client (début du nom, sans accents ni casse), secteur, type,
+    du / au (JJ/MM/AAAA ou AAAA-MM-JJ, jours inclus), limite (50 par défaut).
+    """
+    
+    try:
+        debut = horodatage_jour(request.args['du']) if request.args.get('du') else None
+        fin = horodatage_jour(request.args['au'], fin=True) if request.args.get('au') else None
+        apres = request.args.get('apres') or None
+        if apres:
+            decoder_curseur(apres)
+        limite = int(request.args.get('limite', '50'))
+    except ValueError as e:
+        return jsonify({"status": "error", "message": str(e)}), 400
+    
+    envois, suivant = HISTORIQUE_ENVOIS.rechercher(
+        client=request.args.get('client'),
+        secteur=request.args.get('secteur'),
+        type_demande=request.args.get('type'),
+        debut=debut,
+        fin=fin,
+        limite=max(1, min(limite, LIMITE_PAGE_HISTORIQUE)),
+        apres=apres
+    )
+    for envoi in envois:
+        envoi['horodatage'] = formater_horodatage(envoi['horodatage'])
+    
+    return jsonify({"status": "success", "envois": envois, "suivant": suivant})
+
+@app.route('/historique/<envoi_id>')
+@avec_jeton_historique
+def detail_historique(envoi_id):
+    envoi = HISTORIQUE_ENVOIS.obtenir(envoi_id)
+    if envoi is None:
+        return jsonify({"status": "error", "message": "Envoi inconnu."}), 404
+    
+    envoi['horodatage'] = formater_horodatage(envoi['horodatage'])
+    return jsonify({"status": "success", **envoi})
+
+@app.route('/metrics')
+def metrics():
+    contenu, type_contenu = exposer_metriques()
+    return contenu, 200, {'Content-Type': type_contenu}
+
+def reponse_erreur_televersement(erreur):
+    contenu = {"status": "error", "message": erreur.message}
+    if erreur.recu is not None:
+        contenu["recu"] = erreur.recu
+    return jsonify(contenu), erreur.code
+
+@app.route('/televersements', methods=['POST'])
+def creer_televersement():
+    """Ouvre un téléversement par morceaux: {nom, taille, type_mime?, sha256?} → id et taille des morceaux"""
+
+    donnees = request.get_json(silent=True) or {}
+    # Pièce annoncée pour un type de document: format et taille vérifiés avant le premier morceau
+    if donnees.get('doc_id') and isinstance(donnees.get('nom'), str) and isinstance(donnees.get('taille'), int):
+        REGISTRE_DOCUMENTS.verifier_piece(donnees['doc_id'], donnees['nom'], donnees['taille'])
+    
+    try:
+        televersement_id = ZONE_TELEVERSEMENTS.creer(
+            donnees.get('nom'), donnees.get('taille'), donnees.get('type_mime'), donnees.get('sha256')
+        )
+    except ErreurTeleversement as e:
+        return reponse_erreur_televersement(e)
+
+    return jsonify({
+        "status": "success",
+        "id": televersement_id,
+        "taille_morceau": TAILLE_MORCEAU_TELEVERSEMENT_MO * 1024 * 1024
+    }), 201
+
+@app.route('/televersements/<televersement_id>', methods=['PUT'])
+@avec_admission
+def ecrire_morceau_televersement(televersement_id):
+    """Morceau brut à l'offset `?offset=N`, empreinte facultative dans l'en-tête X-Contenu-Sha256"""
+
+    taille_morceau = TAILLE_MORCEAU_TELEVERSEMENT_MO * 1024 * 1024
+    if request.content_length is None:
+        return jsonify({"status": "error", "message": "En-tête Content-Length requis."}), 411
+    if request.content_length > taille_morceau:
+        return jsonify({
+            "status": "error",
+            "message": f"Morceau trop volumineux (maximum {TAILLE_MORCEAU_TELEVERSEMENT_MO} Mo)."
+        }), 413
+
+    try:
+        offset = int(request.args.get('offset', ''))
+    except ValueError:
+        return jsonify({"status": "error", "message": "Paramètre offset manquant ou invalide."}), 400
+
+    try:
+        donnees = b''
+        if offset == 0:
+            # Premier morceau: signature du format vérifiée avant de lire (et d'écrire) le reste
+            donnees = request.stream.read(TAILLE_SIGNATURE)
+            verifier_signature(ZONE_TELEVERSEMENTS.etat(televersement_id)['nom'], donnees)
+        donnees += request.stream.read()
+        recu = ZONE_TELEVERSEMENTS.ecrire_morceau(
+            televersement_id, offset, donnees, request.headers.get('X-Contenu-Sha256')
+        )
+    except ErreurTeleversement as e:
+        return reponse_erreur_televersement(e)
+
+    return jsonify({"status": "success", "recu": recu})
+
+@app.route('/televersements/<televersement_id>')
+def etat_televersement(televersement_id):
+    """Octets déjà reçus: point de reprise après une coupure"""
+
+    try:
+        return jsonify({"status": "success", **ZONE_TELEVERSEMENTS.etat(televersement_id)})
+    except ErreurTeleversement as e:
+        return reponse_erreur_televersement(e)
+
+@app.route('/televersements/<televersement_id>/finaliser', methods=['POST'])
+def finaliser_televersement(televersement_id):
+    """Vérifie l'empreinte du fichier complet, le range dans le stock et lance son optimisation"""
+
+    try:
+        with mesurer('finalisation_televersement'):
+            etat = ZONE_TELEVERSEMENTS.finaliser(televersement_id)
+    except ErreurTeleversement as e:
+        return reponse_erreur_televersement(e)
+
+    lancer_optimisation_televersement(televersement_id, etat['nom'])
+    return jsonify({"status": "success", **etat})
+
+def lancer_optimisation_televersement(televersement_id, nom):
+    """Optimise le fichier en arrière-plan pendant que les autres pièces sont encore téléversées"""
+
+    if not OPTIMISATION_DOCUMENTS or not optimisation_disponible(nom):
+        return
+
+    with _VERROU_OPTIMISATIONS_TELEVERSEMENTS:
+        if televersement_id in _OPTIMISATIONS_TELEVERSEMENTS:
+            return
+        chemin = ZONE_TELEVERSEMENTS.preparer_optimisation(televersement_id)
+        future = obtenir_pool_optimisation().submit(
+            optimiser_document, chemin, nom, DPI_CIBLE_IMAGES, QUALITE_JPEG, SEUIL_OPTIMISATION_IMAGE_KO * 1024
+        )
+        _OPTIMISATIONS_TELEVERSEMENTS[televersement_id] = future
+
+    def enregistrer(future):
+        try:
+            if not future.cancelled():
+                _, taille_optimisee = future.result()
+                ZONE_TELEVERSEMENTS.marquer_optimise(televersement_id, taille_optimisee)
+        except Exception as e:
+            journal_fichiers.warning("Optimisation impossible pour %s, elle sera retentée à l'envoi: %s", nom, e)
+        finally:
+            # Retirée après l'enregistrement: une demande voit la future ou le fichier optimisé, jamais aucun des deux
+            with _VERROU_OPTIMISATIONS_TELEVERSEMENTS:
+                if _OPTIMISATIONS_TELEVERSEMENTS.get(televersement_id) is future:
+                    del _OPTIMISATIONS_TELEVERSEMENTS[televersement_id]
+
+    future.add_done_callback(enregistrer)
+
+def pieces_televersees(data):
+    """Retourne les paires (doc_id, FichierTeleverse) du champ `televersements` ({doc_id: [ids]} en JSON)"""
+
+    valeur = data.pop('televersements', None)
+    if not valeur:
+        return []
+
+    try:
+        references = json.loads(valeur)
+    except ValueError:
+        raise ErreurTeleversement(400, "Champ televersements invalide (JSON attendu).")
+    if not isinstance(references, dict):
+        raise ErreurTeleversement(400, "Champ televersements invalide: objet {document: [identifiants]} attendu.")
+
+    pieces = []
+    for doc_id, identifiants in references.items():
+        for televersement_id in ([identifiants] if isinstance(identifiants, str) else identifiants):
+            # Optimisation encore en cours dans ce processus: on l'attend plutôt que de la refaire
+            with _VERROU_OPTIMISATIONS_TELEVERSEMENTS:
+                future = _OPTIMISATIONS_TELEVERSEMENTS.get(televersement_id)
+            if future is not None:
+                try:
+                    ZONE_TELEVERSEMENTS.marquer_optimise(televersement_id, future.result()[1])
+                except Exception:
+                    pass
+            fichier = ZONE_TELEVERSEMENTS.obtenir_fichier(str(televersement_id))
+            REGISTRE_DOCUMENTS.verifier_piece(doc_id, fichier.filename, fichier.taille)
+            pieces.append((doc_id, fichier))
+    return pieces
+
+@app.route('/envoyer-lot', methods=['POST'])
+@avec_admission
+def envoyer_lot():
+    """Plusieurs dossiers en un appel: manifeste JSON/CSV + documents (champs 'documents' ou archive ZIP 'archive')"""
+    
+    archive = None
+    dossiers = []
+    try:
+        erreur = verifier_configuration_smtp()
+        if erreur:
+            return jsonify(erreur[0]), erreur[1]
+        
+        manifeste = request.files.get('manifeste')
+        if manifeste and manifeste.filename:
+            contenu_manifeste, nom_manifeste = manifeste.read(), manifeste.filename
+        else:
+            contenu_manifeste, nom_manifeste = request.form.get('manifeste', ''), ''
+        
+        try:
+            documents, tailles, archive = documents_du_lot(request.files)
+        except zipfile.BadZipFile:
+            return jsonify({"status": "error", "message": "L'archive fournie n'est pas un fichier ZIP valide."}), 400
+        
+        # Validation complète avant le moindre envoi
+        try:
+            dossiers = lire_manifeste(contenu_manifeste, nom_manifeste)
+            erreurs = valider_lot(dossiers, documents, TYPES_DEMANDE, CONFIGURATION_ENVOIS.actuelle().secteurs, REGISTRE_DOCUMENTS,
+                                  tailles)
+        except ManifesteInvalide as e:
+            erreurs = e.erreurs
+        if erreurs:
+            return jsonify({
+                "status": "error",
+                "message": f"Lot refusé: {len(erreurs)} erreur(s), aucun envoi effectué.",
+                "erreurs": erreurs
+            }), 400
+        
+        fusionner_zeendoc = request.form.get('fusionner_zeendoc') == '1'
+        journal.info("Lot de %d dossier(s) validé (dépôt ZeenDoc groupé: %s)", len(dossiers), 'oui' if fusionner_zeendoc else 'non')
+        
+        for dossier in dossiers:
+            data = dossier['data']
+            dossier['adresse_zeendoc'] = obtenir_adresse_zeendoc(data['secteurDemandeur'])
+            dossier['dossier_fichiers'] = os.path.join(DOSSIER_DONNEES, 'fichiers', uuid.uuid4().hex)
+            
+            pieces = [(doc_id, documents[nom_document]()) for doc_id, nom_document in dossier['documents']]
+            try:
+                with mesurer('preparation_fichiers'):
+                    dossier['fichiers'] = preparer_fichiers_zeendoc(
+                        pieces, data['nom'], data['prenom'], data['type'], dossier['dossier_fichiers']
+                    )
+            finally:
+                for _, piece in pieces:
+                    piece.close()
+        
+        resultats = traiter_lot(dossiers, fusionner_zeendoc)
+        nb_reussis = sum(1 for r in resultats if r.get('envoi_auto'))
+        journal.info("Lot terminé: %d/%d dossier(s) envoyé(s)", nb_reussis, len(dossiers))
         
         return jsonify({
-            "status": "success", 
-            "message": "Demande envoyée avec succès!",
-            "fichiers_count": len(fichiers_pieces),
-            "envoi_auto": envoi_auto_reussi,
-            "details_envoi": resultats_detailles,
-            "fichiers_info": [f["nom"] for f in fichiers_pieces],
-            "secteur": secteur_demandeur,
-            "adresse_zeendoc": adresse_zeendoc
+            "status": "success",
+            "message": f"Lot traité: {nb_reussis}/{len(dossiers)} dossier(s) envoyé(s) automatiquement.",
+            "dossiers_count": len(dossiers),
+            "fusion_zeendoc": fusionner_zeendoc,
+            "resultats": resultats
         })
         
+    except HTTPException:
+        # 413 et pièces refusées par le registre: réponses des gestionnaires d'erreur
+        raise
     except Exception as e:
-        print(f"Erreur générale: {str(e)}")
-        return jsonify({"status": "error", "message": f"Erreur lors du traitement: {str(e)}"}), 500
+        journal.exception("Erreur générale (lot): %s", e)
+        return jsonify({"status": "error", "message": f"Erreur lors du traitement du lot: {str(e)}"}), 500
+    finally:
+        if archive is not None:
+            archive.close()
+        for dossier in dossiers:
+            if 'dossier_fichiers' in dossier:
+                shutil.rmtree(dossier['dossier_fichiers'], ignore_errors=True)
+
+@app.route('/demandes/<demande_id>/statut')
+def statut_demande(demande_id):
+    statut = FILE_ENVOIS.obtenir_statut(demande_id)
+    if statut is None:
+        return jsonify({"status": "error", "message": "Demande inconnue."}), 404
+    
+    return jsonify({"status": "success", **statut})
+
+@app.route('/demandes/<demande_id>/reprendre', methods=['POST'])
+def reprendre_demande(demande_id):
+    reprise = FILE_ENVOIS.reprendre(demande_id)
+    if reprise is None:
+        return jsonify({"status": "error", "message": "Demande inconnue."}), 404
+    if not reprise:
+        return jsonify({"status": "error", "message": "Seule une demande en échec peut être reprise."}), 409
+    
+    journal.info("Demande %s remise en file (envois en échec uniquement)", demande_id, extra={'demande_id': demande_id})
+    return jsonify({
+        "status": "success",
+        "message": "Reprise en cours: seuls les envois en échec sont renvoyés.",
+        "demande_id": demande_id,
+        "statut_url": f"/demandes/{demande_id}/statut"
+    }), 202
+
+def executer_envois(data, fichiers_pieces, secteur_demandeur, adresse_zeendoc, rappel_progression=None, etat_precedent=None,
+                    inclure_zeendoc=True):
+    """Envoie l'email principal puis les emails ZeenDoc, retourne (succès global, détails)
+    
+    `etat_precedent` ({partie: état}, cf. FileAttenteEnvois.obtenir_parties) permet
+    une reprise: les envois déjà effectués ne sont pas refaits. Avec
+    `inclure_zeendoc=False`, seul l'email principal part (dépôt ZeenDoc groupé d'un lot).
+    """
+    
+    etat_precedent = etat_precedent or {}
+    # Mêmes réglages pour tous les envois de la demande, même si la configuration est rechargée entre-temps
+    reglages = reglages_secteur(secteur_demandeur)
+    
+    journal.info("Début des envois automatiques pour secteur %s (adresse ZeenDoc: %s)", secteur_demandeur, adresse_zeendoc)
+    
+    plan = planifier_envois(data, fichiers_pieces, secteur_demandeur, adresse_zeendoc, etat_precedent, inclure_zeendoc,
+                            reglages)
+    fichiers_zeendoc = plan['fichiers_zeendoc']
+    deja_deposes = plan['deja_deposes']
+    contexte = plan['contexte']
+    
+    # Pièces encodées une seule fois pour l'email principal, les parties ZeenDoc et les nouveaux essais
+    with encodages_partages(DOSSIER_SPOOL, MEMOIRE_CACHE_MIME_MO * 1024 * 1024):
+        # 1. Email PRINCIPAL avec ZIP si nécessaire
+        if etat_precedent.get('principal', {}).get('statut') == 'envoye':
+            journal.info("Email principal déjà envoyé lors d'une tentative précédente")
+            envoi_principal = True
+        else:
+            journal.info("Envoi email principal")
+            if rappel_progression:
+                rappel_progression('principal', 0, 'en_cours', fichiers_count=len(fichiers_pieces))
+            envoi_principal = envoyer_email_principal_auto(
+                plan['sujet_principal'], 
+                plan['corps_principal'], 
+                fichiers_pieces,
+                data,
+                reglages
+            )
+            if rappel_progression:
+                rappel_progression('principal', 0, 'envoye' if envoi_principal else 'echec', fichiers_count=len(fichiers_pieces))
+            ENVOIS.labels(secteur_demandeur, 'principal', 'succes' if envoi_principal else 'echec').inc()
+        
+        if not inclure_zeendoc:
+            return envoi_principal, construire_details_envoi(envoi_principal, [], [], secteur_demandeur, adresse_zeendoc)
+        
+        # 2. Emails ZEENDOC multiples avec fichiers originaux
+        journal.info("Envoi vers ZeenDoc (%s)", secteur_demandeur)
+        resultats_zeendoc = []
+        if fichiers_zeendoc:
+            corps_zeendoc = generer_corps_zeendoc(contexte)
+            resultats_zeendoc = envoyer_emails_zeendoc_multiples(
+                plan['sujet_zeendoc'], 
+                corps_zeendoc, 
+                fichiers_zeendoc,
+                adresse_zeendoc,  # Nouvelle adresse selon secteur
+                rappel_progression=rappel_progression,
+                plan_precedent=plan['plan_precedent'],
+                categories=contexte['categories'],
+                reglages=reglages
+            )
+        elif deja_deposes:
+            journal.info("Tous les documents ont déjà été déposés vers %s, aucun renvoi", adresse_zeendoc)
+        
+        return conclure_envois(envoi_principal, resultats_zeendoc, deja_deposes, secteur_demandeur, adresse_zeendoc)
+
+def planifier_envois(data, fichiers_pieces, secteur_demandeur, adresse_zeendoc, etat_precedent, inclure_zeendoc=True,
+                     reglages=None):
+    """Optimise les pièces et prépare tout ce qui précède les envois (fichiers ZeenDoc, sujets, corps)"""
+    
+    # 0. Réduction des photos et PDF volumineux avant découpage
+    optimiser_fichiers_pieces(fichiers_pieces)
+    
+    # Fichiers à déposer sur ZeenDoc (hors contenus déjà déposés récemment)
+    plan_precedent = [
+        {'partie': partie, **etat}
+        for partie, etat in sorted(etat_precedent.items(), key=lambda e: e[1]['ordre'])
+        if partie != 'principal' and 'fichiers' in etat
+    ]
+    if plan_precedent:
+        # Reprise: mêmes fichiers et même découpage qu'à la première tentative
+        noms_planifies = {nom for partie in plan_precedent for nom in partie['fichiers']}
+        fichiers_zeendoc = [f for f in fichiers_pieces if f['nom'] in noms_planifies]
+        deja_deposes = []
+    elif inclure_zeendoc:
+        fichiers_zeendoc, deja_deposes = separer_fichiers_deja_deposes(fichiers_pieces, adresse_zeendoc)
+    else:
+        fichiers_zeendoc, deja_deposes = fichiers_pieces, []
+    
+    # Un seul contexte (horodatage, regroupement par catégorie) pour tous les corps d'email
+    contexte = construire_contexte_email(data, fichiers_zeendoc, adresse_zeendoc, deja_deposes, reglages=reglages)
+    
+    # Construire le sujet
+    type_demande = data.get('type', 'Demande')
+    nom = data.get('nom', '')
+    prenom = data.get('prenom', '')
+    
+    return {
+        'fichiers_zeendoc': fichiers_zeendoc,
+        'deja_deposes': deja_deposes,
+        'plan_precedent': plan_precedent,
+        'contexte': contexte,
+        'sujet_principal': f"Demande {type_demande.title()} - {nom} {prenom} - {contexte['date_demande']}",
+        'sujet_zeendoc': f"[ZEENDOC-{secteur_demandeur.upper()}] Documents - {nom} {prenom} - {type_demande.title()}",
+        # Construire le corps du mail principal
+        'corps_principal': generer_corps_email(contexte)
+    }
+
+def construire_details_envoi(envoi_principal, resultats_zeendoc, deja_deposes, secteur_demandeur, adresse_zeendoc):
+    zeendoc_reussi = all(r.get('succes', False) for r in resultats_zeendoc) if resultats_zeendoc else True
+    return {
+        'email_principal': envoi_principal,
+        'zeendoc_parties': resultats_zeendoc,
+        'zeendoc_reussi': zeendoc_reussi,
+        'total_emails_zeendoc': len(resultats_zeendoc),
+        'zeendoc_deja_deposes': deja_deposes,
+        'secteur': secteur_demandeur,
+        'adresse_zeendoc': adresse_zeendoc
+    }
+
+def conclure_envois(envoi_principal, resultats_zeendoc, deja_deposes, secteur_demandeur, adresse_zeendoc):
+    """Compte les envois ZeenDoc et retourne (succès global, détails)"""
+    
+    for resultat in resultats_zeendoc:
+        if resultat.get('deja_envoye'):
+            continue
+        ENVOIS.labels(secteur_demandeur, 'zeendoc', 'succes' if resultat.get('succes') else 'echec').inc()
+    
+    # Vérification globale
+    resultats_detailles = construire_details_envoi(
+        envoi_principal, resultats_zeendoc, deja_deposes, secteur_demandeur, adresse_zeendoc
+    )
+    envoi_auto_reussi = envoi_principal and resultats_detailles['zeendoc_reussi']
+    
+    journal.info("Envois terminés - Principal: %s, ZeenDoc (%s): %s",
+                 envoi_principal, secteur_demandeur, resultats_detailles['zeendoc_reussi'])
+    
+    return envoi_auto_reussi, resultats_detailles
+
+def optimiser_fichiers_pieces(fichiers_pieces):
+    """Optimise les images et PDF en parallèle (pool de processus) et met à jour leurs tailles"""
+    
+    if not OPTIMISATION_DOCUMENTS:
+        return
+    
+    a_optimiser = [
+        f for f in fichiers_pieces
+        if 'chemin' in f and 'taille_originale' not in f and optimisation_disponible(f['nom'])
+    ]
+    if not a_optimiser:
+        return
+    
+    with mesurer('optimisation'):
+        executor = obtenir_pool_optimisation()
+        futures = [
+            (fichier, executor.submit(
+                optimiser_document, fichier['chemin'], fichier['nom'],
+                DPI_CIBLE_IMAGES, QUALITE_JPEG, SEUIL_OPTIMISATION_IMAGE_KO * 1024
+            ))
+            for fichier in a_optimiser
+        ]
+        
+        gain_total = 0
+        for fichier, future in futures:
+            try:
+                taille_originale, taille_optimisee = future.result()
+            except Exception as e:
+                journal_fichiers.warning("Optimisation impossible pour %s, envoi de l'original: %s", fichier['nom'], e)
+                continue
+            
+            fichier['taille_originale'] = taille_originale
+            fichier['taille'] = taille_optimisee
+            if taille_optimisee < taille_originale:
+                gain_total += taille_originale - taille_optimisee
+                journal_fichiers.debug("%s: %s → %s", fichier['nom'], format_file_size(taille_originale), format_file_size(taille_optimisee),
+                                       extra={'taille_originale': taille_originale, 'taille_optimisee': taille_optimisee})
+    
+    if gain_total:
+        journal.info("Optimisation: %s économisés sur %d fichier(s)", format_file_size(gain_total), len(a_optimiser))
 
-def envoyer_email_principal_auto(sujet, corps, fichiers_pieces, data):
+def separer_fichiers_deja_deposes(fichiers_pieces, adresse_zeendoc):
+    """Sépare les fichiers à envoyer de ceux déjà déposés à cette adresse dans la fenêtre configurée"""
+    
+    if FENETRE_DEDUPLICATION_HEURES <= 0:
+        return fichiers_pieces, []
+    
+    # Une seule requête pour toutes les pièces de la demande
+    depots = INDEX_DEPOTS.rechercher_plusieurs(
+        adresse_zeendoc, [f['sha256'] for f in fichiers_pieces if f.get('sha256')], FENETRE_DEDUPLICATION_HEURES * 3600
+    )
+    
+    a_envoyer = []
+    deja_deposes = []
+    for fichier in fichiers_pieces:
+        depot = depots.get(fichier.get('sha256'))
+        if depot is None:
+            a_envoyer.append(fichier)
+            continue
+        
+        journal_fichiers.debug("Déjà déposé vers %s: %s (sous le nom %s)", adresse_zeendoc, fichier['nom'], depot['nom'])
+        deja_deposes.append({
+            'nom': fichier['nom'],
+            'nom_depose': depot['nom'],
+            'depose_le': datetime.fromtimestamp(depot['depose_le']).strftime('%d/%m/%Y %H:%M'),
+            'taille': fichier['taille']
+        })
+    
+    return a_envoyer, deja_deposes
+
+def construire_reponse_envoi(fichiers_pieces, envoi_auto_reussi, resultats_detailles, secteur_demandeur, adresse_zeendoc):
+    """Réponse JSON commune au mode synchrone et au résultat de la file d'envois"""
+    
+    return {
+        "status": "success", 
+        "message": "Demande envoyée avec succès!",
+        "fichiers_count": len(fichiers_pieces),
+        "envoi_auto": envoi_auto_reussi,
+        "details_envoi": resultats_detailles,
+        "fichiers_info": [f["nom"] for f in fichiers_pieces],
+        "secteur": secteur_demandeur,
+        "adresse_zeendoc": adresse_zeendoc
+    }
+
+def historiser_envoi(data, fichiers_pieces, reponse, duree, envoi_id=None):
+    """Enregistre une demande envoyée et chacun de ses emails dans l'historique.
+    
+    L'écriture est faite en arrière-plan et une erreur ici ne fait jamais
+    échouer la demande. Une demande de la file garde son identifiant: une
+    reprise remplace l'enregistrement de la tentative précédente.
+    """
+    
+    try:
+        details = reponse['details_envoi']
+        par_nom = {f['nom']: f for f in fichiers_pieces}
+        
+        def resume(nom):
+            fichier = par_nom.get(nom, {})
+            return {'nom': nom, 'sha256': fichier.get('sha256'), 'taille': fichier.get('taille')}
+        
+        client = f"{data.get('nom', '').upper()} {data.get('prenom', '')}".strip()
+        envoi = {
+            'id': envoi_id or uuid.uuid4().hex,
+            'horodatage': time.time() - duree,
+            'correlation_id': CORRELATION_ID.get(),
+            'client': client,
+            'client_cle': normaliser_client(client),
+            'type_demande': data.get('type'),
+            'secteur': reponse['secteur'],
+            'adresse_zeendoc': reponse['adresse_zeendoc'],
+            'fichiers_count': len(fichiers_pieces),
+            'taille_totale': sum(f['taille'] for f in fichiers_pieces),
+            'taille_originale': sum(f.get('taille_originale', f['taille']) for f in fichiers_pieces),
+            'deja_deposes': len(details.get('zeendoc_deja_deposes', [])),
+            'emails_zeendoc': details['total_emails_zeendoc'],
+            'email_principal': details['email_principal'],
+            'zeendoc_reussi': details['zeendoc_reussi'],
+            'envoi_auto': reponse['envoi_auto'],
+            'duree': round(duree, 2)
+        }
+        parties = [{
+            'partie': 'principal',
+            'ordre': 0,
+            'destinataire': reglages_secteur(reponse['secteur']).destinataire,
+            'fichiers_count': len(fichiers_pieces),
+            'taille': envoi['taille_totale'],
+            'succes': details['email_principal'],
+            'deja_envoye': False,
+            'fichiers': [resume(f['nom']) for f in fichiers_pieces]
+        }]
+        for ordre, partie in enumerate(details['zeendoc_parties'], 1):
+            noms = partie.get('fichiers', [])
+            parties.append({
+                'partie': partie['partie'],
+                'ordre': ordre,
+                'destinataire': partie.get('adresse_zeendoc'),
+                'fichiers_count': len(noms),
+                'taille': partie.get('taille_totale'),
+                'succes': partie.get('succes', False),
+                'deja_envoye': partie.get('deja_envoye', False),
+                'duree': partie.get('duree_envoi'),
+                'erreur': partie.get('erreur'),
+                'fichiers': [resume(nom) for nom in noms]
+            })
+        
+        HISTORIQUE_ENVOIS.enregistrer(envoi, parties)
+    except Exception as e:
+        journal.exception("Historique: envoi non enregistré: %s", e)
+
+def documents_du_lot(files):
+    """Documents fournis avec un lot: ({nom: fonction qui ouvre un FileStorage}, {nom: taille}, archive ZIP à fermer ou None)
+    
+    L'archive est refusée (PieceRefusee) d'après ses tailles annoncées, avant
+    toute extraction, et chacun de ses membres est lu au plus jusqu'à sa taille.
+    """
+    
+    documents = {}
+    tailles = {}
+    archive = None
+    
+    fichier_archive = files.get('archive')
+    if fichier_archive and fichier_archive.filename:
+        archive = zipfile.ZipFile(fichier_archive.stream.name)
+        membres = [membre for membre in archive.infolist() if not membre.is_dir()]
+        try:
+            verifier_archive(membres, TAILLE_MAX_LOT_MO * 1024 * 1024, MAX_FICHIERS_LOT, RATIO_COMPRESSION_MAX_LOT)
+        except PieceRefusee:
+            archive.close()
+            raise
+        for membre in membres:
+            tailles[membre.filename] = membre.file_size
+            documents[membre.filename] = lambda m=membre: FileStorage(
+                FluxBorne(archive.open(m), m.file_size, m.filename),
+                filename=os.path.basename(m.filename),
+                content_type=mimetypes.guess_type(m.filename)[0]
+            )
+    
+    # Un même document peut servir à plusieurs dossiers: chaque usage le relit depuis le spool
+    for fichier in files.getlist('documents'):
+        if fichier.filename:
+            tailles[fichier.filename] = os.path.getsize(fichier.stream.name)
+            documents[fichier.filename] = lambda f=fichier: FileStorage(
+                open(f.stream.name, 'rb'),
+                filename=f.filename,
+                content_type=f.content_type
+            )
+    
+    return documents, tailles, archive
+
+def traiter_lot(dossiers, fusionner_zeendoc=False):
+    """Envoie les dossiers d'un lot: à la suite pour une même adresse ZeenDoc, les adresses en parallèle"""
+    
+    par_adresse = {}
+    for dossier in dossiers:
+        par_adresse.setdefault(dossier['adresse_zeendoc'], []).append(dossier)
+    
+    resultats = {}
+    with ThreadPoolExecutor(max_workers=min(THREADS_LOT, len(par_adresse))) as executor:
+        futures = [
+            soumettre(executor, envoyer_dossiers_meme_adresse, groupe, fusionner_zeendoc)
+            for groupe in par_adresse.values()
+        ]
+        for future in futures:
+            resultats.update(future.result())
+    
+    # Résultats dans l'ordre du manifeste
+    return [resultats[dossier['reference']] for dossier in dossiers]
+
+def envoyer_dossiers_meme_adresse(dossiers, fusionner_zeendoc):
+    """Dossiers d'une même adresse ZeenDoc, l'un après l'autre: une seule session SMTP (pool) réutilisée"""
+    
+    resultats = {}
+    a_fusionner = {}
+    durees = {}
+    
+    # Un seul cache d'encodage: les emails principaux et le dépôt groupé joignent les mêmes fichiers
+    with encodages_partages(DOSSIER_SPOOL, MEMOIRE_CACHE_MIME_MO * 1024 * 1024):
+        for dossier in dossiers:
+            reference = dossier['reference']
+            secteur = dossier['data']['secteurDemandeur']
+            fusion = fusionner_zeendoc and secteur in FUSION_ZEENDOC_SECTEURS
+            
+            debut = time.monotonic()
+            try:
+                with contexte_journal(secteur=secteur):
+                    envoi_auto_reussi, resultats_detailles = executer_envois(
+                        dossier['data'],
+                        dossier['fichiers'],
+                        secteur,
+                        dossier['adresse_zeendoc'],
+                        inclure_zeendoc=not fusion
+                    )
+            except Exception as e:
+                journal.exception("Erreur envoi automatique (%s): %s", reference, e)
+                resultats[reference] = {
+                    "reference": reference,
+                    "status": "error",
+                    "message": f"Erreur lors de l'envoi automatique: {str(e)}"
+                }
+                continue
+            
+            durees[reference] = time.monotonic() - debut
+            resultats[reference] = {
+                "reference": reference,
+                **construire_reponse_envoi(
+                    dossier['fichiers'], envoi_auto_reussi, resultats_detailles, secteur, dossier['adresse_zeendoc']
+                )
+            }
+            if fusion:
+                a_fusionner.setdefault(secteur, []).append(dossier)
+        
+        for secteur, groupe in a_fusionner.items():
+            with contexte_journal(secteur=secteur):
+                deposer_zeendoc_groupe(groupe, secteur, [resultats[dossier['reference']] for dossier in groupe])
+    
+    # Après le dépôt groupé: l'historique reprend les parties ZeenDoc communes
+    for dossier in dossiers:
+        if dossier['reference'] in durees:
+            historiser_envoi(dossier['data'], dossier['fichiers'], resultats[dossier['reference']], durees[dossier['reference']])
+    
+    return resultats
+
+def deposer_zeendoc_groupe(dossiers, secteur, reponses):
+    """Dépôt ZeenDoc commun à plusieurs dossiers d'un même secteur, détails reportés sur chaque réponse"""
+    
+    adresse_zeendoc = dossiers[0]['adresse_zeendoc']
+    corps_dossiers = []
+    fichiers_groupe = []
+    noms_par_dossier = []
+    
+    for dossier, reponse in zip(dossiers, reponses):
+        a_envoyer, deja_deposes = separer_fichiers_deja_deposes(dossier['fichiers'], adresse_zeendoc)
+        reponse['details_envoi']['zeendoc_deja_deposes'] = deja_deposes
+        noms_par_dossier.append({f['nom'] for f in a_envoyer})
+        if a_envoyer:
+            corps_dossiers.append(generer_corps_zeendoc(
+                construire_contexte_email(dossier['data'], a_envoyer, adresse_zeendoc, deja_deposes)
+            ))
+            fichiers_groupe.extend(a_envoyer)
+    
+    resultats_zeendoc = []
+    if fichiers_groupe:
+        reglages = reglages_secteur(secteur)
+        journal.info("Dépôt ZeenDoc groupé (%s): %d dossier(s), %d fichier(s)", secteur, len(corps_dossiers), len(fichiers_groupe))
+        sujet = f"[ZEENDOC-{secteur.upper()}] Documents - Dépôt groupé de {len(corps_dossiers)} dossier(s)"
+        corps = f"=== DÉPÔT GROUPÉ ZEENDOC ===\nDossiers: {len(corps_dossiers)}\n\n" + "\n\n".join(corps_dossiers)
+        resultats_zeendoc = envoyer_emails_zeendoc_multiples(
+            sujet,
+            corps,
+            fichiers_groupe,
+            adresse_zeendoc,
+            max_emails=reglages.max_emails_par_demande * len(corps_dossiers),
+            reglages=reglages
+        )
+        for resultat in resultats_zeendoc:
+            ENVOIS.labels(secteur, 'zeendoc', 'succes' if resultat.get('succes') else 'echec').inc()
+    
+    # Chaque dossier ne voit que les parties qui contiennent ses fichiers
+    for noms, reponse in zip(noms_par_dossier, reponses):
+        parties = [r for r in resultats_zeendoc if noms & set(r.get('fichiers', []))]
+        details = reponse['details_envoi']
+        details['zeendoc_parties'] = parties
+        details['zeendoc_reussi'] = all(r.get('succes', False) for r in parties)
+        details['total_emails_zeendoc'] = len(parties)
+        details['zeendoc_groupe'] = True
+        reponse['envoi_auto'] = details['email_principal'] and details['zeendoc_reussi']
+
+def traiter_demande_en_file(demande_id, payload):
+    """Traitement d'une demande par un worker de la file d'envois"""
+    
+    fichiers_pieces = payload['fichiers']
+    
+    def rappel_progression(partie, ordre, statut, **details):
+        FILE_ENVOIS.mettre_a_jour_partie(demande_id, partie, ordre, statut, **details)
+    
+    # Parties déjà envoyées lors d'une tentative précédente (reprise ou worker interrompu)
+    etat_precedent = FILE_ENVOIS.obtenir_parties(demande_id)
+    deja_envoyees = [partie for partie, etat in etat_precedent.items() if etat['statut'] == 'envoye']
+    if deja_envoyees:
+        journal.info("Reprise de la demande %s: déjà envoyé(s): %s", demande_id, ', '.join(deja_envoyees))
+    
+    envoi_auto_reussi = False
+    debut = time.monotonic()
+    try:
+        envoi_auto_reussi, resultats_detailles = executer_envois(
+            payload['data'],
+            fichiers_pieces,
+            payload['secteur'],
+            payload['adresse_zeendoc'],
+            rappel_progression=rappel_progression,
+            etat_precedent=etat_precedent
+        )
+    finally:
+        # Les fichiers restent disponibles pour une reprise tant qu'un envoi a échoué
+        if envoi_auto_reussi:
+            shutil.rmtree(payload['dossier_fichiers'], ignore_errors=True)
+        else:
+            journal.warning("Fichiers de la demande %s conservés pour reprise", demande_id)
+    
+    reponse = construire_reponse_envoi(
+        fichiers_pieces, envoi_auto_reussi, resultats_detailles, payload['secteur'], payload['adresse_zeendoc']
+    )
+    historiser_envoi(payload['data'], fichiers_pieces, reponse, time.monotonic() - debut, envoi_id=demande_id)
+    return reponse
+
+def liberer_demande_en_file(payload):
+    """Supprime les fichiers d'une demande purgée de la file (conservés jusque-là pour une reprise)"""
+    
+    shutil.rmtree(payload['dossier_fichiers'], ignore_errors=True)
+
+FILE_ENVOIS = FileAttenteEnvois(
+    os.path.join(DOSSIER_DONNEES, 'file_envois.db'),
+    traiter_demande_en_file,
+    nb_workers=NB_WORKERS_ENVOI,
+    duree_conservation=CONSERVATION_DEMANDES_JOURS * 86400,
+    liberer=liberer_demande_en_file
+)
+
+def demander_arret():
+    """Début de l'arrêt du processus (SIGTERM): plus de nouvelle demande prise dans la file"""
+    
+    FILE_ENVOIS.demander_arret()
+
+def arreter_processus(delai=DELAI_ARRET):
+    """Arrêt propre du processus: attend les envois en cours (au plus `delai` secondes), puis libère les ressources.
+    
+    Une demande dont l'envoi dépasse le délai reste réservée jusqu'à la fin de
+    son bail et reprend ensuite là où elle s'est arrêtée (parties déjà envoyées
+    conservées), dans ce processus au prochain démarrage ou dans un autre.
+    """
+    
+    FILE_ENVOIS.arreter(delai)
+    if _POOL_OPTIMISATION['pid'] == os.getpid():
+        _POOL_OPTIMISATION['executor'].shutdown(wait=False, cancel_futures=True)
+    POOL_SMTP.fermer_tout()
+    HISTORIQUE_ENVOIS.arreter()
+
+def envoyer_email_principal_auto(sujet, corps, fichiers_pieces, data, reglages=None):
     """Email principal avec compression ZIP si trop lourd"""
     
+    reglages = reglages or reglages_secteur(data.get('secteurDemandeur'))
     try:
         if not fichiers_pieces:
             # Pas de fichiers, envoi simple
             return envoyer_email_smtp(
-                destinataire=EMAIL_DESTINATAIRE,
+                destinataire=reglages.destinataire,
                 sujet=sujet,
                 corps=corps,
                 fichiers=[]
             )
         
-        # Calculer la taille totale
-        taille_totale = sum(f['taille'] for f in fichiers_pieces)
-        limite_bytes = LIMITE_EMAIL_MB * 1024 * 1024
+        fichiers_a_envoyer, corps_modifie = preparer_pieces_email_principal(
+            corps, fichiers_pieces, data, reglages.limite_email_mo
+        )
+        
+        try:
+            return envoyer_email_smtp(
+                destinataire=reglages.destinataire,
+                sujet=sujet,
+                corps=corps_modifie,
+                fichiers=fichiers_a_envoyer
+            )
+        finally:
+            # L'archive temporaire n'est utile que pour cet envoi
+            if fichiers_a_envoyer is not fichiers_pieces:
+                for fichier in fichiers_a_envoyer:
+                    os.remove(fichier['chemin'])
         
-        # Décider si on compresse
-        if taille_totale > limite_bytes:
-            print(f"📦 Compression ZIP nécessaire: {format_file_size(taille_totale)} > {LIMITE_EMAIL_MB}MB")
-            fichiers_a_envoyer = creer_archive_zip(fichiers_pieces, data)
-            corps_modifie = corps + f"""
+    except Exception as e:
+        journal.exception("Erreur envoi email principal: %s", e)
+        return False
+
+def preparer_pieces_email_principal(corps, fichiers_pieces, data, limite_mb=None):
+    """Retourne (pièces, corps) de l'email principal: fichiers originaux, ou archive ZIP si trop lourds"""
+    
+    if limite_mb is None:
+        limite_mb = reglages_secteur(data.get('secteurDemandeur')).limite_email_mo
+    
+    # Calculer la taille totale
+    taille_totale = sum(f['taille'] for f in fichiers_pieces)
+    limite_bytes = limite_mb * 1024 * 1024
+    
+    # Décider si on compresse
+    if taille_totale <= limite_bytes:
+        journal.info("Envoi fichiers originaux: %s < %gMB", format_file_size(taille_totale), limite_mb)
+        return fichiers_pieces, corps
+    
+    journal.info("Compression ZIP nécessaire: %s > %gMB", format_file_size(taille_totale), limite_mb)
+    fichiers_a_envoyer = creer_archive_zip(fichiers_pieces, data)
+    corps_modifie = corps + f"""
 
 === PIÈCES JOINTES ===
 📦 Fichiers compressés en archive ZIP (taille originale: {format_file_size(taille_totale)})
@@ -199,36 +1535,32 @@ def envoyer_email_principal_auto(sujet, corps, fichiers_pieces, data):
 
 ℹ️  Les documents originaux sont envoyés séparément vers ZeenDoc pour traitement.
 """
-        else:
-            print(f"📄 Envoi fichiers originaux: {format_file_size(taille_totale)} < {LIMITE_EMAIL_MB}MB")
-            fichiers_a_envoyer = fichiers_pieces
-            corps_modifie = corps
-        
-        return envoyer_email_smtp(
-            destinataire=EMAIL_DESTINATAIRE,
-            sujet=sujet,
-            corps=corps_modifie,
-            fichiers=fichiers_a_envoyer
-        )
-        
-    except Exception as e:
-        print(f"❌ Erreur envoi email principal: {str(e)}")
-        return False
+    return fichiers_a_envoyer, corps_modifie
 
 def creer_archive_zip(fichiers_pieces, data):
-    """Crée une archive ZIP avec tous les fichiers"""
+    """Crée une archive ZIP (fichier temporaire sur disque) avec tous les fichiers"""
     
     try:
-        zip_buffer = io.BytesIO()
+        descripteur, chemin_zip = tempfile.mkstemp(suffix='.zip', dir=DOSSIER_SPOOL)
+        os.close(descripteur)
         
-        with zipfile.ZipFile(zip_buffer, 'w', zipfile.ZIP_DEFLATED, compresslevel=6) as zip_file:
-            for fichier in fichiers_pieces:
-                # Organiser par catégorie dans le ZIP
-                chemin_dans_zip = f"{fichier['categorie']}/{fichier['nom']}"
-                zip_file.writestr(chemin_dans_zip, fichier['contenu'])
+        try:
+            # Organiser par catégorie dans le ZIP; compression parallèle, formats déjà compressés stockés
+            with mesurer('archive_zip'):
+                membres = construire_archive_zip(
+                    [(fichier, f"{fichier['categorie']}/{fichier['nom']}") for fichier in fichiers_pieces],
+                    chemin_zip,
+                    ouvrir=ouvrir_fichier,
+                    nb_threads=THREADS_COMPRESSION_ZIP,
+                    niveau=NIVEAU_COMPRESSION_ZIP
+                )
+        except Exception:
+            os.remove(chemin_zip)
+            raise
         
-        zip_buffer.seek(0)
-        contenu_zip = zip_buffer.getvalue()
+        taille_zip = os.path.getsize(chemin_zip)
+        nb_stockes = sum(1 for m in membres if m.methode == METHODE_STOCKEE)
+        journal.debug("%d fichier(s) compressé(s), %d stocké(s) tel(s) quel(s)", len(membres) - nb_stockes, nb_stockes)
         
         # Générer nom du ZIP
         nom = data.get('nom', 'Client')
@@ -236,33 +1568,63 @@ def creer_archive_zip(fichiers_pieces, data):
         type_demande = data.get('type', 'Demande')
         nom_zip = f"Documents_{type_demande.upper()}_{nom.upper()}_{prenom}_{datetime.now().strftime('%Y%m%d_%H%M%S')}.zip"
         
-        print(f"📦 Archive ZIP créée: {nom_zip} ({format_file_size(len(contenu_zip))})")
+        journal.info("Archive ZIP créée: %s (%s)", nom_zip, format_file_size(taille_zip))
         
         return [{
             'nom': nom_zip,
-            'contenu': contenu_zip,
+            'chemin': chemin_zip,
             'type_mime': 'application/zip',
-            'taille': len(contenu_zip),
+            'taille': taille_zip,
             'categorie': 'Archive complète'
         }]
         
     except Exception as e:
-        print(f"❌ Erreur création ZIP: {str(e)}")
+        journal.exception("Erreur création ZIP: %s", e)
         return fichiers_pieces  # Retourner les fichiers originaux en cas d'erreur
 
-def diviser_fichiers_par_taille(fichiers_pieces, limite_mb=None):
-    """Divise les fichiers en plusieurs groupes selon la taille"""
+def taille_encodee(fichier):
+    """Taille d'une pièce dans l'email: base64 (lignes de 76 caractères + CRLF) et en-têtes MIME"""
+    
+    caracteres = 4 * ((fichier['taille'] + 2) // 3)
+    return caracteres + 2 * ((caracteres + 75) // 76) + ENTETE_PIECE_MIME + len(fichier['nom'])
+
+def diviser_fichiers_par_taille(fichiers_pieces, limite_mb=None, mode=None):
+    """Divise les fichiers en plusieurs groupes selon leur taille encodée dans l'email"""
     
     if limite_mb is None:
-        limite_mb = LIMITE_EMAIL_MB
+        limite_mb = CONFIGURATION_ENVOIS.actuelle().generaux.limite_email_mo
+    if mode is None:
+        mode = MODE_DECOUPAGE_ZEENDOC
+    
+    # L'en-tête et le corps texte de chaque email consomment aussi une part de la limite
+    limite_bytes = limite_mb * 1024 * 1024 - ENTETE_EMAIL_MIME
+    
+    for fichier in fichiers_pieces:
+        if taille_encodee(fichier) > limite_bytes:
+            journal_fichiers.info("Fichier volumineux isolé: %s (%s)", fichier['nom'], format_file_size(fichier['taille']))
+    
+    if mode == 'sequentiel':
+        return decouper_sequentiel(fichiers_pieces, limite_bytes)
+    
+    # Le regroupement par catégorie ne doit jamais coûter un email de plus:
+    # on retient le découpage le plus court, à égalité celui qui groupe les catégories
+    meilleur_ajustement = (mode == 'best_fit')
+    candidats = [
+        decouper_par_categorie(fichiers_pieces, limite_bytes, meilleur_ajustement, grouper_categories=True),
+        decouper_par_categorie(fichiers_pieces, limite_bytes, meilleur_ajustement, grouper_categories=False),
+        decouper_sequentiel(fichiers_pieces, limite_bytes)
+    ]
+    return min(candidats, key=len)
+
+def decouper_sequentiel(fichiers_pieces, limite_bytes):
+    """Découpage historique en une passe: un groupe est fermé dès qu'un fichier ne tient plus"""
     
-    limite_bytes = limite_mb * 1024 * 1024
     groupes = []
     groupe_actuel = []
     taille_actuelle = 0
     
     for fichier in fichiers_pieces:
-        taille_fichier = fichier['taille']
+        taille_fichier = taille_encodee(fichier)
         
         # Si le fichier seul dépasse la limite
         if taille_fichier > limite_bytes:
@@ -274,7 +1636,6 @@ def diviser_fichiers_par_taille(fichiers_pieces, limite_mb=None):
             
             # Fichier seul dans son propre groupe
             groupes.append([fichier])
-            print(f"⚠️  Fichier volumineux isolé: {fichier['nom']} ({format_file_size(taille_fichier)})")
             continue
         
         # Si ajouter ce fichier dépasse la limite
@@ -297,25 +1658,123 @@ def diviser_fichiers_par_taille(fichiers_pieces, limite_mb=None):
     
     return groupes
 
-def envoyer_emails_zeendoc_multiples(sujet_base, corps_base, fichiers_pieces, adresse_zeendoc):
-    """ZeenDoc: Emails multiples pour préserver la qualité"""
+def decouper_par_categorie(fichiers_pieces, limite_bytes, meilleur_ajustement=True, grouper_categories=True):
+    """Rangement par tailles décroissantes (first-fit ou best-fit), en gardant si possible chaque catégorie groupée"""
+    
+    ordre_origine = {id(fichier): index for index, fichier in enumerate(fichiers_pieces)}
+    groupes = []  # [taille occupée, fichiers]
+    
+    def choisir_groupe(tailles_groupes, taille):
+        candidats = [i for i, occupe in enumerate(tailles_groupes) if occupe + taille <= limite_bytes]
+        if not candidats:
+            return None
+        if meilleur_ajustement:
+            # Le groupe le plus rempli qui peut encore l'accueillir
+            return max(candidats, key=lambda i: tailles_groupes[i])
+        return candidats[0]
+    
+    def placer(fichiers, taille):
+        index = choisir_groupe([g[0] for g in groupes], taille)
+        if index is None:
+            groupes.append([0, []])
+            index = len(groupes) - 1
+        groupes[index][0] += taille
+        groupes[index][1].extend(fichiers)
+    
+    par_categorie = {}
+    for fichier in fichiers_pieces:
+        if taille_encodee(fichier) > limite_bytes:
+            # Fichier seul dans son propre groupe
+            groupes.append([limite_bytes, [fichier]])
+            continue
+        cle = fichier['categorie'] if grouper_categories else id(fichier)
+        par_categorie.setdefault(cle, []).append(fichier)
+    
+    # Catégories les plus lourdes d'abord
+    categories = sorted(
+        par_categorie.values(),
+        key=lambda fichiers: sum(taille_encodee(f) for f in fichiers),
+        reverse=True
+    )
+    
+    for fichiers in categories:
+        fichiers = sorted(fichiers, key=taille_encodee, reverse=True)
+        taille_categorie = sum(taille_encodee(f) for f in fichiers)
+        
+        if len(fichiers) > 1 and taille_categorie <= limite_bytes:
+            tailles_groupes = [g[0] for g in groupes]
+            if choisir_groupe(tailles_groupes, taille_categorie) is not None:
+                placer(fichiers, taille_categorie)
+                continue
+            
+            # Ouvrir un groupe pour la catégorie, sauf si ses fichiers tiennent
+            # séparément dans les groupes existants (un email de moins)
+            tient_sans_nouveau_groupe = True
+            for fichier in fichiers:
+                index = choisir_groupe(tailles_groupes, taille_encodee(fichier))
+                if index is None:
+                    tient_sans_nouveau_groupe = False
+                    break
+                tailles_groupes[index] += taille_encodee(fichier)
+            
+            if not tient_sans_nouveau_groupe:
+                placer(fichiers, taille_categorie)
+                continue
+        
+        for fichier in fichiers:
+            placer([fichier], taille_encodee(fichier))
+    
+    # Ordre d'upload conservé dans chaque groupe et entre les groupes
+    resultat = [sorted(g[1], key=lambda f: ordre_origine[id(f)]) for g in groupes]
+    return sorted(resultat, key=lambda groupe: ordre_origine[id(groupe[0])])
+
+def envoyer_emails_zeendoc_multiples(sujet_base, corps_base, fichiers_pieces, adresse_zeendoc, rappel_progression=None,
+                                     plan_precedent=None, max_emails=None, categories=None, reglages=None):
+    """ZeenDoc: Emails multiples pour préserver la qualité (`reglages`: ceux du secteur, sinon les réglages généraux)"""
     
     if not fichiers_pieces:
         return []
     
-    groupes_fichiers = diviser_fichiers_par_taille(fichiers_pieces)
-    total_groupes = len(groupes_fichiers)
+    reglages = reglages or CONFIGURATION_ENVOIS.actuelle().generaux
+    max_emails = max_emails or reglages.max_emails_par_demande
+    # Regroupement par catégorie de toute la demande, partagé par les corps de chaque partie
+    if categories is None:
+        categories = grouper_par_categorie(fichiers_pieces)
     
-    if total_groupes > MAX_EMAILS_PAR_DEMANDE:
-        print(f"⚠️  Trop de groupes ({total_groupes}), limité à {MAX_EMAILS_PAR_DEMANDE}")
-        groupes_fichiers = groupes_fichiers[:MAX_EMAILS_PAR_DEMANDE]
+    parties_envoyees = set()
+    if plan_precedent:
+        # Reprise: découpage enregistré lors de la première tentative
+        groupes_fichiers, groupes_exclus, parties_envoyees = reconstruire_plan_zeendoc(plan_precedent, fichiers_pieces)
+        total_groupes = len(groupes_fichiers)
+    else:
+        groupes_fichiers, groupes_exclus = decouper_parties_zeendoc(fichiers_pieces, max_emails, reglages.limite_email_mo)
         total_groupes = len(groupes_fichiers)
     
-    print(f"📧 Division ZeenDoc: {len(fichiers_pieces)} fichiers → {total_groupes} email(s) vers {adresse_zeendoc}")
+    journal.info("Division ZeenDoc: %d fichiers → %d email(s) vers %s", len(fichiers_pieces), total_groupes, adresse_zeendoc)
     
-    resultats = []
+    # Le plan (fichiers de chaque partie) est enregistré à chaque mise à jour: il sert à la reprise
+    if rappel_progression:
+        for index, groupe in enumerate(groupes_fichiers, 1):
+            if index not in parties_envoyees:
+                rappel_progression(f"{index}/{total_groupes}", index, 'en_attente',
+                                   fichiers_count=len(groupe), fichiers=[f['nom'] for f in groupe])
     
-    for index, groupe in enumerate(groupes_fichiers, 1):
+    def envoyer_partie(index, groupe):
+        # Contexte copié pour ce thread: la partie ne déborde pas sur les autres envois
+        PARTIE.set(f"{index}/{total_groupes}")
+        noms_fichiers = [f['nom'] for f in groupe]
+        if index in parties_envoyees:
+            journal.info("Partie %d/%d déjà envoyée lors d'une tentative précédente", index, total_groupes)
+            return {
+                'partie': f"{index}/{total_groupes}",
+                'fichiers_count': len(groupe),
+                'succes': True,
+                'deja_envoye': True,
+                'taille_totale': sum(f['taille'] for f in groupe),
+                'fichiers': noms_fichiers,
+                'adresse_zeendoc': adresse_zeendoc
+            }
+        
         try:
             # Sujet avec numérotation
             if total_groupes > 1:
@@ -325,204 +1784,331 @@ def envoyer_emails_zeendoc_multiples(sujet_base, corps_base, fichiers_pieces, ad
             
             # Corps adapté pour ZeenDoc
             corps_numerote = generer_corps_zeendoc_multiple(
-                corps_base, groupe, index, total_groupes, fichiers_pieces
+                corps_base, groupe, index, total_groupes, len(fichiers_pieces), categories,
+                reglages.debit_zeendoc_par_minute
             )
             
+            # Respect du débit autorisé vers cette adresse (partagé entre toutes les demandes)
+            attente = LIMITEUR_ZEENDOC.acquerir(adresse_zeendoc, reglages.debit_zeendoc_par_minute)
+            observer_duree('attente_debit', attente)
+            if attente:
+                journal.info("Partie %d/%d: attente %.1fs (débit %g/min vers %s)",
+                             index, total_groupes, attente, reglages.debit_zeendoc_par_minute, adresse_zeendoc,
+                             extra={'attente': attente})
+            
             taille_groupe = sum(f['taille'] for f in groupe)
-            print(f"📤 Envoi partie {index}/{total_groupes} vers {adresse_zeendoc}: {len(groupe)} fichier(s) ({format_file_size(taille_groupe)})")
+            journal.info("Envoi partie %d/%d vers %s: %d fichier(s) (%s)",
+                         index, total_groupes, adresse_zeendoc, len(groupe), format_file_size(taille_groupe))
+            if rappel_progression:
+                rappel_progression(f"{index}/{total_groupes}", index, 'en_cours',
+                                   fichiers_count=len(groupe), fichiers=noms_fichiers)
             
             # Envoi vers ZeenDoc avec adresse spécifique au secteur
+            debut_envoi = time.monotonic()
             succes = envoyer_email_smtp(
                 destinataire=adresse_zeendoc,  # Adresse spécifique au secteur
-                cc=EMAIL_DESTINATAIRE,  # Copie pour suivi
+                cc=reglages.destinataire,  # Copie pour suivi
                 sujet=sujet_numerote,
                 corps=corps_numerote,
-                fichiers=groupe
+                fichiers=groupe,
+                type_envoi='zeendoc'
             )
             
-            resultats.append({
+            if rappel_progression:
+                rappel_progression(
+                    f"{index}/{total_groupes}", index, 'envoye' if succes else 'echec',
+                    fichiers_count=len(groupe), taille_totale=taille_groupe, fichiers=noms_fichiers
+                )
+            
+            if succes:
+                journal.info("Partie %d/%d envoyée avec succès vers %s", index, total_groupes, adresse_zeendoc)
+                for fichier in groupe:
+                    if fichier.get('sha256'):
+                        INDEX_DEPOTS.enregistrer(adresse_zeendoc, fichier['sha256'], fichier['nom'])
+            else:
+                journal.error("Échec envoi partie %d/%d vers %s", index, total_groupes, adresse_zeendoc)
+            
+            return {
                 'partie': f"{index}/{total_groupes}",
                 'fichiers_count': len(groupe),
                 'succes': succes,
                 'taille_totale': taille_groupe,
-                'fichiers': [f['nom'] for f in groupe],
+                'duree_envoi': round(time.monotonic() - debut_envoi, 2),
+                'fichiers': noms_fichiers,
                 'adresse_zeendoc': adresse_zeendoc
-            })
-            
-            if succes:
-                print(f"✅ Partie {index}/{total_groupes} envoyée avec succès vers {adresse_zeendoc}")
-            else:
-                print(f"❌ Échec envoi partie {index}/{total_groupes} vers {adresse_zeendoc}")
-            
-            # Délai entre envois (sauf dernier)
-            if index < total_groupes and succes:
-                print(f"⏱️  Attente {DELAI_ENTRE_ENVOIS}s avant envoi suivant...")
-                time.sleep(DELAI_ENTRE_ENVOIS)
+            }
                 
         except Exception as e:
-            print(f"❌ Erreur envoi partie {index}/{total_groupes}: {str(e)}")
-            resultats.append({
+            journal.exception("Erreur envoi partie %d/%d: %s", index, total_groupes, e)
+            if rappel_progression:
+                rappel_progression(f"{index}/{total_groupes}", index, 'echec', erreur=str(e), fichiers=noms_fichiers)
+            return {
                 'partie': f"{index}/{total_groupes}",
                 'succes': False,
                 'erreur': str(e),
+                'fichiers': noms_fichiers,
                 'adresse_zeendoc': adresse_zeendoc
-            })
+            }
+    
+    # Envoi des parties en parallèle, cadencé par le limiteur de débit
+    with ThreadPoolExecutor(max_workers=min(THREADS_ENVOI_ZEENDOC, total_groupes)) as executor:
+        futures = [
+            soumettre(executor, envoyer_partie, index, groupe)
+            for index, groupe in enumerate(groupes_fichiers, 1)
+        ]
+        resultats = [future.result() for future in futures]
+    
+    # Les documents au-delà de la limite d'emails ne sont pas envoyés: on le signale
+    fichiers_exclus = [f for groupe in groupes_exclus for f in groupe]
+    if fichiers_exclus:
+        journal.error("%d fichier(s) non envoyé(s) vers ZeenDoc (limite de %d emails)", len(fichiers_exclus), max_emails)
+        if rappel_progression:
+            rappel_progression('non_envoye', total_groupes + 1, 'echec',
+                               fichiers_count=len(fichiers_exclus), fichiers=[f['nom'] for f in fichiers_exclus])
+        resultats.append({
+            'partie': 'non envoyé',
+            'fichiers_count': len(fichiers_exclus),
+            'succes': False,
+            'erreur': f"Limite de {max_emails} emails par demande atteinte",
+            'fichiers': [f['nom'] for f in fichiers_exclus],
+            'adresse_zeendoc': adresse_zeendoc
+        })
     
     return resultats
 
-def envoyer_email_smtp(destinataire, sujet, corps, fichiers, cc=None):
+def decouper_parties_zeendoc(fichiers_pieces, max_emails, limite_mb=None):
+    """Retourne (groupes à envoyer, groupes au-delà de la limite d'emails par demande)"""
+    
+    with mesurer('decoupage'):
+        groupes_fichiers = diviser_fichiers_par_taille(fichiers_pieces, limite_mb)
+    PARTIES_PAR_DEMANDE.observe(len(groupes_fichiers))
+    
+    if len(groupes_fichiers) <= max_emails:
+        return groupes_fichiers, []
+    
+    journal.warning("Trop de groupes (%d), limité à %d", len(groupes_fichiers), max_emails)
+    return groupes_fichiers[:max_emails], groupes_fichiers[max_emails:]
+
+def reconstruire_plan_zeendoc(plan_precedent, fichiers_pieces):
+    """Groupes envoyés, groupes exclus et numéros des parties déjà envoyées d'après le plan enregistré"""
+    
+    par_nom = {f['nom']: f for f in fichiers_pieces}
+    groupes_fichiers = []
+    groupes_exclus = []
+    parties_envoyees = set()
+    
+    for partie in plan_precedent:
+        groupe = [par_nom[nom] for nom in partie['fichiers'] if nom in par_nom]
+        if partie['partie'] == 'non_envoye':
+            groupes_exclus.append(groupe)
+            continue
+        groupes_fichiers.append(groupe)
+        if partie['statut'] == 'envoye':
+            parties_envoyees.add(len(groupes_fichiers))
+    
+    return groupes_fichiers, groupes_exclus, parties_envoyees
+
+def envoyer_email_smtp(destinataire, sujet, corps, fichiers, cc=None, type_envoi='principal'):
     """Fonction SMTP générique pour tous les envois"""
     
     try:
-        msg = MIMEMultipart()
-        msg['From'] = SMTP_USERNAME
-        msg['To'] = destinataire
+        # Message construit à la volée: les pièces sont lues et encodées pendant l'envoi
+        with mesurer('construction_mime'):
+            message = MessageStreaming(
+                SMTP_USERNAME, destinataire, sujet, corps, fichiers,
+                ouvrir=ouvrir_fichier, cc=cc
+            )
+        
+        # Envoi SMTP via une connexion persistante du pool
+        destinataires = [destinataire]
         if cc:
-            msg['Cc'] = cc
-        msg['Subject'] = sujet
+            destinataires.append(cc)
         
-        # Corps du message
-        msg.attach(MIMEText(corps, 'plain', 'utf-8'))
+        def envoyer(server):
+            with mesurer('smtp_envoi'):
+                return envoyer_message_streaming(server, SMTP_USERNAME, destinataires, message)
         
-        # Pièces jointes
-        for fichier in fichiers:
-            part = MIMEBase('application', 'octet-stream')
-            part.set_payload(fichier['contenu'])
-            encoders.encode_base64(part)
-            part.add_header(
-                'Content-Disposition',
-                f'attachment; filename="{fichier["nom"]}"'
-            )
-            msg.attach(part)
+        for tentative in range(1, SMTP_TENTATIVES + 1):
+            try:
+                POOL_SMTP.executer(
+                    SMTP_SERVER, SMTP_PORT, SMTP_USERNAME, SMTP_PASSWORD,
+                    envoyer,
+                    starttls=SMTP_STARTTLS
+                )
+                break
+            except Exception as e:
+                ECHECS_SMTP.labels(type(e).__name__).inc()
+                if tentative == SMTP_TENTATIVES or not erreur_transitoire(e):
+                    raise
+                
+                delai = delai_nouvel_essai(tentative, SMTP_DELAI_NOUVEL_ESSAI, SMTP_DELAI_MAX_NOUVEL_ESSAI)
+                journal.warning("Erreur SMTP temporaire (%s), essai %d/%d dans %.1fs", e, tentative + 1, SMTP_TENTATIVES, delai,
+                                extra={'erreur': type(e).__name__})
+                time.sleep(delai)
         
-        # Envoi SMTP
-        with smtplib.SMTP(SMTP_SERVER, SMTP_PORT) as server:
-            server.starttls()
-            server.login(SMTP_USERNAME, SMTP_PASSWORD)
-            
-            destinataires = [destinataire]
-            if cc:
-                destinataires.append(cc)
-            
-            server.send_message(msg, to_addrs=destinataires)
-            return True
+        observer_duree('encodage_mime', message.duree_encodage)
+        OCTETS_ENVOYES.labels(type_envoi).inc(message.taille())
+        return True
             
     except Exception as e:
-        print(f"❌ Erreur SMTP: {str(e)}")
+        journal.error("Erreur SMTP: %s", e, extra={'erreur': type(e).__name__})
         return False
 
-def generer_corps_zeendoc_multiple(corps_base, fichiers_groupe, index, total, fichiers_complets):
-    """Génère le corps pour un email multiple"""
+def preparer_fichiers_zeendoc(files, nom, prenom, type_demande, dossier):
+    """Prépare les fichiers pour l'envoi vers ZeenDoc (liés dans `dossier`, jamais chargés en mémoire)
     
-    if total == 1:
-        return corps_base
+    Chaque fichier est lu une seule fois (taille et empreinte au passage), tous
+    les fichiers d'un même champ sont pris en compte et les pièces qui
+    recevraient le même nom standardisé sont numérotées (_1, _2...).
+    Un échec du stockage ou d'un lien fait échouer toute la demande (exception,
+    dossier supprimé): aucune pièce n'est écartée en silence.
+    """
     
-    # En-tête spécial pour les envois multiples
-    entete_multiple = f"""=== ENVOI MULTIPLE - PARTIE {index}/{total} ===
-⚠️  ATTENTION: Cet envoi fait partie d'un lot de {total} emails
-📦 Cette partie contient {len(fichiers_groupe)} document(s) sur {len(fichiers_complets)} au total
-⏱️  Délai entre envois: {DELAI_ENTRE_ENVOIS} secondes pour éviter la saturation
-
-"""
+    os.makedirs(dossier, exist_ok=True)
     
-    # Ajouter la liste des fichiers de cette partie
-    fichiers_section = "=== FICHIERS DE CETTE PARTIE ===\n"
+    # Formulaire (request.files, tous les fichiers de chaque champ) ou liste de paires (doc_id, fichier)
+    elements = files.items(multi=True) if hasattr(files, 'items') else files
     
-    par_categorie = {}
-    for fichier in fichiers_groupe:
-        cat = fichier['categorie']
-        if cat not in par_categorie:
-            par_categorie[cat] = []
-        par_categorie[cat].append(fichier)
-    
-    for categorie, fichiers in par_categorie.items():
-        fichiers_section += f"\n📁 {categorie.upper()}:\n"
-        for fichier in fichiers:
-            taille_fmt = format_file_size(fichier['taille'])
-            fichiers_section += f"  • {fichier['nom']} ({taille_fmt})\n"
+    # 1. Taille et empreinte de chaque fichier, doublons écartés
+    recus = []
+    empreintes_vues = set()
+    for key, file in elements:
+        if not (file and file.filename):
+            continue
+        try:
+            if isinstance(file, FichierTeleverse):
+                # Téléversé par morceaux: empreinte et stockage faits à la finalisation
+                chemin_spool, sha256, taille = None, file.sha256, file.taille
+            else:
+                chemin_spool, sha256, taille = spooler_fichier_upload(file)
+        except PieceRefusee:
+            # Pièce hors des règles de son type (taille réelle, archive): la demande échoue
+            raise
+        except Exception as e:
+            journal_fichiers.error("Erreur préparation fichier %s: %s", file.filename, e)
+            continue
+        
+        # Fichier identique déjà joint à cette demande: un seul exemplaire
+        if sha256 in empreintes_vues:
+            journal_fichiers.debug("Doublon ignoré dans la demande: %s", file.filename)
+            if chemin_spool:
+                os.remove(chemin_spool)
+            continue
+        empreintes_vues.add(sha256)
+        recus.append((key, file, chemin_spool, sha256, taille))
     
-    # Informations sur l'envoi complet
-    recap_section = f"""
-
-=== RÉCAPITULATIF COMPLET ===
-Total des documents: {len(fichiers_complets)}
-Nombre d'emails: {total}
-Partie actuelle: {index}/{total}
-"""
+    # 2. Noms standardisés, numérotés quand plusieurs pièces porteraient le même nom
+    noms = [generer_nom_fichier_zeendoc(file.filename, nom, prenom, type_demande, key) for key, file, *_ in recus]
+    occurrences = Counter(noms)
+    numeros = Counter()
+    for position, (key, file, *_) in enumerate(recus):
+        nom_standardise = noms[position]
+        if occurrences[nom_standardise] > 1:
+            numeros[nom_standardise] += 1
+            noms[position] = generer_nom_fichier_zeendoc(
+                file.filename, nom, prenom, type_demande, key, numero=numeros[nom_standardise]
+            )
     
-    return entete_multiple + fichiers_section + recap_section + "\n" + corps_base
+    chemins = [os.path.join(dossier, f"{index}_{nom_standardise}") for index, nom_standardise in enumerate(noms)]
+    try:
+        # 3. Stock adressé par contenu (une transaction pour toute la demande), chaque pièce
+        # liée dans le dossier de la demande par le stock lui-même, avant toute éviction
+        a_stocker = [
+            ((chemin_spool, sha256, taille), chemin)
+            for (_, _, chemin_spool, sha256, taille), chemin in zip(recus, chemins) if chemin_spool
+        ]
+        stockes = iter(STOCK_CONTENU.stocker_plusieurs(
+            [element for element, _ in a_stocker], [chemin for _, chemin in a_stocker]
+        ))
+        
+        # 4. Pièces téléversées par morceaux: liées depuis leur téléversement
+        fichiers_pieces = []
+        for (key, file, chemin_spool, sha256, taille), nom_standardise, chemin in zip(recus, noms, chemins):
+            televerse = chemin_spool is None
+            if televerse:
+                # Version optimisée pendant le téléversement des autres pièces, si elle est prête
+                lier_ou_copier(file.chemin_optimise or file.chemin, chemin)
+            else:
+                _, deja_present = next(stockes)
+                if deja_present:
+                    journal_fichiers.debug("Contenu déjà présent dans le stock local: %s", file.filename)
+            
+            piece = {
+                'nom': nom_standardise,
+                'nom_original': file.filename,
+                'chemin': chemin,
+                'sha256': sha256,
+                'type_mime': file.content_type or 'application/octet-stream',
+                'taille': taille,
+                'categorie': obtenir_categorie_document(key)
+            }
+            if televerse and file.taille_optimisee is not None:
+                # Déjà optimisé: `optimiser_fichiers_pieces` ne le refera pas
+                piece['taille_originale'] = taille
+                piece['taille'] = file.taille_optimisee
+            fichiers_pieces.append(piece)
+    except Exception as e:
+        journal.exception("Erreur stockage des fichiers, demande abandonnée: %s", e)
+        shutil.rmtree(dossier, ignore_errors=True)
+        raise
+    
+    # Téléversements consommés seulement une fois toutes les pièces liées (sinon renvoyables)
+    for _, file, chemin_spool, _, _ in recus:
+        if chemin_spool is None:
+            ZONE_TELEVERSEMENTS.supprimer(file.televersement_id)
+    
+    return fichiers_pieces
 
-def preparer_fichiers_zeendoc(files, nom, prenom, type_demande):
-    """Prépare les fichiers pour l'envoi vers ZeenDoc"""
+def spooler_fichier_upload(file):
+    """Retourne (chemin dans le spool, SHA-256, taille) d'un fichier uploadé, en une seule lecture"""
     
-    fichiers_pieces = []
+    if isinstance(file.stream, FichierSpoole):
+        # Déjà écrit dans le spool pendant la réception, empreinte calculée au passage
+        file.stream.close()
+        return file.stream.name, file.stream.hachage.hexdigest(), file.stream.taille
     
-    for key, file in files.items():
-        if file and file.filename:
-            try:
-                # Lire le contenu du fichier
-                file_content = file.read()
-                file.seek(0)  # Remettre le curseur au début
-                
-                # Générer un nom de fichier standardisé
-                nom_standardise = generer_nom_fichier_zeendoc(
-                    file.filename, 
-                    nom, 
-                    prenom, 
-                    type_demande,
-                    key
-                )
-                
-                fichiers_pieces.append({
-                    'nom': nom_standardise,
-                    'nom_original': file.filename,
-                    'contenu': file_content,
-                    'type_mime': file.content_type or 'application/octet-stream',
-                    'taille': len(file_content),
-                    'categorie': obtenir_categorie_document(key)
-                })
-                
-            except Exception as e:
-                print(f"Erreur préparation fichier {file.filename}: {str(e)}")
-                continue
+    hachage = hashlib.sha256()
+    taille = 0
+    with tempfile.NamedTemporaryFile(dir=DOSSIER_SPOOL, prefix='upload_', delete=False) as destination:
+        try:
+            while True:
+                bloc = file.stream.read(TAILLE_BLOC_FICHIER)
+                if not bloc:
+                    break
+                hachage.update(bloc)
+                taille += len(bloc)
+                destination.write(bloc)
+        except BaseException:
+            # Lecture interrompue (membre d'archive au-delà de sa taille annoncée...): rien ne reste dans le spool
+            destination.close()
+            os.remove(destination.name)
+            raise
     
-    return fichiers_pieces
+    return destination.name, hachage.hexdigest(), taille
 
-def generer_nom_fichier_zeendoc(nom_fichier, nom, prenom, type_demande, doc_id):
-    """Génère un nom de fichier standardisé pour ZeenDoc"""
+def ouvrir_fichier(fichier):
+    """Ouvre en lecture binaire une pièce, sur disque ('chemin') ou en mémoire ('contenu')"""
+    
+    if 'chemin' in fichier:
+        return open(fichier['chemin'], 'rb')
+    return io.BytesIO(fichier['contenu'])
+
+def generer_nom_fichier_zeendoc(nom_fichier, nom, prenom, type_demande, doc_id, numero=None):
+    """Génère un nom de fichier standardisé pour ZeenDoc (`numero`: rang parmi les pièces de même nom)"""
     
     # Extraire l'extension
     extension = ""
     if '.' in nom_fichier:
         extension = nom_fichier.split('.')[-1].lower()
     
-    # Mapper les IDs de documents vers des noms courts
-    mapping_docs = {
-        'majProfil_doc': 'MAJ_Profil',
-        'etudeSignee_doc': 'Etude_Signee',
-        'cniValide_doc': 'CNI',
-        'justifDom_doc': 'Justif_Domicile',
-        'ribJour_doc': 'RIB',
-        'justifProvenance_doc': 'Justif_Provenance',
-        'justifDomImpot_doc': 'Justif_Dom_Impot',
-        'clauseBeneficiaire_doc': 'Clause_Beneficiaire',
-        'majProfilRachat_doc': 'MAJ_Profil',
-        'ribJourRachat_doc': 'RIB',
-        'majProfilArbitrage_doc': 'MAJ_Profil',
-        'ficheRenseignement_doc': 'Fiche_Renseignement',
-        'profilClientSigne_doc': 'Profil_Client',
-        'cartoClientSigne_doc': 'Cartographie',
-        'lettreMiseRelation_doc': 'Lettre_Relation',
-        'filSigne_doc': 'FIL',
-        'justifDomCreation_doc': 'Justif_Domicile',
-        'cniValideCreation_doc': 'CNI'
-    }
-    
-    doc_type = mapping_docs.get(doc_id, 'Document')
+    # Nom court du type de document (registre chargé à l'import)
+    doc_type = REGISTRE_DOCUMENTS.nom_court(doc_id)
     
-    # Format: TYPE_DEMANDE_NOM_Prenom_TypeDocument_YYYYMMDD.ext
+    # Format: TYPE_DEMANDE_NOM_Prenom_TypeDocument_YYYYMMDD[_N].ext
     date_str = datetime.now().strftime('%Y%m%d')
     nom_final = f"{type_demande.upper()}_{nom.upper()}_{prenom}_{doc_type}_{date_str}"
+    if numero is not None:
+        nom_final += f"_{numero}"
     
     if extension:
         nom_final += f".{extension}"
@@ -532,82 +2118,7 @@ def generer_nom_fichier_zeendoc(nom_fichier, nom, prenom, type_demande, doc_id):
 def obtenir_categorie_document(doc_id):
     """Retourne la catégorie du document pour ZeenDoc"""
     
-    categories = {
-        'majProfil_doc': 'Profil Client',
-        'etudeSignee_doc': 'Etudes',
-        'cniValide_doc': 'Identité',
-        'justifDom_doc': 'Justificatifs',
-        'ribJour_doc': 'Bancaire',
-        'justifProvenance_doc': 'Justificatifs',
-        'justifDomImpot_doc': 'Justificatifs',
-        'clauseBeneficiaire_doc': 'Bénéficiaires',
-        'majProfilRachat_doc': 'Profil Client',
-        'ribJourRachat_doc': 'Bancaire',
-        'majProfilArbitrage_doc': 'Profil Client',
-        'ficheRenseignement_doc': 'Profil Client',
-        'profilClientSigne_doc': 'Profil Client',
-        'cartoClientSigne_doc': 'Cartographie',
-        'lettreMiseRelation_doc': 'Relation Client',
-        'filSigne_doc': 'Documents Légaux',
-        'justifDomCreation_doc': 'Justificatifs',
-        'cniValideCreation_doc': 'Identité'
-    }
-    
-    return categories.get(doc_id, 'Général')
-
-def generer_corps_zeendoc(data, fichiers_pieces, adresse_zeendoc):
-    """Génère le corps de l'email pour ZeenDoc"""
-    
-    type_demande = data.get('type', 'Non spécifié').upper()
-    nom = data.get('nom', '')
-    prenom = data.get('prenom', '')
-    date_demande = data.get('dateDemande', datetime.now().strftime('%d/%m/%Y'))
-    secteur = data.get('secteurDemandeur', 'Non spécifié')
-    
-    corps = f"""=== DÉPÔT AUTOMATIQUE ZEENDOC ===
-Type de demande: {type_demande}
-Client: {nom} {prenom}
-Date: {date_demande}
-Secteur: {secteur}
-Adresse de dépôt: {adresse_zeendoc}
-Nombre de pièces: {len(fichiers_pieces)}
-
-=== CLASSIFICATION DES DOCUMENTS ===
-"""
-
-    # Grouper par catégorie
-    par_categorie = {}
-    for fichier in fichiers_pieces:
-        cat = fichier['categorie']
-        if cat not in par_categorie:
-            par_categorie[cat] = []
-        par_categorie[cat].append(fichier)
-    
-    for categorie, fichiers in par_categorie.items():
-        corps += f"\n📁 {categorie.upper()}:\n"
-        for fichier in fichiers:
-            taille_fmt = format_file_size(fichier['taille'])
-            corps += f"  • {fichier['nom']} ({taille_fmt})\n"
-    
-    corps += f"""
-
-=== INFORMATIONS TECHNIQUES ===
-Format de nommage: TYPE_NOM_Prenom_TypeDoc_YYYYMMDD.ext
-Origine: Formulaire automatisé de gestion des demandes
-Secteur de traitement: {secteur}
-Horodatage: {datetime.now().strftime('%d/%m/%Y à %H:%M:%S')}
-
-=== INSTRUCTIONS ZEENDOC ===
-Ces documents sont à classer automatiquement dans le dossier client:
-- Nom du dossier: {nom.upper()} {prenom}
-- Type de demande: {type_demande}
-- Secteur: {secteur}
-- Référence: {type_demande}_{secteur.replace(' ', '')}_{nom.upper()}_{prenom}_{datetime.now().strftime('%Y%m%d')}
-
-Merci de confirmer la réception et le classement.
-"""
-    
-    return corps
+    return REGISTRE_DOCUMENTS.categorie(doc_id)
 
 def format_file_size(bytes_size):
     """Formate la taille des fichiers de manière lisible"""
@@ -622,80 +2133,89 @@ def format_file_size(bytes_size):
     s = round(bytes_size / p, 2)
     return f"{s} {size_names[i]}"
 
-def generer_corps_email(data, adresse_zeendoc):
-    """Génère le contenu formaté de l'email principal"""
+def grouper_par_categorie(fichiers_pieces):
+    """Fichiers regroupés par catégorie (ordre d'apparition), tailles déjà formatées"""
     
-    type_demande = data.get('type', 'Non spécifié').upper()
-    secteur = data.get('secteurDemandeur', 'Non spécifié')
+    par_categorie = {}
+    for fichier in fichiers_pieces:
+        taille = format_file_size(fichier['taille'])
+        taille_originale = fichier.get('taille_originale', fichier['taille'])
+        par_categorie.setdefault(fichier['categorie'], []).append({
+            'nom': fichier['nom'],
+            'taille': taille,
+            'taille_detaillee': (
+                f"{taille}, optimisé depuis {format_file_size(taille_originale)}"
+                if taille_originale != fichier['taille'] else taille
+            )
+        })
     
-    corps = f"""=== DEMANDE DE {type_demande} ===
-Date: {data.get('dateDemande', 'Non spécifiée')}
-Client: {data.get('nom', '')} {data.get('prenom', '')}
-Secteur: {secteur}
-Nouveau client: {data.get('nouveauClient', 'Non spécifié')}
-Urgence: {data.get('urgence', 'Normal')}
-Origine: {data.get('origine', 'Non spécifiée')}
-Mode signature: {data.get('modeSignature', 'Non spécifié')}
-Prochain RDV: {data.get('dateRdv', 'Non programmé')}
-
-"""
-
-    # Informations spécifiques selon le type
-    if data.get('type') == 'versement':
-        corps += f"""=== INFORMATIONS FINANCIÈRES ===
-Type de versement: {data.get('typeVersement', 'Non spécifié')}
-Montant: {data.get('montantVersement', 'Non spécifié')} €
-Allocation: {data.get('allocationVersement', 'Non spécifiée')}
-Frais: {data.get('fraisVersement', 'Non spécifiés')}%
-
-=== PROVENANCE ET TRAÇABILITÉ ===
-Provenance: {data.get('provenanceFonds', 'Non spécifiée')}
-Chemin: {data.get('cheminArgent', 'Non spécifié')}
-Justificatif transit: {data.get('justifCompteTransit', 'Non spécifié')}
-
-=== BÉNÉFICIAIRES ===
-Type clause: {data.get('clauseBeneficiaireType', 'Non spécifié')}
-Spécification: {data.get('clauseBeneficiaireSpec', 'Non spécifiée')}
-
-"""
-
-    elif data.get('type') == 'rachat':
-        corps += f"""=== INFORMATIONS FINANCIÈRES ===
-Type de rachat: {data.get('typeRachat', 'Non spécifié')}
-Montant: {data.get('montantRachat', 'Non spécifié')} €
-Fiscalité: {data.get('fiscaliteRachat', 'Non spécifiée')}
-Motif: {data.get('motifRachat', 'Non spécifié')}
-
-=== SUPPORTS ET RÉALLOCATION ===
-Support à désinvestir: {data.get('supportDesinvestir', 'Non spécifié')}
-Pourcentage à réalouer: {data.get('pourcentageReallouer', 'Non spécifié')}%
-Nouveau support: {data.get('nouveauSupport', 'Non spécifié')}
-
-"""
-
-    elif data.get('type') == 'arbitrage':
-        corps += f"""=== ALLOCATION FINANCIÈRE ===
-Montant: {data.get('allocationArbitrage', 'Non spécifié')} €
+    return [
+        {'categorie': categorie.upper(), 'fichiers': fichiers}
+        for categorie, fichiers in par_categorie.items()
+    ]
 
-"""
+def construire_contexte_email(data, fichiers_pieces, adresse_zeendoc, deja_deposes=None, maintenant=None, reglages=None):
+    """Contexte commun à tous les corps d'email d'une demande: un seul horodatage, un seul regroupement"""
+    
+    maintenant = maintenant or datetime.now()
+    reglages = reglages or reglages_secteur(data.get('secteurDemandeur'))
+    
+    return {
+        'data': data,
+        'type_demande': data.get('type', 'Non spécifié').upper(),
+        'nom': data.get('nom', ''),
+        'prenom': data.get('prenom', ''),
+        'date_demande': data.get('dateDemande', maintenant.strftime('%d/%m/%Y')),
+        'secteur': data.get('secteurDemandeur', 'Non spécifié'),
+        'adresse_zeendoc': adresse_zeendoc,
+        'nb_pieces': len(fichiers_pieces),
+        'categories': grouper_par_categorie(fichiers_pieces),
+        'deja_deposes': deja_deposes or [],
+        'horodatage': maintenant.strftime('%d/%m/%Y à %H:%M:%S'),
+        'horodatage_minute': maintenant.strftime('%d/%m/%Y à %H:%M'),
+        'date_reference': maintenant.strftime('%Y%m%d'),
+        'debit_zeendoc': f"{reglages.debit_zeendoc_par_minute:g}"
+    }
 
-    corps += f"""
+def generer_corps_email(contexte):
+    """Génère le contenu formaté de l'email principal"""
+    
+    return MODELE_CORPS_PRINCIPAL.render(contexte)
 
-=== DOCUMENTS JOINTS ===
-📎 Les pièces justificatives ont été envoyées automatiquement vers ZeenDoc
-📧 Adresse de dépôt ({secteur}): {adresse_zeendoc}
-📁 Référence dossier: {data.get('type', '').upper()}_{secteur.replace(' ', '')}_{data.get('nom', '').upper()}_{data.get('prenom', '')}_{datetime.now().strftime('%Y%m%d')}
+def generer_corps_zeendoc(contexte):
+    """Génère le corps de l'email pour ZeenDoc"""
+    
+    return MODELE_CORPS_ZEENDOC.render(contexte)
 
----
-Demande générée et envoyée automatiquement le {datetime.now().strftime('%d/%m/%Y à %H:%M')}
-Demandeur: {data.get('demandeur', 'Non spécifié')}
-Secteur: {secteur}
-"""
+def generer_corps_zeendoc_multiple(corps_base, fichiers_groupe, index, total, nb_fichiers_total, categories,
+                                   debit_zeendoc_par_minute=None):
+    """Génère le corps pour un email multiple (`categories`: regroupement de toute la demande)"""
+    
+    if total == 1:
+        return corps_base
+    if debit_zeendoc_par_minute is None:
+        debit_zeendoc_par_minute = CONFIGURATION_ENVOIS.actuelle().generaux.debit_zeendoc_par_minute
+    
+    # Les fichiers de cette partie, dans l'ordre des catégories de la demande
+    noms_partie = {fichier['nom'] for fichier in fichiers_groupe}
+    categories_partie = []
+    for groupe in categories:
+        fichiers = [f for f in groupe['fichiers'] if f['nom'] in noms_partie]
+        if fichiers:
+            categories_partie.append({'categorie': groupe['categorie'], 'fichiers': fichiers})
     
-    return corps
+    return MODELE_CORPS_ZEENDOC_PARTIE.render(
+        corps_base=corps_base,
+        index=index,
+        total=total,
+        nb_fichiers_partie=len(fichiers_groupe),
+        nb_fichiers_total=nb_fichiers_total,
+        categories=categories_partie,
+        debit_zeendoc=f"{debit_zeendoc_par_minute:g}"
+    )
 
 if __name__ == '__main__':
-    # En production sur Render, utiliser le port fourni par la plateforme
-    port = int(os.environ.get('PORT', 5000))
-    app.run(host='0.0.0.0', port=port, debug=False)
+    # Lancé directement, ce script serait réimporté (toute l'initialisation) par chaque processus
+    # du pool d'optimisation: le serveur de développement démarre depuis serveur.py
+    os.execv(sys.executable, [sys.executable, os.path.join(os.path.dirname(os.path.abspath(__file__)), 'serveur.py')])
 
@@ -0,0 +1,538 @@
+"""Variante ASGI de l'application (Starlette), pour servir de nombreuses demandes par processus.
+
+POST /envoyer-demande y est traité en coroutines: le formulaire est analysé
+au fil de la réception (fichiers écrits directement dans le spool), les
+envois SMTP passent par `smtp_asynchrone` et les attentes (débit ZeenDoc,
+nouvel essai) sont des `asyncio.sleep`. Les étapes disque et CPU (stock de
+contenus, optimisation, archive ZIP, index SQLite) tournent dans des threads.
+Toutes les autres routes sont celles de l'application Flask, montée telle quelle.
+
+Lancement: uvicorn app_asgi:application --host 0.0.0.0 --port 5000
+"""
+
+import asyncio
+import logging
+import os
+import shutil
+import tempfile
+import time
+import uuid
+from contextlib import asynccontextmanager
+
+from a2wsgi import WSGIMiddleware
+from python_multipart.multipart import MultipartParser, parse_options_header
+from starlette.applications import Starlette
+from starlette.middleware import Middleware
+from starlette.middleware.cors import CORSMiddleware
+from starlette.responses import Response
+from starlette.routing import Mount, Route
+from werkzeug.datastructures import FileStorage
+from werkzeug.exceptions import RequestEntityTooLarge
+
+from admission import CapaciteEpuisee
+
+from app import (
+    ADMISSION,
+    DOSSIER_DONNEES,
+    DOSSIER_SPOOL,
+    ENVOI_ASYNCHRONE,
+    FILE_ENVOIS,
+    INDEX_DEPOTS,
+    LIMITEUR_ZEENDOC,
+    MEMOIRE_CACHE_MIME_MO,
+    POOLS_SMTP,
+    SMTP_AUTH_SANS_TLS,
+    SMTP_DELAI_MAX_NOUVEL_ESSAI,
+    SMTP_DELAI_NOUVEL_ESSAI,
+    SMTP_MAX_CONNEXIONS,
+    SMTP_MAX_MESSAGES_PAR_CONNEXION,
+    SMTP_PASSWORD,
+    SMTP_PORT,
+    SMTP_SERVER,
+    SMTP_STARTTLS,
+    SMTP_TENTATIVES,
+    SMTP_TIMEOUT,
+    SMTP_USERNAME,
+    TAILLE_MAX_REQUETE_MO,
+    THREADS_ENVOI_ZEENDOC,
+    FichierSpoole,
+    app as app_flask,
+    arreter_processus,
+    conclure_envois,
+    construire_reponse_envoi,
+    contenu_refus,
+    decouper_parties_zeendoc,
+    demander_arret,
+    format_file_size,
+    generer_corps_zeendoc,
+    generer_corps_zeendoc_multiple,
+    historiser_envoi,
+    mettre_demande_en_file,
+    obtenir_adresse_zeendoc,
+    ouvrir_fichier,
+    pieces_televersees,
+    planifier_envois,
+    preparer_fichiers_zeendoc,
+    preparer_pieces_email_principal,
+    reglages_secteur,
+    verifier_configuration_smtp,
+    verifier_secteur,
+)
+from journal import PARTIE, SECTEUR, nouvelle_requete
+from metriques import ECHECS_SMTP, ENVOIS, OCTETS_ENVOYES, mesurer, observer_duree
+from mime_streaming import MessageStreaming, encodages_partages
+from pool_smtp import delai_nouvel_essai, erreur_transitoire
+from registre_documents import REGISTRE_DOCUMENTS, PieceRefusee
+from smtp_asynchrone import PoolSMTPAsynchrone
+from televersement import ErreurTeleversement
+
+journal = logging.getLogger('formulaire.asgi')
+
+# Une seule boucle d'événements par processus uvicorn: un pool par processus
+POOL_SMTP_ASYNCHRONE = PoolSMTPAsynchrone(
+    max_messages_par_connexion=SMTP_MAX_MESSAGES_PAR_CONNEXION,
+    max_connexions=SMTP_MAX_CONNEXIONS,
+    timeout=SMTP_TIMEOUT,
+    auth_sans_tls=SMTP_AUTH_SANS_TLS
+)
+POOLS_SMTP.append(POOL_SMTP_ASYNCHRONE)
+
+
+class ReponseJSON(Response):
+    """Réponse JSON sérialisée comme `jsonify` (mêmes clés triées, même échappement)"""
+
+    media_type = 'application/json'
+
+    def render(self, content):
+        return app_flask.json.response(content).get_data()
+
+
+class LecteurMultipartSpoole:
+    """Analyse multipart incrémentale: champs gardés en mémoire, fichiers écrits dans le spool au fil de l'eau"""
+
+    def __init__(self, frontiere, fichiers_spool):
+        self.data = {}
+        self.fichiers = []
+        self.fichiers_spool = fichiers_spool
+        self._entetes = {}
+        self._champ_entete = b''
+        self._valeur_entete = b''
+        self._partie = None
+        self._parser = MultipartParser(frontiere, callbacks={
+            'on_part_begin': self._debut_partie,
+            'on_header_field': self._champ,
+            'on_header_value': self._valeur,
+            'on_header_end': self._fin_entete,
+            'on_headers_finished': self._fin_entetes,
+            'on_part_data': self._donnees,
+            'on_part_end': self._fin_partie,
+        })
+
+    def ecrire(self, morceau):
+        self._parser.write(morceau)
+
+    def terminer(self):
+        self._parser.finalize()
+
+    def _debut_partie(self):
+        self._entetes = {}
+
+    def _champ(self, donnees, debut, fin):
+        self._champ_entete += donnees[debut:fin]
+
+    def _valeur(self, donnees, debut, fin):
+        self._valeur_entete += donnees[debut:fin]
+
+    def _fin_entete(self):
+        self._entetes[self._champ_entete.lower()] = self._valeur_entete
+        self._champ_entete = b''
+        self._valeur_entete = b''
+
+    def _fin_entetes(self):
+        _, options = parse_options_header(self._entetes.get(b'content-disposition', b''))
+        nom = options.get(b'name', b'').decode('utf-8', 'replace')
+        nom_fichier = options.get(b'filename')
+
+        if nom_fichier is None:
+            self._partie = {'nom': nom, 'valeur': bytearray()}
+            return
+
+        # Même vérification d'après le registre que côté Flask, avant d'ouvrir un fichier dans le spool
+        nom_fichier = nom_fichier.decode('utf-8', 'replace')
+        type_document = REGISTRE_DOCUMENTS.verifier_piece(nom, nom_fichier)
+
+        # Même spool et même empreinte au fil de l'écriture que RequeteSpoolee côté Flask
+        fichier = tempfile.NamedTemporaryFile(dir=DOSSIER_SPOOL, prefix='upload_', delete=False)
+        self.fichiers_spool.append(fichier.name)
+        flux = FichierSpoole(fichier)
+        if type_document is not None:
+            flux.limiter(type_document, nom_fichier)
+        self._partie = {
+            'nom': nom,
+            'flux': flux,
+            'nom_fichier': nom_fichier,
+            'type_mime': self._entetes.get(b'content-type', b'').decode('latin-1') or None
+        }
+
+    def _donnees(self, donnees, debut, fin):
+        if 'flux' in self._partie:
+            self._partie['flux'].write(donnees[debut:fin])
+        else:
+            self._partie['valeur'] += donnees[debut:fin]
+
+    def _fin_partie(self):
+        partie = self._partie
+        if 'flux' in partie:
+            partie['flux'].terminer_verification()
+            self.fichiers.append((partie['nom'], FileStorage(
+                stream=partie['flux'], filename=partie['nom_fichier'],
+                name=partie['nom'], content_type=partie['type_mime']
+            )))
+        else:
+            # Comme request.form.to_dict(): la première valeur d'un champ répété
+            self.data.setdefault(partie['nom'], partie['valeur'].decode('utf-8', 'replace'))
+
+
+async def lire_formulaire(requete, fichiers_spool):
+    """Retourne (champs, liste de paires (clé, FileStorage)) en lisant le corps de la requête en flux"""
+
+    type_contenu, options = parse_options_header(requete.headers.get('content-type', ''))
+    if type_contenu != b'multipart/form-data':
+        formulaire = await requete.form()
+        return {cle: formulaire[cle] for cle in formulaire.keys()}, []
+
+    lecteur = LecteurMultipartSpoole(options[b'boundary'], fichiers_spool)
+    recu = 0
+    async for morceau in requete.stream():
+        # Corps sans taille annoncée (envoi par morceaux): même plafond que MAX_CONTENT_LENGTH
+        recu += len(morceau)
+        if recu > ADMISSION.taille_max_requete:
+            raise RequestEntityTooLarge()
+        lecteur.ecrire(morceau)
+    lecteur.terminer()
+    return lecteur.data, lecteur.fichiers
+
+
+async def envoyer_demande(requete):
+    # Contexte propre à la tâche de cette requête (copié par asyncio.to_thread et les sous-tâches)
+    correlation_id = nouvelle_requete(requete.headers.get('x-correlation-id'))
+    reponse = await admettre_demande(requete)
+    reponse.headers['X-Correlation-Id'] = correlation_id
+    return reponse
+
+
+async def admettre_demande(requete):
+    # Même contrôle d'admission que la route Flask, avant la lecture du corps
+    taille_annoncee = requete.headers.get('content-length')
+    try:
+        reservation = ADMISSION.admettre(int(taille_annoncee) if taille_annoncee else None)
+    except CapaciteEpuisee as refus:
+        journal.warning("Demande refusée (%s): %s", refus.motif, refus.message, extra={'motif': refus.motif})
+        contenu, code, entetes = contenu_refus(refus)
+        return ReponseJSON(contenu, status_code=code, headers=entetes)
+
+    try:
+        return await traiter_demande(requete)
+    finally:
+        ADMISSION.liberer(reservation)
+
+
+async def traiter_demande(requete):
+    fichiers_spool = []
+    try:
+        # Vérification de la configuration SMTP
+        erreur = verifier_configuration_smtp()
+        if erreur:
+            return ReponseJSON(erreur[0], status_code=erreur[1])
+
+        with mesurer('lecture_formulaire'):
+            data, files = await lire_formulaire(requete, fichiers_spool)
+
+        erreur = verifier_secteur(data)
+        if erreur:
+            return ReponseJSON(erreur[0], status_code=erreur[1])
+
+        secteur_demandeur = data['secteurDemandeur']
+        SECTEUR.set(secteur_demandeur)
+        adresse_zeendoc = obtenir_adresse_zeendoc(secteur_demandeur)
+
+        # Pièces déjà téléversées par morceaux (routes /televersements de l'application Flask)
+        try:
+            files = files + await asyncio.to_thread(pieces_televersees, data)
+        except ErreurTeleversement as e:
+            contenu = {"status": "error", "message": e.message}
+            if e.recu is not None:
+                contenu["recu"] = e.recu
+            return ReponseJSON(contenu, status_code=e.code)
+
+        nom = data.get('nom', '')
+        prenom = data.get('prenom', '')
+        type_demande = data.get('type', 'Demande')
+
+        dossier_fichiers = os.path.join(DOSSIER_DONNEES, 'fichiers', uuid.uuid4().hex)
+        fichiers_pieces = []
+        if any(file.filename for _, file in files):
+            with mesurer('preparation_fichiers'):
+                fichiers_pieces = await asyncio.to_thread(
+                    preparer_fichiers_zeendoc, files, nom, prenom, type_demande, dossier_fichiers
+                )
+
+        if ENVOI_ASYNCHRONE:
+            reponse = await asyncio.to_thread(
+                mettre_demande_en_file, data, fichiers_pieces, dossier_fichiers, secteur_demandeur, adresse_zeendoc
+            )
+            return ReponseJSON(reponse, status_code=202)
+
+        debut = time.monotonic()
+        try:
+            envoi_auto_reussi, resultats_detailles = await executer_envois_async(
+                data, fichiers_pieces, secteur_demandeur, adresse_zeendoc
+            )
+        except Exception as e:
+            journal.exception("Erreur envoi automatique: %s", e)
+            return ReponseJSON({
+                "status": "error",
+                "message": f"Erreur lors de l'envoi automatique: {str(e)}"
+            }, status_code=500)
+        finally:
+            await asyncio.to_thread(shutil.rmtree, dossier_fichiers, True)
+
+        reponse = construire_reponse_envoi(
+            fichiers_pieces, envoi_auto_reussi, resultats_detailles, secteur_demandeur, adresse_zeendoc
+        )
+        historiser_envoi(data, fichiers_pieces, reponse, time.monotonic() - debut)
+        return ReponseJSON(reponse)
+
+    except RequestEntityTooLarge:
+        return ReponseJSON({
+            "status": "error",
+            "message": f"Requête trop volumineuse (maximum {TAILLE_MAX_REQUETE_MO} Mo)."
+        }, status_code=413)
+    except PieceRefusee as e:
+        journal.info("Pièce refusée (%s): %s", e.doc_id, e.message)
+        return ReponseJSON({"status": "error", "message": e.message, "doc_id": e.doc_id}, status_code=e.code)
+    except Exception as e:
+        journal.exception("Erreur générale: %s", e)
+        return ReponseJSON({"status": "error", "message": f"Erreur lors du traitement: {str(e)}"}, status_code=500)
+    finally:
+        # Les fichiers pris en charge ont été déplacés hors du spool, on supprime le reste
+        for chemin in fichiers_spool:
+            try:
+                os.remove(chemin)
+            except FileNotFoundError:
+                pass
+
+
+async def executer_envois_async(data, fichiers_pieces, secteur_demandeur, adresse_zeendoc):
+    """Équivalent de `executer_envois` (sans reprise: mode sans file d'attente uniquement)"""
+
+    reglages = reglages_secteur(secteur_demandeur)
+    journal.info("Début des envois automatiques pour secteur %s (adresse ZeenDoc: %s)", secteur_demandeur, adresse_zeendoc)
+
+    plan = await asyncio.to_thread(
+        planifier_envois, data, fichiers_pieces, secteur_demandeur, adresse_zeendoc, {}, True, reglages
+    )
+
+    with encodages_partages(DOSSIER_SPOOL, MEMOIRE_CACHE_MIME_MO * 1024 * 1024):
+        # 1. Email PRINCIPAL avec ZIP si nécessaire
+        journal.info("Envoi email principal")
+        envoi_principal = await envoyer_email_principal_async(
+            plan['sujet_principal'], plan['corps_principal'], fichiers_pieces, data, reglages
+        )
+        ENVOIS.labels(secteur_demandeur, 'principal', 'succes' if envoi_principal else 'echec').inc()
+
+        # 2. Emails ZEENDOC multiples avec fichiers originaux
+        journal.info("Envoi vers ZeenDoc (%s)", secteur_demandeur)
+        resultats_zeendoc = []
+        if plan['fichiers_zeendoc']:
+            resultats_zeendoc = await envoyer_emails_zeendoc_async(
+                plan['sujet_zeendoc'],
+                generer_corps_zeendoc(plan['contexte']),
+                plan['fichiers_zeendoc'],
+                adresse_zeendoc,
+                plan['contexte']['categories'],
+                reglages
+            )
+        elif plan['deja_deposes']:
+            journal.info("Tous les documents ont déjà été déposés vers %s, aucun renvoi", adresse_zeendoc)
+
+        return conclure_envois(envoi_principal, resultats_zeendoc, plan['deja_deposes'], secteur_demandeur, adresse_zeendoc)
+
+
+async def envoyer_email_principal_async(sujet, corps, fichiers_pieces, data, reglages):
+    try:
+        if not fichiers_pieces:
+            return await envoyer_email_smtp_async(reglages.destinataire, sujet, corps, [])
+
+        fichiers_a_envoyer, corps_modifie = await asyncio.to_thread(
+            preparer_pieces_email_principal, corps, fichiers_pieces, data, reglages.limite_email_mo
+        )
+        try:
+            return await envoyer_email_smtp_async(reglages.destinataire, sujet, corps_modifie, fichiers_a_envoyer)
+        finally:
+            if fichiers_a_envoyer is not fichiers_pieces:
+                for fichier in fichiers_a_envoyer:
+                    os.remove(fichier['chemin'])
+
+    except Exception as e:
+        journal.exception("Erreur envoi email principal: %s", e)
+        return False
+
+
+async def envoyer_emails_zeendoc_async(sujet_base, corps_base, fichiers_pieces, adresse_zeendoc, categories, reglages):
+    max_emails = reglages.max_emails_par_demande
+    groupes_fichiers, groupes_exclus = decouper_parties_zeendoc(fichiers_pieces, max_emails, reglages.limite_email_mo)
+    total_groupes = len(groupes_fichiers)
+    journal.info("Division ZeenDoc: %d fichiers → %d email(s) vers %s", len(fichiers_pieces), total_groupes, adresse_zeendoc)
+
+    # Autant de parties en cours d'envoi que de threads dans la version synchrone
+    envois_simultanes = asyncio.Semaphore(THREADS_ENVOI_ZEENDOC)
+
+    async def envoyer_partie(index, groupe):
+        # Chaque partie est une tâche de gather, avec sa propre copie du contexte
+        PARTIE.set(f"{index}/{total_groupes}")
+        noms_fichiers = [f['nom'] for f in groupe]
+        try:
+            sujet_numerote = f"{sujet_base} - Partie {index}/{total_groupes}" if total_groupes > 1 else sujet_base
+            corps_numerote = generer_corps_zeendoc_multiple(
+                corps_base, groupe, index, total_groupes, len(fichiers_pieces), categories,
+                reglages.debit_zeendoc_par_minute
+            )
+
+            async with envois_simultanes:
+                # Même seau à jetons que les envois synchrones, attente sans bloquer la boucle
+                attente = await asyncio.to_thread(
+                    LIMITEUR_ZEENDOC.reserver, adresse_zeendoc, reglages.debit_zeendoc_par_minute
+                )
+                observer_duree('attente_debit', attente)
+                if attente:
+                    journal.info("Partie %d/%d: attente %.1fs (débit %g/min vers %s)",
+                                 index, total_groupes, attente, reglages.debit_zeendoc_par_minute, adresse_zeendoc,
+                                 extra={'attente': attente})
+                    await asyncio.sleep(attente)
+
+                taille_groupe = sum(f['taille'] for f in groupe)
+                journal.info("Envoi partie %d/%d vers %s: %d fichier(s) (%s)",
+                             index, total_groupes, adresse_zeendoc, len(groupe), format_file_size(taille_groupe))
+                debut_envoi = time.monotonic()
+                succes = await envoyer_email_smtp_async(
+                    adresse_zeendoc, sujet_numerote, corps_numerote, groupe,
+                    cc=reglages.destinataire, type_envoi='zeendoc'
+                )
+
+            if succes:
+                journal.info("Partie %d/%d envoyée avec succès vers %s", index, total_groupes, adresse_zeendoc)
+                await asyncio.to_thread(_enregistrer_depots, adresse_zeendoc, groupe)
+            else:
+                journal.error("Échec envoi partie %d/%d vers %s", index, total_groupes, adresse_zeendoc)
+
+            return {
+                'partie': f"{index}/{total_groupes}",
+                'fichiers_count': len(groupe),
+                'succes': succes,
+                'taille_totale': taille_groupe,
+                'duree_envoi': round(time.monotonic() - debut_envoi, 2),
+                'fichiers': noms_fichiers,
+                'adresse_zeendoc': adresse_zeendoc
+            }
+
+        except Exception as e:
+            journal.exception("Erreur envoi partie %d/%d: %s", index, total_groupes, e)
+            return {
+                'partie': f"{index}/{total_groupes}",
+                'succes': False,
+                'erreur': str(e),
+                'fichiers': noms_fichiers,
+                'adresse_zeendoc': adresse_zeendoc
+            }
+
+    resultats = list(await asyncio.gather(*(
+        envoyer_partie(index, groupe) for index, groupe in enumerate(groupes_fichiers, 1)
+    )))
+
+    fichiers_exclus = [f for groupe in groupes_exclus for f in groupe]
+    if fichiers_exclus:
+        journal.error("%d fichier(s) non envoyé(s) vers ZeenDoc (limite de %d emails)", len(fichiers_exclus), max_emails)
+        resultats.append({
+            'partie': 'non envoyé',
+            'fichiers_count': len(fichiers_exclus),
+            'succes': False,
+            'erreur': f"Limite de {max_emails} emails par demande atteinte",
+            'fichiers': [f['nom'] for f in fichiers_exclus],
+            'adresse_zeendoc': adresse_zeendoc
+        })
+
+    return resultats
+
+
+def _enregistrer_depots(adresse_zeendoc, groupe):
+    for fichier in groupe:
+        if fichier.get('sha256'):
+            INDEX_DEPOTS.enregistrer(adresse_zeendoc, fichier['sha256'], fichier['nom'])
+
+
+async def envoyer_email_smtp_async(destinataire, sujet, corps, fichiers, cc=None, type_envoi='principal'):
+    """Équivalent de `envoyer_email_smtp`: même message streaming, mêmes règles de nouvel essai"""
+
+    try:
+        with mesurer('construction_mime'):
+            message = MessageStreaming(
+                SMTP_USERNAME, destinataire, sujet, corps, fichiers,
+                ouvrir=ouvrir_fichier, cc=cc
+            )
+
+        destinataires = [destinataire]
+        if cc:
+            destinataires.append(cc)
+
+        async def envoyer(client):
+            with mesurer('smtp_envoi'):
+                return await client.envoyer_message(SMTP_USERNAME, destinataires, message)
+
+        for tentative in range(1, SMTP_TENTATIVES + 1):
+            try:
+                await POOL_SMTP_ASYNCHRONE.executer(
+                    SMTP_SERVER, SMTP_PORT, SMTP_USERNAME, SMTP_PASSWORD,
+                    envoyer,
+                    starttls=SMTP_STARTTLS
+                )
+                break
+            except Exception as e:
+                ECHECS_SMTP.labels(type(e).__name__).inc()
+                if tentative == SMTP_TENTATIVES or not erreur_transitoire(e):
+                    raise
+
+                delai = delai_nouvel_essai(tentative, SMTP_DELAI_NOUVEL_ESSAI, SMTP_DELAI_MAX_NOUVEL_ESSAI)
+                journal.warning("Erreur SMTP temporaire (%s), essai %d/%d dans %.1fs", e, tentative + 1, SMTP_TENTATIVES, delai,
+                                extra={'erreur': type(e).__name__})
+                await asyncio.sleep(delai)
+
+        observer_duree('encodage_mime', message.duree_encodage)
+        OCTETS_ENVOYES.labels(type_envoi).inc(message.taille())
+        return True
+
+    except Exception as e:
+        journal.error("Erreur SMTP: %s", e, extra={'erreur': type(e).__name__})
+        return False
+
+
+@asynccontextmanager
+async def cycle_de_vie(application):
+    if ENVOI_ASYNCHRONE:
+        FILE_ENVOIS.demarrer()
+    yield
+    # Requêtes terminées (uvicorn): envois de la file attendus comme sous gunicorn
+    demander_arret()
+    await asyncio.to_thread(arreter_processus)
+    await POOL_SMTP_ASYNCHRONE.fermer_tout()
+
+
+application = Starlette(
+    routes=[
+        Route('/envoyer-demande', envoyer_demande, methods=['POST'],
+              middleware=[Middleware(CORSMiddleware, allow_origins=['*'])]),
+        # Tout le reste (page, statut, reprise, lot, métriques) reste servi par Flask
+        Mount('/', app=WSGIMiddleware(app_flask)),
+    ],
+    lifespan=cycle_de_vie
+)
@@ -0,0 +1,166 @@
+import os
+import shutil
+import struct
+import tempfile
+import time
+import zlib
+from concurrent.futures import ThreadPoolExecutor
+
+TAILLE_BLOC = 1024 * 1024
+
+METHODE_STOCKEE = 0
+METHODE_DEFLATE = 8
+
+# Formats déjà compressés: les recompresser coûte du CPU pour un gain quasi nul
+EXTENSIONS_COMPRESSEES = {
+    'jpg', 'jpeg', 'png', 'gif', 'webp', 'heic', 'pdf',
+    'zip', 'docx', 'xlsx', 'pptx', 'odt', 'ods', 'gz', '7z', 'rar', 'mp3', 'mp4'
+}
+SIGNATURES_COMPRESSEES = (
+    b'\xff\xd8\xff',      # JPEG
+    b'\x89PNG',           # PNG
+    b'GIF8',              # GIF
+    b'%PDF',              # PDF (flux internes déjà compressés)
+    b'PK\x03\x04',        # ZIP, DOCX, XLSX...
+    b'\x1f\x8b',          # GZIP
+    b'7z\xbc\xaf',        # 7-Zip
+    b'Rar!',              # RAR
+)
+
+
+def est_deja_compresse(nom, entete):
+    """Détection par extension ou par signature (magic bytes)"""
+
+    extension = nom.rsplit('.', 1)[-1].lower() if '.' in nom else ''
+    return extension in EXTENSIONS_COMPRESSEES or entete.startswith(SIGNATURES_COMPRESSEES)
+
+
+class MembreArchive:
+    """Résultat de la préparation d'un membre: méthode, CRC, tailles et données compressées éventuelles"""
+
+    def __init__(self, fichier, nom_archive):
+        self.fichier = fichier
+        self.nom_archive = nom_archive
+        self.methode = METHODE_STOCKEE
+        self.crc = 0
+        self.taille = 0
+        self.taille_compressee = 0
+        self.chemin_compresse = None
+
+
+def _preparer_membre(membre, ouvrir, niveau, gain_minimal, dossier_temp):
+    """Calcule le CRC et, si le format s'y prête, compresse le membre dans un fichier temporaire"""
+
+    with ouvrir(membre.fichier) as source:
+        entete = source.read(8)
+        compresser = not est_deja_compresse(membre.nom_archive, entete)
+        source.seek(0)
+
+        if not compresser:
+            while True:
+                bloc = source.read(TAILLE_BLOC)
+                if not bloc:
+                    break
+                membre.crc = zlib.crc32(bloc, membre.crc)
+                membre.taille += len(bloc)
+            membre.taille_compressee = membre.taille
+            return membre
+
+        compresseur = zlib.compressobj(niveau, zlib.DEFLATED, -15)
+        descripteur, membre.chemin_compresse = tempfile.mkstemp(suffix='.deflate', dir=dossier_temp)
+        with os.fdopen(descripteur, 'wb') as sortie:
+            while True:
+                bloc = source.read(TAILLE_BLOC)
+                if not bloc:
+                    break
+                membre.crc = zlib.crc32(bloc, membre.crc)
+                membre.taille += len(bloc)
+                sortie.write(compresseur.compress(bloc))
+            sortie.write(compresseur.flush())
+            membre.taille_compressee = sortie.tell()
+
+    # Gain insuffisant: on stocke tel quel plutôt que d'imposer une décompression
+    if membre.taille_compressee > membre.taille * (1 - gain_minimal):
+        os.remove(membre.chemin_compresse)
+        membre.chemin_compresse = None
+        membre.taille_compressee = membre.taille
+        return membre
+
+    membre.methode = METHODE_DEFLATE
+    return membre
+
+
+def _date_heure_dos(horodatage):
+    t = time.localtime(horodatage)
+    date = ((max(t.tm_year, 1980) - 1980) << 9) | (t.tm_mon << 5) | t.tm_mday
+    heure = (t.tm_hour << 11) | (t.tm_min << 5) | (t.tm_sec // 2)
+    return heure, date
+
+
+def construire_archive_zip(membres, chemin_sortie, ouvrir, nb_threads=None, niveau=6, gain_minimal=0.05):
+    """Écrit une archive ZIP dans `chemin_sortie` à partir de [(fichier, nom dans l'archive)].
+
+    Les membres sont préparés en parallèle (zlib libère le GIL), chacun
+    étant stocké (ZIP_STORED) s'il est déjà compressé ou si la compression
+    fait gagner moins de `gain_minimal`. L'assemblage final est séquentiel
+    et lit les données depuis le disque: la mémoire utilisée ne dépend pas
+    de la taille des fichiers. Retourne la liste des MembreArchive.
+    """
+
+    dossier_temp = os.path.dirname(os.path.abspath(chemin_sortie))
+    membres = [MembreArchive(fichier, nom) for fichier, nom in membres]
+
+    try:
+        with ThreadPoolExecutor(max_workers=nb_threads or os.cpu_count() or 1) as executor:
+            membres = list(executor.map(
+                lambda m: _preparer_membre(m, ouvrir, niveau, gain_minimal, dossier_temp),
+                membres
+            ))
+
+        heure, date = _date_heure_dos(time.time())
+        repertoire_central = []
+
+        with open(chemin_sortie, 'wb') as sortie:
+            for membre in membres:
+                nom = membre.nom_archive.encode('utf-8')
+                drapeaux = 0 if membre.nom_archive.isascii() else 0x800
+                version = 20 if membre.methode == METHODE_DEFLATE else 10
+                position = sortie.tell()
+
+                if max(membre.taille, membre.taille_compressee, position) > 0xFFFFFFFF:
+                    raise ValueError("Archive trop volumineuse (ZIP64 non pris en charge)")
+
+                sortie.write(struct.pack(
+                    '<IHHHHHIIIHH', 0x04034b50, version, drapeaux, membre.methode, heure, date,
+                    membre.crc, membre.taille_compressee, membre.taille, len(nom), 0
+                ))
+                sortie.write(nom)
+
+                if membre.chemin_compresse:
+                    with open(membre.chemin_compresse, 'rb') as source:
+                        shutil.copyfileobj(source, sortie, TAILLE_BLOC)
+                else:
+                    with ouvrir(membre.fichier) as source:
+                        shutil.copyfileobj(source, sortie, TAILLE_BLOC)
+
+                repertoire_central.append(struct.pack(
+                    '<IHHHHHHIIIHHHHHII', 0x02014b50, (3 << 8) | 20, version, drapeaux, membre.methode,
+                    heure, date, membre.crc, membre.taille_compressee, membre.taille, len(nom),
+                    0, 0, 0, 0, 0o100644 << 16, position
+                ) + nom)
+
+            debut_repertoire = sortie.tell()
+            for entree in repertoire_central:
+                sortie.write(entree)
+            taille_repertoire = sortie.tell() - debut_repertoire
+
+            sortie.write(struct.pack(
+                '<IHHHHIIH', 0x06054b50, 0, 0, len(membres), len(membres),
+                taille_repertoire, debut_repertoire, 0
+            ))
+    finally:
+        for membre in membres:
+            if membre.chemin_compresse and os.path.exists(membre.chemin_compresse):
+                os.remove(membre.chemin_compresse)
+
+    return membres
@@ -0,0 +1,113 @@
+"""Benchmark: archive ZIP historique (série, DEFLATE niveau 6) vs archive parallèle adaptative.
+
+Le jeu de fichiers mélange des formats déjà compressés (JPEG, PNG, PDF,
+DOCX) et des documents texte compressibles. Rapporte le temps de
+construction et le taux de compression, et vérifie que les deux archives
+contiennent exactement les mêmes données.
+
+Usage: python benchmarks/bench_archive_zip.py [--taille 60] [--repetitions 3]
+"""
+
+import argparse
+import io
+import os
+import random
+import sys
+import tempfile
+import time
+import zipfile
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from archive_zip import construire_archive_zip
+
+FORMATS = [
+    ('jpg', b'\xff\xd8\xff\xe0', 0.45),
+    ('pdf', b'%PDF-1.7\n', 0.30),
+    ('png', b'\x89PNG\r\n\x1a\n', 0.10),
+    ('docx', b'PK\x03\x04', 0.05),
+    ('doc', b'\xd0\xcf\x11\xe0', 0.10),
+]
+MOTS = [b'client', b'contrat', b'versement', b'assurance', b'vie', b'montant', b'euros', b'signature',
+        b'profil', b'risque', b'support', b'allocation', b'date', b'adresse', b'Rouen', b'Paris']
+
+
+def generer_fichiers(dossier, taille_totale, alea):
+    fichiers = []
+    restant = taille_totale
+    index = 0
+    while restant > 0:
+        extension, signature, _ = alea.choices(FORMATS, weights=[f[2] for f in FORMATS])[0]
+        taille = min(restant, int(alea.uniform(0.5, 6) * 1024 * 1024))
+        chemin = os.path.join(dossier, f"piece_{index}.{extension}")
+        with open(chemin, 'wb') as f:
+            if extension == 'doc':
+                # Document bureautique non compressé: texte répétitif
+                texte = b' '.join(alea.choice(MOTS) for _ in range(taille // 6))
+                f.write(signature + texte[:taille - len(signature)])
+            else:
+                f.write(signature + os.urandom(taille - len(signature)))
+        fichiers.append({'nom': os.path.basename(chemin), 'chemin': chemin,
+                         'taille': taille, 'categorie': 'Justificatifs'})
+        restant -= taille
+        index += 1
+    return fichiers
+
+
+def ouvrir_fichier(fichier):
+    return open(fichier['chemin'], 'rb')
+
+
+def archive_historique(fichiers, chemin):
+    zip_buffer = io.BytesIO()
+    with zipfile.ZipFile(zip_buffer, 'w', zipfile.ZIP_DEFLATED, compresslevel=6) as zip_file:
+        for fichier in fichiers:
+            with ouvrir_fichier(fichier) as source:
+                zip_file.writestr(f"{fichier['categorie']}/{fichier['nom']}", source.read())
+    with open(chemin, 'wb') as sortie:
+        sortie.write(zip_buffer.getvalue())
+
+
+def archive_parallele(fichiers, chemin):
+    construire_archive_zip(
+        [(fichier, f"{fichier['categorie']}/{fichier['nom']}") for fichier in fichiers],
+        chemin, ouvrir=ouvrir_fichier
+    )
+
+
+def contenu_archive(chemin):
+    with zipfile.ZipFile(chemin) as archive:
+        assert archive.testzip() is None, "archive corrompue"
+        return {nom: archive.read(nom) for nom in archive.namelist()}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--taille', type=int, default=60, help="taille totale du dossier (Mo)")
+    parser.add_argument('--repetitions', type=int, default=3)
+    parser.add_argument('--graine', type=int, default=7)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as dossier:
+        fichiers = generer_fichiers(dossier, args.taille * 1024 * 1024, random.Random(args.graine))
+        taille_originale = sum(f['taille'] for f in fichiers)
+        print(f"{len(fichiers)} fichiers, {taille_originale / 1024 / 1024:.1f} Mo, {os.cpu_count()} cœur(s)")
+
+        resultats = {}
+        for nom, construire in (('historique', archive_historique), ('parallèle', archive_parallele)):
+            chemin = os.path.join(dossier, f"archive_{nom}.zip")
+            durees = []
+            for _ in range(args.repetitions):
+                debut = time.perf_counter()
+                construire(fichiers, chemin)
+                durees.append(time.perf_counter() - debut)
+            resultats[nom] = contenu_archive(chemin)
+            taux = os.path.getsize(chemin) / taille_originale
+            print(f"{nom:<11} {min(durees):>7.2f}s   taille {taux:>6.1%} de l'original")
+
+        assert resultats['historique'] == resultats['parallèle'], "contenus différents"
+        print("✅ Contenus identiques")
+
+
+if __name__ == '__main__':
+    main()
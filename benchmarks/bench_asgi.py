@@ -0,0 +1,187 @@
+"""Benchmark de charge: POST /envoyer-demande en parallèle, serveur WSGI à threads vs variante ASGI.
+
+Les deux serveurs tournent en mode envoi direct (ENVOI_ASYNCHRONE=0: la
+réponse attend la fin des envois SMTP) devant un puits SMTP local qui met
+`--latence` secondes à accepter chaque message. Côté WSGI, un pool fixe de
+`--threads` threads (comme gunicorn --threads) ; côté ASGI, une seule boucle
+d'événements uvicorn limitée à `--connexions-smtp` sessions SMTP
+simultanées (SMTP_MAX_CONNEXIONS). Pour chaque niveau de concurrence: débit, latences
+p50/p95 et nombre maximal de threads du processus (puits SMTP compris: un
+thread par connexion SMTP).
+
+Usage: python benchmarks/bench_asgi.py [--concurrence 10,50,200] [--threads 8] [--latence 0.2] [--taille 200000]
+       [--connexions-smtp 20]
+
+Dépendances: starlette, uvicorn, a2wsgi, python-multipart, httpx.
+"""
+
+import argparse
+import asyncio
+import logging
+import os
+import socket
+import statistics
+import sys
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from benchmarks.puits_smtp import PuitsSMTP
+
+# Pièces jointes: début d'un PDF (signature vérifiée à la réception), puis octets aléatoires
+ENTETE_PDF = b'%PDF-1.7\n'
+
+
+class ServeurWSGIThreadsFixes:
+    """Serveur werkzeug dont les requêtes sont traitées par un pool fixe de threads"""
+
+    def __init__(self, application, port, nb_threads):
+        from werkzeug.serving import BaseWSGIServer
+
+        executor = ThreadPoolExecutor(max_workers=nb_threads)
+
+        class _Serveur(BaseWSGIServer):
+            def process_request(self, requete, adresse_client):
+                executor.submit(self._traiter, requete, adresse_client)
+
+            def _traiter(self, requete, adresse_client):
+                try:
+                    self.finish_request(requete, adresse_client)
+                except Exception:
+                    self.handle_error(requete, adresse_client)
+                finally:
+                    self.shutdown_request(requete)
+
+        self._executor = executor
+        self._serveur = _Serveur('127.0.0.1', port, application)
+
+    def __enter__(self):
+        threading.Thread(target=self._serveur.serve_forever, daemon=True).start()
+        return self
+
+    def __exit__(self, *exc):
+        self._serveur.shutdown()
+        self._serveur.server_close()
+        self._executor.shutdown(wait=True)
+
+
+class ServeurUvicorn:
+
+    def __init__(self, application, port):
+        import uvicorn
+
+        self._serveur = uvicorn.Server(uvicorn.Config(application, host='127.0.0.1', port=port, log_level='warning'))
+        self._thread = threading.Thread(target=self._serveur.run, daemon=True)
+
+    def __enter__(self):
+        self._thread.start()
+        while not self._serveur.started:
+            time.sleep(0.05)
+        return self
+
+    def __exit__(self, *exc):
+        self._serveur.should_exit = True
+        self._thread.join()
+
+
+def port_libre():
+    with socket.socket() as s:
+        s.bind(('127.0.0.1', 0))
+        return s.getsockname()[1]
+
+
+class ObservateurThreads:
+    """Relève le nombre maximal de threads du processus pendant la mesure"""
+
+    def __init__(self):
+        self.maximum = threading.active_count()
+        self._fin = threading.Event()
+
+    def _observer(self):
+        while not self._fin.wait(0.02):
+            self.maximum = max(self.maximum, threading.active_count())
+
+    def __enter__(self):
+        threading.Thread(target=self._observer, daemon=True).start()
+        return self
+
+    def __exit__(self, *exc):
+        self._fin.set()
+
+
+async def lancer_charge(url, concurrence, contenu):
+    import httpx
+
+    data = {'nom': 'Dupont', 'prenom': 'Jean', 'type': 'versement', 'secteurDemandeur': 'Le Havre'}
+    limites = httpx.Limits(max_connections=concurrence, max_keepalive_connections=concurrence)
+
+    async with httpx.AsyncClient(limits=limites, timeout=600) as client:
+        async def une_demande(numero):
+            fichiers = {
+                'cniValide_doc': (f'cni_{numero}.pdf', contenu, 'application/pdf'),
+                # Même en-tête PDF, reste inversé: deux pièces distinctes (pas de doublon écarté)
+                'ribJour_doc': (f'rib_{numero}.pdf', contenu[:len(ENTETE_PDF)] + contenu[:len(ENTETE_PDF) - 1:-1], 'application/pdf'),
+            }
+            debut = time.perf_counter()
+            reponse = await client.post(url, data=data, files=fichiers)
+            ok = reponse.status_code == 200 and reponse.json().get('envoi_auto') is True
+            return time.perf_counter() - debut, ok
+
+        debut = time.perf_counter()
+        resultats = await asyncio.gather(*(une_demande(n) for n in range(concurrence)))
+        return time.perf_counter() - debut, resultats
+
+
+def mesurer(nom, serveur, port, concurrence, contenu, puits):
+    puits.reinitialiser()
+    with serveur, ObservateurThreads() as threads:
+        duree, resultats = asyncio.run(lancer_charge(f'http://127.0.0.1:{port}/envoyer-demande', concurrence, contenu))
+
+    latences = sorted(latence for latence, _ in resultats)
+    echecs = sum(1 for _, ok in resultats if not ok)
+    p95 = latences[min(len(latences) - 1, int(len(latences) * 0.95))]
+    print(f"{nom:<6} {concurrence:>6} {concurrence / duree:>9.1f} {statistics.median(latences):>8.2f}s "
+          f"{p95:>8.2f}s {threads.maximum:>8} {echecs:>7} {puits.compteurs['messages']:>9}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--concurrence', default='10,50,200', help="requêtes simultanées (liste)")
+    parser.add_argument('--threads', type=int, default=8, help="threads du serveur WSGI")
+    parser.add_argument('--latence', type=float, default=0.2, help="temps d'acceptation d'un message par le relais (s)")
+    parser.add_argument('--taille', type=int, default=200_000, help="taille de chaque pièce jointe (octets)")
+    parser.add_argument('--connexions-smtp', type=int, default=20, help="sessions SMTP simultanées côté ASGI")
+    args = parser.parse_args()
+
+    with PuitsSMTP(latence_message=args.latence) as puits:
+        os.environ.update({
+            'SMTP_SERVER': puits.hote, 'SMTP_PORT': str(puits.port), 'SMTP_USERNAME': 'bench@example.com',
+            'SMTP_PASSWORD': 'secret', 'SMTP_STARTTLS': '0', 'SMTP_MAX_CONNEXIONS': str(args.connexions_smtp),
+            'ENVOI_ASYNCHRONE': '0', 'OPTIMISATION_DOCUMENTS': '0', 'FENETRE_DEDUPLICATION_HEURES': '0',
+            'DEBIT_ZEENDOC_PAR_MINUTE': '0', 'DOSSIER_DONNEES': tempfile.mkdtemp(prefix='bench_asgi_'),
+            # Journal de l'application (une ligne par étape): avertissements et erreurs seulement
+            'NIVEAU_JOURNAL': os.environ.get('NIVEAU_JOURNAL', 'WARNING'),
+        })
+        import app
+        import app_asgi
+
+        # Journal d'accès werkzeug (une ligne par requête) muet pendant la mesure
+        logging.getLogger('werkzeug').setLevel(logging.ERROR)
+
+        contenu = ENTETE_PDF + os.urandom(args.taille - len(ENTETE_PDF))
+        print(f"Relais: {args.latence:g}s par message, 2 pièces de {args.taille // 1000} Ko par demande, "
+              f"WSGI: {args.threads} threads, ASGI: {args.connexions_smtp} sessions SMTP")
+        print(f"{'mode':<6} {'requêtes':>6} {'req/s':>9} {'p50':>9} {'p95':>9} {'threads':>8} {'échecs':>7} {'messages':>9}")
+
+        for concurrence in (int(c) for c in args.concurrence.split(',')):
+            port = port_libre()
+            mesurer('wsgi', ServeurWSGIThreadsFixes(app.app, port, args.threads), port, concurrence, contenu, puits)
+            port = port_libre()
+            mesurer('asgi', ServeurUvicorn(app_asgi.application, port), port, concurrence, contenu, puits)
+
+
+if __name__ == '__main__':
+    main()
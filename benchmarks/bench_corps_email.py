@@ -0,0 +1,315 @@
+"""Benchmark: corps d'email en f-strings (historique) vs modèles Jinja compilés une fois.
+
+Pour des dossiers de 5 à 200 pièces, mesure le temps de rendu de tous les
+corps d'une demande (email principal, corps ZeenDoc et corps de chaque
+partie) et vérifie que les modèles produisent le même texte que
+l'implémentation historique, horloge figée.
+
+Usage: python benchmarks/bench_corps_email.py [--repetitions 200]
+"""
+
+import argparse
+import os
+import random
+import sys
+import tempfile
+import time
+from datetime import datetime as datetime_reel
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+os.environ.setdefault('DOSSIER_DONNEES', tempfile.mkdtemp(prefix='bench_donnees_'))
+
+import app as application
+from app import CONFIGURATION_ENVOIS, format_file_size
+
+# Réglages généraux de la configuration des envois: débit cité dans les corps des deux implémentations
+REGLAGES = CONFIGURATION_ENVOIS.actuelle().generaux
+DEBIT_ZEENDOC_PAR_MINUTE = REGLAGES.debit_zeendoc_par_minute
+
+INSTANT = datetime_reel(2024, 3, 15, 14, 30, 45)
+
+
+class datetime(datetime_reel):
+    """Horloge figée: l'implémentation historique appelle datetime.now() plusieurs fois"""
+
+    @classmethod
+    def now(cls, tz=None):
+        return INSTANT
+
+
+DOC_IDS = ['majProfil_doc', 'etudeSignee_doc', 'cniValide_doc', 'justifDom_doc', 'ribJour_doc',
+           'justifProvenance_doc', 'clauseBeneficiaire_doc', 'ficheRenseignement_doc', 'filSigne_doc']
+
+
+# --- Implémentation historique, copiée telle quelle pour comparaison ---
+
+def historique_corps_email(data, adresse_zeendoc):
+    """Génère le contenu formaté de l'email principal"""
+    
+    type_demande = data.get('type', 'Non spécifié').upper()
+    secteur = data.get('secteurDemandeur', 'Non spécifié')
+    
+    corps = f"""=== DEMANDE DE {type_demande} ===
+Date: {data.get('dateDemande', 'Non spécifiée')}
+Client: {data.get('nom', '')} {data.get('prenom', '')}
+Secteur: {secteur}
+Nouveau client: {data.get('nouveauClient', 'Non spécifié')}
+Urgence: {data.get('urgence', 'Normal')}
+Origine: {data.get('origine', 'Non spécifiée')}
+Mode signature: {data.get('modeSignature', 'Non spécifié')}
+Prochain RDV: {data.get('dateRdv', 'Non programmé')}
+
+"""
+
+    # Informations spécifiques selon le type
+    if data.get('type') == 'versement':
+        corps += f"""=== INFORMATIONS FINANCIÈRES ===
+Type de versement: {data.get('typeVersement', 'Non spécifié')}
+Montant: {data.get('montantVersement', 'Non spécifié')} €
+Allocation: {data.get('allocationVersement', 'Non spécifiée')}
+Frais: {data.get('fraisVersement', 'Non spécifiés')}%
+
+=== PROVENANCE ET TRAÇABILITÉ ===
+Provenance: {data.get('provenanceFonds', 'Non spécifiée')}
+Chemin: {data.get('cheminArgent', 'Non spécifié')}
+Justificatif transit: {data.get('justifCompteTransit', 'Non spécifié')}
+
+=== BÉNÉFICIAIRES ===
+Type clause: {data.get('clauseBeneficiaireType', 'Non spécifié')}
+Spécification: {data.get('clauseBeneficiaireSpec', 'Non spécifiée')}
+
+"""
+
+    elif data.get('type') == 'rachat':
+        corps += f"""=== INFORMATIONS FINANCIÈRES ===
+Type de rachat: {data.get('typeRachat', 'Non spécifié')}
+Montant: {data.get('montantRachat', 'Non spécifié')} €
+Fiscalité: {data.get('fiscaliteRachat', 'Non spécifiée')}
+Motif: {data.get('motifRachat', 'Non spécifié')}
+
+=== SUPPORTS ET RÉALLOCATION ===
+Support à désinvestir: {data.get('supportDesinvestir', 'Non spécifié')}
+Pourcentage à réalouer: {data.get('pourcentageReallouer', 'Non spécifié')}%
+Nouveau support: {data.get('nouveauSupport', 'Non spécifié')}
+
+"""
+
+    elif data.get('type') == 'arbitrage':
+        corps += f"""=== ALLOCATION FINANCIÈRE ===
+Montant: {data.get('allocationArbitrage', 'Non spécifié')} €
+
+"""
+
+    corps += f"""
+
+=== DOCUMENTS JOINTS ===
+📎 Les pièces justificatives ont été envoyées automatiquement vers ZeenDoc
+📧 Adresse de dépôt ({secteur}): {adresse_zeendoc}
+📁 Référence dossier: {data.get('type', '').upper()}_{secteur.replace(' ', '')}_{data.get('nom', '').upper()}_{data.get('prenom', '')}_{datetime.now().strftime('%Y%m%d')}
+
+---
+Demande générée et envoyée automatiquement le {datetime.now().strftime('%d/%m/%Y à %H:%M')}
+Demandeur: {data.get('demandeur', 'Non spécifié')}
+Secteur: {secteur}
+"""
+    
+    return corps
+
+
+def historique_corps_zeendoc(data, fichiers_pieces, adresse_zeendoc, deja_deposes=None):
+    """Génère le corps de l'email pour ZeenDoc"""
+    
+    type_demande = data.get('type', 'Non spécifié').upper()
+    nom = data.get('nom', '')
+    prenom = data.get('prenom', '')
+    date_demande = data.get('dateDemande', datetime.now().strftime('%d/%m/%Y'))
+    secteur = data.get('secteurDemandeur', 'Non spécifié')
+    
+    corps = f"""=== DÉPÔT AUTOMATIQUE ZEENDOC ===
+Type de demande: {type_demande}
+Client: {nom} {prenom}
+Date: {date_demande}
+Secteur: {secteur}
+Adresse de dépôt: {adresse_zeendoc}
+Nombre de pièces: {len(fichiers_pieces)}
+
+=== CLASSIFICATION DES DOCUMENTS ===
+"""
+
+    # Grouper par catégorie
+    par_categorie = {}
+    for fichier in fichiers_pieces:
+        cat = fichier['categorie']
+        if cat not in par_categorie:
+            par_categorie[cat] = []
+        par_categorie[cat].append(fichier)
+    
+    for categorie, fichiers in par_categorie.items():
+        corps += f"\n📁 {categorie.upper()}:\n"
+        for fichier in fichiers:
+            taille_fmt = format_file_size(fichier['taille'])
+            taille_originale = fichier.get('taille_originale', fichier['taille'])
+            if taille_originale != fichier['taille']:
+                taille_fmt += f", optimisé depuis {format_file_size(taille_originale)}"
+            corps += f"  • {fichier['nom']} ({taille_fmt})\n"
+    
+    if deja_deposes:
+        corps += "\n=== DOCUMENTS DÉJÀ DÉPOSÉS (non renvoyés) ===\n"
+        for depot in deja_deposes:
+            corps += f"  • {depot['nom']}: identique à {depot['nom_depose']} déposé le {depot['depose_le']}\n"
+    
+    corps += f"""
+
+=== INFORMATIONS TECHNIQUES ===
+Format de nommage: TYPE_NOM_Prenom_TypeDoc_YYYYMMDD[_N].ext (N: numéro si plusieurs pièces du même type)
+Origine: Formulaire automatisé de gestion des demandes
+Secteur de traitement: {secteur}
+Horodatage: {datetime.now().strftime('%d/%m/%Y à %H:%M:%S')}
+
+=== INSTRUCTIONS ZEENDOC ===
+Ces documents sont à classer automatiquement dans le dossier client:
+- Nom du dossier: {nom.upper()} {prenom}
+- Type de demande: {type_demande}
+- Secteur: {secteur}
+- Référence: {type_demande}_{secteur.replace(' ', '')}_{nom.upper()}_{prenom}_{datetime.now().strftime('%Y%m%d')}
+
+Merci de confirmer la réception et le classement.
+"""
+    
+    return corps
+
+
+def historique_corps_zeendoc_multiple(corps_base, fichiers_groupe, index, total, fichiers_complets):
+    """Génère le corps pour un email multiple"""
+    
+    if total == 1:
+        return corps_base
+    
+    # En-tête spécial pour les envois multiples
+    entete_multiple = f"""=== ENVOI MULTIPLE - PARTIE {index}/{total} ===
+⚠️  ATTENTION: Cet envoi fait partie d'un lot de {total} emails
+📦 Cette partie contient {len(fichiers_groupe)} document(s) sur {len(fichiers_complets)} au total
+⏱️  Débit limité à {DEBIT_ZEENDOC_PAR_MINUTE:g} envoi(s)/minute par adresse de dépôt pour éviter la saturation
+
+"""
+    
+    # Ajouter la liste des fichiers de cette partie
+    fichiers_section = "=== FICHIERS DE CETTE PARTIE ===\n"
+    
+    par_categorie = {}
+    for fichier in fichiers_groupe:
+        cat = fichier['categorie']
+        if cat not in par_categorie:
+            par_categorie[cat] = []
+        par_categorie[cat].append(fichier)
+    
+    for categorie, fichiers in par_categorie.items():
+        fichiers_section += f"\n📁 {categorie.upper()}:\n"
+        for fichier in fichiers:
+            taille_fmt = format_file_size(fichier['taille'])
+            fichiers_section += f"  • {fichier['nom']} ({taille_fmt})\n"
+    
+    # Informations sur l'envoi complet
+    recap_section = f"""
+
+=== RÉCAPITULATIF COMPLET ===
+Total des documents: {len(fichiers_complets)}
+Nombre d'emails: {total}
+Partie actuelle: {index}/{total}
+"""
+    
+    return entete_multiple + fichiers_section + recap_section + "\n" + corps_base
+
+
+# --- Benchmark ---
+
+def generer_dossier(nb_pieces, alea):
+    data = {
+        'type': 'versement', 'nom': 'Dupont', 'prenom': 'Jean', 'secteurDemandeur': 'Le Havre',
+        'dateDemande': '15/03/2024', 'typeVersement': 'Libre', 'montantVersement': '25000',
+        'demandeur': 'M. Martin', 'urgence': 'Urgent'
+    }
+    fichiers = []
+    for index in range(nb_pieces):
+        doc_id = alea.choice(DOC_IDS)
+        taille = alea.randint(50_000, 8_000_000)
+        fichier = {
+            'nom': f"VERSEMENT_DUPONT_Jean_{doc_id}_{index}.pdf",
+            'taille': taille,
+            'categorie': application.obtenir_categorie_document(doc_id),
+        }
+        if alea.random() < 0.3:
+            fichier['taille_originale'] = taille * 4
+        fichiers.append(fichier)
+    deja_deposes = [{'nom': 'ANCIEN.pdf', 'nom_depose': 'ANCIEN.pdf', 'depose_le': '14/03/2024 10:00', 'taille': 1}]
+    return data, fichiers, deja_deposes
+
+
+def rendu_historique(data, fichiers, groupes, adresse, deja_deposes):
+    corps_principal = historique_corps_email(data, adresse)
+    corps_zeendoc = historique_corps_zeendoc(data, fichiers, adresse, deja_deposes)
+    parties = [
+        historique_corps_zeendoc_multiple(corps_zeendoc, groupe, index, len(groupes), fichiers)
+        for index, groupe in enumerate(groupes, 1)
+    ]
+    return corps_principal, corps_zeendoc, parties
+
+
+def rendu_modeles(data, fichiers, groupes, adresse, deja_deposes):
+    contexte = application.construire_contexte_email(
+        data, fichiers, adresse, deja_deposes, maintenant=INSTANT, reglages=REGLAGES
+    )
+    corps_principal = application.generer_corps_email(contexte)
+    corps_zeendoc = application.generer_corps_zeendoc(contexte)
+    parties = [
+        application.generer_corps_zeendoc_multiple(
+            corps_zeendoc, groupe, index, len(groupes), len(fichiers), contexte['categories'], DEBIT_ZEENDOC_PAR_MINUTE
+        )
+        for index, groupe in enumerate(groupes, 1)
+    ]
+    return corps_principal, corps_zeendoc, parties
+
+
+def verifier_identite(historique, modeles):
+    assert historique[0] == modeles[0], "corps principal différent"
+    assert historique[1] == modeles[1], "corps ZeenDoc différent"
+    for partie_historique, partie_modele in zip(historique[2], modeles[2]):
+        # Les catégories d'une partie suivent désormais l'ordre de la demande: mêmes lignes
+        assert sorted(partie_historique.split('\n')) == sorted(partie_modele.split('\n')), "corps de partie différent"
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--repetitions', type=int, default=200)
+    parser.add_argument('--graine', type=int, default=3)
+    args = parser.parse_args()
+
+    alea = random.Random(args.graine)
+    adresse = application.obtenir_adresse_zeendoc('Le Havre')
+
+    print(f"{'pièces':>7} {'parties':>8} {'historique':>12} {'modèles':>10} {'historique/modèles':>19}")
+    for nb_pieces in (5, 20, 50, 200):
+        data, fichiers, deja_deposes = generer_dossier(nb_pieces, alea)
+        groupes = application.diviser_fichiers_par_taille(fichiers, REGLAGES.limite_email_mo)
+
+        verifier_identite(
+            rendu_historique(data, fichiers, groupes, adresse, deja_deposes),
+            rendu_modeles(data, fichiers, groupes, adresse, deja_deposes)
+        )
+
+        durees = {}
+        for nom, rendu in (('historique', rendu_historique), ('modeles', rendu_modeles)):
+            debut = time.perf_counter()
+            for _ in range(args.repetitions):
+                rendu(data, fichiers, groupes, adresse, deja_deposes)
+            durees[nom] = (time.perf_counter() - debut) / args.repetitions
+
+        print(f"{nb_pieces:>7} {len(groupes):>8} {durees['historique'] * 1e6:>10.0f}µs "
+              f"{durees['modeles'] * 1e6:>8.0f}µs {durees['historique'] / durees['modeles']:>18.2f}x")
+
+    print("✅ Corps identiques à l'implémentation historique")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,99 @@
+"""Benchmark / test de propriétés du découpage ZeenDoc.
+
+Génère des dossiers réalistes (pièces des 4 types de demande, scans PDF et
+photos JPEG de tailles log-normales), vérifie les invariants de chaque mode
+de `diviser_fichiers_par_taille` puis compare le nombre d'emails produits.
+
+Usage: python benchmarks/bench_decoupage.py [--dossiers 2000] [--limite 20]
+"""
+
+import argparse
+import os
+import random
+import sys
+import tempfile
+import time
+from collections import Counter
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+os.environ.setdefault('DOSSIER_DONNEES', tempfile.mkdtemp(prefix='bench_donnees_'))
+
+import app as application
+from benchmarks.dossiers_synthetiques import generer_pieces
+
+def generer_dossier(alea):
+    """Liste de pièces (métadonnées seulement) pour un dossier aléatoire"""
+
+    type_demande, pieces = generer_pieces(alea)
+    return [
+        {
+            'nom': f"{type_demande.upper()}_DUPONT_Jean_{piece['nom_fichier']}",
+            'taille': piece['taille'],
+            'categorie': application.obtenir_categorie_document(piece['doc_id']),
+        }
+        for piece in pieces
+    ]
+
+
+def verifier_invariants(fichiers, groupes, limite_bytes):
+    assert sorted(id(f) for g in groupes for f in g) == sorted(id(f) for f in fichiers), "fichier perdu ou dupliqué"
+    for groupe in groupes:
+        assert groupe, "groupe vide"
+        taille = sum(application.taille_encodee(f) for f in groupe)
+        assert len(groupe) == 1 or taille <= limite_bytes, "groupe au-delà de la limite"
+
+
+def categories_coupees(groupes):
+    """Nombre de catégories réparties sur plusieurs emails"""
+
+    emails_par_categorie = Counter()
+    for groupe in groupes:
+        for categorie in {f['categorie'] for f in groupe}:
+            emails_par_categorie[categorie] += 1
+    return sum(1 for n in emails_par_categorie.values() if n > 1)
+
+
+def main():
+    reglages = application.CONFIGURATION_ENVOIS.actuelle().generaux
+
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--dossiers', type=int, default=2000)
+    parser.add_argument('--limite', type=int, default=reglages.limite_email_mo, help="limite par email (Mo)")
+    parser.add_argument('--graine', type=int, default=42)
+    args = parser.parse_args()
+
+    alea = random.Random(args.graine)
+    dossiers = [generer_dossier(alea) for _ in range(args.dossiers)]
+    limite_bytes = args.limite * 1024 * 1024 - application.ENTETE_EMAIL_MIME
+
+    print(f"{args.dossiers} dossiers, limite {args.limite} Mo par email")
+    print(f"{'mode':<12} {'emails':>8} {'moy.':>6} {'> max':>6} {'cat. coupées':>13} {'durée':>8}")
+    references = None
+    for mode in ('sequentiel', 'first_fit', 'best_fit'):
+        total_emails = 0
+        depassements = 0
+        coupes = 0
+        debut = time.perf_counter()
+        comptes = []
+        for fichiers in dossiers:
+            groupes = application.diviser_fichiers_par_taille(fichiers, limite_mb=args.limite, mode=mode)
+            verifier_invariants(fichiers, groupes, limite_bytes)
+            comptes.append(len(groupes))
+            total_emails += len(groupes)
+            depassements += len(groupes) > reglages.max_emails_par_demande
+            coupes += categories_coupees(groupes)
+        duree = time.perf_counter() - debut
+
+        if references is None:
+            references = comptes
+        else:
+            pires = sum(1 for n, ref in zip(comptes, references) if n > ref)
+            assert pires == 0, f"{mode}: {pires} dossier(s) avec plus d'emails que le découpage séquentiel"
+
+        print(f"{mode:<12} {total_emails:>8} {total_emails / args.dossiers:>6.2f} "
+              f"{depassements:>6} {coupes:>13} {duree * 1000:>6.0f}ms")
+
+
+if __name__ == '__main__':
+    main()
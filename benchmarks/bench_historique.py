@@ -0,0 +1,137 @@
+"""Benchmark: historique des envois sur plusieurs centaines de milliers de demandes.
+
+Remplit un historique (base SQLite temporaire) de `--envois` demandes
+réparties sur un an, trois secteurs et quelques milliers de clients, en
+passant par `enregistrer` (file + thread d'écriture par lots): mesure le
+coût vu par la requête (mise en file) et le débit d'écriture. Mesure
+ensuite le temps des recherches de /historique: première page, page
+profonde atteinte par curseur, filtre client, secteur + période, et
+affiche le plan de requête SQLite (index utilisé, pas de tri en mémoire).
+
+Usage: python benchmarks/bench_historique.py [--envois 300000] [--repetitions 20]
+"""
+
+import argparse
+import os
+import random
+import sys
+import tempfile
+import time
+import uuid
+from contextlib import closing
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from historique_envois import HistoriqueEnvois, normaliser_client
+
+SECTEURS = ['Le Havre', 'Rouen', 'Paris']
+TYPES = ['versement', 'rachat', 'arbitrage', 'creation']
+NOMS = ['Dupont', 'Durand', 'Martin', 'Lefèvre', 'Petit', 'Moreau', 'Élodie', 'Leroy', 'Roux', 'Fournier']
+
+
+def envoi_synthetique(alea, horodatage):
+    client = f"{alea.choice(NOMS).upper()}{alea.randrange(500)} {alea.choice(['Jean', 'Anne', 'Luc'])}"
+    fichiers = [
+        {'nom': f"piece_{i}.pdf", 'sha256': f"{alea.getrandbits(256):064x}", 'taille': alea.randrange(100_000, 8_000_000)}
+        for i in range(alea.randrange(1, 8))
+    ]
+    taille = sum(f['taille'] for f in fichiers)
+    envoi = {
+        'id': uuid.UUID(int=alea.getrandbits(128)).hex,
+        'horodatage': horodatage,
+        'client': client,
+        'client_cle': normaliser_client(client),
+        'type_demande': alea.choice(TYPES),
+        'secteur': alea.choice(SECTEURS),
+        'adresse_zeendoc': 'depot_docusign@zeenmail.com',
+        'fichiers_count': len(fichiers),
+        'taille_totale': taille,
+        'taille_originale': taille,
+        'emails_zeendoc': 1,
+        'email_principal': True,
+        'zeendoc_reussi': True,
+        'envoi_auto': True,
+        'duree': round(alea.uniform(1, 30), 2),
+    }
+    parties = [
+        {'partie': 'principal', 'ordre': 0, 'destinataire': 'gestion@optia.fr', 'fichiers_count': len(fichiers),
+         'taille': taille, 'succes': True, 'deja_envoye': False, 'fichiers': fichiers},
+        {'partie': '1/1', 'ordre': 1, 'destinataire': 'depot_docusign@zeenmail.com', 'fichiers_count': len(fichiers),
+         'taille': taille, 'succes': True, 'deja_envoye': False, 'duree': 1.5, 'fichiers': fichiers},
+    ]
+    return envoi, parties
+
+
+def remplir(historique, nombre, alea):
+    fin = time.time()
+    debut = fin - 365 * 86400
+    pas = (fin - debut) / nombre
+
+    depart = time.perf_counter()
+    for i in range(nombre):
+        historique.enregistrer(*envoi_synthetique(alea, debut + i * pas))
+    mise_en_file = time.perf_counter() - depart
+    historique.arreter(delai=None)
+    return mise_en_file, time.perf_counter() - depart
+
+
+def mesurer(fonction, repetitions):
+    durees = []
+    for _ in range(repetitions):
+        debut = time.perf_counter()
+        fonction()
+        durees.append(time.perf_counter() - debut)
+    durees.sort()
+    return durees[len(durees) // 2]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--envois', type=int, default=300_000)
+    parser.add_argument('--repetitions', type=int, default=20)
+    args = parser.parse_args()
+
+    alea = random.Random(42)
+    with tempfile.TemporaryDirectory() as dossier:
+        historique = HistoriqueEnvois(os.path.join(dossier, 'historique_envois.db'))
+
+        mise_en_file, ecriture = remplir(historique, args.envois, alea)
+        print(f"{args.envois} envois: mise en file {mise_en_file / args.envois * 1e6:.1f}µs/envoi, "
+              f"écrits en {ecriture:.1f}s ({args.envois / ecriture:.0f} envois/s)")
+
+        # Curseur de la 200e page de 50: parcours complet une fois, mesure de la page seule ensuite
+        curseur = None
+        for _ in range(200):
+            _, curseur = historique.rechercher(apres=curseur)
+        il_y_a_30_jours = time.time() - 30 * 86400
+
+        recherches = {
+            'première page': {},
+            'page 200 (curseur)': {'apres': curseur},
+            'client « dupont1 »': {'client': 'dupont1'},
+            'client « elodie12 anne »': {'client': 'elodie12 anne'},
+            'secteur + 30 jours': {'secteur': 'Rouen', 'debut': il_y_a_30_jours},
+            'secteur + type': {'secteur': 'Paris', 'type_demande': 'rachat'},
+        }
+        print(f"\n{'recherche (50 par page)':<28} {'médiane':>10} {'résultats':>10}")
+        for libelle, criteres in recherches.items():
+            envois, _ = historique.rechercher(**criteres)
+            duree = mesurer(lambda: historique.rechercher(**criteres), args.repetitions)
+            print(f"{libelle:<28} {duree * 1000:>8.2f}ms {len(envois):>10}")
+
+        print("\nPlans de requête:")
+        with closing(historique._connexion()) as conn:
+            for libelle, clause, parametres in (
+                ('client', "client_cle >= ? AND client_cle < ?", ['dupont1', 'dupont1\U0010ffff']),
+                ('secteur + période', "secteur = ? AND horodatage >= ?", ['Rouen', il_y_a_30_jours]),
+                ('curseur', "(horodatage, id) < (?, ?)", [time.time(), '']),
+            ):
+                plan = conn.execute(
+                    f"EXPLAIN QUERY PLAN SELECT id FROM envois WHERE {clause} ORDER BY horodatage DESC, id DESC LIMIT 51",
+                    parametres
+                ).fetchall()
+                print(f"  {libelle}: " + ' | '.join(ligne[3] for ligne in plan))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,124 @@
+"""Benchmark mémoire: réception des uploads, préparation et archive ZIP.
+
+Compare le pic d'allocations Python (tracemalloc) du traitement historique
+(`file.read()` + ZIP dans un BytesIO) avec le traitement spoolé sur disque,
+pour des dossiers de tailles croissantes.
+
+Usage: python benchmarks/bench_memoire_upload.py [--tailles 10 30 60]
+"""
+
+import argparse
+import io
+import os
+import shutil
+import sys
+import tempfile
+import tracemalloc
+import zipfile
+
+from werkzeug.test import create_environ
+from flask import Request
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+os.environ.setdefault('DOSSIER_DONNEES', tempfile.mkdtemp(prefix='bench_donnees_'))
+os.environ.setdefault('ENVOI_ASYNCHRONE', '0')
+
+import app as application
+
+DOCUMENTS = ['cniValide_doc', 'justifDom_doc', 'ribJour_doc', 'majProfil_doc', 'etudeSignee_doc']
+# Début d'un JPEG: la signature est vérifiée à la réception
+ENTETE_JPEG = b'\xff\xd8\xff\xe0\x00\x10JFIF\x00'
+FRONTIERE = 'frontiere-benchmark'
+
+
+def ecrire_corps_multipart(chemin, taille_totale):
+    """Écrit sur disque un corps multipart de `taille_totale` octets répartis sur 5 fichiers"""
+
+    taille_fichier = taille_totale // len(DOCUMENTS)
+    with open(chemin, 'wb') as corps:
+        for champ, valeur in (('nom', 'Dupont'), ('prenom', 'Jean'), ('type', 'versement')):
+            corps.write(f'--{FRONTIERE}\r\nContent-Disposition: form-data; name="{champ}"\r\n\r\n{valeur}\r\n'.encode())
+        for doc_id in DOCUMENTS:
+            corps.write(
+                f'--{FRONTIERE}\r\nContent-Disposition: form-data; name="{doc_id}"; filename="{doc_id}.jpg"\r\n'
+                f'Content-Type: image/jpeg\r\n\r\n'.encode()
+            )
+            corps.write(ENTETE_JPEG)
+            restant = taille_fichier - len(ENTETE_JPEG)
+            while restant:
+                bloc = os.urandom(min(restant, 1024 * 1024))
+                corps.write(bloc)
+                restant -= len(bloc)
+            corps.write(b'\r\n')
+        corps.write(f'--{FRONTIERE}--\r\n'.encode())
+
+
+def construire_environ(chemin_corps, flux):
+    return create_environ(
+        path='/envoyer-demande',
+        method='POST',
+        input_stream=flux,
+        content_length=os.path.getsize(chemin_corps),
+        content_type=f'multipart/form-data; boundary={FRONTIERE}'
+    )
+
+
+def traitement_historique(chemin_corps):
+    with open(chemin_corps, 'rb') as flux:
+        requete = Request(construire_environ(chemin_corps, flux))
+        fichiers = []
+        for key, file in requete.files.items():
+            contenu = file.read()
+            fichiers.append({'nom': file.filename, 'contenu': contenu, 'categorie': key})
+
+        zip_buffer = io.BytesIO()
+        with zipfile.ZipFile(zip_buffer, 'w', zipfile.ZIP_DEFLATED, compresslevel=6) as zip_file:
+            for fichier in fichiers:
+                zip_file.writestr(f"{fichier['categorie']}/{fichier['nom']}", fichier['contenu'])
+        zip_buffer.getvalue()
+        requete.close()
+
+
+def traitement_spoole(chemin_corps):
+    dossier = tempfile.mkdtemp(prefix='bench_fichiers_')
+    with open(chemin_corps, 'rb') as flux:
+        environ = construire_environ(chemin_corps, flux)
+        with application.app.request_context(environ):
+            fichiers = application.preparer_fichiers_zeendoc(
+                application.request.files, 'Dupont', 'Jean', 'versement', dossier
+            )
+            archive = application.creer_archive_zip(fichiers, {'nom': 'Dupont', 'prenom': 'Jean'})
+            os.remove(archive[0]['chemin'])
+    shutil.rmtree(dossier)
+
+
+def mesurer_pic(traitement, chemin_corps):
+    tracemalloc.start()
+    traitement(chemin_corps)
+    _, pic = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return pic
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--tailles', type=int, nargs='+', default=[10, 30, 60], help="tailles de dossier en Mo")
+    args = parser.parse_args()
+
+    print(f"{'dossier':>8} {'historique':>12} {'spoolé':>10}")
+    for taille_mo in args.tailles:
+        descripteur, chemin_corps = tempfile.mkstemp(suffix='.multipart')
+        os.close(descripteur)
+        try:
+            ecrire_corps_multipart(chemin_corps, taille_mo * 1024 * 1024)
+            pic_historique = mesurer_pic(traitement_historique, chemin_corps)
+            pic_spoole = mesurer_pic(traitement_spoole, chemin_corps)
+        finally:
+            os.remove(chemin_corps)
+
+        print(f"{taille_mo:>6}Mo {pic_historique / 1024 / 1024:>10.1f}Mo {pic_spoole / 1024 / 1024:>8.1f}Mo")
+
+
+if __name__ == '__main__':
+    main()
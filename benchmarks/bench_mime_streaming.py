@@ -0,0 +1,169 @@
+"""Benchmark: construction MIME en mémoire vs écriture streaming.
+
+Vérifie d'abord que le flux produit par `MessageStreaming` est identique,
+octet pour octet, à `MIMEMultipart` + `encoders.encode_base64` +
+`send_message` (même frontière), puis compare le pic d'allocations Python
+(tracemalloc) pour un message de plusieurs pièces jointes. Compare enfin
+le temps de production des messages d'une demande dont les mêmes fichiers
+partent `--envois` fois (email principal, parties ZeenDoc, nouvel essai),
+sans et avec le cache d'encodage de la demande.
+
+Usage: python benchmarks/bench_mime_streaming.py [--tailles 5 20] [--envois 3]
+"""
+
+import argparse
+import hashlib
+import io
+import os
+import re
+import sys
+import tempfile
+import time
+import tracemalloc
+from email import encoders, generator
+from email.mime.base import MIMEBase
+from email.mime.multipart import MIMEMultipart
+from email.mime.text import MIMEText
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from mime_streaming import CacheEncodage, MessageStreaming
+
+FRONTIERE = '===============0123456789012345=='
+CORPS = "=== DÉPÔT AUTOMATIQUE ZEENDOC ===\nClient: Dupont Jean\n.ligne commençant par un point\n"
+
+
+def ouvrir_fichier(fichier):
+    return open(fichier['chemin'], 'rb')
+
+
+def message_historique(fichiers):
+    """Flux DATA produit par la construction MIME historique puis `send_message`"""
+
+    msg = MIMEMultipart()
+    msg['From'] = 'depot@optia.fr'
+    msg['To'] = 'depot_docusign@zeenmail.com'
+    msg['Cc'] = 'gestionprivee@optia-conseil.fr'
+    msg['Subject'] = '[ZEENDOC-LE HAVRE] Documents - Dupont Jean - Versement'
+    msg.set_boundary(FRONTIERE)
+    msg.attach(MIMEText(CORPS, 'plain', 'utf-8'))
+
+    for fichier in fichiers:
+        part = MIMEBase('application', 'octet-stream')
+        with ouvrir_fichier(fichier) as source:
+            part.set_payload(source.read())
+        encoders.encode_base64(part)
+        part.add_header('Content-Disposition', f'attachment; filename="{fichier["nom"]}"')
+        msg.attach(part)
+
+    tampon = io.BytesIO()
+    generator.BytesGenerator(tampon).flatten(msg, linesep='\r\n')
+    donnees = tampon.getvalue()
+    # Dot-stuffing et fin de données appliqués par smtplib.SMTP.data()
+    donnees = re.sub(br'(?m)^\.', b'..', donnees)
+    if not donnees.endswith(b'\r\n'):
+        donnees += b'\r\n'
+    return donnees
+
+
+def message_streaming(fichiers, cache=None):
+    return MessageStreaming(
+        'depot@optia.fr', 'depot_docusign@zeenmail.com',
+        '[ZEENDOC-LE HAVRE] Documents - Dupont Jean - Versement', CORPS, fichiers,
+        ouvrir=ouvrir_fichier, cc='gestionprivee@optia-conseil.fr', frontiere=FRONTIERE, cache=cache
+    )
+
+
+def creer_fichiers(dossier, tailles):
+    fichiers = []
+    for index, taille in enumerate(tailles):
+        chemin = os.path.join(dossier, f"piece_{index}")
+        contenu = os.urandom(taille)
+        with open(chemin, 'wb') as f:
+            f.write(contenu)
+        fichiers.append({
+            'nom': f"VERSEMENT_DUPONT_Jean_CNI_20240101_{index}.jpg",
+            'chemin': chemin,
+            'taille': taille,
+            'sha256': hashlib.sha256(contenu).hexdigest()
+        })
+    return fichiers
+
+
+def verifier_identite(dossier):
+    for tailles in ([], [0], [1], [56, 57, 58], [57 * 1024, 57 * 1024 + 1, 300_001]):
+        fichiers = creer_fichiers(dossier, tailles)
+        attendu = message_historique(fichiers)
+        message = message_streaming(fichiers)
+        obtenu = b''.join(message.blocs())
+        assert obtenu == attendu, f"flux différent pour les tailles {tailles}"
+        assert message.taille() == len(b''.join(message.segments)) + sum(
+            len(b''.join(message._encoder_piece(f))) for f in fichiers
+        )
+
+        # Pièces relues depuis le cache (en mémoire ou fichier temporaire): même flux
+        cache = CacheEncodage(dossier, seuil_memoire=100_000)
+        for _ in range(2):
+            assert b''.join(message_streaming(fichiers, cache).blocs()) == attendu
+        cache.fermer()
+    print("✅ Flux streaming identique au flux MIME historique (avec et sans cache d'encodage)")
+
+
+def mesurer_pic(fonction):
+    tracemalloc.start()
+    fonction()
+    _, pic = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return pic
+
+
+def mesurer_demande(fichiers, envois, cache):
+    """Durée de production des `envois` messages d'une demande, et temps de lecture + encodage des pièces"""
+
+    debut = time.perf_counter()
+    encodage = 0.0
+    for _ in range(envois):
+        message = message_streaming(fichiers, cache)
+        for _ in message.blocs():
+            pass
+        encodage += message.duree_encodage
+    total = time.perf_counter() - debut
+    if cache is not None:
+        cache.fermer()
+    return total, encodage
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--tailles', type=int, nargs='+', default=[5, 20], help="taille par message en Mo")
+    parser.add_argument('--envois', type=int, default=3, help="envois des mêmes pièces par demande")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as dossier:
+        verifier_identite(dossier)
+
+        print(f"{'message':>8} {'historique':>12} {'streaming':>10}")
+        for taille_mo in args.tailles:
+            fichiers = creer_fichiers(dossier, [taille_mo * 1024 * 1024 // 4] * 4)
+
+            pic_historique = mesurer_pic(lambda: message_historique(fichiers))
+
+            def envoyer_streaming():
+                for _ in message_streaming(fichiers).blocs():
+                    pass
+            pic_streaming = mesurer_pic(envoyer_streaming)
+
+            print(f"{taille_mo:>6}Mo {pic_historique / 1024 / 1024:>10.1f}Mo {pic_streaming / 1024 / 1024:>8.2f}Mo")
+
+        print(f"\nMêmes pièces envoyées {args.envois} fois par demande (durée totale / dont lecture et encodage)")
+        print(f"{'demande':>8} {'sans cache':>20} {'avec cache':>20}")
+        for taille_mo in args.tailles:
+            fichiers = creer_fichiers(dossier, [taille_mo * 1024 * 1024 // 4] * 4)
+            sans = mesurer_demande(fichiers, args.envois, None)
+            avec = mesurer_demande(fichiers, args.envois, CacheEncodage(dossier))
+            print(f"{taille_mo:>6}Mo {sans[0] * 1000:>9.1f}ms / {sans[1] * 1000:>6.1f}ms "
+                  f"{avec[0] * 1000:>9.1f}ms / {avec[1] * 1000:>6.1f}ms")
+
+
+if __name__ == '__main__':
+    main()
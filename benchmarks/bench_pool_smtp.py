@@ -0,0 +1,81 @@
+"""Benchmark: messages/seconde avec et sans pool de connexions SMTP.
+
+Usage: python benchmarks/bench_pool_smtp.py [--messages 200] [--threads 4] [--latence 0.02]
+
+`--latence` simule le coût d'une poignée de main (TCP/TLS/AUTH) sur le relais.
+"""
+
+import argparse
+import os
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+from email.mime.application import MIMEApplication
+from email.mime.multipart import MIMEMultipart
+from email.mime.text import MIMEText
+import smtplib
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from benchmarks.puits_smtp import PuitsSMTP
+from pool_smtp import PoolSMTP
+
+
+def construire_message(taille_piece):
+    msg = MIMEMultipart()
+    msg['From'] = 'bench@example.com'
+    msg['To'] = 'zeendoc@example.com'
+    msg['Subject'] = 'Benchmark pool SMTP'
+    msg.attach(MIMEText('Corps du message', 'plain', 'utf-8'))
+    msg.attach(MIMEApplication(os.urandom(taille_piece)))
+    return msg
+
+
+def envoyer_sans_pool(puits, msg):
+    # Comportement historique: connexion + login par message
+    with smtplib.SMTP(puits.hote, puits.port) as server:
+        server.login('bench', 'secret')
+        server.send_message(msg)
+
+
+def envoyer_avec_pool(pool, puits, msg):
+    pool.executer(puits.hote, puits.port, 'bench', 'secret',
+                  lambda server: server.send_message(msg), starttls=False)
+
+
+def mesurer(nom, envoyer, nb_messages, nb_threads, puits):
+    puits.reinitialiser()
+    debut = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=nb_threads) as executor:
+        list(executor.map(lambda _: envoyer(), range(nb_messages)))
+    duree = time.perf_counter() - debut
+
+    print(f"{nom:<12} {nb_messages} messages en {duree:.2f}s → "
+          f"{nb_messages / duree:.1f} msg/s ({puits.compteurs['connexions']} connexion(s))")
+    return nb_messages / duree
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--messages', type=int, default=200)
+    parser.add_argument('--threads', type=int, default=4)
+    parser.add_argument('--taille', type=int, default=20_000, help="taille de la pièce jointe (octets)")
+    parser.add_argument('--latence', type=float, default=0.02)
+    args = parser.parse_args()
+
+    msg = construire_message(args.taille)
+
+    with PuitsSMTP(latence_poignee_de_main=args.latence) as puits:
+        sans_pool = mesurer('sans pool', lambda: envoyer_sans_pool(puits, msg),
+                            args.messages, args.threads, puits)
+
+        pool = PoolSMTP()
+        avec_pool = mesurer('avec pool', lambda: envoyer_avec_pool(pool, puits, msg),
+                            args.messages, args.threads, puits)
+        pool.fermer_tout()
+
+    print(f"Gain: x{avec_pool / sans_pool:.1f}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,93 @@
+"""Benchmark: préparation et planification d'une demande selon son nombre de pièces jointes.
+
+Chaque demande envoie plusieurs fichiers par champ (comme les champs `multiple`
+du formulaire). Mesure, pour chaque nombre de pièces: la préparation
+(`preparer_fichiers_zeendoc`: spool, empreinte, stock de contenus, liens),
+puis la planification (recherche des dépôts récents, découpage ZeenDoc,
+corps de toutes les parties). Vérifie au passage qu'aucune pièce n'est
+perdue et que tous les noms standardisés sont distincts.
+
+Usage: python benchmarks/bench_preparation_pieces.py [--pieces 10,50,200] [--taille 50000] [--repetitions 5]
+"""
+
+import argparse
+import io
+import os
+import shutil
+import statistics
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+os.environ.setdefault('DOSSIER_DONNEES', tempfile.mkdtemp(prefix='bench_donnees_'))
+os.environ.setdefault('OPTIMISATION_DOCUMENTS', '0')
+
+from werkzeug.datastructures import FileStorage, MultiDict
+
+import app as application
+
+CHAMPS = ['majProfil_doc', 'etudeSignee_doc', 'cniValide_doc', 'justifDom_doc', 'ribJour_doc',
+          'justifProvenance_doc', 'justifDomImpot_doc', 'clauseBeneficiaire_doc']
+
+DATA = {'nom': 'Dupont', 'prenom': 'Jean', 'type': 'versement', 'secteurDemandeur': 'Paris'}
+
+
+def generer_formulaire(nb_pieces, taille):
+    """request.files d'une demande: `nb_pieces` fichiers distincts répartis sur les champs"""
+
+    return MultiDict([
+        (CHAMPS[i % len(CHAMPS)], FileStorage(
+            io.BytesIO(os.urandom(taille)), filename=f"page_{i}.pdf", content_type='application/pdf'
+        ))
+        for i in range(nb_pieces)
+    ])
+
+
+def mesurer_demande(nb_pieces, taille, limite_mb):
+    files = generer_formulaire(nb_pieces, taille)
+    dossier = os.path.join(application.DOSSIER_DONNEES, 'fichiers', 'bench')
+
+    debut = time.perf_counter()
+    fichiers_pieces = application.preparer_fichiers_zeendoc(files, DATA['nom'], DATA['prenom'], DATA['type'], dossier)
+    preparation = time.perf_counter() - debut
+
+    noms = [f['nom'] for f in fichiers_pieces]
+    assert len(noms) == nb_pieces, f"{nb_pieces - len(noms)} pièce(s) perdue(s)"
+    assert len(set(noms)) == nb_pieces, "noms standardisés en double"
+
+    debut = time.perf_counter()
+    plan = application.planifier_envois(DATA, fichiers_pieces, DATA['secteurDemandeur'], 'bench@example.com', {})
+    groupes, exclus = application.decouper_parties_zeendoc(plan['fichiers_zeendoc'], len(fichiers_pieces), limite_mb)
+    corps_base = application.generer_corps_zeendoc(plan['contexte'])
+    for index, groupe in enumerate(groupes, 1):
+        application.generer_corps_zeendoc_multiple(
+            corps_base, groupe, index, len(groupes), len(plan['fichiers_zeendoc']), plan['contexte']['categories']
+        )
+    planification = time.perf_counter() - debut
+
+    shutil.rmtree(dossier, ignore_errors=True)
+    return preparation, planification, len(groupes)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--pieces', default='10,50,200', help="nombres de pièces par demande (liste)")
+    parser.add_argument('--taille', type=int, default=50_000, help="taille de chaque pièce (octets)")
+    parser.add_argument('--repetitions', type=int, default=5)
+    parser.add_argument('--limite', type=int, default=1, help="limite par email (Mo), petite pour multiplier les parties")
+    args = parser.parse_args()
+
+    print(f"Pièces de {args.taille // 1000} Ko, limite {args.limite} Mo par email, médiane de {args.repetitions} demandes")
+    print(f"{'pièces':>7} {'parties':>8} {'préparation':>12} {'par pièce':>10} {'planification':>14} {'par pièce':>10}")
+    for nb_pieces in (int(n) for n in args.pieces.split(',')):
+        mesures = [mesurer_demande(nb_pieces, args.taille, args.limite) for _ in range(args.repetitions)]
+        preparation = statistics.median(m[0] for m in mesures)
+        planification = statistics.median(m[1] for m in mesures)
+        print(f"{nb_pieces:>7} {mesures[0][2]:>8} {preparation * 1000:>10.1f}ms {preparation * 1e6 / nb_pieces:>8.0f}µs "
+              f"{planification * 1000:>12.1f}ms {planification * 1e6 / nb_pieces:>8.0f}µs")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,78 @@
+"""Générateur de dossiers synthétiques partagé par les benchmarks.
+
+Un dossier reprend les champs d'un type de demande (les 18 identifiants du
+registre des documents), avec un ou plusieurs fichiers par champ:
+photos JPEG de téléphone (1 à 12 Mo) ou scans PDF (100 Ko à 8 Mo), de
+tailles log-normales. `echelle` réduit toutes les tailles (bancs rapides),
+`pages` donne le tirage du nombre de fichiers par champ. Le contenu est
+aléatoire après la signature du format: incompressible, comme une photo ou
+un scan. Tout dépend de la graine de `alea`, un même tirage redonne le même dossier.
+"""
+
+import io
+
+from registre_documents import REGISTRE_DOCUMENTS
+
+DOCUMENTS_PAR_TYPE = {
+    type_demande: list(doc_ids) for type_demande, doc_ids in REGISTRE_DOCUMENTS.documents_par_demande.items()
+}
+
+SECTEURS = ['Le Havre', 'Rouen', 'Paris']
+
+SIGNATURES = {
+    'jpg': b'\xff\xd8\xff\xe0\x00\x10JFIF\x00',
+    'pdf': b'%PDF-1.7\n',
+}
+
+TYPES_MIME = {'jpg': 'image/jpeg', 'pdf': 'application/pdf'}
+
+PAGES_PAR_CHAMP = (1, 1, 1, 2, 3)
+
+
+def generer_pieces(alea, type_demande=None, pages=PAGES_PAR_CHAMP, echelle=1.0):
+    """Retourne (type de demande, pièces): métadonnées seulement, {doc_id, nom_fichier, extension, taille}"""
+
+    if type_demande is None:
+        type_demande = alea.choice(list(DOCUMENTS_PAR_TYPE))
+
+    pieces = []
+    for doc_id in DOCUMENTS_PAR_TYPE[type_demande]:
+        for page in range(alea.choice(pages)):
+            if alea.random() < 0.5:
+                # Photo de téléphone: 1 à 12 Mo
+                taille = min(12, max(1, alea.lognormvariate(1.3, 0.6)))
+                extension = 'jpg'
+            else:
+                # Scan PDF: 100 Ko à 8 Mo
+                taille = min(8, max(0.1, alea.lognormvariate(0, 0.9)))
+                extension = 'pdf'
+            pieces.append({
+                'doc_id': doc_id,
+                'nom_fichier': f"{doc_id}_{page}.{extension}",
+                'extension': extension,
+                'taille': max(len(SIGNATURES[extension]), int(taille * echelle * 1024 * 1024)),
+            })
+    return type_demande, pieces
+
+
+def contenu_piece(piece, alea):
+    signature = SIGNATURES[piece['extension']]
+    return signature + alea.randbytes(piece['taille'] - len(signature))
+
+
+def generer_demande(alea, numero, type_demande=None, pages=PAGES_PAR_CHAMP, echelle=1.0):
+    """Champs du formulaire et fichiers [(doc_id, (flux, nom, type MIME))] d'une demande complète"""
+
+    type_demande, pieces = generer_pieces(alea, type_demande, pages, echelle)
+    data = {
+        'nom': f'Dupont{numero}',
+        'prenom': 'Jean',
+        'type': type_demande,
+        'secteurDemandeur': alea.choice(SECTEURS),
+        'dateDemande': '01/01/2025',
+    }
+    fichiers = [
+        (piece['doc_id'], (io.BytesIO(contenu_piece(piece, alea)), piece['nom_fichier'], TYPES_MIME[piece['extension']]))
+        for piece in pieces
+    ]
+    return data, fichiers
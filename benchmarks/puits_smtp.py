@@ -0,0 +1,117 @@
+"""Serveur SMTP local minimal pour les benchmarks (aucune dépendance externe).
+
+Accepte EHLO/HELO, AUTH PLAIN/LOGIN (tout identifiant), NOOP, RSET, MAIL,
+RCPT, DATA et QUIT, compte les messages et les octets reçus, puis jette le
+contenu. `latence_poignee_de_main` simule le coût réseau d'une ouverture de
+session (TCP + TLS + AUTH) sur un relais distant, `latence_message` le temps
+de traitement d'un message par le relais avant sa réponse à la fin de DATA.
+"""
+
+import socketserver
+import threading
+import time
+
+
+class _GestionnaireSMTP(socketserver.StreamRequestHandler):
+
+    def _repondre(self, ligne):
+        self.wfile.write(ligne.encode('ascii') + b'\r\n')
+
+    def handle(self):
+        puits = self.server.puits
+        puits._compter('connexions')
+        time.sleep(puits.latence_poignee_de_main)
+        self._repondre('220 puits-smtp ESMTP')
+
+        while True:
+            ligne = self.rfile.readline()
+            if not ligne:
+                return
+
+            commande = ligne.decode('ascii', 'replace').strip()
+            verbe = commande.split(' ', 1)[0].upper()
+
+            if verbe == 'EHLO':
+                self._repondre('250-puits-smtp')
+                self._repondre('250-8BITMIME')
+                self._repondre('250-SIZE 104857600')
+                self._repondre('250 AUTH PLAIN LOGIN')
+            elif verbe == 'HELO':
+                self._repondre('250 puits-smtp')
+            elif verbe == 'AUTH':
+                time.sleep(puits.latence_poignee_de_main)
+                arguments = commande.split(' ')
+                if arguments[1].upper() == 'LOGIN':
+                    self._repondre('334 VXNlcm5hbWU6')
+                    self.rfile.readline()
+                    self._repondre('334 UGFzc3dvcmQ6')
+                    self.rfile.readline()
+                elif len(arguments) < 3:
+                    self._repondre('334 ')
+                    self.rfile.readline()
+                self._repondre('235 2.7.0 Authentication successful')
+            elif verbe in ('NOOP', 'RSET', 'MAIL', 'RCPT'):
+                self._repondre('250 OK')
+            elif verbe == 'DATA':
+                self._repondre('354 End data with <CR><LF>.<CR><LF>')
+                taille = 0
+                while True:
+                    donnees = self.rfile.readline()
+                    if not donnees or donnees == b'.\r\n':
+                        break
+                    taille += len(donnees)
+                time.sleep(puits.latence_message)
+                puits._enregistrer_message(taille)
+                self._repondre('250 OK')
+            elif verbe == 'QUIT':
+                self._repondre('221 Bye')
+                return
+            else:
+                self._repondre('502 Command not implemented')
+
+
+class _ServeurThreade(socketserver.ThreadingMixIn, socketserver.TCPServer):
+    daemon_threads = True
+    allow_reuse_address = True
+    # Des centaines de connexions simultanées en charge: file d'attente d'acceptation large
+    request_queue_size = 512
+
+
+class PuitsSMTP:
+    """Puits SMTP lancé dans un thread: `with PuitsSMTP() as puits: ...`"""
+
+    def __init__(self, hote='127.0.0.1', port=0, latence_poignee_de_main=0.0, latence_message=0.0):
+        self.latence_poignee_de_main = latence_poignee_de_main
+        self.latence_message = latence_message
+        self._serveur = _ServeurThreade((hote, port), _GestionnaireSMTP)
+        self._serveur.puits = self
+        self.hote, self.port = self._serveur.server_address
+        self._verrou = threading.Lock()
+        self.compteurs = {'connexions': 0, 'messages': 0, 'octets': 0}
+
+    def _compter(self, cle, valeur=1):
+        with self._verrou:
+            self.compteurs[cle] += valeur
+
+    def _enregistrer_message(self, taille):
+        with self._verrou:
+            self.compteurs['messages'] += 1
+            self.compteurs['octets'] += taille
+
+    def reinitialiser(self):
+        with self._verrou:
+            self.compteurs = {cle: 0 for cle in self.compteurs}
+
+    def demarrer(self):
+        threading.Thread(target=self._serveur.serve_forever, daemon=True).start()
+        return self
+
+    def arreter(self):
+        self._serveur.shutdown()
+        self._serveur.server_close()
+
+    def __enter__(self):
+        return self.demarrer()
+
+    def __exit__(self, *exc):
+        self.arreter()
@@ -0,0 +1,321 @@
+"""Suite de benchmarks de bout en bout du traitement des demandes, devant un puits SMTP local.
+
+Chaque scénario envoie `--demandes` demandes synthétiques (voir
+dossiers_synthetiques.py) sur POST /envoyer-demande, `--concurrence` à la
+fois, via le client de test Flask (dans le processus, sans réseau HTTP).
+Les emails partent vers le puits SMTP local (benchmarks/puits_smtp.py).
+Mesures par scénario:
+
+- latence de bout en bout (p50, p95, max), jusqu'à la fin des envois
+  (en mode `file`, jusqu'à l'état final de la demande dans la file);
+- débit en demandes par seconde;
+- RSS maximal du processus (client de test et puits compris) et sa
+  hausse par rapport au début du scénario;
+- octets sur le fil par étape: téléversement (corps des requêtes),
+  email principal et emails ZeenDoc (compteur formulaire_smtp_octets_envoyes),
+  total reçu par le puits;
+- durée cumulée de chaque étape instrumentée (histogramme
+  formulaire_duree_etape_secondes: archive_zip, decoupage, smtp_envoi...).
+
+Les résultats sont écrits en JSON (`--sortie`), avec le commit et la
+machine, pour comparer les exécutions dans le temps (`--comparer`).
+
+Usage: python benchmarks/suite.py [--scenarios typique,volumineux,nombreux] [--demandes 8] [--concurrence 2]
+       [--delai 0] [--latence-smtp 0] [--mode direct] [--optimisation] [--sortie resultats.json]
+       [--comparer precedent.json]
+"""
+
+import argparse
+import contextlib
+import json
+import os
+import platform
+import random
+import resource
+import shutil
+import statistics
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+
+RACINE = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, RACINE)
+
+from benchmarks.dossiers_synthetiques import generer_demande
+from benchmarks.puits_smtp import PuitsSMTP
+
+# Tirage des fichiers par champ et réduction des tailles de chaque scénario
+SCENARIOS = {
+    # Demande courante: quelques Mo, un email ZeenDoc
+    'typique': {'pages': (1, 1, 1, 2, 3), 'echelle': 0.15},
+    # Photos pleine résolution: archive ZIP pour l'email principal, plusieurs parties ZeenDoc
+    'volumineux': {'pages': (1, 1, 2, 3), 'echelle': 1.0},
+    # Dizaines de petites pièces (pages scannées une par une)
+    'nombreux': {'pages': (5, 6, 8), 'echelle': 0.03},
+}
+
+PAGE_RSS = os.sysconf('SC_PAGE_SIZE') if hasattr(os, 'sysconf') else 4096
+
+
+def rss_courant():
+    """RSS du processus en octets (Linux: /proc/self/statm), sinon le maximum depuis le démarrage"""
+
+    try:
+        with open('/proc/self/statm') as statm:
+            return int(statm.read().split()[1]) * PAGE_RSS
+    except OSError:
+        maximum = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        return maximum if sys.platform == 'darwin' else maximum * 1024
+
+
+class ObservateurRSS:
+    """Relève le RSS maximal du processus pendant la mesure"""
+
+    def __init__(self, intervalle=0.01):
+        self.intervalle = intervalle
+        self.base = rss_courant()
+        self.maximum = self.base
+        self._fin = threading.Event()
+
+    def _observer(self):
+        while not self._fin.wait(self.intervalle):
+            self.maximum = max(self.maximum, rss_courant())
+
+    def __enter__(self):
+        threading.Thread(target=self._observer, daemon=True).start()
+        return self
+
+    def __exit__(self, *exc):
+        self._fin.set()
+        self.maximum = max(self.maximum, rss_courant())
+
+
+def releve_metriques():
+    """Valeurs courantes des durées d'étapes et des octets SMTP du registre Prometheus du processus"""
+
+    from prometheus_client import REGISTRY
+
+    releve = {}
+    for metrique in REGISTRY.collect():
+        for echantillon in metrique.samples:
+            if echantillon.name == 'formulaire_duree_etape_secondes_sum':
+                releve[('duree', echantillon.labels['etape'])] = echantillon.value
+            elif echantillon.name == 'formulaire_duree_etape_secondes_count':
+                releve[('appels', echantillon.labels['etape'])] = echantillon.value
+            elif echantillon.name == 'formulaire_smtp_octets_envoyes_total':
+                releve[('octets', echantillon.labels['type_envoi'])] = echantillon.value
+    return releve
+
+
+def difference(avant, apres, genre):
+    return {
+        cle: apres[(g, cle)] - avant.get((g, cle), 0)
+        for g, cle in apres
+        if g == genre and apres[(g, cle)] - avant.get((g, cle), 0) > 0
+    }
+
+
+def ecrire_demande(demande, dossier):
+    """Écrit les fichiers d'une demande sur disque: le RSS mesuré ne compte pas les demandes en attente"""
+
+    data, fichiers = demande
+    sur_disque = []
+    for doc_id, (flux, nom_fichier, type_mime) in fichiers:
+        chemin = os.path.join(dossier, f"{len(os.listdir(dossier))}_{nom_fichier}")
+        with open(chemin, 'wb') as destination:
+            destination.write(flux.getbuffer())
+        sur_disque.append((doc_id, chemin, nom_fichier, type_mime))
+    return data, sur_disque
+
+
+def envoyer(application, data, fichiers, mode):
+    """Envoie une demande et attend la fin de ses envois, retourne (durée, succès)"""
+
+    client = application.test_client()
+    champs = dict(data)
+    with contextlib.ExitStack() as pile:
+        # Plusieurs fichiers par champ: une liste de tuples par clé pour le client de test
+        for doc_id, chemin, nom_fichier, type_mime in fichiers:
+            champs.setdefault(doc_id, []).append((pile.enter_context(open(chemin, 'rb')), nom_fichier, type_mime))
+
+        debut = time.perf_counter()
+        reponse = client.post('/envoyer-demande', data=champs, content_type='multipart/form-data')
+
+    if mode == 'file' and reponse.status_code == 202:
+        statut_url = reponse.get_json()['statut_url']
+        while True:
+            statut = client.get(statut_url).get_json()
+            if statut['etat'] in ('termine', 'echec'):
+                return time.perf_counter() - debut, bool(statut.get('resultat', {}).get('envoi_auto'))
+            time.sleep(0.02)
+
+    contenu = reponse.get_json() or {}
+    return time.perf_counter() - debut, reponse.status_code == 200 and contenu.get('envoi_auto') is True
+
+
+def executer_scenario(application, puits, nom, parametres, args):
+    alea = random.Random(args.graine)
+    dossier = tempfile.mkdtemp(prefix=f'bench_suite_{nom}_')
+    demandes = [
+        ecrire_demande(generer_demande(alea, numero, pages=parametres['pages'], echelle=parametres['echelle']), dossier)
+        for numero in range(args.demandes)
+    ]
+    # Contenu des fichiers et champs texte: ordre de grandeur du corps des requêtes
+    octets_televerses = sum(
+        sum(len(str(v)) for v in data.values()) + sum(os.path.getsize(f[1]) for f in fichiers)
+        for data, fichiers in demandes
+    )
+    nb_pieces = [len(fichiers) for _, fichiers in demandes]
+
+    puits.reinitialiser()
+    avant = releve_metriques()
+    with ObservateurRSS() as rss, ThreadPoolExecutor(max_workers=args.concurrence) as executor:
+        debut = time.perf_counter()
+        resultats = list(executor.map(lambda d: envoyer(application, d[0], d[1], args.mode), demandes))
+        duree = time.perf_counter() - debut
+    apres = releve_metriques()
+    shutil.rmtree(dossier, ignore_errors=True)
+
+    latences = sorted(latence for latence, _ in resultats)
+    durees_etapes = difference(avant, apres, 'duree')
+    appels_etapes = difference(avant, apres, 'appels')
+
+    return {
+        'scenario': nom,
+        'demandes': args.demandes,
+        'pieces_par_demande': round(statistics.mean(nb_pieces), 1),
+        'echecs': sum(1 for _, ok in resultats if not ok),
+        'duree_s': round(duree, 3),
+        'debit_demandes_s': round(args.demandes / duree, 3),
+        'latence_s': {
+            'p50': round(statistics.median(latences), 3),
+            'p95': round(latences[min(len(latences) - 1, int(len(latences) * 0.95))], 3),
+            'max': round(latences[-1], 3),
+        },
+        'rss_mo': {
+            'maximum': round(rss.maximum / 1024 / 1024, 1),
+            'hausse': round((rss.maximum - rss.base) / 1024 / 1024, 1),
+        },
+        'octets': {
+            'televersement': octets_televerses,
+            **{f"smtp_{type_envoi}": int(octets) for type_envoi, octets in difference(avant, apres, 'octets').items()},
+            'puits_smtp': puits.compteurs['octets'],
+        },
+        'smtp': {'messages': puits.compteurs['messages'], 'connexions': puits.compteurs['connexions']},
+        'etapes': {
+            etape: {'appels': int(appels_etapes.get(etape, 0)), 'total_s': round(total, 4)}
+            for etape, total in sorted(durees_etapes.items())
+        },
+    }
+
+
+def afficher(resultat):
+    octets = resultat['octets']
+    print(f"{resultat['scenario']:<11} {resultat['demandes']:>4} {resultat['pieces_par_demande']:>7} "
+          f"{resultat['debit_demandes_s']:>7.2f} {resultat['latence_s']['p50']:>7.2f}s {resultat['latence_s']['p95']:>7.2f}s "
+          f"{resultat['rss_mo']['maximum']:>7.0f} {octets['televersement'] / 1e6:>8.1f} {octets['puits_smtp'] / 1e6:>8.1f} "
+          f"{resultat['smtp']['messages']:>5} {resultat['echecs']:>6}")
+    etapes = ', '.join(f"{etape} {valeurs['total_s']:.2f}s" for etape, valeurs in resultat['etapes'].items())
+    print(f"{'':<11} étapes: {etapes}")
+
+
+def comparer(precedent, scenarios):
+    """Variation des indicateurs principaux par rapport à une exécution enregistrée"""
+
+    anciens = {r['scenario']: r for r in precedent['scenarios']}
+    print(f"\nComparaison avec {precedent.get('commit') or '?'} ({precedent.get('date')}):")
+    indicateurs = [
+        ('débit', lambda r: r['debit_demandes_s']),
+        ('p50', lambda r: r['latence_s']['p50']),
+        ('p95', lambda r: r['latence_s']['p95']),
+        ('RSS max', lambda r: r['rss_mo']['maximum']),
+        ('octets SMTP', lambda r: r['octets']['puits_smtp']),
+    ]
+    for resultat in scenarios:
+        ancien = anciens.get(resultat['scenario'])
+        if ancien is None:
+            continue
+        variations = []
+        for libelle, valeur in indicateurs:
+            a, n = valeur(ancien), valeur(resultat)
+            variations.append(f"{libelle} {a:g} → {n:g}" + (f" ({(n - a) / a:+.0%})" if a else ''))
+        print(f"  {resultat['scenario']:<11} " + ', '.join(variations))
+
+
+def commit_courant():
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], cwd=RACINE, capture_output=True,
+                              text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--scenarios', default=','.join(SCENARIOS), help="scénarios à exécuter (liste)")
+    parser.add_argument('--demandes', type=int, default=8, help="demandes par scénario")
+    parser.add_argument('--concurrence', type=int, default=2, help="demandes simultanées")
+    parser.add_argument('--delai', type=float, default=0, help="DELAI_ENTRE_ENVOIS (s) entre deux emails ZeenDoc")
+    parser.add_argument('--latence-smtp', type=float, default=0, help="temps d'acceptation d'un message par le puits (s)")
+    parser.add_argument('--mode', choices=('direct', 'file'), default='direct',
+                        help="direct: réponse après les envois, file: file d'envois en arrière-plan")
+    parser.add_argument('--optimisation', action='store_true', help="active l'optimisation des photos et PDF")
+    parser.add_argument('--graine', type=int, default=42)
+    parser.add_argument('--sortie', help="fichier JSON des résultats")
+    parser.add_argument('--comparer', help="fichier JSON d'une exécution précédente")
+    args = parser.parse_args()
+
+    inconnus = set(args.scenarios.split(',')) - set(SCENARIOS)
+    if inconnus:
+        parser.error(f"scénario(s) inconnu(s): {', '.join(sorted(inconnus))}")
+
+    with PuitsSMTP(latence_message=args.latence_smtp) as puits:
+        # Configuration lue à l'import de l'application
+        os.environ.pop('PROMETHEUS_MULTIPROC_DIR', None)
+        os.environ.update({
+            'SMTP_SERVER': puits.hote, 'SMTP_PORT': str(puits.port), 'SMTP_USERNAME': 'bench@example.com',
+            'SMTP_PASSWORD': 'secret', 'SMTP_STARTTLS': '0',
+            'ENVOI_ASYNCHRONE': '1' if args.mode == 'file' else '0',
+            'DELAI_ENTRE_ENVOIS': f"{args.delai:g}",
+            'OPTIMISATION_DOCUMENTS': '1' if args.optimisation else '0',
+            'FENETRE_DEDUPLICATION_HEURES': '0',
+            'DOSSIER_DONNEES': tempfile.mkdtemp(prefix='bench_suite_'),
+            # Journal de l'application (une ligne par étape): avertissements et erreurs seulement
+            'NIVEAU_JOURNAL': os.environ.get('NIVEAU_JOURNAL', 'WARNING'),
+        })
+        import app
+
+        print(f"Mode {args.mode}, délai ZeenDoc {args.delai:g}s, relais {args.latence_smtp:g}s par message, "
+              f"{args.demandes} demandes par scénario, {args.concurrence} à la fois")
+        print(f"{'scénario':<11} {'dem.':>4} {'pièces':>7} {'req/s':>7} {'p50':>8} {'p95':>8} "
+              f"{'RSS Mo':>7} {'envoi Mo':>8} {'SMTP Mo':>8} {'msgs':>5} {'échecs':>6}")
+
+        scenarios = []
+        for nom in args.scenarios.split(','):
+            resultat = executer_scenario(app.app, puits, nom, SCENARIOS[nom], args)
+            afficher(resultat)
+            scenarios.append(resultat)
+
+    execution = {
+        'date': datetime.now().isoformat(timespec='seconds'),
+        'commit': commit_courant(),
+        'machine': {'python': platform.python_version(), 'plateforme': platform.platform(), 'cpu': os.cpu_count()},
+        'parametres': vars(args),
+        'scenarios': scenarios,
+    }
+    if args.sortie:
+        with open(args.sortie, 'w', encoding='utf-8') as sortie:
+            json.dump(execution, sortie, ensure_ascii=False, indent=2)
+        print(f"\nRésultats écrits dans {args.sortie}")
+
+    if args.comparer:
+        with open(args.comparer, encoding='utf-8') as fichier:
+            comparer(json.load(fichier), scenarios)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,180 @@
+import fcntl
+import os
+import shutil
+import sqlite3
+import threading
+import time
+from contextlib import closing, contextmanager
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS contenus (
+    sha256 TEXT PRIMARY KEY,
+    taille INTEGER NOT NULL,
+    dernier_acces REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS idx_contenus_acces ON contenus (dernier_acces);
+CREATE TABLE IF NOT EXISTS depots (
+    destinataire TEXT NOT NULL,
+    sha256 TEXT NOT NULL,
+    nom TEXT NOT NULL,
+    depose_le REAL NOT NULL,
+    PRIMARY KEY (destinataire, sha256)
+);
+"""
+
+
+def _connexion(chemin_base):
+    conn = sqlite3.connect(chemin_base, timeout=30, isolation_level=None)
+    conn.row_factory = sqlite3.Row
+    conn.execute('PRAGMA journal_mode=WAL')
+    return conn
+
+
+def initialiser_base(chemin_base):
+    os.makedirs(os.path.dirname(os.path.abspath(chemin_base)), exist_ok=True)
+    with closing(_connexion(chemin_base)) as conn:
+        conn.executescript(SCHEMA)
+
+
+def lier_ou_copier(source, destination):
+    """Lien physique (aucune copie de données) ou copie si le système de fichiers le refuse"""
+
+    try:
+        os.link(source, destination)
+    except OSError:
+        shutil.copyfile(source, destination)
+
+
+class StockContenu:
+    """Stockage local adressé par SHA-256 avec éviction LRU au-delà de `taille_max` octets.
+
+    Les demandes ne référencent jamais directement un fichier du stock: elles
+    en reçoivent un lien physique dans leur propre dossier, créé par
+    `stocker_plusieurs` sous le verrou du stock (threads et processus), si
+    bien qu'une éviction ne retire jamais un fichier en cours d'envoi.
+    """
+
+    def __init__(self, dossier, chemin_base, taille_max):
+        self.dossier = dossier
+        self.chemin_base = chemin_base
+        self.taille_max = taille_max
+        self._verrou = threading.Lock()
+        os.makedirs(dossier, exist_ok=True)
+        self._chemin_verrou = os.path.join(dossier, '.verrou')
+        initialiser_base(chemin_base)
+
+    def chemin(self, sha256):
+        return os.path.join(self.dossier, sha256[:2], sha256)
+
+    @contextmanager
+    def _verrouiller(self):
+        # Verrou du processus (threads) puis verrou de fichier (workers gunicorn, autres processus)
+        with self._verrou, open(self._chemin_verrou, 'a') as fichier_verrou:
+            fcntl.flock(fichier_verrou, fcntl.LOCK_EX)
+            yield
+
+    def stocker(self, chemin_source, sha256, taille, lien):
+        """Range le fichier dans le stock (ou l'écarte s'il y est déjà) et le lie en `lien`, retourne (chemin, déjà présent)"""
+
+        return self.stocker_plusieurs([(chemin_source, sha256, taille)], [lien])[0]
+
+    def stocker_plusieurs(self, elements, liens):
+        """Comme `stocker` pour une liste de (chemin source, SHA-256, taille) et leurs liens, en une transaction.
+
+        Les liens sont créés avant de rendre le verrou: aucune éviction (de ce
+        processus ou d'un autre) ne peut retirer un contenu entre son stockage
+        et son lien. L'éviction n'a lieu qu'ensuite. Une demande de plusieurs
+        dizaines de pièces ne coûte qu'une connexion et une vérification de la
+        taille du stock, au lieu d'une par pièce.
+        """
+
+        resultats = []
+        nouveau = False
+        with self._verrouiller(), closing(_connexion(self.chemin_base)) as conn:
+            maintenant = time.time()
+            for (chemin_source, sha256, taille), lien in zip(elements, liens, strict=True):
+                destination = self.chemin(sha256)
+                os.makedirs(os.path.dirname(destination), exist_ok=True)
+
+                deja_present = os.path.exists(destination)
+                if deja_present:
+                    os.remove(chemin_source)
+                else:
+                    os.replace(chemin_source, destination)
+                    nouveau = True
+                lier_ou_copier(destination, lien)
+                resultats.append((destination, deja_present))
+
+            conn.executemany(
+                """INSERT INTO contenus (sha256, taille, dernier_acces) VALUES (?, ?, ?)
+                   ON CONFLICT (sha256) DO UPDATE SET dernier_acces = excluded.dernier_acces""",
+                [(sha256, taille, maintenant) for _, sha256, taille in elements]
+            )
+
+        if nouveau:
+            self.evincer()
+        return resultats
+
+    def evincer(self):
+        """Supprime les contenus les moins récemment utilisés tant que le stock dépasse sa taille"""
+
+        with self._verrouiller(), closing(_connexion(self.chemin_base)) as conn:
+            total = conn.execute("SELECT COALESCE(SUM(taille), 0) FROM contenus").fetchone()[0]
+            if total <= self.taille_max:
+                return
+
+            for ligne in conn.execute("SELECT sha256, taille FROM contenus ORDER BY dernier_acces").fetchall():
+                if total <= self.taille_max:
+                    break
+                try:
+                    os.remove(self.chemin(ligne['sha256']))
+                except FileNotFoundError:
+                    pass
+                conn.execute("DELETE FROM contenus WHERE sha256 = ?", (ligne['sha256'],))
+                total -= ligne['taille']
+
+
+class IndexDepots:
+    """Mémorise quels contenus ont déjà été déposés à quelle adresse, et quand"""
+
+    def __init__(self, chemin_base):
+        self.chemin_base = chemin_base
+        initialiser_base(chemin_base)
+
+    def enregistrer(self, destinataire, sha256, nom):
+        with closing(_connexion(self.chemin_base)) as conn:
+            conn.execute(
+                """INSERT INTO depots (destinataire, sha256, nom, depose_le) VALUES (?, ?, ?, ?)
+                   ON CONFLICT (destinataire, sha256) DO UPDATE SET
+                   nom = excluded.nom, depose_le = excluded.depose_le""",
+                (destinataire, sha256, nom, time.time())
+            )
+
+    def rechercher(self, destinataire, sha256, fenetre_secondes):
+        """Dépôt de ce contenu à cette adresse depuis moins de `fenetre_secondes`, ou None"""
+
+        with closing(_connexion(self.chemin_base)) as conn:
+            ligne = conn.execute(
+                "SELECT nom, depose_le FROM depots WHERE destinataire = ? AND sha256 = ? AND depose_le >= ?",
+                (destinataire, sha256, time.time() - fenetre_secondes)
+            ).fetchone()
+
+        return dict(ligne) if ligne else None
+
+    def rechercher_plusieurs(self, destinataire, empreintes, fenetre_secondes):
+        """Comme `rechercher` pour plusieurs contenus en une requête: {sha256: dépôt} des contenus trouvés"""
+
+        empreintes = list(set(empreintes))
+        depots = {}
+        with closing(_connexion(self.chemin_base)) as conn:
+            # Par paquets: nombre de paramètres d'une requête SQLite limité
+            for debut in range(0, len(empreintes), 500):
+                paquet = empreintes[debut:debut + 500]
+                for ligne in conn.execute(
+                    f"""SELECT sha256, nom, depose_le FROM depots
+                        WHERE destinataire = ? AND depose_le >= ? AND sha256 IN ({', '.join('?' * len(paquet))})""",
+                    (destinataire, time.time() - fenetre_secondes, *paquet)
+                ):
+                    depots[ligne['sha256']] = {'nom': ligne['nom'], 'depose_le': ligne['depose_le']}
+
+        return depots
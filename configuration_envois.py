@@ -0,0 +1,230 @@
+import copy
+import hashlib
+import json
+import logging
+import os
+import threading
+import time
+from types import MappingProxyType
+
+journal = logging.getLogger('formulaire.configuration')
+
+# Réglages valables pour tous les secteurs, chacun surchargeable dans "secteurs"
+REGLAGES_GENERAUX = {
+    # Email principal (gestion) et copie de suivi des dépôts ZeenDoc
+    'destinataire': str,
+    # Taille maximale d'un email: au-delà, archive ZIP (principal) ou plusieurs parties (ZeenDoc)
+    'limite_email_mo': (int, float),
+    'max_emails_par_demande': int,
+    # Débit vers l'adresse ZeenDoc du secteur (0 = sans limite)
+    'debit_zeendoc_par_minute': (int, float),
+}
+REGLAGES_SECTEUR = dict(REGLAGES_GENERAUX, adresse_zeendoc=str)
+
+
+class ReglagesSecteur:
+    """Réglages d'envoi d'un secteur (valeurs générales complétées par ses surcharges), en lecture seule"""
+
+    __slots__ = ('secteur',) + tuple(REGLAGES_SECTEUR)
+
+    def __init__(self, secteur, valeurs):
+        object.__setattr__(self, 'secteur', secteur)
+        for cle in REGLAGES_SECTEUR:
+            object.__setattr__(self, cle, valeurs.get(cle))
+
+    def __setattr__(self, nom, valeur):
+        raise AttributeError("Réglages en lecture seule: modifier le fichier de configuration")
+
+    def en_dict(self):
+        return {cle: getattr(self, cle) for cle in self.__slots__}
+
+
+def _erreurs_reglages(valeurs, autorises, origine):
+    erreurs = [f"{origine}: réglage inconnu « {cle} »" for cle in valeurs if cle not in autorises]
+    for cle, types_acceptes in autorises.items():
+        if cle not in valeurs:
+            continue
+        valeur = valeurs[cle]
+        if isinstance(valeur, bool) or not isinstance(valeur, types_acceptes):
+            erreurs.append(f"{origine}: « {cle} » de type invalide ({valeur!r})")
+        elif types_acceptes is str and '@' not in valeur:
+            erreurs.append(f"{origine}: « {cle} » n'est pas une adresse email ({valeur!r})")
+        elif types_acceptes is not str and (valeur < 0 or (valeur == 0 and cle != 'debit_zeendoc_par_minute')):
+            erreurs.append(f"{origine}: « {cle} » doit être positif ({valeur!r})")
+    return erreurs
+
+
+class ConfigurationEnvois:
+    """Instantané du routage et des limites d'envoi par secteur, construit une fois et jamais modifié.
+
+    `contenu` a la forme du fichier de configuration: réglages généraux
+    (REGLAGES_GENERAUX), "secteur_par_defaut" et "secteurs" ({secteur:
+    {"adresse_zeendoc": ..., surcharges}}). Les réglages de chaque secteur
+    sont résolus à la construction: `reglages` n'est qu'une recherche de
+    dictionnaire. Lève ValueError avec toutes les erreurs détectées.
+    """
+
+    def __init__(self, contenu, source=None):
+        self.source = source
+
+        if not isinstance(contenu, dict):
+            raise ValueError("La configuration doit être un objet JSON")
+        secteurs = contenu.get('secteurs')
+        if not isinstance(secteurs, dict) or not secteurs:
+            raise ValueError("« secteurs » doit associer au moins un secteur à ses réglages")
+
+        generaux = {cle: valeur for cle, valeur in contenu.items() if cle not in ('secteurs', 'secteur_par_defaut')}
+        erreurs = _erreurs_reglages(generaux, REGLAGES_GENERAUX, "Réglages généraux")
+        erreurs += [f"Réglages généraux: « {cle} » manquant" for cle in REGLAGES_GENERAUX if cle not in generaux]
+
+        for secteur, surcharges in secteurs.items():
+            if not isinstance(surcharges, dict):
+                erreurs.append(f"Secteur « {secteur} »: réglages attendus sous forme d'objet")
+                continue
+            erreurs += _erreurs_reglages(surcharges, REGLAGES_SECTEUR, f"Secteur « {secteur} »")
+            if 'adresse_zeendoc' not in surcharges:
+                erreurs.append(f"Secteur « {secteur} »: « adresse_zeendoc » manquant")
+
+        self.secteur_par_defaut = contenu.get('secteur_par_defaut') or next(iter(secteurs))
+        if not isinstance(self.secteur_par_defaut, str) or self.secteur_par_defaut not in secteurs:
+            erreurs.append(f"Secteur par défaut « {self.secteur_par_defaut} » absent des secteurs")
+        if erreurs:
+            raise ValueError("; ".join(erreurs))
+
+        self.generaux = ReglagesSecteur(None, generaux)
+        self._secteurs = MappingProxyType({
+            secteur: ReglagesSecteur(secteur, {**generaux, **surcharges}) for secteur, surcharges in secteurs.items()
+        })
+
+        # Une adresse partagée par plusieurs secteurs n'a qu'un seau à jetons: un seul débit possible
+        debits = {}
+        for reglages in self._secteurs.values():
+            debits.setdefault(reglages.adresse_zeendoc, {})[reglages.secteur] = reglages.debit_zeendoc_par_minute
+        for adresse, par_secteur in debits.items():
+            if len(set(par_secteur.values())) > 1:
+                raise ValueError(
+                    f"Secteurs {', '.join(par_secteur)}: même adresse ZeenDoc ({adresse}) mais débits différents"
+                )
+
+        self.adresses_zeendoc = MappingProxyType({s: r.adresse_zeendoc for s, r in self._secteurs.items()})
+
+        # Réponse de /secteurs (noms seulement, pas les adresses), sérialisée une seule fois
+        self.contenu_json = json.dumps(
+            {'secteurs': list(self._secteurs), 'secteur_par_defaut': self.secteur_par_defaut}, ensure_ascii=False
+        ).encode('utf-8')
+        self.empreinte = hashlib.sha256(json.dumps(
+            {'generaux': self.generaux.en_dict(), 'secteurs': {s: r.en_dict() for s, r in self._secteurs.items()}},
+            ensure_ascii=False, sort_keys=True
+        ).encode('utf-8')).hexdigest()[:12]
+        self.etag = hashlib.sha256(self.contenu_json).hexdigest()[:32]
+
+    @property
+    def secteurs(self):
+        return tuple(self._secteurs)
+
+    def connait(self, secteur):
+        return secteur in self._secteurs
+
+    def reglages(self, secteur):
+        """Réglages du secteur, ceux du secteur par défaut pour un secteur inconnu"""
+
+        return self._secteurs.get(secteur) or self._secteurs[self.secteur_par_defaut]
+
+
+def fusionner_configuration(defauts, fichier):
+    """Contenu du fichier sur les valeurs par défaut: réglages généraux un à un, "secteurs" remplacés en entier"""
+
+    contenu = copy.deepcopy(defauts)
+    contenu.update(copy.deepcopy(fichier))
+    if 'secteurs' in fichier and 'secteur_par_defaut' not in fichier and contenu.get('secteur_par_defaut') not in fichier['secteurs']:
+        # Secteur par défaut de l'environnement absent de la nouvelle liste: le premier du fichier
+        contenu.pop('secteur_par_defaut', None)
+    return contenu
+
+
+class ConfigurationRechargeable:
+    """Configuration des envois relue à chaud depuis `chemin` (JSON), sur `defauts` (variables d'environnement).
+
+    `actuelle()` retourne l'instantané en cours: au plus une fois tous les
+    `delai_verification` secondes, un stat() du fichier (date, taille, inode)
+    décide d'une relecture. La nouvelle configuration est entièrement
+    construite et validée avant de remplacer l'ancienne (une seule
+    affectation): une requête voit l'ancienne ou la nouvelle, jamais un
+    mélange. Un fichier invalide est signalé au journal et l'instantané
+    précédent reste en service ; au démarrage, il lève ValueError.
+
+    Sans fichier, la configuration est celle des variables d'environnement.
+    `demander_rechargement` (SIGHUP) relit le fichier sans attendre.
+    """
+
+    def __init__(self, chemin, defauts, delai_verification=5):
+        self.chemin = chemin
+        self.defauts = defauts
+        self.delai_verification = delai_verification
+
+        self._verrou = threading.Lock()
+        self._signature = self._signature_fichier()
+        self._configuration = self._lire()
+        self._prochaine_verification = time.monotonic() + delai_verification
+        journal.info("Configuration des envois chargée (%s, %s): secteurs %s", self._configuration.source,
+                     self._configuration.empreinte, ', '.join(self._configuration.secteurs))
+
+    def actuelle(self):
+        if time.monotonic() >= self._prochaine_verification:
+            self._verifier()
+        return self._configuration
+
+    def _signature_fichier(self):
+        try:
+            etat = os.stat(self.chemin)
+        except (OSError, TypeError):
+            return None
+        return etat.st_mtime_ns, etat.st_size, etat.st_ino
+
+    def _lire(self):
+        if self._signature is None:
+            return ConfigurationEnvois(self.defauts, source='environnement')
+        with open(self.chemin, encoding='utf-8') as f:
+            fichier = json.load(f)
+        if not isinstance(fichier, dict):
+            raise ValueError(f"{self.chemin}: la configuration doit être un objet JSON")
+        return ConfigurationEnvois(fusionner_configuration(self.defauts, fichier), source=self.chemin)
+
+    def _verifier(self):
+        # Une seule vérification à la fois: les autres requêtes gardent l'instantané en cours
+        if not self._verrou.acquire(blocking=False):
+            return
+        try:
+            self._prochaine_verification = time.monotonic() + self.delai_verification
+            signature = self._signature_fichier()
+            if signature != self._signature:
+                self._recharger(signature)
+        finally:
+            self._verrou.release()
+
+    def _recharger(self, signature):
+        # Signature retenue même en cas d'erreur: un fichier invalide n'est relu qu'une fois modifié
+        self._signature = signature
+        try:
+            configuration = self._lire()
+        except (OSError, ValueError) as e:
+            journal.error("Configuration des envois non rechargée, la précédente (%s) reste en service: %s",
+                          self._configuration.empreinte, e)
+            return False
+
+        ancienne, self._configuration = self._configuration, configuration
+        journal.warning("Configuration des envois rechargée (%s, %s → %s): secteurs %s", configuration.source,
+                        ancienne.empreinte, configuration.empreinte, ', '.join(configuration.secteurs))
+        return True
+
+    def recharger(self):
+        """Relit le fichier sans attendre, retourne False s'il est invalide (configuration précédente conservée)"""
+
+        with self._verrou:
+            self._prochaine_verification = time.monotonic() + self.delai_verification
+            return self._recharger(self._signature_fichier())
+
+    def demander_rechargement(self, signum=None, frame=None):
+        """Gestionnaire de SIGHUP: relecture dans un thread, le signal peut interrompre un thread qui tient le verrou"""
+
+        threading.Thread(target=self.recharger, name='rechargement-configuration', daemon=True).start()
@@ -0,0 +1,393 @@
+import json
+import logging
+import os
+import sqlite3
+import threading
+import time
+import uuid
+from contextlib import closing
+from datetime import datetime
+
+from journal import contexte_journal
+
+# États possibles d'une demande dans la file
+STATUT_EN_ATTENTE = 'en_attente'
+STATUT_EN_COURS = 'en_cours'
+STATUT_TERMINE = 'termine'
+STATUT_ECHEC = 'echec'
+
+journal = logging.getLogger('formulaire.file_attente')
+
+# Purge des demandes terminées ou en échec: au plus une fois par heure et par processus
+INTERVALLE_PURGE = 3600
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS demandes (
+    id TEXT PRIMARY KEY,
+    statut TEXT NOT NULL,
+    payload TEXT NOT NULL,
+    resultat TEXT,
+    erreur TEXT,
+    tentatives INTEGER NOT NULL DEFAULT 0,
+    bail_jusqu_a REAL,
+    cree_le REAL NOT NULL,
+    maj_le REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS idx_demandes_statut ON demandes (statut, cree_le);
+CREATE TABLE IF NOT EXISTS parties (
+    demande_id TEXT NOT NULL,
+    partie TEXT NOT NULL,
+    ordre INTEGER NOT NULL,
+    statut TEXT NOT NULL,
+    details TEXT,
+    maj_le REAL NOT NULL,
+    PRIMARY KEY (demande_id, partie)
+);
+"""
+
+
+class FileAttenteEnvois:
+    """File d'attente durable (SQLite) traitée par des threads en arrière-plan.
+
+    Chaque processus (worker gunicorn) démarre ses propres threads ; la
+    réservation d'une demande passe par une transaction SQLite, donc une
+    demande n'est traitée que par un seul thread à la fois. Une demande dont
+    le bail expire (processus tué en plein envoi) est reprise par un autre
+    thread, dans la limite de `max_tentatives`.
+
+    À l'arrêt du processus (`arreter`), les threads ne réservent plus de
+    nouvelle demande et terminent celle qu'ils envoient: les demandes en
+    attente restent en file pour les autres processus.
+
+    Les demandes terminées ou en échec sont supprimées `duree_conservation`
+    secondes après leur dernière mise à jour (None: conservées), avec leurs
+    parties; `liberer(payload)` rend alors ce qu'elles occupaient encore
+    (fichiers gardés pour une reprise qui n'a jamais eu lieu).
+    """
+
+    def __init__(self, chemin_base, traiter, nb_workers=2, duree_bail=600,
+                 delai_scrutation=1.0, max_tentatives=3, duree_conservation=None, liberer=None):
+        self.chemin_base = chemin_base
+        self.traiter = traiter
+        self.nb_workers = nb_workers
+        self.duree_bail = duree_bail
+        self.delai_scrutation = delai_scrutation
+        self.max_tentatives = max_tentatives
+        self.duree_conservation = duree_conservation
+        self.liberer = liberer
+
+        self._verrou = threading.Lock()
+        self._reveil = threading.Event()
+        self._arret = threading.Event()
+        self._threads = []
+        self._pid = None
+        self._prochaine_purge = 0.0
+
+        os.makedirs(os.path.dirname(os.path.abspath(chemin_base)), exist_ok=True)
+        with closing(self._connexion()) as conn:
+            conn.executescript(SCHEMA)
+
+    def _connexion(self):
+        conn = sqlite3.connect(self.chemin_base, timeout=30, isolation_level=None)
+        conn.row_factory = sqlite3.Row
+        conn.execute('PRAGMA journal_mode=WAL')
+        return conn
+
+    def demarrer(self):
+        """Démarre les threads de traitement (une fois par processus)"""
+
+        with self._verrou:
+            # Après un fork, les threads du parent n'existent plus
+            if self._pid == os.getpid():
+                return
+            self._pid = os.getpid()
+            self._arret.clear()
+            self._threads = []
+            for numero in range(self.nb_workers):
+                thread = threading.Thread(
+                    target=self._boucle_worker,
+                    name=f"file-envois-{numero}",
+                    daemon=True
+                )
+                thread.start()
+                self._threads.append(thread)
+
+        journal.info("File d'envois: %d worker(s) démarré(s) (pid %d)", self.nb_workers, self._pid)
+
+    def ajouter(self, payload):
+        """Enregistre une nouvelle demande et retourne son identifiant"""
+
+        demande_id = uuid.uuid4().hex
+        maintenant = time.time()
+
+        with closing(self._connexion()) as conn:
+            conn.execute(
+                "INSERT INTO demandes (id, statut, payload, cree_le, maj_le) VALUES (?, ?, ?, ?, ?)",
+                (demande_id, STATUT_EN_ATTENTE, json.dumps(payload), maintenant, maintenant)
+            )
+
+        self.demarrer()
+        self._reveil.set()
+        return demande_id
+
+    def _reserver_prochaine(self):
+        """Réserve la prochaine demande à traiter (ou une demande au bail expiré)"""
+
+        maintenant = time.time()
+        conn = self._connexion()
+        try:
+            conn.execute('BEGIN IMMEDIATE')
+            ligne = conn.execute(
+                """SELECT id, payload, tentatives FROM demandes
+                   WHERE statut = ? OR (statut = ? AND bail_jusqu_a < ?)
+                   ORDER BY cree_le LIMIT 1""",
+                (STATUT_EN_ATTENTE, STATUT_EN_COURS, maintenant)
+            ).fetchone()
+
+            if ligne is None:
+                conn.execute('COMMIT')
+                return None
+
+            if ligne['tentatives'] >= self.max_tentatives:
+                conn.execute(
+                    "UPDATE demandes SET statut = ?, erreur = ?, maj_le = ? WHERE id = ?",
+                    (STATUT_ECHEC, "Nombre maximal de tentatives atteint", maintenant, ligne['id'])
+                )
+                conn.execute('COMMIT')
+                return self._reserver_prochaine()
+
+            conn.execute(
+                """UPDATE demandes SET statut = ?, tentatives = tentatives + 1,
+                   bail_jusqu_a = ?, maj_le = ? WHERE id = ?""",
+                (STATUT_EN_COURS, maintenant + self.duree_bail, maintenant, ligne['id'])
+            )
+            conn.execute('COMMIT')
+            return ligne['id'], json.loads(ligne['payload'])
+        except Exception:
+            # Transaction peut-être déjà close (erreur après COMMIT): c'est l'erreur d'origine qui compte
+            try:
+                conn.execute('ROLLBACK')
+            except sqlite3.Error:
+                pass
+            raise
+        finally:
+            conn.close()
+
+    def demander_arret(self):
+        """Plus aucune nouvelle demande réservée par ce processus (sans attendre, appelable depuis un signal)"""
+
+        self._arret.set()
+        self._reveil.set()
+
+    @property
+    def en_arret(self):
+        return self._arret.is_set()
+
+    def arreter(self, delai):
+        """Arrête les threads après la demande en cours d'envoi, au plus `delai` secondes.
+
+        Retourne le nombre de threads encore occupés au terme du délai: leurs
+        demandes seront reprises par un autre processus à l'expiration du bail.
+        """
+
+        self.demander_arret()
+        if self._pid != os.getpid():
+            return 0
+
+        echeance = time.monotonic() + delai
+        for thread in self._threads:
+            thread.join(max(0, echeance - time.monotonic()))
+
+        occupes = sum(thread.is_alive() for thread in self._threads)
+        if occupes:
+            journal.warning("File d'envois: %d envoi(s) interrompu(s) par l'arrêt, repris après le bail", occupes)
+        else:
+            journal.info("File d'envois: threads arrêtés (pid %d)", self._pid)
+        return occupes
+
+    def _boucle_worker(self):
+        while not self._arret.is_set():
+            try:
+                reservation = self._reserver_prochaine()
+            except sqlite3.Error as e:
+                journal.error("File d'envois: erreur SQLite: %s", e)
+                reservation = None
+
+            if reservation is None:
+                self._purger_si_necessaire()
+                self._reveil.wait(self.delai_scrutation)
+                if not self._arret.is_set():
+                    self._reveil.clear()
+                continue
+
+            demande_id, payload = reservation
+            # Même identifiant de corrélation que la requête qui a mis la demande en file
+            with contexte_journal(correlation_id=payload.get('correlation_id') or demande_id,
+                                  secteur=payload.get('secteur')):
+                journal.info("Traitement de la demande %s", demande_id, extra={'demande_id': demande_id})
+
+                try:
+                    resultat = self.traiter(demande_id, payload)
+                    statut = STATUT_TERMINE if resultat.get('envoi_auto') else STATUT_ECHEC
+                    self.terminer(demande_id, statut, resultat=resultat)
+                except Exception as e:
+                    journal.exception("Erreur traitement demande %s: %s", demande_id, e,
+                                      extra={'demande_id': demande_id})
+                    self.terminer(demande_id, STATUT_ECHEC, erreur=str(e))
+
+    def _purger_si_necessaire(self):
+        # Threads inactifs seulement: la purge ne retarde jamais un envoi
+        if self.duree_conservation is None:
+            return
+        with self._verrou:
+            if time.monotonic() < self._prochaine_purge:
+                return
+            self._prochaine_purge = time.monotonic() + INTERVALLE_PURGE
+        try:
+            self.purger()
+        except (sqlite3.Error, OSError) as e:
+            journal.error("File d'envois: purge impossible: %s", e)
+
+    def purger(self):
+        """Supprime les demandes terminées ou en échec depuis plus de `duree_conservation` secondes, retourne leur nombre"""
+
+        limite = time.time() - self.duree_conservation
+        with closing(self._connexion()) as conn:
+            # Lues et supprimées dans la même transaction: une demande reprise entre-temps n'est pas touchée
+            conn.execute('BEGIN IMMEDIATE')
+            try:
+                lignes = conn.execute(
+                    "SELECT id, payload FROM demandes WHERE statut IN (?, ?) AND maj_le < ?",
+                    (STATUT_TERMINE, STATUT_ECHEC, limite)
+                ).fetchall()
+                identifiants = [(ligne['id'],) for ligne in lignes]
+                conn.executemany("DELETE FROM parties WHERE demande_id = ?", identifiants)
+                conn.executemany("DELETE FROM demandes WHERE id = ?", identifiants)
+                conn.execute('COMMIT')
+            except Exception:
+                try:
+                    conn.execute('ROLLBACK')
+                except sqlite3.Error:
+                    pass
+                raise
+
+        if self.liberer:
+            for ligne in lignes:
+                try:
+                    self.liberer(json.loads(ligne['payload']))
+                except (OSError, ValueError) as e:
+                    journal.warning("File d'envois: fichiers de la demande %s non libérés: %s", ligne['id'], e)
+        if lignes:
+            journal.info("File d'envois: %d demande(s) ancienne(s) purgée(s)", len(lignes))
+        return len(lignes)
+
+    def terminer(self, demande_id, statut, resultat=None, erreur=None):
+        with closing(self._connexion()) as conn:
+            conn.execute(
+                "UPDATE demandes SET statut = ?, resultat = ?, erreur = ?, maj_le = ? WHERE id = ?",
+                (statut, json.dumps(resultat) if resultat is not None else None,
+                 erreur, time.time(), demande_id)
+            )
+
+    def mettre_a_jour_partie(self, demande_id, partie, ordre, statut, **details):
+        """Enregistre la progression d'une partie et prolonge le bail de la demande"""
+
+        maintenant = time.time()
+        with closing(self._connexion()) as conn:
+            conn.execute(
+                """INSERT INTO parties (demande_id, partie, ordre, statut, details, maj_le)
+                   VALUES (?, ?, ?, ?, ?, ?)
+                   ON CONFLICT (demande_id, partie) DO UPDATE SET
+                   statut = excluded.statut, details = excluded.details, maj_le = excluded.maj_le""",
+                (demande_id, partie, ordre, statut, json.dumps(details), maintenant)
+            )
+            conn.execute(
+                "UPDATE demandes SET bail_jusqu_a = ?, maj_le = ? WHERE id = ? AND statut = ?",
+                (maintenant + self.duree_bail, maintenant, demande_id, STATUT_EN_COURS)
+            )
+
+    def obtenir_parties(self, demande_id):
+        """État enregistré de chaque partie: {partie: {'ordre', 'statut', **détails}}"""
+
+        with closing(self._connexion()) as conn:
+            parties = conn.execute(
+                "SELECT partie, ordre, statut, details FROM parties WHERE demande_id = ? ORDER BY ordre",
+                (demande_id,)
+            ).fetchall()
+
+        return {
+            p['partie']: {'ordre': p['ordre'], 'statut': p['statut'], **json.loads(p['details'] or '{}')}
+            for p in parties
+        }
+
+    def reprendre(self, demande_id):
+        """Remet en file une demande en échec, en conservant l'état de ses parties.
+
+        Retourne None si la demande est inconnue, False si elle n'est pas en échec.
+        """
+
+        with closing(self._connexion()) as conn:
+            curseur = conn.execute(
+                """UPDATE demandes SET statut = ?, tentatives = 0, resultat = NULL, erreur = NULL,
+                   bail_jusqu_a = NULL, maj_le = ? WHERE id = ? AND statut = ?""",
+                (STATUT_EN_ATTENTE, time.time(), demande_id, STATUT_ECHEC)
+            )
+            if curseur.rowcount == 0:
+                existe = conn.execute("SELECT 1 FROM demandes WHERE id = ?", (demande_id,)).fetchone()
+                return False if existe else None
+
+        self.demarrer()
+        self._reveil.set()
+        return True
+
+    def compter_actives(self):
+        """Nombre de demandes en attente et en cours d'envoi (tous processus confondus)"""
+
+        with closing(self._connexion()) as conn:
+            lignes = conn.execute(
+                "SELECT statut, COUNT(*) AS nombre FROM demandes WHERE statut IN (?, ?) GROUP BY statut",
+                (STATUT_EN_ATTENTE, STATUT_EN_COURS)
+            ).fetchall()
+
+        comptes = {STATUT_EN_ATTENTE: 0, STATUT_EN_COURS: 0}
+        comptes.update({ligne['statut']: ligne['nombre'] for ligne in lignes})
+        return comptes
+
+    def obtenir_statut(self, demande_id):
+        """Retourne l'état de la demande et de chacune de ses parties (None si inconnue)"""
+
+        with closing(self._connexion()) as conn:
+            demande = conn.execute(
+                "SELECT id, statut, resultat, erreur, tentatives, cree_le, maj_le FROM demandes WHERE id = ?",
+                (demande_id,)
+            ).fetchone()
+            if demande is None:
+                return None
+
+            parties = conn.execute(
+                "SELECT partie, statut, details, maj_le FROM parties WHERE demande_id = ? ORDER BY ordre",
+                (demande_id,)
+            ).fetchall()
+
+        return {
+            'demande_id': demande['id'],
+            'etat': demande['statut'],
+            'tentatives': demande['tentatives'],
+            'cree_le': formater_horodatage(demande['cree_le']),
+            'maj_le': formater_horodatage(demande['maj_le']),
+            'erreur': demande['erreur'],
+            'parties': [
+                {
+                    'partie': p['partie'],
+                    'statut': p['statut'],
+                    'maj_le': formater_horodatage(p['maj_le']),
+                    **json.loads(p['details'] or '{}')
+                }
+                for p in parties
+            ],
+            'resultat': json.loads(demande['resultat']) if demande['resultat'] else None
+        }
+
+
+def formater_horodatage(horodatage):
+    return datetime.fromtimestamp(horodatage).strftime('%d/%m/%Y %H:%M:%S')
@@ -0,0 +1,91 @@
+"""Configuration gunicorn pour la production (lue automatiquement depuis le dossier courant).
+
+Lancement: gunicorn app:app
+
+Workers à threads (gthread): les requêtes passent l'essentiel de leur temps
+à recevoir des fichiers et à attendre le serveur SMTP. L'application est
+chargée une fois dans le maître puis partagée par fork (preload): les
+threads (file d'envois, journal) et les pools (SMTP, optimisation) sont
+créés dans chaque worker après le fork.
+
+À l'arrêt (SIGTERM, redéploiement), chaque worker cesse d'accepter des
+connexions, termine les requêtes en cours et laisse aux envois de la file
+jusqu'à DELAI_ARRET secondes: un dossier n'est pas coupé au milieu de ses
+parties ZeenDoc.
+
+Le contrôle d'admission et le débit vers chaque adresse ZeenDoc sont
+partagés par tous les workers (bases SQLite dans DOSSIER_DONNEES): ils
+valent pour le serveur entier, quel que soit WEB_CONCURRENCY.
+
+La configuration des envois (CONFIGURATION_ENVOIS, cf. app.py) est relue par
+chaque worker dès que le fichier change, sans redémarrage. SIGHUP envoyé
+à un worker force sa relecture ; envoyé au maître, il redémarre les
+workers comme d'habitude avec gunicorn.
+
+Chaque worker a son pool d'optimisation des documents (PROCESSUS_OPTIMISATION,
+2 processus par défaut): workers × PROCESSUS_OPTIMISATION interpréteurs au plus.
+
+Variables: PORT, WEB_CONCURRENCY (workers, 2 par cœur + 1 par défaut),
+GUNICORN_THREADS (8), GUNICORN_TIMEOUT (300), DELAI_ARRET (90, cf. app.py).
+"""
+
+import multiprocessing
+import os
+import signal
+import time
+
+bind = f"0.0.0.0:{os.environ.get('PORT', '5000')}"
+worker_class = 'gthread'
+workers = int(os.environ.get('WEB_CONCURRENCY', multiprocessing.cpu_count() * 2 + 1))
+threads = int(os.environ.get('GUNICORN_THREADS', '8'))
+preload_app = True
+
+# Un envoi synchrone (ENVOI_ASYNCHRONE=0) de plusieurs parties ZeenDoc peut durer plusieurs minutes
+timeout = int(os.environ.get('GUNICORN_TIMEOUT', '300'))
+keepalive = 5
+# Le maître tue les workers au-delà: délai des envois en cours, plus une marge pour la fin du worker
+DELAI_ARRET = float(os.environ.get('DELAI_ARRET', '90'))
+graceful_timeout = int(DELAI_ARRET) + 10
+
+# Journal d'accès désactivé: l'application journalise ses requêtes (JSON, identifiant de corrélation)
+accesslog = None
+errorlog = '-'
+
+
+def post_worker_init(worker):
+    # SIGTERM: la file d'envois ne prend plus de nouvelle demande pendant que
+    # gunicorn termine les requêtes en cours (le gestionnaire de gunicorn est conservé)
+    from app import CONFIGURATION_ENVOIS, demander_arret
+
+    gestionnaire_gunicorn = signal.getsignal(signal.SIGTERM)
+
+    def arret(signum, frame):
+        worker.debut_arret = time.monotonic()
+        demander_arret()
+        gestionnaire_gunicorn(signum, frame)
+
+    signal.signal(signal.SIGTERM, arret)
+    signal.siginterrupt(signal.SIGTERM, False)
+
+    # SIGHUP (terminerait le worker par défaut): relecture de la configuration des envois
+    signal.signal(signal.SIGHUP, CONFIGURATION_ENVOIS.demander_rechargement)
+    signal.siginterrupt(signal.SIGHUP, False)
+
+
+def worker_exit(server, worker):
+    # Dans le worker, requêtes terminées: attente des envois de la file (le reste du
+    # délai compté depuis SIGTERM, les envois ont continué pendant les requêtes), puis fermeture des pools
+    from app import arreter_processus
+
+    ecoule = time.monotonic() - getattr(worker, 'debut_arret', time.monotonic())
+    arreter_processus(max(0, DELAI_ARRET - ecoule))
+
+
+def child_exit(server, worker):
+    # Dans le maître: métriques du worker retirées des jauges multiprocessus, réservations
+    # d'admission qu'il n'a pas rendues (tué au timeout) libérées pour les autres workers
+    from app import ADMISSION
+    from metriques import processus_termine
+
+    processus_termine(worker.pid)
+    ADMISSION.processus_termine(worker.pid)
@@ -0,0 +1,277 @@
+import base64
+import json
+import logging
+import os
+import queue
+import sqlite3
+import threading
+import time
+import unicodedata
+from contextlib import closing
+
+journal = logging.getLogger('formulaire.historique')
+
+# Enregistrements écrits dans une même transaction par le thread d'écriture
+TAILLE_LOT_ECRITURE = 200
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS envois (
+    id TEXT PRIMARY KEY,
+    horodatage REAL NOT NULL,
+    correlation_id TEXT,
+    client TEXT NOT NULL,
+    client_cle TEXT NOT NULL,
+    type_demande TEXT,
+    secteur TEXT,
+    adresse_zeendoc TEXT,
+    fichiers_count INTEGER NOT NULL,
+    taille_totale INTEGER NOT NULL,
+    taille_originale INTEGER NOT NULL,
+    deja_deposes INTEGER NOT NULL DEFAULT 0,
+    emails_zeendoc INTEGER NOT NULL DEFAULT 0,
+    email_principal INTEGER NOT NULL,
+    zeendoc_reussi INTEGER NOT NULL,
+    envoi_auto INTEGER NOT NULL,
+    duree REAL
+);
+CREATE INDEX IF NOT EXISTS idx_envois_horodatage ON envois (horodatage, id);
+CREATE INDEX IF NOT EXISTS idx_envois_secteur ON envois (secteur, horodatage, id);
+CREATE INDEX IF NOT EXISTS idx_envois_client ON envois (client_cle, horodatage, id);
+CREATE TABLE IF NOT EXISTS envois_parties (
+    envoi_id TEXT NOT NULL,
+    partie TEXT NOT NULL,
+    ordre INTEGER NOT NULL,
+    destinataire TEXT,
+    fichiers_count INTEGER NOT NULL,
+    taille INTEGER,
+    succes INTEGER NOT NULL,
+    deja_envoye INTEGER NOT NULL DEFAULT 0,
+    duree REAL,
+    erreur TEXT,
+    fichiers TEXT NOT NULL,
+    PRIMARY KEY (envoi_id, partie)
+) WITHOUT ROWID;
+"""
+
+COLONNES_ENVOI = (
+    'id', 'horodatage', 'correlation_id', 'client', 'client_cle', 'type_demande', 'secteur', 'adresse_zeendoc',
+    'fichiers_count', 'taille_totale', 'taille_originale', 'deja_deposes', 'emails_zeendoc',
+    'email_principal', 'zeendoc_reussi', 'envoi_auto', 'duree'
+)
+COLONNES_PARTIE = (
+    'envoi_id', 'partie', 'ordre', 'destinataire', 'fichiers_count', 'taille',
+    'succes', 'deja_envoye', 'duree', 'erreur', 'fichiers'
+)
+COLONNES_BOOLEENNES = {'email_principal', 'zeendoc_reussi', 'envoi_auto', 'succes', 'deja_envoye'}
+
+
+def normaliser_client(texte):
+    """Clé de recherche d'un client: minuscules, sans accents, espaces simples"""
+
+    decompose = unicodedata.normalize('NFKD', texte)
+    sans_accents = ''.join(c for c in decompose if not unicodedata.combining(c))
+    return ' '.join(sans_accents.lower().split())
+
+
+def encoder_curseur(ligne):
+    brut = json.dumps([ligne['horodatage'], ligne['id']]).encode('utf-8')
+    return base64.urlsafe_b64encode(brut).decode('ascii').rstrip('=')
+
+
+def decoder_curseur(curseur):
+    """Retourne (horodatage, id) du dernier envoi de la page précédente, ValueError si illisible"""
+
+    try:
+        brut = base64.urlsafe_b64decode(curseur + '=' * (-len(curseur) % 4))
+        horodatage, envoi_id = json.loads(brut)
+        return float(horodatage), str(envoi_id)
+    except (ValueError, TypeError) as e:
+        raise ValueError("Curseur de pagination invalide") from e
+
+
+def _en_dict(ligne):
+    return {cle: bool(ligne[cle]) if cle in COLONNES_BOOLEENNES else ligne[cle] for cle in ligne.keys()}
+
+
+class HistoriqueEnvois:
+    """Historique des demandes envoyées et de chacun de leurs emails (SQLite, tous processus).
+
+    `enregistrer` ne fait que déposer l'envoi dans une file: un thread par
+    processus l'écrit ensuite, par lots d'une transaction, sans ralentir la
+    requête. Un envoi réenregistré sous le même identifiant (reprise d'une
+    demande de la file) remplace le précédent.
+
+    Les recherches sont paginées par curseur (horodatage, id) et servies par
+    les index (secteur | client, horodatage, id): le coût d'une page ne dépend
+    ni de sa profondeur ni du nombre total d'envois.
+    """
+
+    def __init__(self, chemin_base):
+        self.chemin_base = chemin_base
+
+        self._verrou = threading.Lock()
+        self._file = None
+        self._thread = None
+        self._pid = None
+
+        os.makedirs(os.path.dirname(os.path.abspath(chemin_base)), exist_ok=True)
+        with closing(self._connexion()) as conn:
+            conn.executescript(SCHEMA)
+
+    def _connexion(self):
+        conn = sqlite3.connect(self.chemin_base, timeout=30, isolation_level=None)
+        conn.row_factory = sqlite3.Row
+        conn.execute('PRAGMA journal_mode=WAL')
+        # Historique: une coupure de courant peut perdre les derniers lots, jamais corrompre la base
+        conn.execute('PRAGMA synchronous=NORMAL')
+        return conn
+
+    def demarrer(self):
+        """Démarre le thread d'écriture (une fois par processus, de nouveau après un fork)"""
+
+        with self._verrou:
+            if self._pid == os.getpid():
+                return
+            self._pid = os.getpid()
+            self._file = queue.SimpleQueue()
+            self._thread = threading.Thread(target=self._boucle_ecriture, name='historique-envois', daemon=True)
+            self._thread.start()
+
+    def enregistrer(self, envoi, parties):
+        """Met en file un envoi (colonnes de `envois`) et ses emails (colonnes de `envois_parties`)"""
+
+        self.demarrer()
+        self._file.put((envoi, parties))
+
+    def arreter(self, delai=5):
+        """Écrit les envois encore en file puis arrête le thread (au plus `delai` secondes)"""
+
+        with self._verrou:
+            if self._pid != os.getpid():
+                return
+            self._pid = None
+            self._file.put(None)
+            thread = self._thread
+        thread.join(delai)
+
+    def _boucle_ecriture(self):
+        file = self._file
+        with closing(self._connexion()) as conn:
+            while True:
+                lot = [file.get()]
+                while len(lot) < TAILLE_LOT_ECRITURE:
+                    try:
+                        lot.append(file.get_nowait())
+                    except queue.Empty:
+                        break
+
+                envois = [element for element in lot if element is not None]
+                if envois:
+                    try:
+                        self._ecrire(conn, envois)
+                    except sqlite3.Error as e:
+                        journal.error("Historique: %d envoi(s) non enregistré(s): %s", len(envois), e)
+                if len(envois) < len(lot):
+                    return
+
+    def _ecrire(self, conn, envois):
+        conn.execute('BEGIN IMMEDIATE')
+        try:
+            for envoi, parties in envois:
+                conn.execute(
+                    f"INSERT OR REPLACE INTO envois ({', '.join(COLONNES_ENVOI)}) "
+                    f"VALUES ({', '.join('?' * len(COLONNES_ENVOI))})",
+                    [envoi.get(colonne) for colonne in COLONNES_ENVOI]
+                )
+                conn.execute("DELETE FROM envois_parties WHERE envoi_id = ?", (envoi['id'],))
+                conn.executemany(
+                    f"INSERT INTO envois_parties ({', '.join(COLONNES_PARTIE)}) "
+                    f"VALUES ({', '.join('?' * len(COLONNES_PARTIE))})",
+                    [
+                        [envoi['id']] + [partie.get(colonne) for colonne in COLONNES_PARTIE[1:-1]]
+                        + [json.dumps(partie['fichiers'], ensure_ascii=False)]
+                        for partie in parties
+                    ]
+                )
+            conn.execute('COMMIT')
+        except Exception:
+            try:
+                conn.execute('ROLLBACK')
+            except sqlite3.Error:
+                pass
+            raise
+
+    def rechercher(self, client=None, secteur=None, type_demande=None, debut=None, fin=None, limite=50, apres=None):
+        """Envois du plus récent au plus ancien, retourne (envois, curseur de la page suivante ou None).
+
+        `client`: début du nom (« dupont », « dupont je »), sans tenir compte des
+        accents ni de la casse ; `debut` / `fin`: horodatages (fin exclue) ;
+        `apres`: curseur retourné par la page précédente.
+        """
+
+        conditions, parametres = [], []
+        if client:
+            cle = normaliser_client(client)
+            conditions.append("client_cle >= ? AND client_cle < ?")
+            parametres += [cle, cle + '\U0010ffff']
+        if secteur:
+            conditions.append("secteur = ?")
+            parametres.append(secteur)
+        if type_demande:
+            conditions.append("type_demande = ?")
+            parametres.append(type_demande)
+        if debut is not None:
+            conditions.append("horodatage >= ?")
+            parametres.append(debut)
+        if fin is not None:
+            conditions.append("horodatage < ?")
+            parametres.append(fin)
+        if apres:
+            conditions.append("(horodatage, id) < (?, ?)")
+            parametres += list(decoder_curseur(apres))
+
+        clause = f"WHERE {' AND '.join(conditions)}" if conditions else ''
+        colonnes = ', '.join(c for c in COLONNES_ENVOI if c != 'client_cle')
+        with closing(self._connexion()) as conn:
+            lignes = conn.execute(
+                f"SELECT {colonnes} FROM envois {clause} ORDER BY horodatage DESC, id DESC LIMIT ?",
+                parametres + [limite + 1]
+            ).fetchall()
+
+        suivant = encoder_curseur(lignes[limite - 1]) if len(lignes) > limite else None
+        return [_en_dict(ligne) for ligne in lignes[:limite]], suivant
+
+    def obtenir(self, envoi_id):
+        """Un envoi et le détail de ses emails (fichiers: nom, SHA-256, taille), None si inconnu"""
+
+        colonnes = ', '.join(c for c in COLONNES_ENVOI if c != 'client_cle')
+        with closing(self._connexion()) as conn:
+            envoi = conn.execute(f"SELECT {colonnes} FROM envois WHERE id = ?", (envoi_id,)).fetchone()
+            if envoi is None:
+                return None
+            parties = conn.execute(
+                f"SELECT {', '.join(COLONNES_PARTIE[1:])} FROM envois_parties WHERE envoi_id = ? ORDER BY ordre",
+                (envoi_id,)
+            ).fetchall()
+
+        resultat = _en_dict(envoi)
+        resultat['parties'] = [
+            {**_en_dict(partie), 'fichiers': json.loads(partie['fichiers'])}
+            for partie in parties
+        ]
+        return resultat
+
+
+def horodatage_jour(texte, fin=False):
+    """Début du jour (ou du lendemain si `fin`) d'une date JJ/MM/AAAA ou AAAA-MM-JJ, heure locale"""
+
+    for format_date in ('%d/%m/%Y', '%Y-%m-%d'):
+        try:
+            jour = time.strptime(texte, format_date)
+            break
+        except ValueError:
+            continue
+    else:
+        raise ValueError(f"Date invalide: « {texte} » (JJ/MM/AAAA ou AAAA-MM-JJ)")
+
+    return time.mktime((jour.tm_year, jour.tm_mon, jour.tm_mday + (1 if fin else 0), 0, 0, 0, 0, 0, -1))
@@ -0,0 +1,173 @@
+import atexit
+import contextvars
+import json
+import logging
+import logging.handlers
+import os
+import queue
+import sys
+import threading
+import time
+import uuid
+from contextlib import contextmanager
+
+# Journal JSON (une ligne par enregistrement) écrit sur stdout par un thread dédié:
+# les threads de requête ne font que déposer l'enregistrement dans une file.
+#
+# NIVEAU_JOURNAL: niveau par défaut (DEBUG, INFO, WARNING, ERROR), INFO si absent
+# NIVEAUX_JOURNAL: niveaux par journal, ex. "formulaire.fichiers=WARNING,formulaire.smtp=DEBUG"
+# Les messages par fichier (optimisation, doublons, dépôts déjà faits) sont au
+# niveau DEBUG dans "formulaire.fichiers".
+
+NIVEAU_JOURNAL = os.environ.get('NIVEAU_JOURNAL', 'INFO').upper()
+NIVEAUX_JOURNAL = os.environ.get('NIVEAUX_JOURNAL', '')
+
+# Contexte de l'enregistrement: demande (identifiant de corrélation), secteur, partie ZeenDoc
+CORRELATION_ID = contextvars.ContextVar('correlation_id', default=None)
+SECTEUR = contextvars.ContextVar('secteur', default=None)
+PARTIE = contextvars.ContextVar('partie', default=None)
+
+# Attributs de tout LogRecord: le reste vient de `extra` et part dans le JSON
+_ATTRIBUTS_STANDARD = set(vars(logging.LogRecord('', 0, '', 0, '', None, None))) | {'message', 'asctime'}
+
+
+class FormatJSON(logging.Formatter):
+    """Un objet JSON par ligne: horodatage, niveau, journal, message, contexte et champs `extra`"""
+
+    def format(self, record):
+        contenu = {
+            'horodatage': time.strftime('%Y-%m-%dT%H:%M:%S', time.gmtime(record.created))
+                          + f'.{int(record.msecs):03d}Z',
+            'niveau': record.levelname,
+            'journal': record.name,
+            'message': record.getMessage(),
+            'correlation_id': getattr(record, 'correlation_id', None),
+            'secteur': getattr(record, 'secteur', None),
+            'partie': getattr(record, 'partie', None),
+        }
+        for cle, valeur in vars(record).items():
+            if cle not in _ATTRIBUTS_STANDARD and cle not in contenu:
+                contenu[cle] = valeur
+        if record.exc_info:
+            contenu['exception'] = self.formatException(record.exc_info)
+        elif record.exc_text:
+            contenu['exception'] = record.exc_text
+        return json.dumps(contenu, ensure_ascii=False, default=str)
+
+
+class FiltreContexte(logging.Filter):
+    """Ajoute à l'enregistrement le contexte du thread (ou de la tâche) qui l'émet"""
+
+    def filter(self, record):
+        record.correlation_id = CORRELATION_ID.get()
+        record.secteur = SECTEUR.get()
+        record.partie = PARTIE.get()
+        return True
+
+
+class GestionnaireFile(logging.handlers.QueueHandler):
+    """QueueHandler qui laisse le formatage JSON au thread d'écriture.
+
+    Seuls le message (arguments appliqués) et la trace d'une exception sont
+    figés ici, pour que l'enregistrement puisse traverser la file sans
+    références vers des objets de la requête. Pas de copie de l'enregistrement:
+    le journal "formulaire" ne le transmet à aucun autre gestionnaire.
+    """
+
+    def prepare(self, record):
+        record.msg = record.getMessage()
+        record.args = None
+        if record.exc_info:
+            record.exc_text = logging.Formatter().formatException(record.exc_info)
+            record.exc_info = None
+        return record
+
+
+_ETAT = {'pid': None, 'gestionnaire': None, 'ecouteur': None}
+_VERROU = threading.Lock()
+
+
+def _demarrer_ecouteur():
+    file = queue.SimpleQueue()
+    sortie = logging.StreamHandler(sys.stdout)
+    sortie.setFormatter(FormatJSON())
+    ecouteur = logging.handlers.QueueListener(file, sortie, respect_handler_level=True)
+    ecouteur.start()
+
+    _ETAT['gestionnaire'].queue = file
+    _ETAT['ecouteur'] = ecouteur
+    _ETAT['pid'] = os.getpid()
+
+
+def _apres_fork():
+    # Le thread d'écriture du parent n'existe pas dans l'enfant: nouvelle file, nouveau thread
+    if _ETAT['gestionnaire'] is not None:
+        _ETAT['ecouteur'] = None
+        _demarrer_ecouteur()
+
+
+def _arreter():
+    # Vide la file avant la sortie du processus
+    if _ETAT['ecouteur'] is not None and _ETAT['pid'] == os.getpid():
+        _ETAT['ecouteur'].stop()
+        _ETAT['ecouteur'] = None
+
+
+def configurer_journal():
+    """Installe le journal JSON sur le journal "formulaire" (une fois par processus)"""
+
+    with _VERROU:
+        if _ETAT['gestionnaire'] is not None:
+            return
+
+        gestionnaire = GestionnaireFile(None)
+        gestionnaire.addFilter(FiltreContexte())
+        _ETAT['gestionnaire'] = gestionnaire
+        _demarrer_ecouteur()
+
+        racine = logging.getLogger('formulaire')
+        racine.setLevel(NIVEAU_JOURNAL)
+        racine.addHandler(gestionnaire)
+        racine.propagate = False
+
+        for reglage in filter(None, (r.strip() for r in NIVEAUX_JOURNAL.split(','))):
+            nom, _, niveau = reglage.partition('=')
+            logging.getLogger(nom.strip()).setLevel(niveau.strip().upper())
+
+        os.register_at_fork(after_in_child=_apres_fork)
+        atexit.register(_arreter)
+
+
+def nouvelle_requete(correlation_id=None):
+    """Contexte d'une nouvelle requête (identifiant reçu ou généré), retourne l'identifiant.
+
+    Les threads d'un serveur sont réutilisés d'une requête à l'autre: le secteur
+    et la partie de la requête précédente sont effacés.
+    """
+
+    correlation_id = correlation_id or uuid.uuid4().hex
+    CORRELATION_ID.set(correlation_id)
+    SECTEUR.set(None)
+    PARTIE.set(None)
+    return correlation_id
+
+
+@contextmanager
+def contexte_journal(correlation_id=None, secteur=None, partie=None):
+    """Contexte de journalisation le temps d'un bloc (valeurs None: inchangées)"""
+
+    jetons = []
+    for variable, valeur in ((CORRELATION_ID, correlation_id), (SECTEUR, secteur), (PARTIE, partie)):
+        if valeur is not None:
+            jetons.append((variable, variable.set(valeur)))
+    try:
+        yield
+    finally:
+        for variable, jeton in reversed(jetons):
+            variable.reset(jeton)
+
+
+def soumettre(executor, fonction, *args, **kwargs):
+    """executor.submit en transmettant le contexte de journalisation au thread qui exécute"""
+
+    return executor.submit(contextvars.copy_context().run, fonction, *args, **kwargs)
@@ -0,0 +1,141 @@
+import os
+import sqlite3
+import threading
+import time
+from contextlib import closing
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS seaux (
+    destinataire TEXT PRIMARY KEY,
+    debit_par_seconde REAL NOT NULL,
+    jetons REAL NOT NULL,
+    derniere_maj REAL NOT NULL
+);
+"""
+
+
+class SeauAJetons:
+    """Seau à jetons: `capacite` envois immédiats, puis `debit_par_seconde` en régime continu.
+
+    `acquerir` réserve un jeton même s'il n'est pas encore disponible (le
+    solde peut devenir négatif) puis attend hors verrou le temps nécessaire :
+    les appelants concurrents sont servis dans l'ordre de réservation.
+
+    `jetons` et `derniere_maj` (lue sur `horloge`) forment tout l'état du
+    seau: `LimiteurParDestinataire` les conserve en base entre deux appels.
+    """
+
+    def __init__(self, debit_par_seconde, capacite=1, jetons=None, derniere_maj=None, horloge=time.monotonic):
+        self.debit_par_seconde = debit_par_seconde
+        self.capacite = capacite
+        self.horloge = horloge
+        self.jetons = float(capacite if jetons is None else jetons)
+        self.derniere_maj = horloge() if derniere_maj is None else derniere_maj
+        self._verrou = threading.Lock()
+
+    def acquerir(self):
+        """Bloque jusqu'à disponibilité d'un jeton, retourne le temps d'attente en secondes"""
+
+        attente = self.reserver()
+        if attente:
+            time.sleep(attente)
+        return attente
+
+    def reserver(self):
+        """Réserve un jeton sans attendre, retourne le délai à respecter avant l'envoi (code asynchrone)"""
+
+        if self.debit_par_seconde <= 0:
+            return 0.0
+
+        with self._verrou:
+            self._remplir()
+            self.jetons -= 1
+            return max(0.0, -self.jetons / self.debit_par_seconde)
+
+    def modifier_debit(self, debit_par_seconde):
+        """Change le débit (configuration rechargée): les jetons accumulés jusqu'ici l'ont été à l'ancien"""
+
+        with self._verrou:
+            self._remplir()
+            self.debit_par_seconde = debit_par_seconde
+
+    def _remplir(self):
+        maintenant = self.horloge()
+        # Horloge revenue en arrière (réglage de l'heure système): aucun jeton ajouté ni retiré
+        ecoule = max(0.0, maintenant - self.derniere_maj)
+        self.jetons = min(self.capacite, self.jetons + ecoule * self.debit_par_seconde)
+        self.derniere_maj = maintenant
+
+
+class LimiteurParDestinataire:
+    """Un seau à jetons par adresse de destination, partagé par tous les processus du serveur.
+
+    L'état de chaque seau (jetons, dernière mise à jour) est une ligne d'une
+    table SQLite, lue, débitée et réécrite dans une même transaction BEGIN
+    IMMEDIATE: le débit et la rafale valent pour le serveur entier, quel que
+    soit le nombre de workers gunicorn et de threads de la file d'envois.
+    L'horloge est celle du système (`time.time`), commune aux processus.
+
+    `debit_par_minute` peut être donné à chaque appel (réglages du secteur,
+    configuration rechargée à chaud): le seau de l'adresse s'y adapte sans
+    perdre les réservations en cours.
+    """
+
+    def __init__(self, chemin_base, debit_par_minute, capacite=1, horloge=time.time):
+        self.chemin_base = chemin_base
+        self.debit_par_seconde = debit_par_minute / 60
+        self.capacite = capacite
+        self.horloge = horloge
+
+        os.makedirs(os.path.dirname(os.path.abspath(chemin_base)), exist_ok=True)
+        with closing(self._connexion()) as conn:
+            conn.executescript(SCHEMA)
+
+    def _connexion(self):
+        conn = sqlite3.connect(self.chemin_base, timeout=30, isolation_level=None)
+        conn.execute('PRAGMA journal_mode=WAL')
+        # Seaux reconstruits pleins après une coupure de courant: rien à conserver sur disque
+        conn.execute('PRAGMA synchronous=OFF')
+        return conn
+
+    def reserver(self, destinataire, debit_par_minute=None):
+        """Réserve un jeton sans attendre, retourne le délai à respecter avant l'envoi (code asynchrone)"""
+
+        debit_par_seconde = self.debit_par_seconde if debit_par_minute is None else debit_par_minute / 60
+
+        with closing(self._connexion()) as conn:
+            conn.execute('BEGIN IMMEDIATE')
+            try:
+                ligne = conn.execute(
+                    "SELECT debit_par_seconde, jetons, derniere_maj FROM seaux WHERE destinataire = ?", (destinataire,)
+                ).fetchone()
+                if ligne is None:
+                    seau = SeauAJetons(debit_par_seconde, self.capacite, horloge=self.horloge)
+                else:
+                    seau = SeauAJetons(ligne[0], self.capacite, jetons=ligne[1], derniere_maj=ligne[2],
+                                       horloge=self.horloge)
+                    if seau.debit_par_seconde != debit_par_seconde:
+                        seau.modifier_debit(debit_par_seconde)
+
+                attente = seau.reserver()
+                conn.execute(
+                    "INSERT OR REPLACE INTO seaux (destinataire, debit_par_seconde, jetons, derniere_maj) "
+                    "VALUES (?, ?, ?, ?)",
+                    (destinataire, seau.debit_par_seconde, seau.jetons, seau.derniere_maj)
+                )
+                conn.execute('COMMIT')
+            except Exception:
+                try:
+                    conn.execute('ROLLBACK')
+                except sqlite3.Error:
+                    pass
+                raise
+        return attente
+
+    def acquerir(self, destinataire, debit_par_minute=None):
+        """Bloque jusqu'à disponibilité d'un jeton pour `destinataire`, retourne le temps d'attente en secondes"""
+
+        attente = self.reserver(destinataire, debit_par_minute)
+        if attente:
+            time.sleep(attente)
+        return attente
@@ -0,0 +1,224 @@
+import csv
+import io
+import json
+
+from registre_documents import TAILLE_SIGNATURE, PieceRefusee
+
+CHAMPS_OBLIGATOIRES = ('nom', 'prenom', 'type', 'secteurDemandeur')
+
+# Colonnes CSV propres au manifeste: les autres colonnes sont les champs du formulaire
+COLONNES_RESERVEES = ('reference', 'doc_id', 'fichier')
+
+# En dessous, le taux de compression d'un membre de l'archive n'est pas vérifié (texte, petits fichiers)
+TAILLE_MIN_VERIFICATION_RATIO = 1024 * 1024
+
+
+class ManifesteInvalide(ValueError):
+    """Manifeste illisible ou incohérent, avec la liste de toutes les erreurs détectées"""
+
+    def __init__(self, erreurs):
+        super().__init__("; ".join(erreurs))
+        self.erreurs = erreurs
+
+
+def lire_manifeste(contenu, nom_fichier=''):
+    """Lit un manifeste JSON ou CSV et retourne la liste des dossiers.
+
+    Chaque dossier est un dict {'reference', 'data', 'documents'} où `data`
+    contient les champs du formulaire (comme `request.form`) et `documents`
+    la liste des paires (doc_id, nom du fichier dans le lot).
+
+    JSON: une liste (ou {"dossiers": [...]}) d'objets portant les champs du
+    formulaire, une "reference" facultative et "documents": {doc_id: fichier
+    ou [fichiers]}.
+    CSV: une ligne par document, colonnes reference, doc_id, fichier et
+    champs du formulaire; les lignes d'une même référence forment un dossier.
+    """
+
+    try:
+        texte = contenu.decode('utf-8-sig') if isinstance(contenu, bytes) else contenu
+    except UnicodeDecodeError:
+        raise ManifesteInvalide(["Manifeste non encodé en UTF-8"])
+
+    if nom_fichier.lower().endswith('.csv') or not texte.lstrip().startswith(('[', '{')):
+        return _lire_csv(texte)
+    return _lire_json(texte)
+
+
+def _lire_json(texte):
+    try:
+        contenu = json.loads(texte)
+    except json.JSONDecodeError as e:
+        raise ManifesteInvalide([f"JSON invalide: {e}"])
+
+    if isinstance(contenu, dict):
+        contenu = contenu.get('dossiers')
+    if not isinstance(contenu, list):
+        raise ManifesteInvalide(["Le manifeste JSON doit être une liste de dossiers (ou {\"dossiers\": [...]})"])
+
+    dossiers = []
+    erreurs = []
+    for position, entree in enumerate(contenu, 1):
+        if not isinstance(entree, dict):
+            erreurs.append(f"Dossier n°{position}: objet JSON attendu")
+            continue
+
+        entree = dict(entree)
+        reference = str(entree.pop('reference', '') or f"dossier_{position}")
+        documents = entree.pop('documents', {}) or {}
+        if not isinstance(documents, dict):
+            erreurs.append(f"{reference}: 'documents' doit associer chaque doc_id à un ou plusieurs fichiers")
+            continue
+
+        paires = []
+        for doc_id, fichiers in documents.items():
+            for fichier in (fichiers if isinstance(fichiers, list) else [fichiers]):
+                paires.append((doc_id, str(fichier)))
+
+        dossiers.append({
+            'reference': reference,
+            'data': {cle: '' if valeur is None else str(valeur) for cle, valeur in entree.items()},
+            'documents': paires
+        })
+
+    if erreurs:
+        raise ManifesteInvalide(erreurs)
+    return dossiers
+
+
+def _lire_csv(texte):
+    lecteur = csv.DictReader(io.StringIO(texte), delimiter=_detecter_separateur(texte))
+    if not lecteur.fieldnames or 'reference' not in lecteur.fieldnames:
+        raise ManifesteInvalide(["Le manifeste CSV doit contenir une colonne 'reference'"])
+
+    par_reference = {}
+    erreurs = []
+    for numero, ligne in enumerate(lecteur, 2):
+        reference = (ligne.get('reference') or '').strip()
+        if not reference:
+            erreurs.append(f"Ligne {numero}: référence manquante")
+            continue
+
+        dossier = par_reference.setdefault(reference, {'reference': reference, 'data': {}, 'documents': []})
+        for cle, valeur in ligne.items():
+            # Les champs du formulaire peuvent n'être renseignés que sur la première ligne
+            if cle and cle not in COLONNES_RESERVEES and valeur and not dossier['data'].get(cle):
+                dossier['data'][cle] = valeur.strip()
+
+        doc_id = (ligne.get('doc_id') or '').strip()
+        fichier = (ligne.get('fichier') or '').strip()
+        if doc_id and fichier:
+            dossier['documents'].append((doc_id, fichier))
+        elif doc_id or fichier:
+            erreurs.append(f"Ligne {numero}: 'doc_id' et 'fichier' doivent être renseignés ensemble")
+
+    if erreurs:
+        raise ManifesteInvalide(erreurs)
+    return list(par_reference.values())
+
+
+def _detecter_separateur(texte):
+    entete = texte.split('\n', 1)[0]
+    return ';' if entete.count(';') > entete.count(',') else ','
+
+
+def verifier_archive(membres, taille_max, max_fichiers, ratio_max):
+    """Refuse (PieceRefusee, 413) une archive de lot trop grande une fois décompressée, avant toute extraction.
+
+    `membres`: ZipInfo des fichiers de l'archive. Les tailles vérifiées sont
+    celles annoncées par l'archive ; `FluxBorne` garantit ensuite qu'aucun
+    membre ne produit davantage à la lecture.
+    """
+
+    if len(membres) > max_fichiers:
+        raise PieceRefusee(f"Archive refusée: {len(membres)} fichiers (maximum {max_fichiers}).", code=413)
+
+    total = 0
+    for membre in membres:
+        total += membre.file_size
+        if total > taille_max:
+            raise PieceRefusee(
+                f"Archive refusée: plus de {taille_max // (1024 * 1024)} Mo une fois décompressée.", code=413
+            )
+        if membre.file_size > TAILLE_MIN_VERIFICATION_RATIO and membre.file_size > ratio_max * max(membre.compress_size, 1):
+            raise PieceRefusee(f"Archive refusée: '{membre.filename}' anormalement compressé.", code=413)
+
+
+class FluxBorne:
+    """Flux d'un membre d'archive qui échoue (PieceRefusee, 413) s'il produit plus que sa taille annoncée"""
+
+    def __init__(self, flux, taille_annoncee, nom):
+        self._flux = flux
+        self._reste = taille_annoncee
+        self.nom = nom
+
+    def read(self, taille=-1):
+        # Un octet de plus que le reste annoncé suffit à détecter le dépassement
+        limite = self._reste + 1 if taille is None or taille < 0 else min(taille, self._reste + 1)
+        donnees = self._flux.read(limite)
+        self._reste -= len(donnees)
+        if self._reste < 0:
+            raise PieceRefusee(f"Archive refusée: '{self.nom}' plus grand que la taille annoncée.", code=413)
+        return donnees
+
+    def close(self):
+        self._flux.close()
+
+
+def valider_lot(dossiers, fichiers_disponibles, types_demande, secteurs, registre=None, tailles=None):
+    """Vérifie tout le lot avant le moindre envoi, retourne la liste des erreurs (vide si valide)
+
+    Avec `registre` (RegistreDocuments), chaque doc_id doit être un type de
+    document connu et chaque fichier avoir un format accepté pour ce type,
+    et une taille (`tailles`: {nom: octets}) dans la limite de ce type.
+    Si `fichiers_disponibles` associe à chaque nom une fonction qui ouvre le
+    fichier (cf. `documents_du_lot`), le début de chaque fichier est aussi
+    comparé à la signature de son format.
+    """
+
+    erreurs = []
+    if not dossiers:
+        erreurs.append("Le manifeste ne contient aucun dossier")
+
+    references = set()
+    for dossier in dossiers:
+        reference = dossier['reference']
+        if reference in references:
+            erreurs.append(f"{reference}: référence en double dans le manifeste")
+        references.add(reference)
+
+        data = dossier['data']
+        for champ in CHAMPS_OBLIGATOIRES:
+            if not data.get(champ):
+                erreurs.append(f"{reference}: champ obligatoire manquant '{champ}'")
+
+        if data.get('type') and data['type'] not in types_demande:
+            erreurs.append(f"{reference}: type de demande inconnu '{data['type']}'")
+        if data.get('secteurDemandeur') and data['secteurDemandeur'] not in secteurs:
+            erreurs.append(f"{reference}: secteur inconnu '{data['secteurDemandeur']}'")
+
+        for doc_id, fichier in dossier['documents']:
+            if fichier not in fichiers_disponibles:
+                erreurs.append(f"{reference}: fichier '{fichier}' ({doc_id}) absent du lot")
+            if registre is None:
+                continue
+            if registre.obtenir(doc_id) is None:
+                erreurs.append(f"{reference}: type de document inconnu '{doc_id}'")
+                continue
+            try:
+                registre.verifier_piece(doc_id, fichier, (tailles or {}).get(fichier))
+                ouvrir = fichiers_disponibles.get(fichier) if isinstance(fichiers_disponibles, dict) else None
+                if callable(ouvrir):
+                    registre.verifier_contenu(doc_id, fichier, lire_debut(ouvrir))
+            except PieceRefusee as e:
+                erreurs.append(f"{reference}: {e.message}")
+
+    return erreurs
+
+
+def lire_debut(ouvrir):
+    document = ouvrir()
+    try:
+        return document.stream.read(TAILLE_SIGNATURE)
+    finally:
+        document.close()
@@ -0,0 +1,96 @@
+import os
+
+from prometheus_client import (
+    CONTENT_TYPE_LATEST,
+    REGISTRY,
+    CollectorRegistry,
+    Counter,
+    Gauge,
+    Histogram,
+    generate_latest,
+    multiprocess,
+)
+
+# Sous gunicorn avec plusieurs workers, définir PROMETHEUS_MULTIPROC_DIR (dossier
+# vide au démarrage) AVANT le lancement: chaque processus y écrit ses valeurs
+# et /metrics agrège l'ensemble, quel que soit le worker qui répond.
+
+DUREES_ETAPES = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300)
+
+DUREE_ETAPE = Histogram(
+    'formulaire_duree_etape_secondes',
+    "Durée de chaque étape du traitement d'une demande",
+    ['etape'],
+    buckets=DUREES_ETAPES
+)
+
+OCTETS_ENVOYES = Counter(
+    'formulaire_smtp_octets_envoyes',
+    "Octets transmis au serveur SMTP (messages acceptés)",
+    ['type_envoi']
+)
+
+PARTIES_PAR_DEMANDE = Histogram(
+    'formulaire_parties_zeendoc_par_demande',
+    "Nombre d'emails ZeenDoc par demande",
+    buckets=(1, 2, 3, 4, 5, 6, 8, 10)
+)
+
+ENVOIS = Counter(
+    'formulaire_envois',
+    "Emails envoyés, par secteur, type et résultat",
+    ['secteur', 'type_envoi', 'resultat']
+)
+
+ECHECS_SMTP = Counter(
+    'formulaire_smtp_echecs',
+    "Échecs SMTP, par type d'erreur",
+    ['erreur']
+)
+
+# Jauges sommées sur les processus vivants en mode multiprocessus
+TRAITEMENTS_EN_COURS = Gauge(
+    'formulaire_traitements_en_cours',
+    "Demandes admises en cours de traitement",
+    multiprocess_mode='livesum'
+)
+
+OCTETS_EN_COURS = Gauge(
+    'formulaire_octets_en_cours',
+    "Octets réservés par les demandes admises en cours de traitement",
+    multiprocess_mode='livesum'
+)
+
+REFUS_ADMISSION = Counter(
+    'formulaire_refus_admission',
+    "Demandes refusées à l'admission, par motif (taille, octets, traitements)",
+    ['motif']
+)
+
+
+def mesurer(etape):
+    """Chronomètre (context manager ou décorateur) pour une étape du traitement"""
+
+    return DUREE_ETAPE.labels(etape=etape).time()
+
+
+def observer_duree(etape, secondes):
+    DUREE_ETAPE.labels(etape=etape).observe(secondes)
+
+
+def exposer_metriques():
+    """Retourne (contenu, type MIME) au format texte Prometheus"""
+
+    if 'PROMETHEUS_MULTIPROC_DIR' in os.environ:
+        registre = CollectorRegistry()
+        multiprocess.MultiProcessCollector(registre)
+    else:
+        registre = REGISTRY
+    return generate_latest(registre), CONTENT_TYPE_LATEST
+
+
+def processus_termine(pid):
+    """À appeler à la sortie d'un worker gunicorn (hook child_exit) en mode multiprocessus"""
+
+    if 'PROMETHEUS_MULTIPROC_DIR' in os.environ:
+        multiprocess.mark_process_dead(pid)
@@ -0,0 +1,328 @@
+import base64
+import contextvars
+import io
+import logging
+import os
+import re
+import smtplib
+import tempfile
+import threading
+import time
+import uuid
+from contextlib import contextmanager
+from email import generator
+from email.mime.base import MIMEBase
+from email.mime.multipart import MIMEMultipart
+from email.mime.text import MIMEText
+
+# 57 octets bruts = une ligne base64 de 76 caractères: les blocs restent alignés sur les lignes
+TAILLE_BLOC_BRUT = 57 * 1024
+
+_POINT_EN_DEBUT_DE_LIGNE = re.compile(br'(?m)^\.')
+
+# Pièce encodée gardée en mémoire jusqu'à cette taille (encodée), au-delà dans un fichier temporaire
+SEUIL_MEMOIRE_ENCODAGE = 2 * 1024 * 1024
+TAILLE_BLOC_RELECTURE = 1024 * 1024
+
+# Cache d'encodage de la demande en cours (cf. `encodages_partages`), transmis aux
+# threads lancés par `journal.soumettre` et aux tâches asyncio avec le reste du contexte
+CACHE_ENCODAGE = contextvars.ContextVar('cache_encodage', default=None)
+
+journal = logging.getLogger('formulaire.mime')
+
+
+def taille_base64(taille):
+    """Taille encodée d'un contenu de `taille` octets: base64 en lignes de 76 caractères + CRLF"""
+
+    caracteres = 4 * ((taille + 2) // 3)
+    lignes = (caracteres + 75) // 76
+    return caracteres + 2 * lignes
+
+
+class PieceEncodee:
+    """Charge utile base64 d'une pièce, en mémoire (`contenu`) ou dans un fichier temporaire (`chemin`)"""
+
+    def __init__(self, contenu=None, chemin=None):
+        self.contenu = contenu
+        self.chemin = chemin
+
+    def blocs(self):
+        if self.contenu is not None:
+            yield self.contenu
+            return
+        with open(self.chemin, 'rb') as source:
+            while True:
+                bloc = source.read(TAILLE_BLOC_RELECTURE)
+                if not bloc:
+                    break
+                yield bloc
+
+    def supprimer(self):
+        if self.chemin is not None:
+            try:
+                os.remove(self.chemin)
+            except FileNotFoundError:
+                pass
+
+
+class CacheEncodage:
+    """Pièces déjà encodées en base64 pendant une demande, par empreinte du contenu.
+
+    L'email principal et les emails ZeenDoc joignent les mêmes fichiers, et un
+    nouvel essai renvoie le même message: chaque contenu n'est encodé qu'une
+    fois, la première fois qu'un message l'écrit sur la socket. Une pièce
+    n'entre dans le cache que si son encodage est allé jusqu'au bout (envoi
+    interrompu: rien n'est conservé). Les petites pièces restent en mémoire
+    dans la limite de `budget_memoire` octets, les autres sont écrites dans un
+    fichier temporaire de `dossier`. `fermer` libère tout à la fin de la demande.
+
+    La clé est (SHA-256 du fichier reçu, taille): après optimisation, le
+    contenu change avec sa taille. Les pièces sans empreinte (archive ZIP,
+    envoyée une seule fois) ne passent pas par le cache.
+    """
+
+    def __init__(self, dossier, budget_memoire=32 * 1024 * 1024, seuil_memoire=SEUIL_MEMOIRE_ENCODAGE):
+        self.dossier = dossier
+        self.budget_memoire = budget_memoire
+        self.seuil_memoire = seuil_memoire
+
+        self._verrou = threading.Lock()
+        self._pieces = {}
+        self._memoire = 0
+        self.statistiques = {'encodages': 0, 'reutilisations': 0}
+
+    @staticmethod
+    def cle(fichier):
+        if not fichier.get('sha256'):
+            return None
+        return fichier['sha256'], fichier['taille']
+
+    def blocs(self, fichier, encoder):
+        """Charge utile encodée de `fichier`: relue depuis le cache, ou produite par `encoder(fichier)` et conservée"""
+
+        cle = self.cle(fichier)
+        if cle is None:
+            yield from encoder(fichier)
+            return
+
+        with self._verrou:
+            piece = self._pieces.get(cle)
+            if piece is not None:
+                self.statistiques['reutilisations'] += 1
+            else:
+                taille = taille_base64(fichier['taille'])
+                en_memoire = taille <= self.seuil_memoire and self._memoire + taille <= self.budget_memoire
+                if en_memoire:
+                    self._memoire += taille
+
+        if piece is not None:
+            yield from piece.blocs()
+            return
+
+        if en_memoire:
+            tampon = []
+            ecrire = tampon.append
+        else:
+            descripteur, chemin = tempfile.mkstemp(prefix='mime_', suffix='.b64', dir=self.dossier)
+            sortie = os.fdopen(descripteur, 'wb')
+            ecrire = sortie.write
+
+        complet = False
+        try:
+            for bloc in encoder(fichier):
+                ecrire(bloc)
+                yield bloc
+            complet = True
+        finally:
+            if en_memoire:
+                piece = PieceEncodee(contenu=b''.join(tampon)) if complet else None
+            else:
+                sortie.close()
+                piece = PieceEncodee(chemin=chemin)
+            self._conserver(cle, piece, complet, taille if en_memoire else 0)
+
+    def _conserver(self, cle, piece, complet, memoire):
+        with self._verrou:
+            if complet and cle not in self._pieces:
+                self._pieces[cle] = piece
+                self.statistiques['encodages'] += 1
+                return
+            # Encodage interrompu, ou même pièce encodée en parallèle par un autre envoi
+            self._memoire -= memoire
+        if piece is not None:
+            piece.supprimer()
+
+    def fermer(self):
+        with self._verrou:
+            pieces = list(self._pieces.values())
+            self._pieces.clear()
+            self._memoire = 0
+        for piece in pieces:
+            piece.supprimer()
+        if self.statistiques['reutilisations']:
+            journal.debug("Cache d'encodage: %d pièce(s) encodée(s), %d réutilisation(s)",
+                          self.statistiques['encodages'], self.statistiques['reutilisations'],
+                          extra=dict(self.statistiques))
+
+
+@contextmanager
+def encodages_partages(dossier, budget_memoire=32 * 1024 * 1024):
+    """Un cache d'encodage pour tous les messages construits dans le bloc (déjà actif: le même)"""
+
+    cache = CACHE_ENCODAGE.get()
+    if cache is not None:
+        yield cache
+        return
+
+    cache = CacheEncodage(dossier, budget_memoire)
+    jeton = CACHE_ENCODAGE.set(cache)
+    try:
+        yield cache
+    finally:
+        CACHE_ENCODAGE.reset(jeton)
+        cache.fermer()
+
+
+class MessageStreaming:
+    """Email multipart dont les pièces jointes sont encodées en base64 au fil de l'envoi.
+
+    Les en-têtes et le corps texte sont produits par le générateur de la
+    bibliothèque `email` (même structure MIME que `MIMEMultipart` +
+    `encoders.encode_base64` + `send_message`) ; seule la charge utile des
+    pièces jointes est remplacée par un marqueur, puis lue depuis sa source
+    et encodée bloc par bloc au moment de l'écriture sur la socket.
+
+    Dans un bloc `encodages_partages` (ou avec `cache`), la charge utile
+    d'une pièce déjà encodée pour un autre message de la demande est reprise
+    telle quelle.
+    """
+
+    def __init__(self, expediteur, destinataire, sujet, corps, fichiers, ouvrir, cc=None, frontiere=None, cache=None):
+        self.fichiers = fichiers
+        self.ouvrir = ouvrir
+        self.cache = cache if cache is not None else CACHE_ENCODAGE.get()
+        # Temps passé à lire et encoder les pièces pendant l'envoi (hors attente réseau)
+        self.duree_encodage = 0.0
+
+        msg = MIMEMultipart()
+        msg['From'] = expediteur
+        msg['To'] = destinataire
+        if cc:
+            msg['Cc'] = cc
+        msg['Subject'] = sujet
+        if frontiere:
+            msg.set_boundary(frontiere)
+
+        # Corps du message
+        msg.attach(MIMEText(corps, 'plain', 'utf-8'))
+
+        # Pièces jointes: un marqueur à la place du contenu encodé
+        marqueurs = []
+        for index, fichier in enumerate(fichiers):
+            marqueur = f"MARQUEUR-PIECE-{index}-{uuid.uuid4().hex}"
+            marqueurs.append(marqueur.encode('ascii'))
+
+            part = MIMEBase('application', 'octet-stream')
+            part.set_payload(marqueur)
+            part['Content-Transfer-Encoding'] = 'base64'
+            part.add_header(
+                'Content-Disposition',
+                f'attachment; filename="{fichier["nom"]}"'
+            )
+            msg.attach(part)
+
+        tampon = io.BytesIO()
+        generator.BytesGenerator(tampon).flatten(msg, linesep='\r\n')
+        squelette = tampon.getvalue()
+
+        # Découpage du squelette autour des marqueurs
+        self.segments = []
+        for marqueur in marqueurs:
+            avant, squelette = squelette.split(marqueur, 1)
+            self.segments.append(avant)
+        self.segments.append(squelette)
+
+    def taille(self):
+        """Taille exacte du message (avant dot-stuffing), pour l'option SIZE"""
+
+        return sum(len(segment) for segment in self.segments) + sum(
+            taille_base64(fichier['taille']) for fichier in self.fichiers
+        )
+
+    def blocs(self):
+        """Génère le message, prêt pour la commande DATA (lignes CRLF, points doublés)"""
+
+        for segment, fichier in zip(self.segments, self.fichiers):
+            yield _POINT_EN_DEBUT_DE_LIGNE.sub(b'..', segment)
+            yield from self._encoder_piece(fichier)
+
+        dernier = _POINT_EN_DEBUT_DE_LIGNE.sub(b'..', self.segments[-1])
+        if not dernier.endswith(b'\r\n'):
+            dernier += b'\r\n'
+        yield dernier
+
+    def _encoder_piece(self, fichier):
+        if self.cache is None:
+            return self._lire_et_encoder(fichier)
+        return self.cache.blocs(fichier, self._lire_et_encoder)
+
+    def _lire_et_encoder(self, fichier):
+        with self.ouvrir(fichier) as source:
+            while True:
+                debut = time.perf_counter()
+                bloc = source.read(TAILLE_BLOC_BRUT)
+                if not bloc:
+                    break
+                encode = base64.encodebytes(bloc).replace(b'\n', b'\r\n')
+                self.duree_encodage += time.perf_counter() - debut
+                yield encode
+
+
+def envoyer_message_streaming(smtp, expediteur, destinataires, message):
+    """Équivalent de `smtp.send_message` qui écrit le message bloc par bloc pendant DATA"""
+
+    smtp.ehlo_or_helo_if_needed()
+
+    options = []
+    if smtp.does_esmtp and smtp.has_extn('size'):
+        options.append(f"SIZE={message.taille()}")
+
+    code, reponse = smtp.mail(expediteur, options)
+    if code != 250:
+        if code == 421:
+            smtp.close()
+        else:
+            smtp._rset()
+        raise smtplib.SMTPSenderRefused(code, reponse, expediteur)
+
+    refuses = {}
+    for destinataire in destinataires:
+        code, reponse = smtp.rcpt(destinataire)
+        if code not in (250, 251):
+            refuses[destinataire] = (code, reponse)
+        if code == 421:
+            smtp.close()
+            raise smtplib.SMTPRecipientsRefused(refuses)
+    if len(refuses) == len(destinataires):
+        smtp._rset()
+        raise smtplib.SMTPRecipientsRefused(refuses)
+
+    smtp.putcmd('data')
+    code, reponse = smtp.getreply()
+    if code != 354:
+        smtp._rset()
+        raise smtplib.SMTPDataError(code, reponse)
+
+    for bloc in message.blocs():
+        smtp.send(bloc)
+    smtp.send(b'.\r\n')
+
+    code, reponse = smtp.getreply()
+    if code != 250:
+        if code == 421:
+            smtp.close()
+        else:
+            smtp._rset()
+        raise smtplib.SMTPDataError(code, reponse)
+
+    return refuses
@@ -0,0 +1,99 @@
+import os
+
+# Dépendances optionnelles: sans elles, les documents sont envoyés tels quels
+try:
+    from PIL import Image, ImageOps
+except ImportError:
+    Image = None
+
+try:
+    import pikepdf
+except ImportError:
+    pikepdf = None
+
+EXTENSIONS_IMAGES = {'jpg', 'jpeg', 'png', 'webp'}
+FORMATS_PILLOW = {'jpg': 'JPEG', 'jpeg': 'JPEG', 'png': 'PNG', 'webp': 'WEBP'}
+
+# Plus grand côté d'une page A4, en pouces: une pièce d'identité ou un
+# justificatif n'a pas besoin de plus de pixels que sa page imprimée
+COTE_A4_POUCES = 11.69
+
+
+def extension(nom):
+    return nom.rsplit('.', 1)[-1].lower() if '.' in nom else ''
+
+
+def optimisation_disponible(nom):
+    """Vrai si une bibliothèque capable d'optimiser ce type de fichier est installée"""
+
+    ext = extension(nom)
+    if ext in EXTENSIONS_IMAGES:
+        return Image is not None
+    if ext == 'pdf':
+        return pikepdf is not None
+    return False
+
+
+def _optimiser_image(chemin, chemin_sortie, ext, dpi, qualite):
+    cote_max = int(COTE_A4_POUCES * dpi)
+
+    with Image.open(chemin) as image:
+        # Les photos de téléphone portent leur orientation dans l'EXIF, perdu au réencodage
+        image = ImageOps.exif_transpose(image)
+        image.thumbnail((cote_max, cote_max), Image.LANCZOS)
+
+        format_pillow = FORMATS_PILLOW[ext]
+        if format_pillow == 'JPEG':
+            if image.mode not in ('RGB', 'L'):
+                image = image.convert('RGB')
+            image.save(chemin_sortie, 'JPEG', quality=qualite, optimize=True, progressive=True, dpi=(dpi, dpi))
+        elif format_pillow == 'WEBP':
+            image.save(chemin_sortie, 'WEBP', quality=qualite, method=4)
+        else:
+            image.save(chemin_sortie, 'PNG', optimize=True, dpi=(dpi, dpi))
+
+
+def _optimiser_pdf(chemin, chemin_sortie):
+    with pikepdf.open(chemin) as pdf:
+        pdf.remove_unreferenced_resources()
+        pdf.save(
+            chemin_sortie,
+            compress_streams=True,
+            recompress_flate=True,
+            object_stream_mode=pikepdf.ObjectStreamMode.generate
+        )
+
+
+def optimiser_document(chemin, nom, dpi=200, qualite=80, seuil_image=1024 * 1024):
+    """Optimise le fichier en place s'il y gagne, retourne (taille originale, taille finale).
+
+    Exécutée dans un processus séparé: ne dépend que de ses arguments. Le
+    fichier n'est remplacé (os.replace, atomique) que si la version optimisée
+    est plus petite; en cas d'échec de l'optimisation, l'original est conservé.
+    """
+
+    taille_originale = os.path.getsize(chemin)
+    ext = extension(nom)
+    chemin_sortie = f"{chemin}.optimise"
+
+    try:
+        if ext in EXTENSIONS_IMAGES and Image is not None:
+            if taille_originale < seuil_image:
+                return taille_originale, taille_originale
+            _optimiser_image(chemin, chemin_sortie, ext, dpi, qualite)
+        elif ext == 'pdf' and pikepdf is not None:
+            _optimiser_pdf(chemin, chemin_sortie)
+        else:
+            return taille_originale, taille_originale
+
+        taille_optimisee = os.path.getsize(chemin_sortie)
+        if taille_optimisee >= taille_originale:
+            return taille_originale, taille_originale
+
+        # Le fichier de la demande est un lien physique vers le stock de
+        # contenus: os.replace remplace le lien, le contenu stocké reste intact
+        os.replace(chemin_sortie, chemin)
+        return taille_originale, taille_optimisee
+    finally:
+        if os.path.exists(chemin_sortie):
+            os.remove(chemin_sortie)
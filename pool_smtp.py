@@ -0,0 +1,200 @@
+import errno
+import random
+import smtplib
+import socket
+import threading
+import time
+
+from metriques import mesurer
+
+
+ERREURS_RESEAU_TRANSITOIRES = {errno.ENETUNREACH, errno.EHOSTUNREACH, errno.ENETDOWN}
+
+
+def erreur_transitoire(exception):
+    """Vrai si l'erreur SMTP peut disparaître d'elle-même (code 4xx, coupure réseau, délai dépassé).
+
+    Les refus définitifs (codes 5xx, authentification refusée, fichier
+    illisible...) ne sont jamais considérés comme transitoires.
+    """
+
+    if isinstance(exception, smtplib.SMTPRecipientsRefused):
+        codes = [code for code, _ in exception.recipients.values()]
+        return bool(codes) and all(400 <= code < 500 for code in codes)
+    if isinstance(exception, smtplib.SMTPResponseException):
+        return 400 <= exception.smtp_code < 500
+    if isinstance(exception, (smtplib.SMTPServerDisconnected, ConnectionError, TimeoutError, socket.gaierror)):
+        return True
+    return isinstance(exception, OSError) and exception.errno in ERREURS_RESEAU_TRANSITOIRES
+
+
+def delai_nouvel_essai(tentative, delai_base, delai_max):
+    """Attente exponentielle avec gigue avant l'essai suivant (tentative = nombre d'échecs)"""
+
+    plafond = min(delai_max, delai_base * 2 ** (tentative - 1))
+    # La moitié fixe, l'autre aléatoire: les envois en échec simultané ne repartent pas ensemble
+    return plafond / 2 + random.uniform(0, plafond / 2)
+
+
+class ConnexionSMTP:
+    """Connexion SMTP authentifiée conservée dans le pool"""
+
+    def __init__(self, smtp):
+        self.smtp = smtp
+        self.messages_envoyes = 0
+        self.dernier_usage = time.monotonic()
+
+    def fermer(self):
+        try:
+            self.smtp.quit()
+        except Exception:
+            try:
+                self.smtp.close()
+            except Exception:
+                pass
+
+
+class PoolSMTP:
+    """Pool thread-safe de connexions SMTP persistantes.
+
+    Les connexions sont regroupées par (serveur, port, identifiants). Avant
+    réutilisation, une connexion inactive est vérifiée par NOOP ; si le
+    serveur l'a fermée entre-temps, une nouvelle connexion est ouverte. Une
+    connexion est fermée après `max_messages_par_connexion` envois, ou si
+    elle reste inutilisée plus de `delai_inactivite` secondes.
+    """
+
+    def __init__(self, max_messages_par_connexion=50, max_connexions_inactives=4,
+                 delai_inactivite=60, timeout=60):
+        self.max_messages_par_connexion = max_messages_par_connexion
+        self.max_connexions_inactives = max_connexions_inactives
+        self.delai_inactivite = delai_inactivite
+        self.timeout = timeout
+
+        self._verrou = threading.Lock()
+        self._inactives = {}
+        self.statistiques = {'ouvertures': 0, 'reutilisations': 0, 'reconnexions': 0}
+        # Dernier résultat d'un échange avec le serveur, pour les sondes sans connexion
+        self.dernier_succes = None
+        self.derniere_erreur = None
+
+    def _ouvrir(self, serveur, port, utilisateur, mot_de_passe, starttls):
+        with mesurer('smtp_connexion'):
+            smtp = smtplib.SMTP(serveur, port, timeout=self.timeout)
+        try:
+            with mesurer('smtp_authentification'):
+                if starttls:
+                    smtp.starttls()
+                if utilisateur:
+                    smtp.login(utilisateur, mot_de_passe)
+        except Exception:
+            smtp.close()
+            raise
+
+        with self._verrou:
+            self.statistiques['ouvertures'] += 1
+        return ConnexionSMTP(smtp)
+
+    def _prendre(self, cle):
+        """Retourne une connexion inactive encore valide pour cette clé, ou None"""
+
+        while True:
+            with self._verrou:
+                connexions = self._inactives.get(cle)
+                if not connexions:
+                    return None
+                connexion = connexions.pop()
+
+            if time.monotonic() - connexion.dernier_usage > self.delai_inactivite:
+                connexion.fermer()
+                continue
+
+            try:
+                code, _ = connexion.smtp.noop()
+            except (smtplib.SMTPException, OSError):
+                code = None
+
+            if code == 250:
+                with self._verrou:
+                    self.statistiques['reutilisations'] += 1
+                return connexion
+
+            connexion.fermer()
+
+    def _rendre(self, cle, connexion):
+        connexion.messages_envoyes += 1
+        connexion.dernier_usage = time.monotonic()
+
+        if connexion.messages_envoyes >= self.max_messages_par_connexion:
+            connexion.fermer()
+            return
+
+        with self._verrou:
+            connexions = self._inactives.setdefault(cle, [])
+            if len(connexions) < self.max_connexions_inactives:
+                connexions.append(connexion)
+                return
+
+        connexion.fermer()
+
+    def executer(self, serveur, port, utilisateur, mot_de_passe, action, starttls=True):
+        """Exécute `action(smtp)` sur une connexion du pool et retourne son résultat.
+
+        Si une connexion réutilisée est coupée par le serveur pendant l'action,
+        l'action est rejouée une fois sur une connexion neuve.
+        """
+
+        try:
+            resultat = self._executer(serveur, port, utilisateur, mot_de_passe, action, starttls)
+        except Exception as e:
+            self.derniere_erreur = (time.time(), f"{type(e).__name__}: {e}")
+            raise
+        self.dernier_succes = time.time()
+        return resultat
+
+    def _executer(self, serveur, port, utilisateur, mot_de_passe, action, starttls):
+        cle = (serveur, port, utilisateur, mot_de_passe, starttls)
+        connexion = self._prendre(cle)
+        reutilisee = connexion is not None
+        if connexion is None:
+            connexion = self._ouvrir(serveur, port, utilisateur, mot_de_passe, starttls)
+
+        try:
+            resultat = action(connexion.smtp)
+        except smtplib.SMTPServerDisconnected:
+            connexion.fermer()
+            if not reutilisee:
+                raise
+            with self._verrou:
+                self.statistiques['reconnexions'] += 1
+            connexion = self._ouvrir(serveur, port, utilisateur, mot_de_passe, starttls)
+            try:
+                resultat = action(connexion.smtp)
+            except Exception:
+                connexion.fermer()
+                raise
+        except Exception:
+            # État de la session inconnu après une erreur: on ne la réutilise pas
+            connexion.fermer()
+            raise
+
+        self._rendre(cle, connexion)
+        return resultat
+
+    def etat(self):
+        """Dernier succès et dernière erreur SMTP de ce processus (horodatages time.time())"""
+
+        erreur = self.derniere_erreur
+        return {
+            'dernier_succes': self.dernier_succes,
+            'derniere_erreur': erreur[0] if erreur else None,
+            'erreur': erreur[1] if erreur else None
+        }
+
+    def fermer_tout(self):
+        with self._verrou:
+            connexions = [c for liste in self._inactives.values() for c in liste]
+            self._inactives.clear()
+
+        for connexion in connexions:
+            connexion.fermer()
@@ -0,0 +1,234 @@
+import hashlib
+import json
+import os
+
+from werkzeug.exceptions import BadRequest
+
+# Formats acceptés par défaut pour toutes les pièces (champ `accept` du formulaire)
+EXTENSIONS_DOCUMENTS = ('pdf', 'doc', 'docx', 'jpg', 'jpeg', 'png')
+# Taille maximale d'une pièce, avant optimisation (les photos de téléphone sont réduites ensuite)
+TAILLE_MAX_DOCUMENT_MO = int(os.environ.get('TAILLE_MAX_DOCUMENT_MO', '25'))
+
+# Début de fichier gardé pour reconnaître son format (signature), avant d'écrire quoi que ce soit
+TAILLE_SIGNATURE = 1024
+
+# Format attendu pour chaque extension: libellé et signatures possibles en tête de fichier.
+# Un PDF peut commencer par quelques octets parasites: "%PDF-" est cherché dans tout le début.
+FORMATS_EXTENSIONS = {
+    'pdf': ('PDF', (b'%PDF-',)),
+    'jpg': ('JPEG', (b'\xff\xd8\xff',)),
+    'jpeg': ('JPEG', (b'\xff\xd8\xff',)),
+    'png': ('PNG', (b'\x89PNG\r\n\x1a\n',)),
+    # Word 97-2003: conteneur OLE ; Word 2007 et suivants: archive ZIP
+    'doc': ('Word', (b'\xd0\xcf\x11\xe0\xa1\xb1\x1a\xe1',)),
+    'docx': ('Word', (b'PK\x03\x04',)),
+}
+
+
+class PieceRefusee(BadRequest):
+    """Pièce jointe refusée avant d'être conservée: extension ou contenu (400), taille (413) hors des règles de son type"""
+
+    def __init__(self, message, doc_id=None, code=400):
+        super().__init__(message)
+        self.message = message
+        self.doc_id = doc_id
+        self.code = code
+
+
+def extension_fichier(nom_fichier):
+    return nom_fichier.rsplit('.', 1)[-1].lower() if '.' in nom_fichier else ''
+
+
+def signature_reconnue(extension, debut):
+    """True si `debut` (premiers octets du fichier) est bien du format de l'extension, ou si l'extension n'a pas de format connu"""
+
+    if extension not in FORMATS_EXTENSIONS:
+        return True
+    _, signatures = FORMATS_EXTENSIONS[extension]
+    if extension == 'pdf':
+        return any(signature in debut[:TAILLE_SIGNATURE] for signature in signatures)
+    return debut.startswith(signatures)
+
+
+def verifier_signature(nom_fichier, debut, libelle=None, doc_id=None):
+    """Lève PieceRefusee si le fichier est vide ou si son contenu ne correspond pas à son extension"""
+
+    extension = extension_fichier(nom_fichier)
+    if not debut:
+        message = f"« {nom_fichier} » est vide."
+    elif not signature_reconnue(extension, debut):
+        message = (f"le contenu de « {nom_fichier} » n'est pas un fichier {FORMATS_EXTENSIONS[extension][0]} "
+                   f"(fichier renommé ou endommagé ?).")
+    else:
+        return
+    raise PieceRefusee(f"{libelle}: {message}" if libelle else message[0].upper() + message[1:], doc_id=doc_id)
+
+
+class TypeDocument:
+    """Type de pièce d'un formulaire: nom court (nommage ZeenDoc), catégorie, formats et taille acceptés"""
+
+    def __init__(self, doc_id, libelle, aide, nom_court, categorie,
+                 extensions=EXTENSIONS_DOCUMENTS, taille_max_mo=None):
+        self.doc_id = doc_id
+        self.libelle = libelle
+        self.aide = aide
+        self.nom_court = nom_court
+        self.categorie = categorie
+        self.extensions = frozenset(extensions)
+        self.taille_max = (taille_max_mo or TAILLE_MAX_DOCUMENT_MO) * 1024 * 1024
+        self._extensions_ordonnees = tuple(extensions)
+
+    def verifier(self, nom_fichier, taille=None):
+        """Lève PieceRefusee si l'extension (ou la taille, quand elle est connue) n'est pas acceptée"""
+
+        extension = extension_fichier(nom_fichier)
+        if extension not in self.extensions:
+            raise PieceRefusee(
+                f"{self.libelle}: format non accepté pour « {nom_fichier} » "
+                f"(formats acceptés: {', '.join(e.upper() for e in self._extensions_ordonnees)}).",
+                doc_id=self.doc_id
+            )
+        if taille is not None and taille > self.taille_max:
+            raise PieceRefusee(
+                f"{self.libelle}: « {nom_fichier} » est trop volumineux "
+                f"(maximum {self.taille_max // (1024 * 1024)} Mo).",
+                doc_id=self.doc_id, code=413
+            )
+
+    def verifier_contenu(self, nom_fichier, debut):
+        """Lève PieceRefusee si les premiers octets (TAILLE_SIGNATURE) ne sont pas ceux du format de l'extension"""
+
+        verifier_signature(nom_fichier, debut, self.libelle, self.doc_id)
+
+    def en_dict(self):
+        return {
+            'libelle': self.libelle,
+            'aide': self.aide,
+            'nom_court': self.nom_court,
+            'categorie': self.categorie,
+            'extensions': list(self._extensions_ordonnees),
+            'taille_max': self.taille_max
+        }
+
+
+class RegistreDocuments:
+    """Registre des types de pièces, construit une fois: recherches O(1) et JSON servi tel quel au formulaire"""
+
+    def __init__(self, documents_par_demande, types_documents):
+        self.documents_par_demande = {
+            type_demande: tuple(doc_ids) for type_demande, doc_ids in documents_par_demande.items()
+        }
+        self.types = {type_document.doc_id: type_document for type_document in types_documents}
+
+        inconnus = {d for doc_ids in self.documents_par_demande.values() for d in doc_ids} - set(self.types)
+        if inconnus:
+            raise ValueError(f"Documents sans type dans le registre: {', '.join(sorted(inconnus))}")
+
+        # Réponse de /documents: sérialisée une seule fois, ETag tiré de son contenu
+        self.contenu_json = json.dumps({
+            'types_demande': {t: list(doc_ids) for t, doc_ids in self.documents_par_demande.items()},
+            'documents': {doc_id: t.en_dict() for doc_id, t in self.types.items()}
+        }, ensure_ascii=False, sort_keys=True).encode('utf-8')
+        self.etag = hashlib.sha256(self.contenu_json).hexdigest()[:32]
+
+    @property
+    def types_demande(self):
+        return tuple(self.documents_par_demande)
+
+    def obtenir(self, doc_id):
+        return self.types.get(doc_id)
+
+    def nom_court(self, doc_id):
+        type_document = self.types.get(doc_id)
+        return type_document.nom_court if type_document else 'Document'
+
+    def categorie(self, doc_id):
+        type_document = self.types.get(doc_id)
+        return type_document.categorie if type_document else 'Général'
+
+    def verifier_piece(self, doc_id, nom_fichier, taille=None):
+        """Vérifie une pièce d'un type connu, retourne son TypeDocument (None pour un autre champ ou sans fichier)"""
+
+        type_document = self.types.get(doc_id)
+        if type_document is None or not nom_fichier:
+            return None
+        type_document.verifier(nom_fichier, taille)
+        return type_document
+
+    def verifier_contenu(self, doc_id, nom_fichier, debut):
+        type_document = self.types.get(doc_id)
+        if type_document is not None:
+            type_document.verifier_contenu(nom_fichier, debut)
+
+
+REGISTRE_DOCUMENTS = RegistreDocuments(
+    {
+        'versement': ['majProfil_doc', 'etudeSignee_doc', 'cniValide_doc', 'justifDom_doc', 'ribJour_doc',
+                      'justifProvenance_doc', 'justifDomImpot_doc', 'clauseBeneficiaire_doc'],
+        'rachat': ['majProfilRachat_doc', 'ribJourRachat_doc'],
+        'arbitrage': ['majProfilArbitrage_doc'],
+        'creation': ['ficheRenseignement_doc', 'profilClientSigne_doc', 'cartoClientSigne_doc',
+                     'lettreMiseRelation_doc', 'filSigne_doc', 'justifDomCreation_doc', 'cniValideCreation_doc'],
+    },
+    [
+        # Versement
+        TypeDocument('majProfil_doc', "MAJ & profil signés",
+                     "Document de mise à jour et profil client signés (validité 12 mois)",
+                     'MAJ_Profil', 'Profil Client'),
+        TypeDocument('etudeSignee_doc', "Etude signée",
+                     "Étude financière signée par le client",
+                     'Etude_Signee', 'Etudes'),
+        TypeDocument('cniValide_doc', "CNI en cours de validité",
+                     "Carte nationale d'identité en cours de validité",
+                     'CNI', 'Identité'),
+        TypeDocument('justifDom_doc', "Justificatif de domicile et avis d'imposition",
+                     "Justificatif de domicile de moins de 3 mois ET dernier avis d'imposition",
+                     'Justif_Domicile', 'Justificatifs'),
+        TypeDocument('ribJour_doc', "RIB à jour",
+                     "Relevé d'identité bancaire récent",
+                     'RIB', 'Bancaire'),
+        TypeDocument('justifProvenance_doc', "Justificatif de provenance des fonds",
+                     "Bulletin de salaire, relevé épargne, acte succession, donation, vente, certificat cession, "
+                     "attestation employeur, etc.",
+                     'Justif_Provenance', 'Justificatifs'),
+        TypeDocument('justifDomImpot_doc', "Justificatif domicile et impôt (copie)",
+                     "Copie supplémentaire du justificatif de domicile ET avis d'imposition",
+                     'Justif_Dom_Impot', 'Justificatifs'),
+        TypeDocument('clauseBeneficiaire_doc', "Clause bénéficiaire",
+                     "Document de désignation des bénéficiaires",
+                     'Clause_Beneficiaire', 'Bénéficiaires'),
+        # Rachat
+        TypeDocument('majProfilRachat_doc', "MAJ & profil signés",
+                     "Document de mise à jour et profil client signés (validité 12 mois)",
+                     'MAJ_Profil', 'Profil Client'),
+        TypeDocument('ribJourRachat_doc', "RIB à jour",
+                     "Relevé d'identité bancaire récent pour le virement",
+                     'RIB', 'Bancaire'),
+        # Arbitrage
+        TypeDocument('majProfilArbitrage_doc', "MAJ & profil signés",
+                     "Document de mise à jour et profil client signés (validité 12 mois)",
+                     'MAJ_Profil', 'Profil Client'),
+        # Création
+        TypeDocument('ficheRenseignement_doc', "Fiche de renseignement signée",
+                     "Fiche client complète avec informations personnelles et financières",
+                     'Fiche_Renseignement', 'Profil Client'),
+        TypeDocument('profilClientSigne_doc', "Profil client signé",
+                     "Document de profilage financier signé par le client",
+                     'Profil_Client', 'Profil Client'),
+        TypeDocument('cartoClientSigne_doc', "Cartographie client signée",
+                     "Document de cartographie patrimoniale signé",
+                     'Cartographie', 'Cartographie'),
+        TypeDocument('lettreMiseRelation_doc', "Lettre de mise en relation signée",
+                     "Lettre officielle de mise en relation signée",
+                     'Lettre_Relation', 'Relation Client'),
+        TypeDocument('filSigne_doc', "FIL signé",
+                     "Document FIL (Fiche d'Information Légale) signé",
+                     'FIL', 'Documents Légaux'),
+        TypeDocument('justifDomCreation_doc', "Justificatif domicile et avis d'imposition",
+                     "Justificatif de domicile de moins de 3 mois ET dernier avis d'imposition",
+                     'Justif_Domicile', 'Justificatifs'),
+        TypeDocument('cniValideCreation_doc', "CNI en cours de validité",
+                     "Carte nationale d'identité en cours de validité",
+                     'CNI', 'Identité'),
+    ]
+)
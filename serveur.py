@@ -0,0 +1,17 @@
+"""Serveur de développement (un seul processus): python serveur.py
+
+En production: gunicorn app:app (réglages dans gunicorn.conf.py, lu automatiquement).
+
+L'application n'est importée que sous `if __name__ == '__main__'`: les
+processus 'spawn' du pool d'optimisation réimportent le module principal,
+ce module-ci, et n'ont ainsi rien d'autre à charger que
+`optimisation_documents` (configuration, bases SQLite, journal et signaux
+ne sont initialisés que dans le serveur).
+"""
+
+import os
+
+if __name__ == '__main__':
+    from app import app
+
+    app.run(host='0.0.0.0', port=int(os.environ.get('PORT', 5000)), debug=False)
@@ -0,0 +1,330 @@
+import asyncio
+import base64
+import smtplib
+import ssl
+import time
+
+from metriques import mesurer
+
+
+def adresse_enveloppe(adresse):
+    """Adresse entre chevrons pour MAIL FROM / RCPT TO (`smtplib.quoteaddr`), refusée si elle contient CR ou LF"""
+
+    if '\r' in adresse or '\n' in adresse:
+        raise ValueError(f"Adresse d'enveloppe invalide (retour à la ligne): {adresse!r}")
+    return smtplib.quoteaddr(adresse)
+
+
+class ClientSMTPAsynchrone:
+    """Session SMTP sur les flux asyncio: aucune attente réseau ne bloque la boucle d'événements.
+
+    Les erreurs sont celles de `smtplib` (SMTPResponseException et dérivées,
+    SMTPServerDisconnected), si bien que `erreur_transitoire` et la logique de
+    nouvel essai s'appliquent telles quelles aux deux variantes.
+    """
+
+    def __init__(self, lecteur, ecrivain, timeout):
+        self.lecteur = lecteur
+        self.ecrivain = ecrivain
+        self.timeout = timeout
+        self.extensions = {}
+        self.chiffree = False
+        self.messages_envoyes = 0
+        self.dernier_usage = time.monotonic()
+
+    @classmethod
+    async def ouvrir(cls, serveur, port, utilisateur, mot_de_passe, starttls=True, timeout=60, auth_sans_tls=False):
+        with mesurer('smtp_connexion'):
+            lecteur, ecrivain = await asyncio.wait_for(asyncio.open_connection(serveur, port), timeout)
+        client = cls(lecteur, ecrivain, timeout)
+        try:
+            code, reponse = await client.lire_reponse()
+            if code != 220:
+                raise smtplib.SMTPConnectError(code, reponse)
+            await client.ehlo()
+
+            with mesurer('smtp_authentification'):
+                if starttls:
+                    await client.commande('STARTTLS', attendu=(220,))
+                    await ecrivain.start_tls(ssl.create_default_context(), server_hostname=serveur)
+                    client.chiffree = True
+                    await client.ehlo()
+                if utilisateur:
+                    await client.login(utilisateur, mot_de_passe, auth_sans_tls)
+        except BaseException:
+            client.fermer()
+            raise
+        return client
+
+    async def lire_reponse(self):
+        """Lit une réponse (éventuellement multiligne), retourne (code, texte)"""
+
+        lignes = []
+        while True:
+            ligne = await asyncio.wait_for(self.lecteur.readline(), self.timeout)
+            if not ligne:
+                self.fermer()
+                raise smtplib.SMTPServerDisconnected("Connexion fermée par le serveur")
+            lignes.append(ligne[4:].strip())
+            try:
+                code = int(ligne[:3])
+            except ValueError:
+                self.fermer()
+                raise smtplib.SMTPServerDisconnected(f"Réponse SMTP invalide: {ligne!r}")
+            if ligne[3:4] != b'-':
+                return code, b'\n'.join(lignes)
+
+    async def commande(self, ligne, attendu=(250,)):
+        self.ecrivain.write(ligne.encode('ascii') + b'\r\n')
+        await self.ecrivain.drain()
+        code, reponse = await self.lire_reponse()
+        if attendu and code not in attendu:
+            if code == 421:
+                self.fermer()
+            raise smtplib.SMTPResponseException(code, reponse)
+        return code, reponse
+
+    async def ehlo(self):
+        self.extensions = {}
+        code, reponse = await self.commande('EHLO formulaire-demandes', attendu=None)
+        if code != 250:
+            # Serveur non ESMTP: ni SIZE ni AUTH annoncés
+            await self.commande('HELO formulaire-demandes')
+            return
+
+        for ligne in reponse.decode('ascii', 'replace').split('\n')[1:]:
+            mot_cle, _, parametres = ligne.partition(' ')
+            self.extensions[mot_cle.lower()] = parametres
+
+    async def login(self, utilisateur, mot_de_passe, sans_tls=False):
+        """AUTH PLAIN ou LOGIN, comme `smtplib.SMTP.login`; jamais en clair sauf si `sans_tls` l'autorise"""
+
+        if not self.chiffree and not sans_tls:
+            raise smtplib.SMTPException(
+                "Identifiants SMTP non envoyés sur une connexion non chiffrée (SMTP_AUTH_SANS_TLS=1 pour l'autoriser)"
+            )
+        if 'auth' not in self.extensions:
+            raise smtplib.SMTPNotSupportedError("Extension SMTP AUTH non proposée par le serveur")
+
+        methodes = self.extensions['auth'].upper().split()
+        if 'PLAIN' not in methodes and 'LOGIN' not in methodes:
+            raise smtplib.SMTPException(f"Aucune méthode d'authentification prise en charge (serveur: {' '.join(methodes)})")
+        try:
+            if 'PLAIN' in methodes:
+                jeton = base64.b64encode(f"\0{utilisateur}\0{mot_de_passe}".encode('utf-8')).decode('ascii')
+                await self.commande(f'AUTH PLAIN {jeton}', attendu=(235,))
+            else:
+                await self.commande('AUTH LOGIN', attendu=(334,))
+                await self.commande(base64.b64encode(utilisateur.encode('utf-8')).decode('ascii'), attendu=(334,))
+                await self.commande(base64.b64encode(mot_de_passe.encode('utf-8')).decode('ascii'), attendu=(235,))
+        except smtplib.SMTPResponseException as e:
+            raise smtplib.SMTPAuthenticationError(e.smtp_code, e.smtp_error)
+
+    async def noop(self):
+        code, _ = await self.commande('NOOP', attendu=None)
+        return code
+
+    async def rset(self):
+        try:
+            await self.commande('RSET', attendu=None)
+        except (smtplib.SMTPException, OSError, asyncio.TimeoutError):
+            self.fermer()
+
+    async def envoyer_message(self, expediteur, destinataires, message):
+        """Équivalent asynchrone de `envoyer_message_streaming` (MAIL, RCPT, DATA bloc par bloc)"""
+
+        # Adresses vérifiées avant la première commande: une adresse invalide ne laisse pas de transaction ouverte
+        enveloppe_expediteur = adresse_enveloppe(expediteur)
+        enveloppes = [(destinataire, adresse_enveloppe(destinataire)) for destinataire in destinataires]
+
+        options = f" SIZE={message.taille()}" if 'size' in self.extensions else ''
+        code, reponse = await self.commande(f"MAIL FROM:{enveloppe_expediteur}{options}", attendu=None)
+        if code != 250:
+            if code == 421:
+                self.fermer()
+            else:
+                await self.rset()
+            raise smtplib.SMTPSenderRefused(code, reponse, expediteur)
+
+        refuses = {}
+        for destinataire, enveloppe in enveloppes:
+            code, reponse = await self.commande(f"RCPT TO:{enveloppe}", attendu=None)
+            if code not in (250, 251):
+                refuses[destinataire] = (code, reponse)
+            if code == 421:
+                self.fermer()
+                raise smtplib.SMTPRecipientsRefused(refuses)
+        if len(refuses) == len(destinataires):
+            await self.rset()
+            raise smtplib.SMTPRecipientsRefused(refuses)
+
+        code, reponse = await self.commande('DATA', attendu=None)
+        if code != 354:
+            await self.rset()
+            raise smtplib.SMTPDataError(code, reponse)
+
+        # Lecture disque et encodage base64 hors de la boucle, écriture avec contre-pression
+        blocs = message.blocs()
+        while True:
+            bloc = await asyncio.to_thread(next, blocs, None)
+            if bloc is None:
+                break
+            self.ecrivain.write(bloc)
+            await self.ecrivain.drain()
+
+        code, reponse = await self.commande('.', attendu=None)
+        if code != 250:
+            if code == 421:
+                self.fermer()
+            else:
+                await self.rset()
+            raise smtplib.SMTPDataError(code, reponse)
+
+        return refuses
+
+    async def quitter(self):
+        try:
+            await self.commande('QUIT', attendu=None)
+        except (smtplib.SMTPException, OSError, asyncio.TimeoutError):
+            pass
+        self.fermer()
+
+    def fermer(self):
+        if not self.ecrivain.is_closing():
+            self.ecrivain.close()
+
+    @property
+    def ouverte(self):
+        return not self.ecrivain.is_closing()
+
+
+class PoolSMTPAsynchrone:
+    """Équivalent de `PoolSMTP` pour une boucle d'événements (une instance par boucle).
+
+    Mêmes règles: connexion inactive vérifiée par NOOP avant réutilisation,
+    fermée après `max_messages_par_connexion` envois ou `delai_inactivite`
+    secondes sans usage, action rejouée une fois si une connexion réutilisée
+    a été coupée par le serveur. Au plus `max_connexions` sessions sont
+    ouvertes en même temps: un relais refuse ou ralentit au-delà de quelques
+    dizaines de connexions par client, les envois suivants attendent leur tour.
+    """
+
+    def __init__(self, max_messages_par_connexion=50, max_connexions_inactives=4,
+                 delai_inactivite=60, timeout=60, max_connexions=20, auth_sans_tls=False):
+        self.max_messages_par_connexion = max_messages_par_connexion
+        self.max_connexions_inactives = max_connexions_inactives
+        self.max_connexions = max_connexions
+        self.delai_inactivite = delai_inactivite
+        self.timeout = timeout
+        # Identifiants envoyés même sans STARTTLS (relais local de confiance uniquement)
+        self.auth_sans_tls = auth_sans_tls
+
+        self._inactives = {}
+        self._boucle = None
+        self._sessions = None
+        self.statistiques = {'ouvertures': 0, 'reutilisations': 0, 'reconnexions': 0}
+        self.dernier_succes = None
+        self.derniere_erreur = None
+
+    def _limite(self):
+        # Sémaphore propre à la boucle courante (une boucle par serveur démarré)
+        boucle = asyncio.get_running_loop()
+        if self._boucle is not boucle:
+            self._boucle = boucle
+            self._sessions = asyncio.Semaphore(self.max_connexions)
+        return self._sessions
+
+    async def _ouvrir(self, cle):
+        serveur, port, utilisateur, mot_de_passe, starttls = cle
+        client = await ClientSMTPAsynchrone.ouvrir(
+            serveur, port, utilisateur, mot_de_passe, starttls=starttls, timeout=self.timeout,
+            auth_sans_tls=self.auth_sans_tls
+        )
+        self.statistiques['ouvertures'] += 1
+        return client
+
+    async def _prendre(self, cle):
+        connexions = self._inactives.get(cle)
+        while connexions:
+            client = connexions.pop()
+
+            if time.monotonic() - client.dernier_usage > self.delai_inactivite or not client.ouverte:
+                await client.quitter()
+                continue
+
+            try:
+                code = await client.noop()
+            except (smtplib.SMTPException, OSError, asyncio.TimeoutError):
+                code = None
+
+            if code == 250:
+                self.statistiques['reutilisations'] += 1
+                return client
+
+            client.fermer()
+        return None
+
+    async def _rendre(self, cle, client):
+        client.messages_envoyes += 1
+        client.dernier_usage = time.monotonic()
+
+        connexions = self._inactives.setdefault(cle, [])
+        if client.messages_envoyes >= self.max_messages_par_connexion or len(connexions) >= self.max_connexions_inactives:
+            await client.quitter()
+            return
+        connexions.append(client)
+
+    async def executer(self, serveur, port, utilisateur, mot_de_passe, action, starttls=True):
+        """Exécute `await action(client)` sur une connexion du pool et retourne son résultat"""
+
+        async with self._limite():
+            try:
+                resultat = await self._executer((serveur, port, utilisateur, mot_de_passe, starttls), action)
+            except Exception as e:
+                self.derniere_erreur = (time.time(), f"{type(e).__name__}: {e}")
+                raise
+        self.dernier_succes = time.time()
+        return resultat
+
+    async def _executer(self, cle, action):
+        client = await self._prendre(cle)
+        reutilisee = client is not None
+        if client is None:
+            client = await self._ouvrir(cle)
+
+        try:
+            resultat = await action(client)
+        except smtplib.SMTPServerDisconnected:
+            client.fermer()
+            if not reutilisee:
+                raise
+            self.statistiques['reconnexions'] += 1
+            client = await self._ouvrir(cle)
+            try:
+                resultat = await action(client)
+            except BaseException:
+                client.fermer()
+                raise
+        except BaseException:
+            # État de la session inconnu après une erreur (ou annulation): on ne la réutilise pas
+            client.fermer()
+            raise
+
+        await self._rendre(cle, client)
+        return resultat
+
+    def etat(self):
+        """Même contenu que `PoolSMTP.etat`"""
+
+        erreur = self.derniere_erreur
+        return {
+            'dernier_succes': self.dernier_succes,
+            'derniere_erreur': erreur[0] if erreur else None,
+            'erreur': erreur[1] if erreur else None
+        }
+
+    async def fermer_tout(self):
+        connexions = [c for liste in self._inactives.values() for c in liste]
+        self._inactives.clear()
+        for client in connexions:
+            await client.quitter()
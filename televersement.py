@@ -0,0 +1,276 @@
+import fcntl
+import hashlib
+import os
+import shutil
+import sqlite3
+import time
+import uuid
+from contextlib import closing
+
+from cache_contenu import lier_ou_copier
+
+TAILLE_BLOC_LECTURE = 1024 * 1024
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS televersements (
+    id TEXT PRIMARY KEY,
+    nom TEXT NOT NULL,
+    type_mime TEXT,
+    taille INTEGER NOT NULL,
+    recu INTEGER NOT NULL DEFAULT 0,
+    sha256_attendu TEXT,
+    sha256 TEXT,
+    taille_optimisee INTEGER,
+    cree_le REAL NOT NULL,
+    maj_le REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS idx_televersements_maj ON televersements (maj_le);
+"""
+
+
+class ErreurTeleversement(Exception):
+    """Erreur de téléversement avec le code HTTP à renvoyer (et l'offset attendu en cas de décalage)"""
+
+    def __init__(self, code, message, recu=None):
+        super().__init__(message)
+        self.code = code
+        self.message = message
+        self.recu = recu
+
+
+class FichierTeleverse:
+    """Fichier finalisé de la zone de téléversement, accepté par `preparer_fichiers_zeendoc`.
+
+    `taille_optimisee` est renseignée quand l'optimisation lancée à la
+    finalisation est terminée, `chemin_optimise` seulement si elle a réduit le fichier.
+    """
+
+    def __init__(self, televersement_id, filename, content_type, chemin, sha256, taille,
+                 chemin_optimise=None, taille_optimisee=None):
+        self.televersement_id = televersement_id
+        self.filename = filename
+        self.content_type = content_type
+        self.chemin = chemin
+        self.sha256 = sha256
+        self.taille = taille
+        self.chemin_optimise = chemin_optimise
+        self.taille_optimisee = taille_optimisee
+
+
+class ZoneTeleversements:
+    """Zone de transit des téléversements par morceaux, partagée par tous les processus.
+
+    Un téléversement est créé avec sa taille totale, reçoit ses morceaux dans
+    l'ordre (l'offset de chaque morceau doit être égal au nombre d'octets déjà
+    reçus, ce qui permet de reprendre après une coupure), puis est finalisé:
+    empreinte SHA-256 calculée en une lecture, comparée à celle annoncée, et
+    contenu rangé dans le stock de contenus. Le dossier du téléversement garde
+    un lien physique vers le contenu jusqu'à son utilisation par une demande.
+
+    `a_la_suppression(televersement_id)` est appelée pour chaque téléversement
+    supprimé (utilisé ou expiré): l'état qu'un processus y associe est oublié.
+    """
+
+    def __init__(self, dossier, chemin_base, stock, taille_max, duree_vie, a_la_suppression=None):
+        self.dossier = dossier
+        self.chemin_base = chemin_base
+        self.stock = stock
+        self.taille_max = taille_max
+        self.duree_vie = duree_vie
+        self.a_la_suppression = a_la_suppression
+        os.makedirs(dossier, exist_ok=True)
+        with closing(self._connexion()) as conn:
+            conn.executescript(SCHEMA)
+
+    def _connexion(self):
+        conn = sqlite3.connect(self.chemin_base, timeout=30, isolation_level=None)
+        conn.row_factory = sqlite3.Row
+        conn.execute('PRAGMA journal_mode=WAL')
+        return conn
+
+    def _chemin(self, televersement_id, nom='donnees'):
+        return os.path.join(self.dossier, televersement_id, nom)
+
+    def _lire(self, conn, televersement_id):
+        ligne = conn.execute("SELECT * FROM televersements WHERE id = ?", (televersement_id,)).fetchone()
+        if ligne is None:
+            raise ErreurTeleversement(404, "Téléversement inconnu ou expiré.")
+        return ligne
+
+    def creer(self, nom, taille, type_mime=None, sha256=None):
+        if not nom:
+            raise ErreurTeleversement(400, "Nom de fichier manquant.")
+        if not isinstance(taille, int) or taille < 0:
+            raise ErreurTeleversement(400, "Taille de fichier invalide.")
+        if taille > self.taille_max:
+            raise ErreurTeleversement(413, f"Fichier trop volumineux (maximum {self.taille_max // (1024 * 1024)} Mo).")
+
+        self.purger()
+
+        televersement_id = uuid.uuid4().hex
+        os.makedirs(os.path.join(self.dossier, televersement_id))
+        open(self._chemin(televersement_id), 'wb').close()
+
+        maintenant = time.time()
+        with closing(self._connexion()) as conn:
+            conn.execute(
+                """INSERT INTO televersements (id, nom, type_mime, taille, sha256_attendu, cree_le, maj_le)
+                   VALUES (?, ?, ?, ?, ?, ?, ?)""",
+                (televersement_id, nom, type_mime, taille, (sha256 or '').lower() or None, maintenant, maintenant)
+            )
+        return televersement_id
+
+    def etat(self, televersement_id):
+        with closing(self._connexion()) as conn:
+            ligne = self._lire(conn, televersement_id)
+        return {
+            'id': ligne['id'],
+            'nom': ligne['nom'],
+            'taille': ligne['taille'],
+            'recu': ligne['recu'],
+            'finalise': ligne['sha256'] is not None,
+            'sha256': ligne['sha256']
+        }
+
+    def ecrire_morceau(self, televersement_id, offset, donnees, sha256_morceau=None):
+        """Écrit un morceau à `offset`, retourne le nombre total d'octets reçus"""
+
+        if sha256_morceau and hashlib.sha256(donnees).hexdigest() != sha256_morceau.lower():
+            raise ErreurTeleversement(400, "Empreinte SHA-256 du morceau invalide, morceau à renvoyer.")
+
+        try:
+            fichier = open(self._chemin(televersement_id), 'r+b')
+        except FileNotFoundError:
+            # Données déjà rangées dans le stock, ou téléversement inconnu (404)
+            etat = self.etat(televersement_id)
+            raise ErreurTeleversement(409, "Téléversement déjà finalisé.", recu=etat['recu'])
+
+        with fichier:
+            # Verrou par téléversement: deux envois du même morceau ne s'entrelacent pas
+            fcntl.flock(fichier, fcntl.LOCK_EX)
+            with closing(self._connexion()) as conn:
+                ligne = self._lire(conn, televersement_id)
+                if ligne['sha256'] is not None:
+                    raise ErreurTeleversement(409, "Téléversement déjà finalisé.", recu=ligne['recu'])
+                if offset != ligne['recu']:
+                    raise ErreurTeleversement(409, f"Offset attendu: {ligne['recu']}.", recu=ligne['recu'])
+                if offset + len(donnees) > ligne['taille']:
+                    raise ErreurTeleversement(413, "Le morceau dépasse la taille annoncée du fichier.", recu=ligne['recu'])
+
+                fichier.seek(offset)
+                fichier.write(donnees)
+                fichier.truncate()
+                fichier.flush()
+                os.fsync(fichier.fileno())
+
+                recu = offset + len(donnees)
+                conn.execute("UPDATE televersements SET recu = ?, maj_le = ? WHERE id = ?",
+                             (recu, time.time(), televersement_id))
+        return recu
+
+    def finaliser(self, televersement_id):
+        """Vérifie le fichier complet et le range dans le stock, retourne son état"""
+
+        chemin = self._chemin(televersement_id)
+        try:
+            fichier = open(chemin, 'rb')
+        except FileNotFoundError:
+            # Déjà rangé dans le stock (finalisation répétée) ou inconnu
+            return self.etat(televersement_id)
+
+        with fichier:
+            fcntl.flock(fichier, fcntl.LOCK_EX)
+            with closing(self._connexion()) as conn:
+                ligne = self._lire(conn, televersement_id)
+            if ligne['sha256'] is not None:
+                return self.etat(televersement_id)
+            if ligne['recu'] != ligne['taille']:
+                raise ErreurTeleversement(409, f"Fichier incomplet: {ligne['recu']}/{ligne['taille']} octets reçus.",
+                                          recu=ligne['recu'])
+
+            hachage = hashlib.sha256()
+            for bloc in iter(lambda: fichier.read(TAILLE_BLOC_LECTURE), b''):
+                hachage.update(bloc)
+            sha256 = hachage.hexdigest()
+
+            if ligne['sha256_attendu'] and sha256 != ligne['sha256_attendu']:
+                # Contenu corrompu: on repart de zéro
+                os.truncate(chemin, 0)
+                with closing(self._connexion()) as conn:
+                    conn.execute("UPDATE televersements SET recu = 0, maj_le = ? WHERE id = ?",
+                                 (time.time(), televersement_id))
+                raise ErreurTeleversement(422, "Empreinte SHA-256 différente de celle annoncée, fichier à renvoyer.",
+                                          recu=0)
+
+            # Contenu rangé dans le stock, lien physique conservé ici jusqu'à l'utilisation
+            # (créé par le stock sous son verrou, celui d'une finalisation interrompue est remplacé)
+            lien = self._chemin(televersement_id, 'contenu')
+            try:
+                os.remove(lien)
+            except FileNotFoundError:
+                pass
+            self.stock.stocker(chemin, sha256, ligne['taille'], lien)
+
+            with closing(self._connexion()) as conn:
+                conn.execute("UPDATE televersements SET sha256 = ?, maj_le = ? WHERE id = ?",
+                             (sha256, time.time(), televersement_id))
+        return self.etat(televersement_id)
+
+    def chemin_optimise(self, televersement_id):
+        return self._chemin(televersement_id, 'optimise')
+
+    def preparer_optimisation(self, televersement_id):
+        """Copie de travail (lien physique) à optimiser en place, l'original reste intact"""
+
+        chemin = self.chemin_optimise(televersement_id)
+        _lier(self._chemin(televersement_id, 'contenu'), chemin)
+        return chemin
+
+    def marquer_optimise(self, televersement_id, taille_optimisee):
+        """Enregistre le résultat de l'optimisation (taille inchangée si elle n'a rien gagné)"""
+
+        with closing(self._connexion()) as conn:
+            conn.execute("UPDATE televersements SET taille_optimisee = ?, maj_le = ? WHERE id = ?",
+                         (taille_optimisee, time.time(), televersement_id))
+
+    def obtenir_fichier(self, televersement_id):
+        """Retourne le FichierTeleverse d'un téléversement finalisé"""
+
+        with closing(self._connexion()) as conn:
+            ligne = self._lire(conn, televersement_id)
+        if ligne['sha256'] is None:
+            raise ErreurTeleversement(409, f"Téléversement {televersement_id} non finalisé.", recu=ligne['recu'])
+
+        reduit = ligne['taille_optimisee'] is not None and ligne['taille_optimisee'] < ligne['taille']
+        return FichierTeleverse(
+            televersement_id, ligne['nom'], ligne['type_mime'],
+            self._chemin(televersement_id, 'contenu'), ligne['sha256'], ligne['taille'],
+            chemin_optimise=self.chemin_optimise(televersement_id) if reduit else None,
+            taille_optimisee=ligne['taille_optimisee']
+        )
+
+    def supprimer(self, televersement_id):
+        with closing(self._connexion()) as conn:
+            conn.execute("DELETE FROM televersements WHERE id = ?", (televersement_id,))
+        shutil.rmtree(os.path.join(self.dossier, televersement_id), ignore_errors=True)
+        if self.a_la_suppression:
+            self.a_la_suppression(televersement_id)
+
+    def purger(self):
+        """Supprime les téléversements inutilisés depuis plus de `duree_vie` secondes"""
+
+        with closing(self._connexion()) as conn:
+            expires = [ligne['id'] for ligne in conn.execute(
+                "SELECT id FROM televersements WHERE maj_le < ?", (time.time() - self.duree_vie,)
+            )]
+        for televersement_id in expires:
+            self.supprimer(televersement_id)
+
+
+def _lier(source, destination):
+    # Remplace un lien laissé par une tentative précédente
+    try:
+        os.remove(destination)
+    except FileNotFoundError:
+        pass
+    lier_ou_copier(source, destination)
@@ -0,0 +1,10 @@
+import os
+import sys
+import tempfile
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+# Avant l'import de app: données dans un dossier temporaire, ni optimisation ni file d'envoi
+os.environ.setdefault('DOSSIER_DONNEES', tempfile.mkdtemp(prefix='tests_donnees_'))
+os.environ.setdefault('OPTIMISATION_DOCUMENTS', '0')
+os.environ.setdefault('ENVOI_ASYNCHRONE', '0')
@@ -0,0 +1,84 @@
+"""Archive ZIP construite en parallèle: relue par `zipfile`, méthode choisie selon le type de fichier"""
+
+import os
+import zipfile
+
+import pytest
+
+from archive_zip import construire_archive_zip
+
+
+@pytest.fixture
+def pieces(tmp_path):
+    contenus = {
+        'releve.txt': "Relevé de compte, ligne répétée\n".encode('utf-8') * 5000,
+        'photo.jpg': b'\xff\xd8\xff\xe0' + os.urandom(300_000),
+        'vide.csv': b'',
+        'aléatoire.bin': os.urandom(50_000),
+        'déclaration été.txt': "Données accentuées ".encode('utf-8') * 1000,
+    }
+    for nom, contenu in contenus.items():
+        (tmp_path / nom).write_bytes(contenu)
+    return contenus
+
+
+def construire(tmp_path, contenus, **options):
+    chemin = str(tmp_path / 'sortie.zip')
+    membres = [(str(tmp_path / nom), f"Dossier client/{nom}") for nom in contenus]
+    resultat = construire_archive_zip(membres, chemin, lambda fichier: open(fichier, 'rb'), **options)
+    return chemin, resultat
+
+
+@pytest.mark.parametrize('nb_threads', [1, 4])
+def test_archive_relue_sans_erreur(tmp_path, pieces, nb_threads):
+    chemin, resultat = construire(tmp_path, pieces, nb_threads=nb_threads)
+
+    assert len(resultat) == len(pieces)
+    with zipfile.ZipFile(chemin) as archive:
+        assert archive.testzip() is None
+        assert archive.namelist() == [f"Dossier client/{nom}" for nom in pieces]
+        for nom, contenu in pieces.items():
+            assert archive.read(f"Dossier client/{nom}") == contenu
+
+
+def test_methode_selon_le_type_de_fichier(tmp_path, pieces):
+    chemin, _ = construire(tmp_path, pieces)
+
+    with zipfile.ZipFile(chemin) as archive:
+        methodes = {info.filename.split('/', 1)[1]: info.compress_type for info in archive.infolist()}
+        tailles = {info.filename.split('/', 1)[1]: info.compress_size for info in archive.infolist()}
+
+    assert methodes['photo.jpg'] == zipfile.ZIP_STORED
+    assert methodes['releve.txt'] == zipfile.ZIP_DEFLATED
+    assert tailles['releve.txt'] < len(pieces['releve.txt']) // 10
+    # Données incompressibles: stockées telles quelles faute de gain suffisant
+    assert methodes['aléatoire.bin'] == zipfile.ZIP_STORED
+
+
+def test_noms_accentues_en_utf8(tmp_path, pieces):
+    chemin, _ = construire(tmp_path, pieces)
+
+    with zipfile.ZipFile(chemin) as archive:
+        info = archive.getinfo("Dossier client/déclaration été.txt")
+        assert info.flag_bits & 0x800
+        assert not archive.getinfo("Dossier client/releve.txt").flag_bits & 0x800
+
+
+def test_membres_retournes_avec_crc_et_tailles(tmp_path, pieces):
+    chemin, resultat = construire(tmp_path, pieces)
+
+    with zipfile.ZipFile(chemin) as archive:
+        for membre in resultat:
+            info = archive.getinfo(membre.nom_archive)
+            assert (membre.crc, membre.taille, membre.taille_compressee) == (
+                info.CRC, info.file_size, info.compress_size
+            )
+
+
+def test_archive_sans_membre(tmp_path):
+    chemin, resultat = construire(tmp_path, {})
+
+    assert resultat == []
+    with zipfile.ZipFile(chemin) as archive:
+        assert archive.testzip() is None
+        assert archive.namelist() == []
@@ -0,0 +1,120 @@
+"""Invariants du découpage ZeenDoc (`diviser_fichiers_par_taille`) et reprise d'un plan enregistré"""
+
+import random
+
+import pytest
+
+import app as application
+from benchmarks.dossiers_synthetiques import generer_pieces
+
+MODES = ('best_fit', 'first_fit', 'sequentiel')
+LIMITE_MO = 5
+LIMITE_BYTES = LIMITE_MO * 1024 * 1024 - application.ENTETE_EMAIL_MIME
+
+
+def generer_dossier(alea):
+    type_demande, pieces = generer_pieces(alea, echelle=0.5)
+    return [
+        {
+            'nom': f"{type_demande.upper()}_DUPONT_Jean_{index}_{piece['nom_fichier']}",
+            'taille': piece['taille'],
+            'categorie': application.obtenir_categorie_document(piece['doc_id']),
+        }
+        for index, piece in enumerate(pieces)
+    ]
+
+
+def dossiers(nombre=200, graine=7):
+    alea = random.Random(graine)
+    return [generer_dossier(alea) for _ in range(nombre)]
+
+
+def fichier(nom, taille_mo, categorie='Identité'):
+    return {'nom': nom, 'taille': int(taille_mo * 1024 * 1024), 'categorie': categorie}
+
+
+@pytest.fixture(scope='module')
+def dossiers_synthetiques():
+    return dossiers()
+
+
+@pytest.mark.parametrize('mode', MODES)
+def test_chaque_fichier_une_seule_fois(dossiers_synthetiques, mode):
+    for fichiers in dossiers_synthetiques:
+        groupes = application.diviser_fichiers_par_taille(fichiers, limite_mb=LIMITE_MO, mode=mode)
+        assert sorted(id(f) for g in groupes for f in g) == sorted(id(f) for f in fichiers)
+        assert all(groupes)
+
+
+@pytest.mark.parametrize('mode', MODES)
+def test_aucune_partie_au_dela_de_la_limite(dossiers_synthetiques, mode):
+    for fichiers in dossiers_synthetiques:
+        for groupe in application.diviser_fichiers_par_taille(fichiers, limite_mb=LIMITE_MO, mode=mode):
+            taille = sum(application.taille_encodee(f) for f in groupe)
+            # Seul un fichier trop volumineux à lui seul peut dépasser, et il est alors isolé
+            assert taille <= LIMITE_BYTES or len(groupe) == 1
+
+
+@pytest.mark.parametrize('mode', ('best_fit', 'first_fit'))
+def test_jamais_plus_de_parties_que_sequentiel(dossiers_synthetiques, mode):
+    for fichiers in dossiers_synthetiques:
+        sequentiel = application.diviser_fichiers_par_taille(fichiers, limite_mb=LIMITE_MO, mode='sequentiel')
+        groupes = application.diviser_fichiers_par_taille(fichiers, limite_mb=LIMITE_MO, mode=mode)
+        assert len(groupes) <= len(sequentiel)
+
+
+@pytest.mark.parametrize('mode', MODES)
+def test_fichier_volumineux_isole(mode):
+    fichiers = [fichier('a.pdf', 1), fichier('gros.pdf', 8, 'Revenus'), fichier('b.pdf', 1), fichier('c.jpg', 2)]
+    groupes = application.diviser_fichiers_par_taille(fichiers, limite_mb=LIMITE_MO, mode=mode)
+    assert [fichiers[1]] in groupes
+    assert sum(len(g) for g in groupes) == len(fichiers)
+
+
+@pytest.mark.parametrize('mode', MODES)
+def test_ordre_d_upload_conserve_dans_chaque_partie(dossiers_synthetiques, mode):
+    for fichiers in dossiers_synthetiques:
+        rang = {id(f): i for i, f in enumerate(fichiers)}
+        for groupe in application.diviser_fichiers_par_taille(fichiers, limite_mb=LIMITE_MO, mode=mode):
+            assert [rang[id(f)] for f in groupe] == sorted(rang[id(f)] for f in groupe)
+
+
+def plan_enregistre(groupes, statuts, exclus=()):
+    """Plan tel que l'enregistre `rappel_progression` (une entrée par partie, plus les fichiers non envoyés)"""
+
+    total = len(groupes)
+    plan = [
+        {'partie': f"{index}/{total}", 'statut': statut, 'fichiers': [f['nom'] for f in groupe]}
+        for index, (groupe, statut) in enumerate(zip(groupes, statuts), 1)
+    ]
+    if exclus:
+        plan.append({'partie': 'non_envoye', 'statut': 'echec', 'fichiers': [f['nom'] for g in exclus for f in g]})
+    return plan
+
+
+def test_reprise_plan_avec_parties_deja_envoyees(dossiers_synthetiques):
+    fichiers = max(dossiers_synthetiques, key=len)
+    groupes = application.diviser_fichiers_par_taille(fichiers, limite_mb=LIMITE_MO)
+    assert len(groupes) >= 3
+    statuts = ['envoye', 'echec'] + ['envoye'] * (len(groupes) - 3) + ['en_attente']
+    plan = plan_enregistre(groupes[:-1], statuts[:-1], exclus=groupes[-1:])
+
+    # À la reprise, les pièces sont relues dans un autre ordre: le plan enregistré fait foi
+    pieces_reprise = [dict(f) for f in reversed(fichiers)]
+    groupes_repris, groupes_exclus, parties_envoyees = application.reconstruire_plan_zeendoc(plan, pieces_reprise)
+
+    assert [[f['nom'] for f in g] for g in groupes_repris] == [[f['nom'] for f in g] for g in groupes[:-1]]
+    assert [[f['nom'] for f in g] for g in groupes_exclus] == [[f['nom'] for f in groupes[-1]]]
+    assert parties_envoyees == {i for i, statut in enumerate(statuts[:-1], 1) if statut == 'envoye'}
+    assert 2 not in parties_envoyees
+
+
+def test_reprise_ignore_les_fichiers_disparus():
+    fichiers = [fichier('a.pdf', 1), fichier('b.pdf', 1), fichier('c.pdf', 4)]
+    plan = plan_enregistre([fichiers[:2], fichiers[2:]], ['envoye', 'en_attente'])
+
+    groupes, exclus, parties_envoyees = application.reconstruire_plan_zeendoc(plan, [fichiers[0], fichiers[2]])
+
+    assert groupes == [[fichiers[0]], [fichiers[2]]]
+    assert exclus == []
+    assert parties_envoyees == {1}
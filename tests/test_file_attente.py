@@ -0,0 +1,153 @@
+"""File d'envois durable: bail, reprise après expiration, nombre maximal de tentatives, purge"""
+
+import pytest
+
+import file_attente
+from file_attente import FileAttenteEnvois
+
+
+class Horloge:
+    def __init__(self, debut=1_000_000.0):
+        self.maintenant = debut
+
+    def __call__(self):
+        return self.maintenant
+
+    def avancer(self, secondes):
+        self.maintenant += secondes
+
+
+@pytest.fixture
+def horloge(monkeypatch):
+    horloge = Horloge()
+    monkeypatch.setattr(file_attente.time, 'time', horloge)
+    return horloge
+
+
+def creer_file(tmp_path, **options):
+    # Aucun thread: les réservations sont faites par le test, dans l'ordre voulu
+    return FileAttenteEnvois(str(tmp_path / 'file.db'), traiter=None, nb_workers=0, **options)
+
+
+def test_demande_reservee_une_seule_fois_pendant_le_bail(tmp_path, horloge):
+    file = creer_file(tmp_path, duree_bail=60)
+    demande_id = file.ajouter({'secteur': 'Paris'})
+
+    assert file._reserver_prochaine() == (demande_id, {'secteur': 'Paris'})
+    assert file._reserver_prochaine() is None
+
+    horloge.avancer(59)
+    assert file._reserver_prochaine() is None
+    assert file.obtenir_statut(demande_id)['etat'] == file_attente.STATUT_EN_COURS
+
+
+def test_demande_reprise_apres_expiration_du_bail(tmp_path, horloge):
+    file = creer_file(tmp_path, duree_bail=60)
+    demande_id = file.ajouter({'secteur': 'Paris'})
+    file._reserver_prochaine()
+
+    horloge.avancer(61)
+    assert file._reserver_prochaine() == (demande_id, {'secteur': 'Paris'})
+    assert file.obtenir_statut(demande_id)['tentatives'] == 2
+
+
+def test_progression_d_une_partie_prolonge_le_bail(tmp_path, horloge):
+    file = creer_file(tmp_path, duree_bail=60)
+    demande_id = file.ajouter({})
+    file._reserver_prochaine()
+
+    horloge.avancer(50)
+    file.mettre_a_jour_partie(demande_id, '1/2', 1, 'envoye')
+    horloge.avancer(50)
+    assert file._reserver_prochaine() is None
+
+
+def test_echec_au_dela_du_nombre_maximal_de_tentatives(tmp_path, horloge):
+    file = creer_file(tmp_path, duree_bail=60, max_tentatives=2)
+    demande_id = file.ajouter({})
+
+    for _ in range(2):
+        assert file._reserver_prochaine() is not None
+        horloge.avancer(61)
+    assert file._reserver_prochaine() is None
+
+    statut = file.obtenir_statut(demande_id)
+    assert statut['etat'] == file_attente.STATUT_ECHEC
+    assert statut['erreur'] == "Nombre maximal de tentatives atteint"
+
+
+def test_demande_suivante_reservee_apres_une_demande_epuisee(tmp_path, horloge):
+    file = creer_file(tmp_path, duree_bail=60, max_tentatives=1)
+    epuisee = file.ajouter({'rang': 1})
+    file._reserver_prochaine()
+    horloge.avancer(61)
+    suivante = file.ajouter({'rang': 2})
+
+    assert file._reserver_prochaine() == (suivante, {'rang': 2})
+    assert file.obtenir_statut(epuisee)['etat'] == file_attente.STATUT_ECHEC
+
+
+def test_reprise_conserve_les_parties_deja_envoyees(tmp_path, horloge):
+    file = creer_file(tmp_path)
+    demande_id = file.ajouter({})
+    file._reserver_prochaine()
+    file.mettre_a_jour_partie(demande_id, '1/2', 1, 'envoye', fichiers=['a.pdf'])
+    file.mettre_a_jour_partie(demande_id, '2/2', 2, 'echec', fichiers=['b.pdf'])
+    file.terminer(demande_id, file_attente.STATUT_ECHEC, erreur="Relais indisponible")
+
+    assert file.reprendre(demande_id) is True
+    assert file.reprendre(demande_id) is False
+    assert file.reprendre('inconnue') is None
+    assert file._reserver_prochaine() == (demande_id, {})
+    assert file.obtenir_parties(demande_id)['1/2'] == {'ordre': 1, 'statut': 'envoye', 'fichiers': ['a.pdf']}
+
+
+def test_purge_des_demandes_anciennes(tmp_path, horloge):
+    liberes = []
+    file = creer_file(tmp_path, duree_conservation=3600, liberer=liberes.append)
+    ancienne = file.ajouter({'dossier_fichiers': 'ancienne'})
+    file._reserver_prochaine()
+    file.mettre_a_jour_partie(ancienne, '1/1', 1, 'echec')
+    file.terminer(ancienne, file_attente.STATUT_ECHEC, erreur="Relais indisponible")
+
+    horloge.avancer(1800)
+    recente = file.ajouter({'dossier_fichiers': 'recente'})
+    file._reserver_prochaine()
+    file.terminer(recente, file_attente.STATUT_TERMINE, resultat={'envoi_auto': True})
+    en_attente = file.ajouter({'dossier_fichiers': 'en_attente'})
+
+    horloge.avancer(1801)
+    assert file.purger() == 1
+    assert liberes == [{'dossier_fichiers': 'ancienne'}]
+    assert file.obtenir_statut(ancienne) is None
+    assert file.obtenir_parties(ancienne) == {}
+    assert file.obtenir_statut(recente)['etat'] == file_attente.STATUT_TERMINE
+
+    # Jamais purgée tant qu'elle n'est ni terminée ni en échec
+    horloge.avancer(7200)
+    assert file.purger() == 1
+    assert file.obtenir_statut(recente) is None
+    assert file.obtenir_statut(en_attente)['etat'] == file_attente.STATUT_EN_ATTENTE
+
+
+def test_worker_traite_et_termine_la_demande(tmp_path):
+    traitees = []
+
+    def traiter(demande_id, payload):
+        traitees.append(demande_id)
+        return {'envoi_auto': payload['ok']}
+
+    file = FileAttenteEnvois(str(tmp_path / 'file.db'), traiter, nb_workers=1, delai_scrutation=0.01)
+    reussie = file.ajouter({'ok': True})
+    echouee = file.ajouter({'ok': False})
+    try:
+        for _ in range(500):
+            if file.compter_actives() == {file_attente.STATUT_EN_ATTENTE: 0, file_attente.STATUT_EN_COURS: 0}:
+                break
+            file._reveil.wait(0.01)
+    finally:
+        file.arreter(5)
+
+    assert traitees == [reussie, echouee]
+    assert file.obtenir_statut(reussie)['etat'] == file_attente.STATUT_TERMINE
+    assert file.obtenir_statut(echouee)['etat'] == file_attente.STATUT_ECHEC
@@ -0,0 +1,129 @@
+"""Historique des envois: pagination par curseur, filtres, détail des emails d'un envoi"""
+
+import pytest
+
+from historique_envois import HistoriqueEnvois, decoder_curseur, horodatage_jour, normaliser_client
+
+DEBUT = 1_700_000_000.0
+
+
+def envoi(numero, client, secteur='Paris', horodatage=None, **champs):
+    return {
+        'id': f"envoi-{numero:03d}",
+        'horodatage': DEBUT + numero if horodatage is None else horodatage,
+        'client': client,
+        'client_cle': normaliser_client(client),
+        'type_demande': 'particulier',
+        'secteur': secteur,
+        'fichiers_count': 1,
+        'taille_totale': 1000,
+        'taille_originale': 1200,
+        'deja_deposes': 0,
+        'emails_zeendoc': 1,
+        'email_principal': True,
+        'zeendoc_reussi': True,
+        'envoi_auto': True,
+        **champs
+    }
+
+
+def partie(nom, ordre, succes=True):
+    return {'partie': nom, 'ordre': ordre, 'destinataire': f"{nom}@exemple.fr", 'fichiers_count': 1,
+            'taille': 1000, 'succes': succes, 'deja_envoye': False,
+            'fichiers': [{'nom': 'facture.pdf', 'sha256': 'ab', 'taille': 1000}]}
+
+
+@pytest.fixture
+def historique(tmp_path):
+    historique = HistoriqueEnvois(str(tmp_path / 'historique.db'))
+    yield historique
+    historique.arreter()
+
+
+def remplir(historique, envois):
+    for element in envois:
+        historique.enregistrer(element, [partie('principal', 0)])
+    # Attend l'écriture des envois en file
+    historique.arreter()
+
+
+def parcourir(historique, **filtres):
+    pages, curseur = [], None
+    while True:
+        envois, curseur = historique.rechercher(apres=curseur, **filtres)
+        pages.append([e['id'] for e in envois])
+        if curseur is None:
+            return pages
+
+
+def test_pagination_complete_sans_doublon(historique):
+    # Deux envois à la même seconde: départagés par leur identifiant
+    envois = [envoi(n, f"CLIENT{n} Jean") for n in range(7)] + [envoi(7, "MARTIN Paul", horodatage=DEBUT + 6)]
+    remplir(historique, envois)
+
+    pages = parcourir(historique, limite=3)
+    assert pages == [
+        ['envoi-007', 'envoi-006', 'envoi-005'],
+        ['envoi-004', 'envoi-003', 'envoi-002'],
+        ['envoi-001', 'envoi-000'],
+    ]
+
+
+def test_derniere_page_pleine_sans_curseur(historique):
+    remplir(historique, [envoi(n, "DUPONT Jean") for n in range(4)])
+
+    envois, curseur = historique.rechercher(limite=4)
+    assert len(envois) == 4
+    assert curseur is None
+
+
+def test_filtres_combines_avec_la_pagination(historique):
+    remplir(historique, [envoi(n, "DUPONT Jean", secteur='Paris' if n % 2 else 'Lyon') for n in range(9)])
+
+    pages = parcourir(historique, secteur='Paris', limite=2)
+    assert sum(pages, []) == ['envoi-007', 'envoi-005', 'envoi-003', 'envoi-001']
+
+    envois, _ = historique.rechercher(debut=DEBUT + 2, fin=DEBUT + 5)
+    assert [e['id'] for e in envois] == ['envoi-004', 'envoi-003', 'envoi-002']
+
+
+def test_recherche_client_sans_accents_ni_casse(historique):
+    remplir(historique, [
+        envoi(1, "LÉGER Hélène"),
+        envoi(2, "LEGERE  Anne"),
+        envoi(3, "DUPONT Léa"),
+    ])
+
+    envois, _ = historique.rechercher(client="leger")
+    assert [e['id'] for e in envois] == ['envoi-002', 'envoi-001']
+    envois, _ = historique.rechercher(client="Léger hél")
+    assert [e['client'] for e in envois] == ["LÉGER Hélène"]
+    assert 'client_cle' not in envois[0]
+
+
+def test_envoi_reenregistre_remplace_le_precedent(historique):
+    historique.enregistrer(envoi(1, "DUPONT Jean", zeendoc_reussi=False),
+                           [partie('principal', 0), partie('zeendoc_1', 1, succes=False)])
+    historique.enregistrer(envoi(1, "DUPONT Jean"), [partie('principal', 0), partie('zeendoc_1', 1)])
+    historique.arreter()
+
+    detail = historique.obtenir('envoi-001')
+    assert detail['zeendoc_reussi'] is True
+    assert [(p['partie'], p['succes']) for p in detail['parties']] == [('principal', True), ('zeendoc_1', True)]
+    assert detail['parties'][0]['fichiers'] == [{'nom': 'facture.pdf', 'sha256': 'ab', 'taille': 1000}]
+    assert historique.obtenir('inconnu') is None
+
+
+@pytest.mark.parametrize('curseur', ['!!!', 'e30', 'WzEsMiwzXQ'])
+def test_curseur_invalide(historique, curseur):
+    with pytest.raises(ValueError):
+        decoder_curseur(curseur)
+    with pytest.raises(ValueError):
+        historique.rechercher(apres=curseur)
+
+
+def test_horodatage_jour():
+    assert horodatage_jour('02/01/2024') == horodatage_jour('2024-01-02')
+    assert horodatage_jour('31/12/2023', fin=True) == horodatage_jour('01/01/2024')
+    with pytest.raises(ValueError):
+        horodatage_jour('2024-13-01')
@@ -0,0 +1,110 @@
+"""Seau à jetons et limiteur par destinataire, mesurés sur une horloge simulée"""
+
+import pytest
+
+from limiteur_debit import LimiteurParDestinataire, SeauAJetons
+
+
+class Horloge:
+    def __init__(self, debut=1_000_000.0):
+        self.maintenant = debut
+
+    def __call__(self):
+        return self.maintenant
+
+    def avancer(self, secondes):
+        self.maintenant += secondes
+
+
+def test_rafale_puis_debit_continu():
+    horloge = Horloge()
+    seau = SeauAJetons(1.0, capacite=2, horloge=horloge)
+
+    assert [seau.reserver() for _ in range(4)] == [0.0, 0.0, 1.0, 2.0]
+
+
+def test_jetons_regagnes_avec_le_temps_dans_la_limite_de_la_capacite():
+    horloge = Horloge()
+    seau = SeauAJetons(0.5, capacite=2, horloge=horloge)
+    seau.reserver()
+    seau.reserver()
+
+    horloge.avancer(2)
+    assert seau.reserver() == 0.0
+    assert seau.reserver() == pytest.approx(2.0)
+
+    horloge.avancer(3600)
+    assert seau.reserver() == 0.0
+    assert seau.reserver() == 0.0
+    assert seau.reserver() == pytest.approx(2.0)
+
+
+def test_reservations_en_attente_servies_dans_l_ordre():
+    horloge = Horloge()
+    seau = SeauAJetons(2.0, capacite=1, horloge=horloge)
+    assert [seau.reserver() for _ in range(3)] == [0.0, 0.5, 1.0]
+
+    # Une demi-seconde plus tard, la deuxième réservation est échue: la suivante attend d'autant moins
+    horloge.avancer(0.5)
+    assert seau.reserver() == pytest.approx(1.0)
+
+
+def test_changement_de_debit():
+    horloge = Horloge()
+    seau = SeauAJetons(1.0, capacite=1, horloge=horloge)
+    seau.reserver()
+
+    horloge.avancer(0.5)
+    seau.modifier_debit(0.25)
+    # Demi-jeton gagné à l'ancien débit, le reste au nouveau
+    assert seau.reserver() == pytest.approx(2.0)
+
+
+def test_horloge_revenue_en_arriere():
+    horloge = Horloge()
+    seau = SeauAJetons(1.0, capacite=1, horloge=horloge)
+    seau.reserver()
+
+    horloge.avancer(-30)
+    assert seau.reserver() == pytest.approx(1.0)
+    horloge.avancer(1)
+    assert seau.reserver() == pytest.approx(1.0)
+
+
+def test_debit_nul_sans_limite():
+    seau = SeauAJetons(0, horloge=Horloge())
+
+    assert [seau.reserver() for _ in range(3)] == [0.0, 0.0, 0.0]
+
+
+def test_budget_partage_entre_instances(tmp_path):
+    horloge = Horloge()
+    chemin = str(tmp_path / 'limiteur.db')
+    premier = LimiteurParDestinataire(chemin, 60, capacite=2, horloge=horloge)
+    second = LimiteurParDestinataire(chemin, 60, capacite=2, horloge=horloge)
+
+    attentes = [premier.reserver('ged@exemple.fr'), second.reserver('ged@exemple.fr'),
+                premier.reserver('ged@exemple.fr'), second.reserver('ged@exemple.fr')]
+    assert attentes == [0.0, 0.0, pytest.approx(1.0), pytest.approx(2.0)]
+
+    horloge.avancer(10)
+    assert second.reserver('ged@exemple.fr') == 0.0
+
+
+def test_seau_distinct_par_destinataire(tmp_path):
+    limiteur = LimiteurParDestinataire(str(tmp_path / 'limiteur.db'), 60, horloge=Horloge())
+
+    assert limiteur.reserver('paris@exemple.fr') == 0.0
+    assert limiteur.reserver('lyon@exemple.fr') == 0.0
+    assert limiteur.reserver('paris@exemple.fr') == pytest.approx(1.0)
+
+
+def test_debit_par_appel(tmp_path):
+    horloge = Horloge()
+    limiteur = LimiteurParDestinataire(str(tmp_path / 'limiteur.db'), 60, horloge=horloge)
+
+    assert limiteur.reserver('ged@exemple.fr', debit_par_minute=6) == 0.0
+    assert limiteur.reserver('ged@exemple.fr', debit_par_minute=6) == pytest.approx(10.0)
+    # Configuration rechargée: le débit plus élevé vaut pour les jetons à venir
+    horloge.avancer(10)
+    assert limiteur.reserver('ged@exemple.fr', debit_par_minute=60) == pytest.approx(1.0)
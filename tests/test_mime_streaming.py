@@ -0,0 +1,116 @@
+"""Message MIME produit au fil de l'envoi: taille annoncée exacte, pièces jointes décodées à l'identique"""
+
+import base64
+import email
+import hashlib
+import os
+from email import policy
+
+import pytest
+
+from mime_streaming import CacheEncodage, MessageStreaming, taille_base64
+
+
+def retirer_points_doubles(donnees):
+    """Inverse du dot-stuffing SMTP, tel que le fait le serveur à la réception"""
+
+    return b'\r\n'.join(
+        ligne[1:] if ligne.startswith(b'..') else ligne for ligne in donnees.split(b'\r\n')
+    )
+
+
+@pytest.fixture
+def pieces(tmp_path):
+    contenus = {
+        'facture.pdf': b'%PDF-1.4\n' + os.urandom(200_000),
+        'vide.txt': b'',
+        'notes.txt': b'.premiere ligne\n.\n' * 3000,
+        'court.bin': os.urandom(57 * 1024),
+    }
+    fichiers = []
+    for nom, contenu in contenus.items():
+        chemin = tmp_path / nom
+        chemin.write_bytes(contenu)
+        fichiers.append({'nom': nom, 'chemin': str(chemin), 'taille': len(contenu),
+                         'sha256': hashlib.sha256(contenu).hexdigest()})
+    return fichiers, contenus
+
+
+def ouvrir(fichier):
+    return open(fichier['chemin'], 'rb')
+
+
+def construire(fichiers, **options):
+    return MessageStreaming(
+        'formulaire@exemple.fr', 'ged@exemple.fr', "Dossier client Étienne", "Corps du message\n.\nFin",
+        fichiers, ouvrir, cc='copie@exemple.fr', **options
+    )
+
+
+@pytest.mark.parametrize('taille', [0, 1, 2, 3, 56, 57, 58, 100_000])
+def test_taille_base64(taille):
+    assert taille_base64(taille) == len(base64.encodebytes(b'x' * taille).replace(b'\n', b'\r\n'))
+
+
+def test_taille_annoncee_exacte(pieces):
+    fichiers, _ = pieces
+    message = construire(fichiers)
+
+    donnees = retirer_points_doubles(b''.join(message.blocs()))
+    assert len(donnees) == message.taille()
+
+
+def test_aucune_ligne_ne_commence_par_un_point_seul(pieces):
+    fichiers, _ = pieces
+    donnees = b''.join(construire(fichiers).blocs())
+
+    assert donnees.endswith(b'\r\n')
+    assert b'\r\n.\r\n' not in donnees
+
+
+def test_pieces_jointes_decodees_a_l_identique(pieces):
+    fichiers, contenus = pieces
+    donnees = retirer_points_doubles(b''.join(construire(fichiers).blocs()))
+
+    message = email.message_from_bytes(donnees, policy=policy.default)
+    assert message['To'] == 'ged@exemple.fr'
+    assert message['Cc'] == 'copie@exemple.fr'
+    assert str(message['Subject']) == "Dossier client Étienne"
+    assert message.get_body().get_content().replace('\r\n', '\n') == "Corps du message\n.\nFin"
+
+    pieces_jointes = {piece.get_filename(): piece.get_payload(decode=True) for piece in message.iter_attachments()}
+    assert pieces_jointes == contenus
+
+
+def test_message_identique_avec_le_cache(tmp_path, pieces):
+    fichiers, _ = pieces
+    sans_cache = b''.join(construire(fichiers, frontiere='frontiere-test').blocs())
+
+    # Seuil bas: les grosses pièces passent par un fichier temporaire, les petites restent en mémoire
+    cache = CacheEncodage(str(tmp_path), seuil_memoire=64 * 1024)
+    try:
+        premier = b''.join(construire(fichiers, frontiere='frontiere-test', cache=cache).blocs())
+        second = b''.join(construire(fichiers, frontiere='frontiere-test', cache=cache).blocs())
+        assert cache.statistiques == {'encodages': len(fichiers), 'reutilisations': len(fichiers)}
+        assert any(nom.startswith('mime_') for nom in os.listdir(tmp_path))
+    finally:
+        cache.fermer()
+
+    assert premier == second == sans_cache
+    assert not any(nom.startswith('mime_') for nom in os.listdir(tmp_path))
+
+
+def test_encodage_interrompu_non_conserve(tmp_path, pieces):
+    fichiers, _ = pieces
+    cache = CacheEncodage(str(tmp_path), seuil_memoire=0)
+    try:
+        blocs = construire(fichiers, cache=cache).blocs()
+        # En-têtes, puis premier bloc de la première pièce: l'envoi s'arrête là
+        next(blocs)
+        next(blocs)
+        blocs.close()
+        assert cache.statistiques['encodages'] == 0
+    finally:
+        cache.fermer()
+
+    assert not any(nom.startswith('mime_') for nom in os.listdir(tmp_path))
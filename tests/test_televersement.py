@@ -0,0 +1,154 @@
+"""Téléversement par morceaux: offsets, empreintes des morceaux et du fichier, finalisation"""
+
+import hashlib
+import os
+
+import pytest
+
+import televersement
+from cache_contenu import StockContenu
+from televersement import ErreurTeleversement, ZoneTeleversements
+
+TAILLE_MAX = 1024 * 1024
+
+
+@pytest.fixture
+def supprimes():
+    return []
+
+
+@pytest.fixture
+def zone(tmp_path, supprimes):
+    stock = StockContenu(str(tmp_path / 'stock'), str(tmp_path / 'stock.db'), 10 * TAILLE_MAX)
+    return ZoneTeleversements(str(tmp_path / 'televersements'), str(tmp_path / 'televersements.db'),
+                              stock, TAILLE_MAX, duree_vie=3600, a_la_suppression=supprimes.append)
+
+
+@pytest.fixture
+def contenu():
+    return os.urandom(100_000)
+
+
+def televerser(zone, televersement_id, contenu, taille_morceau=30_000):
+    for offset in range(0, len(contenu), taille_morceau):
+        morceau = contenu[offset:offset + taille_morceau]
+        zone.ecrire_morceau(televersement_id, offset, morceau, hashlib.sha256(morceau).hexdigest())
+
+
+def test_fichier_reconstitue_et_finalise(zone, contenu):
+    sha256 = hashlib.sha256(contenu).hexdigest()
+    televersement_id = zone.creer('facture.pdf', len(contenu), 'application/pdf', sha256.upper())
+    televerser(zone, televersement_id, contenu)
+
+    etat = zone.finaliser(televersement_id)
+    assert etat['finalise'] is True
+    assert (etat['recu'], etat['sha256']) == (len(contenu), sha256)
+    # Finalisation répétée (réponse perdue côté client): même résultat
+    assert zone.finaliser(televersement_id) == etat
+
+    fichier = zone.obtenir_fichier(televersement_id)
+    assert (fichier.filename, fichier.content_type, fichier.taille) == ('facture.pdf', 'application/pdf', len(contenu))
+    with open(fichier.chemin, 'rb') as source:
+        assert source.read() == contenu
+
+
+def test_offset_decale_refuse_avec_l_offset_attendu(zone, contenu):
+    televersement_id = zone.creer('facture.pdf', len(contenu))
+    zone.ecrire_morceau(televersement_id, 0, contenu[:1000])
+
+    with pytest.raises(ErreurTeleversement) as erreur:
+        zone.ecrire_morceau(televersement_id, 2000, contenu[2000:3000])
+    assert (erreur.value.code, erreur.value.recu) == (409, 1000)
+
+    # Reprise à l'offset indiqué, morceau renvoyé deux fois compris
+    with pytest.raises(ErreurTeleversement) as erreur:
+        zone.ecrire_morceau(televersement_id, 0, contenu[:1000])
+    assert erreur.value.code == 409
+    assert zone.ecrire_morceau(televersement_id, 1000, contenu[1000:]) == len(contenu)
+    assert zone.finaliser(televersement_id)['finalise'] is True
+
+
+def test_morceau_a_l_empreinte_invalide_refuse(zone, contenu):
+    televersement_id = zone.creer('facture.pdf', len(contenu))
+
+    with pytest.raises(ErreurTeleversement) as erreur:
+        zone.ecrire_morceau(televersement_id, 0, contenu[:1000], hashlib.sha256(b'autre').hexdigest())
+    assert erreur.value.code == 400
+    assert zone.etat(televersement_id)['recu'] == 0
+
+
+def test_morceau_au_dela_de_la_taille_annoncee(zone, contenu):
+    televersement_id = zone.creer('facture.pdf', 1000)
+
+    with pytest.raises(ErreurTeleversement) as erreur:
+        zone.ecrire_morceau(televersement_id, 0, contenu[:1001])
+    assert (erreur.value.code, erreur.value.recu) == (413, 0)
+
+
+@pytest.mark.parametrize('nom, taille, code', [
+    ('', 10, 400),
+    ('facture.pdf', -1, 400),
+    ('facture.pdf', '10', 400),
+    ('facture.pdf', TAILLE_MAX + 1, 413),
+])
+def test_creation_refusee(zone, nom, taille, code):
+    with pytest.raises(ErreurTeleversement) as erreur:
+        zone.creer(nom, taille)
+    assert erreur.value.code == code
+
+
+def test_finalisation_d_un_fichier_incomplet(zone, contenu):
+    televersement_id = zone.creer('facture.pdf', len(contenu))
+    zone.ecrire_morceau(televersement_id, 0, contenu[:5000])
+
+    with pytest.raises(ErreurTeleversement) as erreur:
+        zone.finaliser(televersement_id)
+    assert (erreur.value.code, erreur.value.recu) == (409, 5000)
+    with pytest.raises(ErreurTeleversement) as erreur:
+        zone.obtenir_fichier(televersement_id)
+    assert erreur.value.code == 409
+
+
+def test_empreinte_differente_de_celle_annoncee(zone, contenu):
+    televersement_id = zone.creer('facture.pdf', len(contenu), sha256=hashlib.sha256(contenu).hexdigest())
+    corrompu = bytes([contenu[0] ^ 0xff]) + contenu[1:]
+    televerser(zone, televersement_id, corrompu)
+
+    with pytest.raises(ErreurTeleversement) as erreur:
+        zone.finaliser(televersement_id)
+    assert (erreur.value.code, erreur.value.recu) == (422, 0)
+    assert zone.etat(televersement_id)['recu'] == 0
+
+    televerser(zone, televersement_id, contenu)
+    assert zone.finaliser(televersement_id)['finalise'] is True
+
+
+def test_morceau_apres_finalisation(zone, contenu):
+    televersement_id = zone.creer('facture.pdf', len(contenu))
+    televerser(zone, televersement_id, contenu)
+    zone.finaliser(televersement_id)
+
+    with pytest.raises(ErreurTeleversement) as erreur:
+        zone.ecrire_morceau(televersement_id, len(contenu), b'')
+    assert (erreur.value.code, erreur.value.recu) == (409, len(contenu))
+
+
+def test_televersement_inconnu(zone):
+    with pytest.raises(ErreurTeleversement) as erreur:
+        zone.etat('inconnu')
+    assert erreur.value.code == 404
+
+
+def test_suppression_et_expiration(zone, supprimes, monkeypatch):
+    utilise = zone.creer('utilise.pdf', 10)
+    expire = zone.creer('expire.pdf', 10)
+    zone.supprimer(utilise)
+    assert supprimes == [utilise]
+
+    horloge = televersement.time.time() + 3601
+    monkeypatch.setattr(televersement.time, 'time', lambda: horloge)
+    zone.purger()
+    assert supprimes == [utilise, expire]
+    assert not os.path.exists(os.path.join(zone.dossier, expire))
+    with pytest.raises(ErreurTeleversement):
+        zone.etat(expire)